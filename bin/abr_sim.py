@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+abr_sim.py -- offline trace-driven ABR simulator
+
+Replays throughput traces against the segment ladder of a DASH manifest,
+models the player buffer and runs dash.js-style ABR rules, without a
+browser.  All traces are simulated at once: every step downloads one
+segment for every trace with NumPy operations, so thousands of traces
+take about as long as one.
+
+Traces come from segment_downloads_*.csv files of real runs, from
+netshaper.py trace files, or are synthesised.  The output has the
+columns of qoe_metrics_*.csv (see qoe_sink.QOE_FIELDS), one sample per
+downloaded segment, plus a per-trace summary.
+
+Player model: segments are fetched back to back; a download that takes
+longer than the buffer lasts is a stall.  Playback starts once
+--startup seconds are buffered, and fetching pauses while the buffer is
+above --buffer-target, as dash.js does with stableBufferTime.
+
+An ABR rule is any object with:
+
+    reset(n)                    start n independent sessions
+    observe(kbps, seconds)      throughput of the segments just fetched
+    choose(state) -> ndarray    quality index per session (AbrState)
+
+and optionally min_buffer(ladder), the least buffer target it needs.
+
+Rules named on the command line are looked up in RULES or imported as
+"module:Class".  With several rules the lowest quality wins.
+
+Examples:
+    ./abr_sim.py video/manifest.mpd --segment-logs results/*/segment_downloads_*.csv
+    ./abr_sim.py video/manifest.mpd --synthetic 10000 --mean-kbps 4000 \
+                 --rules bolaRule --rules throughputRule --outdir sim
+"""
+import argparse
+import csv
+import importlib
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from qoe_sink import QOE_FIELDS, open_sink
+
+MPD_NS = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
+
+
+# ─── Segment ladder ─────────────────────────────────────────────────────
+
+class Ladder:
+    """Video representations of a manifest, lowest bitrate first"""
+
+    def __init__(self, bitrates_kbps, widths, heights, seg_durations,
+                 sizes_bits=None, fps=30.0):
+        order = np.argsort(bitrates_kbps)
+        self.bitrates = np.asarray(bitrates_kbps, dtype=np.float64)[order]
+        self.widths = np.asarray(widths, dtype=np.int64)[order]
+        self.heights = np.asarray(heights, dtype=np.int64)[order]
+        self.seg_durations = np.asarray(seg_durations, dtype=np.float64)
+        if sizes_bits is None:
+            sizes_bits = np.outer(self.bitrates * 1000.0, self.seg_durations)
+        else:
+            sizes_bits = np.asarray(sizes_bits, dtype=np.float64)[order]
+        self.sizes = sizes_bits        # (n_qualities, n_segments)
+        self.fps = fps
+
+    @property
+    def n_qualities(self):
+        return len(self.bitrates)
+
+    @property
+    def n_segments(self):
+        return len(self.seg_durations)
+
+
+def _iso_duration(value):
+    m = re.fullmatch(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?", value or "")
+    if not m:
+        raise ValueError(f"Cannot parse duration `{value}'")
+    d, h, mi, s = (float(x) if x else 0.0 for x in m.groups())
+    return ((d * 24 + h) * 60 + mi) * 60 + s
+
+
+def _expand_template(template, rep_id, bandwidth, number):
+    def sub(m):
+        name, fmt = m.group(1), m.group(2)
+        value = {"RepresentationID": rep_id, "Bandwidth": bandwidth,
+                 "Number": number}[name]
+        return (fmt % value) if fmt else str(value)
+    return re.sub(r"\$(RepresentationID|Bandwidth|Number)(%0\d+d)?\$", sub,
+                  template).replace("$$", "$")
+
+
+def parse_mpd(path, video_dir=None):
+    """Load the video ladder from an MPD using SegmentTemplate
+
+    Segment sizes are bitrate x duration unless video_dir holds the
+    segment files, in which case their real sizes are used.
+    """
+    root = ET.parse(path).getroot()
+    total = _iso_duration(root.get("mediaPresentationDuration"))
+
+    for aset in root.iterfind(".//mpd:AdaptationSet", MPD_NS):
+        reps = aset.findall("mpd:Representation", MPD_NS)
+        mime = aset.get("mimeType") or (reps[0].get("mimeType") if reps else "") or ""
+        if aset.get("contentType") == "video" or mime.startswith("video"):
+            break
+    else:
+        raise ValueError(f"{path}: no video AdaptationSet")
+
+    fps = aset.get("frameRate") or reps[0].get("frameRate") or "30"
+    num, _, den = fps.partition("/")
+    fps = float(num) / float(den or 1)
+
+    bitrates, widths, heights, sizes = [], [], [], []
+    seg_durations = None
+    for rep in reps:
+        tmpl = rep.find("mpd:SegmentTemplate", MPD_NS)
+        if tmpl is None:
+            tmpl = aset.find("mpd:SegmentTemplate", MPD_NS)
+        if tmpl is None:
+            raise ValueError(f"{path}: only SegmentTemplate manifests are supported")
+        timescale = float(tmpl.get("timescale", 1))
+        timeline = tmpl.find("mpd:SegmentTimeline", MPD_NS)
+        if timeline is not None:
+            durs = []
+            for s in timeline.iterfind("mpd:S", MPD_NS):
+                durs.extend([float(s.get("d")) / timescale] * (int(s.get("r", 0)) + 1))
+        else:
+            dur = float(tmpl.get("duration")) / timescale
+            n = math.ceil(total / dur - 1e-9)
+            durs = [dur] * (n - 1) + [total - dur * (n - 1)]
+        if seg_durations is None:
+            seg_durations = durs
+
+        bandwidth = int(rep.get("bandwidth"))
+        bitrates.append(bandwidth / 1000.0)
+        widths.append(int(rep.get("width", 0)))
+        heights.append(int(rep.get("height", 0)))
+        if video_dir:
+            start = int(tmpl.get("startNumber", 1))
+            names = [_expand_template(tmpl.get("media"), rep.get("id"), bandwidth, start + i)
+                     for i in range(len(seg_durations))]
+            sizes.append([os.path.getsize(os.path.join(video_dir, name)) * 8.0
+                          for name in names])
+
+    return Ladder(bitrates, widths, heights, seg_durations,
+                  sizes if video_dir else None, fps)
+
+
+def rendition_files(path, rep_id):
+    """Initialization segment and media segments of one representation,
+    as paths relative to the manifest's directory"""
+    root = ET.parse(path).getroot()
+    total = _iso_duration(root.get("mediaPresentationDuration"))
+    for aset in root.iterfind(".//mpd:AdaptationSet", MPD_NS):
+        for rep in aset.iterfind("mpd:Representation", MPD_NS):
+            if rep.get("id") != rep_id:
+                continue
+            tmpl = rep.find("mpd:SegmentTemplate", MPD_NS)
+            if tmpl is None:
+                tmpl = aset.find("mpd:SegmentTemplate", MPD_NS)
+            if tmpl is None:
+                raise ValueError(f"{path}: only SegmentTemplate manifests are supported")
+            timeline = tmpl.find("mpd:SegmentTimeline", MPD_NS)
+            if timeline is not None:
+                count = sum(int(s.get("r", 0)) + 1
+                            for s in timeline.iterfind("mpd:S", MPD_NS))
+            else:
+                dur = float(tmpl.get("duration")) / float(tmpl.get("timescale", 1))
+                count = math.ceil(total / dur - 1e-9)
+            bandwidth = int(rep.get("bandwidth"))
+            start = int(tmpl.get("startNumber", 1))
+            files = [_expand_template(tmpl.get("initialization"), rep_id, bandwidth, 0)] \
+                    if tmpl.get("initialization") else []
+            return files + [_expand_template(tmpl.get("media"), rep_id, bandwidth, start + i)
+                            for i in range(count)]
+    raise ValueError(f"{path}: no Representation `{rep_id}'")
+
+
+# ─── Throughput traces ──────────────────────────────────────────────────
+
+class TraceSet:
+    """Throughput of n traces sampled every dt seconds, in kbps
+
+    Cumulative capacity is precomputed, so the time a download finishes
+    is found for all traces with one searchsorted().  Past the end of
+    the trace, each trace continues at its mean rate.
+    """
+
+    def __init__(self, rates_kbps, dt, names=None):
+        self.rate = np.maximum(np.asarray(rates_kbps, dtype=np.float64), 0.0)
+        self.dt = dt
+        n, steps = self.rate.shape
+        self.names = names or [str(i) for i in range(n)]
+        bits = self.rate * 1000.0 * dt
+        self.cum = np.zeros((n, steps + 1))
+        np.cumsum(bits, axis=1, out=self.cum[:, 1:])
+        self.mean_bps = np.maximum(self.cum[:, -1] / (steps * dt), 1.0)
+        # Row r is shifted above row r-1, making the whole array sorted
+        self.stride = self.cum[:, -1].max() + 1.0
+        self.flat = (self.cum + self.stride * np.arange(n)[:, None]).ravel()
+
+    def __len__(self):
+        return self.rate.shape[0]
+
+    def capacity(self, t):
+        """Bits each trace delivers from time 0 to t (one t per trace)"""
+        steps = self.rate.shape[1]
+        rows = np.arange(len(self))
+        j = np.minimum((t / self.dt).astype(np.int64), steps)
+        inside = j < steps
+        partial = np.where(inside,
+                           self.rate[rows, np.minimum(j, steps - 1)] * 1000.0,
+                           self.mean_bps) * (t - j * self.dt)
+        return self.cum[rows, j] + partial
+
+    def finish_time(self, t, bits):
+        """When a download of `bits' started at t completes, per trace"""
+        n, steps = self.rate.shape
+        rows = np.arange(n)
+        target = self.capacity(t) + bits
+        last = self.cum[:, -1]
+        beyond = target > last
+
+        # First step j with cum[j] < target <= cum[j + 1]: rate[j] > 0
+        pos = np.searchsorted(self.flat, np.where(beyond, last, target)
+                              + self.stride * rows, side="left")
+        j = np.clip(pos - rows * (steps + 1) - 1, 0, steps - 1)
+        rate = self.rate[rows, j] * 1000.0
+        within = j * self.dt + (target - self.cum[rows, j]) / np.where(rate > 0, rate, 1.0)
+        past = steps * self.dt + (target - last) / self.mean_bps
+        return np.where(beyond, past, within)
+
+
+def _tile(traces):
+    """Loop traces of different lengths to a common length"""
+    length = max(len(t) for t in traces)
+    return np.stack([np.resize(t, length) for t in traces])
+
+
+def traces_from_segment_logs(paths, dt=0.5):
+    """One trace per segment_downloads_*.csv: each download's goodput holds
+    for its duration; gaps between downloads keep the last value"""
+    traces, names = [], []
+    for path in paths:
+        with open(path, newline="") as f:
+            # Audio segments download alongside video and understate the link
+            rows = [r for r in csv.DictReader(f)
+                    if r["download_time"] and r.get("media_type") != "audio"]
+        if not rows:
+            continue
+        start = np.array([float(r["timestamp"]) for r in rows])
+        dur = np.array([float(r["download_time"]) for r in rows]) / 1000.0
+        kbps = np.array([float(r["size"]) for r in rows]) * 8 / 1000.0 / np.maximum(dur, 1e-3)
+        order = np.argsort(start)
+        start, dur, kbps = start[order] - start.min(), dur[order], kbps[order]
+        grid = np.arange(0.0, (start + dur).max(), dt) + dt / 2
+        # The most recent download that started before each grid point
+        idx = np.maximum(np.searchsorted(start, grid, side="right") - 1, 0)
+        traces.append(kbps[idx])
+        names.append(os.path.basename(os.path.dirname(path)) or path)
+    if not traces:
+        raise ValueError("No video downloads in the segment logs")
+    return TraceSet(_tile(traces), dt, names)
+
+
+def traces_from_files(paths, dt=0.5):
+    """netshaper.py trace files (mahimahi or schedule), averaged over dt"""
+    from netshaper import load_trace
+
+    step = max(int(round(dt * 1000)), 1)
+    traces = []
+    for path in paths:
+        per_ms = np.frombuffer(load_trace(path).rate, dtype=np.float64)
+        n = len(per_ms) // step * step or len(per_ms)
+        traces.append(np.resize(per_ms, max(n, step)).reshape(-1, step).mean(axis=1) * 8.0)
+    return TraceSet(_tile(traces), step / 1000.0, [os.path.basename(p) for p in paths])
+
+
+def synthetic_traces(n, seconds=600.0, dt=0.5, mean_kbps=4000.0, sigma=0.5,
+                     corr=0.95, seed=None):
+    """Log-normal AR(1) throughput: mean_kbps on average, sigma is the
+    spread of log throughput and corr its correlation from step to step"""
+    rng = np.random.default_rng(seed)
+    steps = int(seconds / dt)
+    x = np.empty((n, steps))
+    x[:, 0] = rng.standard_normal(n)
+    noise = rng.standard_normal((n, steps)) * math.sqrt(1 - corr * corr)
+    for i in range(1, steps):
+        x[:, i] = corr * x[:, i - 1] + noise[:, i]
+    rate = mean_kbps * np.exp(sigma * x - sigma * sigma / 2)
+    return TraceSet(rate, dt, [f"synthetic-{i}" for i in range(n)])
+
+
+# ─── ABR rules ──────────────────────────────────────────────────────────
+
+class AbrState:
+    """What a rule may look at when choosing the next segment"""
+
+    def __init__(self, ladder, n):
+        self.ladder = ladder
+        self.segment = 0
+        self.buffer = np.zeros(n)               # Seconds
+        self.last_quality = np.full(n, -1)
+        self.playing = np.zeros(n, dtype=bool)
+
+
+class ThroughputRule:
+    """dash.js throughputRule: highest bitrate below the safe throughput,
+    the lower of a fast and a slow EWMA weighted by download time"""
+
+    def __init__(self, safety=0.9, fast_halflife=3.0, slow_halflife=8.0):
+        self.safety = safety
+        self.halflives = (fast_halflife, slow_halflife)
+
+    def reset(self, n):
+        self.est = np.zeros((2, n))
+        self.weight = np.zeros((2, n))
+
+    def observe(self, kbps, seconds):
+        for i, halflife in enumerate(self.halflives):
+            alpha = 0.5 ** (seconds / halflife)
+            self.est[i] = alpha * self.est[i] + (1 - alpha) * kbps
+            self.weight[i] = alpha * self.weight[i] + (1 - alpha)
+
+    def throughput(self):
+        est = self.est / np.where(self.weight > 0, self.weight, 1.0)
+        return est.min(axis=0) * self.safety
+
+    def choose(self, state):
+        q = np.searchsorted(state.ladder.bitrates, self.throughput(), side="right") - 1
+        return np.maximum(q, 0)
+
+
+class BolaRule:
+    """dash.js bolaRule (BOLA-BASIC): quality from the buffer level alone"""
+
+    MINIMUM_BUFFER_S = 10.0
+    MINIMUM_BUFFER_PER_LEVEL_S = 2.0
+
+    def __init__(self, stable_buffer=12.0):
+        self.stable_buffer = stable_buffer
+
+    def reset(self, n):
+        pass
+
+    def observe(self, kbps, seconds):
+        pass
+
+    def min_buffer(self, ladder):
+        """dash.js raises the stable buffer time so BOLA can reach the top"""
+        return max(self.stable_buffer, self.MINIMUM_BUFFER_S
+                   + self.MINIMUM_BUFFER_PER_LEVEL_S * ladder.n_qualities)
+
+    def choose(self, state):
+        bitrates = state.ladder.bitrates
+        utilities = np.log(bitrates) - np.log(bitrates[0]) + 1.0
+        buffer_time = self.min_buffer(state.ladder)
+        gp = (utilities[-1] - 1.0) / (buffer_time / self.MINIMUM_BUFFER_S - 1.0)
+        vp = self.MINIMUM_BUFFER_S / gp
+        score = (vp * (utilities[None, :] + gp) - state.buffer[:, None]) / bitrates[None, :]
+        return score.argmax(axis=1)
+
+
+class LowestOf:
+    """Several rules at once: the lowest quality wins"""
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def reset(self, n):
+        for rule in self.rules:
+            rule.reset(n)
+
+    def observe(self, kbps, seconds):
+        for rule in self.rules:
+            rule.observe(kbps, seconds)
+
+    def min_buffer(self, ladder):
+        return max([rule.min_buffer(ladder) for rule in self.rules
+                    if hasattr(rule, "min_buffer")], default=0.0)
+
+    def choose(self, state):
+        return np.minimum.reduce([rule.choose(state) for rule in self.rules])
+
+
+RULES = {
+    "throughputRule": ThroughputRule,
+    "bolaRule": BolaRule,
+}
+
+
+def make_rule(names):
+    """Build a rule from names in RULES or "module:Class" specs"""
+    rules = []
+    for name in names:
+        if name in RULES:
+            rules.append(RULES[name]())
+        elif ":" in name:
+            module, _, cls = name.partition(":")
+            rules.append(getattr(importlib.import_module(module), cls)())
+        else:
+            raise ValueError(f"Unknown ABR rule `{name}'")
+    return rules[0] if len(rules) == 1 else LowestOf(rules)
+
+
+# ─── Simulation ─────────────────────────────────────────────────────────
+
+def simulate(ladder, traces, rule, startup=None, buffer_target=12.0, rtt=0.0):
+    """Play the whole ladder once per trace
+
+    Returns a dict of (n_traces, n_segments) arrays named as QOE_FIELDS,
+    plus "quality" and "startup_delay" (n_traces,).
+    """
+    n, K = len(traces), ladder.n_segments
+    if hasattr(rule, "min_buffer"):
+        buffer_target = max(buffer_target, rule.min_buffer(ladder))
+    startup = ladder.seg_durations[0] if startup is None else startup
+    state = AbrState(ladder, n)
+    rule.reset(n)
+
+    out = {name: np.zeros((n, K)) for name in QOE_FIELDS}
+    out["quality"] = np.zeros((n, K), dtype=np.int64)
+    t = np.zeros(n)
+    played = np.zeros(n)
+    stall_count = np.zeros(n)
+    stall_time = np.zeros(n)
+    switches = np.zeros(n)
+    startup_delay = np.full(n, np.nan)
+    buffered_end = 0.0
+
+    for k in range(K):
+        state.segment = k
+        q = rule.choose(state)
+        bits = ladder.sizes[q, k]
+        end = traces.finish_time(t + rtt, bits)
+        dl = end - t
+
+        # Playback continues while the segment downloads
+        playing = state.playing
+        stalled = playing & (dl > state.buffer)
+        stall_count += stalled
+        stall_time += np.where(playing, np.maximum(dl - state.buffer, 0.0), 0.0)
+        played += np.where(playing, np.minimum(dl, state.buffer), 0.0)
+        state.buffer = np.where(playing, np.maximum(state.buffer - dl, 0.0), state.buffer)
+        t = end
+
+        buffered_end += ladder.seg_durations[k]
+        state.buffer += ladder.seg_durations[k]
+        starting = ~playing & ((state.buffer >= startup) | (k == K - 1))
+        startup_delay[starting] = t[starting]
+        state.playing = playing | starting
+
+        switches += (state.last_quality >= 0) & (q != state.last_quality)
+        state.last_quality = q
+        rule.observe(bits / 1000.0 / np.maximum(dl, 1e-6), dl)
+
+        out["wall_clock"][:, k] = t
+        out["playback_time"][:, k] = played
+        out["buffered"][:, k] = buffered_end
+        out["playback_rate"][:, k] = state.playing
+        out["bitrate_kbps"][:, k] = ladder.bitrates[q]
+        out["quality_switch_count"][:, k] = switches
+        out["width"][:, k] = ladder.widths[q]
+        out["height"][:, k] = ladder.heights[q]
+        out["stall_count"][:, k] = stall_count
+        out["total_stall_time"][:, k] = stall_time
+        out["quality"][:, k] = q
+
+        # Buffer full: idle, playing, until it drains to the target
+        idle = np.where(state.playing, np.maximum(state.buffer - buffer_target, 0.0), 0.0)
+        t = t + idle
+        played += idle
+        state.buffer -= idle
+
+    out["total_frames"] = np.floor(out["playback_time"] * ladder.fps)
+    out["fps"] = np.where(out["playback_time"] > 0, ladder.fps, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["rebuffer_rate"] = np.where(out["playback_time"] > 0,
+                                        out["total_stall_time"] / out["playback_time"], 0.0)
+    out["startup_delay"] = startup_delay
+    return out
+
+
+SUMMARY_FIELDS = ["rules", "trace", "playback_time", "bitrate_kbps", "switches",
+                  "stall_count", "total_stall_time", "rebuffer_rate", "startup_delay"]
+
+
+def summarize(ladder, result):
+    """Per-trace totals, bitrate weighted by segment duration"""
+    w = ladder.seg_durations / ladder.seg_durations.sum()
+    return {
+        "playback_time":    result["playback_time"][:, -1],
+        "bitrate_kbps":     result["bitrate_kbps"] @ w,
+        "switches":         result["quality_switch_count"][:, -1],
+        "stall_count":      result["stall_count"][:, -1],
+        "total_stall_time": result["total_stall_time"][:, -1],
+        "rebuffer_rate":    result["rebuffer_rate"][:, -1],
+        "startup_delay":    result["startup_delay"],
+    }
+
+
+def write_run(path, result, i):
+    """Write trace i as a qoe_metrics file (.csv or .qoe)"""
+    columns = [result[name][i] if code in "fd" else result[name][i].astype(np.int64)
+               for name, code in QOE_FIELDS.items()]
+    with open_sink(path) as sink:
+        for row in zip(*(c.tolist() for c in columns)):
+            sink.write(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline trace-driven ABR simulator')
+    parser.add_argument('manifest', help='DASH manifest (SegmentTemplate)')
+    parser.add_argument('--video-dir', default=None,
+                        help='Directory with the segments, to use their real sizes')
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument('--segment-logs', nargs='+', help='segment_downloads_*.csv files')
+    src.add_argument('--trace-files', nargs='+', help='netshaper.py trace files')
+    src.add_argument('--synthetic', type=int, metavar='N', help='Number of synthetic traces')
+    parser.add_argument('--mean-kbps', type=float, default=4000.0,
+                        help='Mean synthetic throughput (default: 4000)')
+    parser.add_argument('--sigma', type=float, default=0.5,
+                        help='Spread of synthetic log throughput (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=None, help='Synthetic trace seed')
+    parser.add_argument('--dt', type=float, default=0.5,
+                        help='Trace resolution in seconds (default: 0.5)')
+    parser.add_argument('--rules', action='append', default=None,
+                        help='Comma-separated rules in one rule set; repeat to '
+                             'compare rule sets (default: bolaRule)')
+    parser.add_argument('--buffer-target', type=float, default=12.0,
+                        help='Buffer level at which fetching pauses (default: 12)')
+    parser.add_argument('--startup', type=float, default=None,
+                        help='Seconds buffered before playback starts (default: one segment)')
+    parser.add_argument('--rtt', type=float, default=0.0,
+                        help='Request round trip time in seconds (default: 0)')
+    parser.add_argument('--outdir', default='sim', help='Output directory (default: sim)')
+    parser.add_argument('--write-runs', type=int, default=10, metavar='N',
+                        help='Write qoe_metrics files for the first N traces (default: 10)')
+    parser.add_argument('--format', choices=['csv', 'qoe'], default='csv',
+                        help='Format of per-trace metrics (default: csv)')
+    args = parser.parse_args()
+
+    ladder = parse_mpd(args.manifest, args.video_dir)
+    if args.segment_logs:
+        traces = traces_from_segment_logs(args.segment_logs, args.dt)
+    elif args.trace_files:
+        traces = traces_from_files(args.trace_files, args.dt)
+    else:
+        traces = synthetic_traces(args.synthetic, dt=args.dt, mean_kbps=args.mean_kbps,
+                                  sigma=args.sigma, seed=args.seed)
+    rule_sets = [tuple(r for r in spec.split(",") if r) for spec in args.rules] \
+                if args.rules else [("bolaRule",)]
+
+    os.makedirs(args.outdir, exist_ok=True)
+    summary_path = os.path.join(args.outdir, "sim_summary.csv")
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_FIELDS)
+        for rules in rule_sets:
+            name = "+".join(rules)
+            result = simulate(ladder, traces, make_rule(rules), startup=args.startup,
+                              buffer_target=args.buffer_target, rtt=args.rtt)
+            summary = summarize(ladder, result)
+            for i in range(len(traces)):
+                writer.writerow([name, traces.names[i]]
+                                + [round(float(summary[k][i]), 4) for k in SUMMARY_FIELDS[2:]])
+            for i in range(min(args.write_runs, len(traces))):
+                write_run(os.path.join(args.outdir, f"qoe_metrics_{name}_{i}.{args.format}"),
+                          result, i)
+            print(f"✔ {name}: {len(traces)} traces, mean bitrate "
+                  f"{summary['bitrate_kbps'].mean():.0f} kbps, mean rebuffer rate "
+                  f"{summary['rebuffer_rate'].mean():.4f}, mean switches "
+                  f"{summary['switches'].mean():.1f}")
+    print(f"🗒  Summary written to {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+abr_sweep.py -- sweep dash.js ABR settings across transports and server CC
+
+Builds a grid of dash.js ABR configurations:
+
+  --main      one main rule per configuration (throughputRule, l2ARule,
+              loLPRule, ...)
+  --toggle    rules tried both on and off
+  --always    rules enabled in every configuration
+  --stable-buffer / --top-buffer
+              buffer targets (stableBufferTime, bufferTimeAtTopQuality)
+
+and crosses it with protocol and server congestion control.  With
+--server-cmd the video server is started locally once per CC algorithm,
+"{cc}" in the command being replaced by its -A number; without it the
+single --cc value only labels the results.  The CC algorithm is that of
+video_server (-A), so it only changes QUIC runs; TCP runs use the
+kernel's.
+
+Runs within one CC algorithm go in parallel on qoe_runner's driver pool;
+Chrome sessions are only reused between repetitions of a configuration.
+A finished run leaves run.json in its directory and is skipped when the
+sweep is restarted, so an interrupted sweep resumes where it stopped.
+At the end every run is scored with qoe_analysis.py:
+
+  results.csv             one row per run
+  results_by_config.csv   means per configuration, best QoE first
+
+Example:
+    ./abr_sweep.py -j 4 --protocols tcp quic --cc cubic bbr \
+        --server-cmd "./video_server -s 0.0.0.0:5201 -r video -c quic.local,cert,key -A {cc}" \
+        --stable-buffer 12 20 --repeat 3 --server 127.0.0.1 --outdir sweep
+"""
+import argparse
+import itertools
+import json
+import os
+import shlex
+import subprocess
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import qoe_analysis
+from qoe_runner import DriverPool, write_summary
+from watch_and_save import ALL_ABR_RULES, DEFAULT_SERVER, run_session
+
+CC_ALGOS = {"cubic": 1, "bbr": 2, "adaptive": 3}
+
+# Columns averaged per configuration in results_by_config.csv
+CONFIG_METRICS = ("qoe", "bitrate_kbps", "startup_delay", "time_to_first_frame_ms",
+                  "rebuffer_rate", "stall_count", "switches_per_min", "fps_p5",
+                  "frame_drop_pct")
+
+
+class Config(namedtuple("Config", "protocol cc rules stable_buffer top_buffer")):
+    """One point of the grid; repetitions share it"""
+
+    def tag(self, n):
+        def buf(value):
+            return "default" if value is None else f"{value:g}"
+        return (f"{self.protocol}-{self.cc}-{'+'.join(self.rules)}"
+                f"-sb{buf(self.stable_buffer)}-tb{buf(self.top_buffer)}-{n}")
+
+
+def rule_sets(mains, toggles, always):
+    """Every main rule with every on/off combination of the toggled rules"""
+    sets = []
+    for main in mains or [None]:
+        for mask in itertools.product((False, True), repeat=len(toggles)):
+            rules = list(always)
+            rules += [main] if main else []
+            rules += [rule for rule, on in zip(toggles, mask) if on]
+            rules = tuple(dict.fromkeys(rules))
+            if rules and rules not in sets:
+                sets.append(rules)
+    return sets
+
+
+def build_grid(protocols, ccs, sets, stable_buffers, top_buffers):
+    return [Config(*point) for point in itertools.product(
+                protocols, ccs, sets, stable_buffers, top_buffers)]
+
+
+class ServerProcess:
+    """A local video server running with one CC algorithm"""
+
+    def __init__(self, cmd, cc, warmup=2.0):
+        self.argv = shlex.split(cmd.format(cc=CC_ALGOS[cc]))
+        self.cc = cc
+        self.warmup = warmup
+        self.proc = None
+
+    def __enter__(self):
+        print(f"🚀 Starting server ({self.cc}): {' '.join(self.argv)}")
+        self.proc = subprocess.Popen(self.argv)
+        time.sleep(self.warmup)
+        if self.proc.poll() is not None:
+            raise RuntimeError(f"server exited with status {self.proc.returncode}")
+        return self
+
+    def __exit__(self, *exc):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+def run_one(pool, outdir, cfg, n, interval, sample_ms, fmt):
+    run_dir = os.path.join(outdir, cfg.tag(n))
+    row = {"protocol": cfg.protocol, "cc": cfg.cc, "abr_rules": "+".join(cfg.rules),
+           "stable_buffer": cfg.stable_buffer, "top_buffer": cfg.top_buffer,
+           "outdir": run_dir, "run": n}
+    driver = pool.acquire(cfg.protocol, cfg)
+    try:
+        driver = pool.reset(cfg.protocol, driver)
+        summary = run_session(driver, cfg.protocol, run_dir, abr_rules=cfg.rules,
+                              interval=interval, sample_ms=sample_ms,
+                              tag=cfg.tag(n), fmt=fmt, server=pool.server,
+                              stable_buffer=cfg.stable_buffer,
+                              top_buffer=cfg.top_buffer)
+    except Exception as e:
+        # Not recorded as done: the next sweep retries it
+        pool.discard(driver)
+        return dict(row, status=f"error: {e}")
+    pool.release(cfg.protocol, driver, cfg)
+    row = dict(summary, **row, status="ok")
+    with open(os.path.join(run_dir, "run.json"), "w") as f:
+        json.dump(row, f, indent=2)
+    return row
+
+
+def load_done(outdir, cfg, n):
+    try:
+        with open(os.path.join(outdir, cfg.tag(n), "run.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def score(rows):
+    """Add qoe_analysis metrics to every successful run"""
+    ok = {row["outdir"]: row for row in rows if row["status"] == "ok"}
+    if not ok:
+        return
+    runs = qoe_analysis.load(qoe_analysis.find_runs(list(ok)))
+    metrics = qoe_analysis.compute(runs)
+    for i, path in enumerate(runs.names):
+        row = ok.get(os.path.dirname(path))
+        if row is not None:
+            row.update((name, round(float(metrics[name][i]), 4))
+                       for name in qoe_analysis.METRIC_FIELDS)
+
+
+def by_config(rows):
+    """Mean of CONFIG_METRICS over the repetitions of each configuration"""
+    groups = {}
+    for row in rows:
+        if row["status"] == "ok" and "qoe" in row:
+            key = (row["protocol"], row["cc"], row["abr_rules"],
+                   row["stable_buffer"], row["top_buffer"])
+            groups.setdefault(key, []).append(row)
+    table = []
+    for (protocol, cc, rules, stable, top), group in groups.items():
+        entry = {"protocol": protocol, "cc": cc, "abr_rules": rules,
+                 "stable_buffer": stable, "top_buffer": top, "runs": len(group)}
+        for name in CONFIG_METRICS:
+            values = [r[name] for r in group
+                      if r.get(name) is not None and r[name] == r[name]]
+            entry[name] = round(sum(values) / len(values), 4) if values else ""
+        table.append(entry)
+    table.sort(key=lambda e: (e["protocol"], -e["qoe"] if e["qoe"] != "" else 0))
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep dash.js ABR settings across protocols and server CC')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of concurrent Chrome sessions (default: CPU count)')
+    parser.add_argument('--protocols', nargs='+', choices=['tcp', 'quic'],
+                        default=['tcp', 'quic'], help='Protocols to run (default: tcp quic)')
+    parser.add_argument('--cc', nargs='+', choices=sorted(CC_ALGOS), default=['bbr'],
+                        help='Server congestion control algorithms (default: bbr)')
+    parser.add_argument('--server-cmd', default=None,
+                        help='Command starting the video server; {cc} is replaced by the -A value')
+    parser.add_argument('--server-warmup', type=float, default=2.0,
+                        help='Seconds to wait after starting the server (default: 2)')
+    parser.add_argument('--main', nargs='*', choices=ALL_ABR_RULES,
+                        default=['throughputRule', 'l2ARule', 'loLPRule'],
+                        help='Main rules, one per configuration (default: throughputRule l2ARule loLPRule)')
+    parser.add_argument('--toggle', nargs='*', choices=ALL_ABR_RULES,
+                        default=['bolaRule', 'insufficientBufferRule'],
+                        help='Rules tried both on and off (default: bolaRule insufficientBufferRule)')
+    parser.add_argument('--always', nargs='*', choices=ALL_ABR_RULES, default=[],
+                        help='Rules enabled in every configuration')
+    parser.add_argument('--stable-buffer', nargs='+', type=float, default=[None],
+                        help='stableBufferTime values in seconds (default: player default)')
+    parser.add_argument('--top-buffer', nargs='+', type=float, default=[None],
+                        help='bufferTimeAtTopQuality values in seconds (default: player default)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Runs per configuration (default: 1)')
+    parser.add_argument('--outdir', default='sweep',
+                        help='Root output directory (default: sweep)')
+    parser.add_argument('--chromedriver', default=None,
+                        help='Path to chromedriver (default: let Selenium find it)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Seconds between collector drains (default: 1.0)')
+    parser.add_argument('--sample-ms', type=int, default=250,
+                        help='In-page sampling period in milliseconds (default: 250)')
+    parser.add_argument('--format', choices=['csv', 'qoe'], default='qoe',
+                        help='Per-run QoE metrics format (default: qoe)')
+    parser.add_argument('--server', default=DEFAULT_SERVER,
+                        help=f'Server address; 127.0.0.1 for a local server (default: {DEFAULT_SERVER})')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Print the grid and what is left to run, then exit')
+    args = parser.parse_args()
+
+    if len(args.cc) > 1 and not args.server_cmd:
+        parser.error('sweeping --cc needs --server-cmd to restart the server')
+
+    grid = build_grid(args.protocols, args.cc,
+                      rule_sets(args.main, args.toggle, args.always),
+                      args.stable_buffer, args.top_buffer)
+    rows, todo = [], []
+    for cfg in grid:
+        for n in range(args.repeat):
+            done = load_done(args.outdir, cfg, n)
+            if done:
+                rows.append(done)
+            else:
+                todo.append((cfg, n))
+    print(f"{len(grid)} configurations x {args.repeat}: {len(rows)} runs done, "
+          f"{len(todo)} to run, {args.jobs} at a time")
+    if args.dry_run:
+        for cfg, n in todo:
+            print(f"  {cfg.tag(n)}")
+        return
+
+    os.makedirs(args.outdir, exist_ok=True)
+    start = time.time()
+    pool = DriverPool(args.chromedriver, args.server)
+    try:
+        for cc in args.cc:
+            batch = [(cfg, n) for cfg, n in todo if cfg.cc == cc]
+            if not batch:
+                continue
+            server = ServerProcess(args.server_cmd, cc, args.server_warmup) \
+                     if args.server_cmd else nullcontext()
+            with server, ThreadPoolExecutor(max_workers=args.jobs) as executor:
+                futures = [executor.submit(run_one, pool, args.outdir, cfg, n,
+                                           args.interval, args.sample_ms,
+                                           args.format)
+                           for cfg, n in batch]
+                for i, future in enumerate(as_completed(futures), 1):
+                    row = future.result()
+                    rows.append(row)
+                    print(f"✔ {cc} {i}/{len(batch)} {row['outdir']}: {row['status']}")
+    finally:
+        pool.close()
+        score(rows)
+        rows.sort(key=lambda r: (r["protocol"], r["cc"], r["abr_rules"],
+                                 str(r["stable_buffer"]), str(r["top_buffer"]), r["run"]))
+        write_summary(os.path.join(args.outdir, "results.csv"), rows)
+        table = by_config(rows)
+        write_summary(os.path.join(args.outdir, "results_by_config.csv"), table)
+
+    for protocol in args.protocols:
+        best = next((e for e in table if e["protocol"] == protocol), None)
+        if best:
+            print(f"🏆 {protocol}: {best['abr_rules']} cc={best['cc']} "
+                  f"stable={best['stable_buffer']} top={best['top_buffer']} "
+                  f"qoe={best['qoe']} over {best['runs']} runs")
+    print(f"🗒  {len(rows)} runs in {time.time() - start:.0f}s, results written to "
+          f"{os.path.join(args.outdir, 'results.csv')}")
+
+
+if __name__ == "__main__":
+    main()
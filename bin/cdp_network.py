@@ -0,0 +1,127 @@
+"""
+cdp_network.py -- per-segment download timing from Chrome DevTools events
+
+Correlates Network.requestWillBeSent, responseReceived, dataReceived,
+loadingFinished and loadingFailed by requestId, as found in
+driver.get_log('performance'), and yields one record per finished
+segment request with TTFB, transfer time and goodput.
+
+The performance log carries every network and page event as a JSON
+string.  Messages are filtered on the raw string -- method name, URL
+pattern, requestId -- and only the few that belong to a tracked segment
+request are fully decoded.
+"""
+import json
+import re
+
+# Also matches inside the raw JSON, where the URL is followed by a quote
+SEGMENT_URL_RE = r"\.(?:m4s|mp4|m4v|m4a|webm)(?:[?#\"]|$)"
+
+CSV_HEADER = [
+    "timestamp", "wall_clock", "url", "size", "download_time", "media_type",
+    "ttfb_ms", "transfer_ms", "goodput_kbps", "protocol", "status",
+]
+
+_REQUEST_ID_RE = re.compile(r'"requestId":"([^"]+)"')
+
+
+def media_type_of(url):
+    if "video" in url:
+        return "video"
+    if "audio" in url:
+        return "audio"
+    return "unknown"
+
+
+class _Request:
+    __slots__ = ("url", "wall_time", "start", "headers_end", "ttfb_ms",
+                 "protocol", "status", "nbytes")
+
+    def __init__(self, url, wall_time, start):
+        self.url = url
+        self.wall_time = wall_time      # Epoch seconds at request start
+        self.start = start              # Monotonic seconds, CDP clock
+        self.headers_end = None
+        self.ttfb_ms = None
+        self.protocol = ""
+        self.status = 0
+        self.nbytes = 0
+
+
+class NetworkTracker:
+    """Turns performance log entries into per-segment timing records"""
+
+    def __init__(self, url_pattern=SEGMENT_URL_RE):
+        self.url_re = re.compile(url_pattern)
+        self.inflight = {}
+
+    def feed(self, entries):
+        """Consume get_log('performance') entries; return finished segments"""
+        done = []
+        for entry in entries:
+            raw = entry["message"]
+            if '"Network.' not in raw:
+                continue
+            if '"Network.requestWillBeSent"' in raw:
+                if self.url_re.search(raw):
+                    params = json.loads(raw)["message"]["params"]
+                    req = params["request"]
+                    if self.url_re.search(req["url"]):
+                        self.inflight[params["requestId"]] = _Request(
+                            req["url"], params["wallTime"], params["timestamp"])
+                continue
+            m = _REQUEST_ID_RE.search(raw)
+            if m is None or m.group(1) not in self.inflight:
+                continue
+            request_id = m.group(1)
+            params = json.loads(raw)["message"]["params"]
+            r = self.inflight[request_id]
+            if '"Network.responseReceived"' in raw:
+                resp = params["response"]
+                r.protocol = resp.get("protocol", "")
+                r.status = resp.get("status", 0)
+                timing = resp.get("timing")
+                if timing:
+                    # Offsets in ms from timing.requestTime (CDP clock)
+                    r.ttfb_ms = timing["receiveHeadersEnd"] - max(timing["sendStart"], 0)
+                    r.headers_end = timing["requestTime"] + timing["receiveHeadersEnd"] / 1000.0
+                else:
+                    r.headers_end = params["timestamp"]
+            elif '"Network.dataReceived"' in raw:
+                r.nbytes += params.get("encodedDataLength") or params.get("dataLength", 0)
+            elif '"Network.loadingFinished"' in raw:
+                del self.inflight[request_id]
+                done.append(self._finish(r, params["timestamp"],
+                                         params.get("encodedDataLength", r.nbytes)))
+            elif '"Network.loadingFailed"' in raw:
+                del self.inflight[request_id]
+        return done
+
+    @staticmethod
+    def _finish(r, end, nbytes):
+        headers_end = r.headers_end if r.headers_end is not None else r.start
+        transfer_ms = max(end - headers_end, 0.0) * 1000.0
+        return {
+            "timestamp":    r.wall_time,
+            "url":          r.url,
+            "size":         nbytes,
+            "download_time": (end - r.start) * 1000.0,
+            "media_type":   media_type_of(r.url),
+            "ttfb_ms":      r.ttfb_ms,
+            "transfer_ms":  transfer_ms,
+            "goodput_kbps": nbytes * 8 / transfer_ms if transfer_ms > 0 else None,
+            "protocol":     r.protocol,
+            "status":       r.status,
+        }
+
+
+def csv_row(seg, wall_clock_start):
+    """Format a finished segment as a segment_downloads.csv row"""
+    def r(value, digits=2):
+        return "" if value is None else round(value, digits)
+    return [
+        seg["timestamp"], round(seg["timestamp"] - wall_clock_start, 3),
+        seg["url"], seg["size"], r(seg["download_time"]), seg["media_type"],
+        r(seg["ttfb_ms"]), r(seg["transfer_ms"]), r(seg["goodput_kbps"]),
+        seg["protocol"], seg["status"],
+    ]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+fetch_dashjs.py -- install the pinned dash.js next to index.html
+
+The player page and the injection snippets load dash.js from
+video/dashjs/<version>/dash.all.min.js, which video_server sends with
+Cache-Control: immutable (see its -I option).  The version is in the
+path, so bumping DASHJS_VERSION never serves a stale copy.
+
+The harness scripts (qoe_collector.py, tcp_selenium.py, watch_and_save.py)
+use the dash.js 5 API: Representations instead of quality indices in
+QUALITY_CHANGE_RENDERED, getCurrentRepresentationForType() instead of
+getQualityFor() and getBitrateInfoListFor().  Check them before pinning
+another major version.
+
+Run once per checkout; on machines without Internet access, copy a
+release build in with --from.  The SHA-256 printed at the end can be
+checked on other boxes with --sha256.
+
+Usage:
+    ./fetch_dashjs.py
+    ./fetch_dashjs.py --from ~/Downloads/dash.all.min.js
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import urllib.request
+
+DASHJS_VERSION = "5.0.0"
+
+# Relative to the document root, as the page requests it
+DASHJS_PATH = f"dashjs/{DASHJS_VERSION}/dash.all.min.js"
+
+DASHJS_URL = (f"https://cdn.jsdelivr.net/npm/dashjs@{DASHJS_VERSION}"
+              f"/dist/modern/umd/dash.all.min.js")
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Install the pinned dash.js build')
+    parser.add_argument('--root', default=os.path.join(here, 'video'),
+                        help='Document root served by video_server (default: bin/video)')
+    parser.add_argument('--url', default=DASHJS_URL,
+                        help=f'Where to download dash.js {DASHJS_VERSION} from')
+    parser.add_argument('--from', dest='src', default=None,
+                        help='Copy a local dash.all.min.js instead of downloading')
+    parser.add_argument('--sha256', default=None,
+                        help='Expected SHA-256 of the file')
+    args = parser.parse_args()
+
+    dest = os.path.join(args.root, DASHJS_PATH)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = dest + ".tmp"
+    if args.src:
+        shutil.copyfile(args.src, tmp)
+    else:
+        print(f"⬇️  {args.url}")
+        with urllib.request.urlopen(args.url, timeout=60) as resp, open(tmp, "wb") as f:
+            shutil.copyfileobj(resp, f)
+
+    with open(tmp, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    if args.sha256 and digest != args.sha256.lower():
+        os.unlink(tmp)
+        print(f"❌ SHA-256 mismatch: got {digest}", file=sys.stderr)
+        sys.exit(1)
+    os.replace(tmp, dest)
+    print(f"✔ dash.js {DASHJS_VERSION} installed as {dest}")
+    print(f"   sha256 {digest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,586 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * file_cache.c -- Server-wide cache of file contents, shared by all streams
+ */
+
+#include <assert.h>
+#include <errno.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/queue.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <time.h>
+
+#ifndef WIN32
+#include <sys/mman.h>
+#include <unistd.h>
+#else
+#include <io.h>
+#include "vc_compat.h"
+#endif
+
+#include "lsquic.h"
+#include "../src/liblsquic/lsquic_hash.h"
+#include "../src/liblsquic/lsquic_logger.h"
+
+#include "file_cache.h"
+
+/* LFU entries are kept in buckets by hit count: bucket 0 holds the
+ * entries without hits and bucket b > 0 those with 2^(b-1) to 2^b - 1
+ * hits.  Halving all counts moves every entry one bucket down.
+ */
+#define FC_LFU_BUCKETS 16
+#define FC_LFU_MAX_HITS ((1UL << (FC_LFU_BUCKETS - 1)) - 1)
+
+/* Hit counts are halved after this many hits per cached entry, so that
+ * segments that were popular long ago do not stay cached forever.
+ */
+#define FC_LFU_AGE_HITS 4
+
+
+struct file_cache
+{
+    struct lsquic_hash         *fc_hash;
+    /* All entries, least recently used first */
+    TAILQ_HEAD(, fc_entry)      fc_lru;
+    /* LFU: entries by hit count, each bucket least recently used first */
+    TAILQ_HEAD(, fc_entry)      fc_lfu[FC_LFU_BUCKETS];
+    unsigned long               fc_lfu_hits;    /* Since the last aging */
+    struct fc_settings          fc_settings;
+    struct fc_stats             fc_stats;
+};
+
+
+struct file_cache *
+file_cache_new (const struct fc_settings *settings)
+{
+    struct file_cache *cache;
+    unsigned i;
+
+    cache = calloc(1, sizeof(*cache));
+    if (!cache)
+        return NULL;
+
+    cache->fc_hash = lsquic_hash_create();
+    if (!cache->fc_hash)
+    {
+        free(cache);
+        return NULL;
+    }
+    TAILQ_INIT(&cache->fc_lru);
+    for (i = 0; i < FC_LFU_BUCKETS; ++i)
+        TAILQ_INIT(&cache->fc_lfu[i]);
+    cache->fc_settings = *settings;
+    return cache;
+}
+
+
+static unsigned long long
+fc_now_ms (void)
+{
+#ifndef WIN32
+    struct timespec ts;
+    (void) clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (unsigned long long) ts.tv_sec * 1000 + ts.tv_nsec / 1000000;
+#else
+    return GetTickCount64();
+#endif
+}
+
+
+long long
+file_cache_mtime_ns (const struct stat *st)
+{
+#if defined(__APPLE__)
+    return (long long) st->st_mtimespec.tv_sec * 1000000000
+                                            + st->st_mtimespec.tv_nsec;
+#elif defined(WIN32)
+    return (long long) st->st_mtime * 1000000000;
+#else
+    return (long long) st->st_mtim.tv_sec * 1000000000 + st->st_mtim.tv_nsec;
+#endif
+}
+
+
+static unsigned
+fc_lfu_bucket (unsigned long hits)
+{
+    unsigned bucket;
+
+    for (bucket = 0; hits; hits >>= 1)
+        ++bucket;
+    return bucket;
+}
+
+
+/* Halve the hit counts of all entries.  Two buckets merge into one, so
+ * the buckets are refilled from the LRU list to keep them in access order.
+ */
+static void
+fc_lfu_age (struct file_cache *cache)
+{
+    struct fc_entry *entry;
+    unsigned i;
+
+    for (i = 0; i < FC_LFU_BUCKETS; ++i)
+        TAILQ_INIT(&cache->fc_lfu[i]);
+    TAILQ_FOREACH(entry, &cache->fc_lru, fce_next_lru)
+    {
+        entry->fce_hits >>= 1;
+        TAILQ_INSERT_TAIL(&cache->fc_lfu[fc_lfu_bucket(entry->fce_hits)],
+                                                        entry, fce_next_lfu);
+    }
+    cache->fc_lfu_hits = 0;
+}
+
+
+static void
+fc_lfu_hit (struct file_cache *cache, struct fc_entry *entry)
+{
+    unsigned bucket;
+
+    bucket = fc_lfu_bucket(entry->fce_hits);
+    TAILQ_REMOVE(&cache->fc_lfu[bucket], entry, fce_next_lfu);
+    if (entry->fce_hits < FC_LFU_MAX_HITS)
+        ++entry->fce_hits;
+    bucket = fc_lfu_bucket(entry->fce_hits);
+    TAILQ_INSERT_TAIL(&cache->fc_lfu[bucket], entry, fce_next_lfu);
+
+    if (++cache->fc_lfu_hits >= FC_LFU_AGE_HITS
+                                * (unsigned long) cache->fc_stats.n_entries)
+        fc_lfu_age(cache);
+}
+
+
+static void
+fc_entry_destroy (struct fc_entry *entry)
+{
+    if (entry->fce_flags & FCE_MAPPED)
+    {
+#ifndef WIN32
+        (void) munmap((void *) entry->fce_buf, entry->fce_size);
+#endif
+    }
+    else
+        free((void *) entry->fce_buf);
+    free(entry->fce_path);
+    free(entry);
+}
+
+
+/* Unlink the entry from the cache.  It is freed when its last reference
+ * is released.
+ */
+static void
+fc_remove (struct file_cache *cache, struct fc_entry *entry)
+{
+    assert(entry->fce_flags & FCE_HASHED);
+    lsquic_hash_erase(cache->fc_hash, &entry->fce_hash_el);
+    entry->fce_flags &= ~FCE_HASHED;
+    TAILQ_REMOVE(&cache->fc_lru, entry, fce_next_lru);
+    if (cache->fc_settings.fcs_policy == FCP_LFU)
+        TAILQ_REMOVE(&cache->fc_lfu[fc_lfu_bucket(entry->fce_hits)], entry,
+                                                                fce_next_lfu);
+    --cache->fc_stats.n_entries;
+    cache->fc_stats.n_bytes -= entry->fce_size;
+    if (entry->fce_refcnt == 0)
+        fc_entry_destroy(entry);
+}
+
+
+static int
+fc_over_budget (const struct file_cache *cache)
+{
+    return cache->fc_stats.n_entries > cache->fc_settings.fcs_max_entries
+        || cache->fc_stats.n_bytes > cache->fc_settings.fcs_max_bytes;
+}
+
+
+/* Entries in use by a stream are never evicted, so the cache may stay
+ * over budget until they are released.  Only those are skipped.
+ */
+static struct fc_entry *
+fc_find_victim (const struct file_cache *cache)
+{
+    struct fc_entry *entry;
+    unsigned i;
+
+    if (cache->fc_settings.fcs_policy == FCP_LRU)
+    {
+        TAILQ_FOREACH(entry, &cache->fc_lru, fce_next_lru)
+            if (entry->fce_refcnt == 0)
+                return entry;
+        return NULL;
+    }
+
+    /* LFU: fewest hits; ties go to the least recently used */
+    for (i = 0; i < FC_LFU_BUCKETS; ++i)
+        TAILQ_FOREACH(entry, &cache->fc_lfu[i], fce_next_lfu)
+            if (entry->fce_refcnt == 0)
+                return entry;
+
+    return NULL;
+}
+
+
+static void
+fc_evict (struct file_cache *cache)
+{
+    struct fc_entry *victim;
+
+    while (fc_over_budget(cache) && (victim = fc_find_victim(cache)))
+    {
+        LSQ_DEBUG("evict %s from file cache", victim->fce_path);
+        ++cache->fc_stats.evictions;
+        fc_remove(cache, victim);
+    }
+}
+
+
+static int
+fc_load (const struct file_cache *cache, int fd, size_t size,
+                                                const unsigned char **buf)
+{
+    unsigned char *mem;
+    size_t off;
+    ssize_t nread;
+
+    if (size == 0)
+    {
+        *buf = NULL;
+        return 0;
+    }
+
+#ifndef WIN32
+    if (cache->fc_settings.fcs_storage == FCS_MMAP)
+    {
+        mem = mmap(NULL, size, PROT_READ, MAP_SHARED, fd, 0);
+        if (mem == MAP_FAILED)
+            return -1;
+        *buf = mem;
+        return 0;
+    }
+#endif
+
+    mem = malloc(size);
+    if (!mem)
+        return -1;
+    for (off = 0; off < size; off += nread)
+    {
+#ifndef WIN32
+        nread = read(fd, mem + off, size - off);
+#else
+        nread = _read(fd, mem + off, size - off);
+#endif
+        if (nread <= 0)
+        {
+            if (nread == 0)
+                errno = EIO;    /* File was truncated under us */
+            free(mem);
+            return -1;
+        }
+    }
+    *buf = mem;
+    return 0;
+}
+
+
+/* Does not log: it may run on a prefetch thread */
+static struct fc_entry *
+fc_entry_new (const struct file_cache *cache, const char *path)
+{
+    struct fc_entry *entry;
+    struct stat st;
+    int fd, saved_errno;
+
+#ifndef WIN32
+    fd = open(path, O_RDONLY);
+#else
+    fd = _open(path, _O_RDONLY | _O_BINARY);
+#endif
+    if (fd < 0)
+        return NULL;
+
+    if (0 != fstat(fd, &st) || !S_ISREG(st.st_mode))
+    {
+        (void) close(fd);
+        errno = ENOENT;
+        return NULL;
+    }
+
+    if ((size_t) st.st_size > cache->fc_settings.fcs_max_bytes)
+    {
+        /* Loading it would flush the whole cache */
+        (void) close(fd);
+        errno = EFBIG;
+        return NULL;
+    }
+
+    entry = calloc(1, sizeof(*entry));
+    if (!entry)
+        goto err;
+    entry->fce_path = strdup(path);
+    if (!entry->fce_path)
+        goto err;
+    if (0 != fc_load(cache, fd, st.st_size, &entry->fce_buf))
+        goto err;
+    (void) close(fd);
+
+    if (cache->fc_settings.fcs_storage == FCS_MMAP && st.st_size > 0)
+        entry->fce_flags |= FCE_MAPPED;
+    entry->fce_size = st.st_size;
+    entry->fce_mtime_ns = file_cache_mtime_ns(&st);
+    entry->fce_ino = st.st_ino;
+    entry->fce_checked_ms = fc_now_ms();
+    return entry;
+
+  err:
+    saved_errno = errno;
+    (void) close(fd);
+    if (entry)
+        free(entry->fce_path);
+    free(entry);
+    errno = saved_errno;
+    return NULL;
+}
+
+
+/* Returns true if the file changed since the entry was loaded */
+static int
+fc_stale (const struct file_cache *cache, struct fc_entry *entry)
+{
+    unsigned long long now;
+    struct stat st;
+
+    now = fc_now_ms();
+    if (now - entry->fce_checked_ms < cache->fc_settings.fcs_revalidate_ms)
+        return 0;
+
+    entry->fce_checked_ms = now;
+    if (0 != stat(entry->fce_path, &st))
+        return 1;
+    return file_cache_mtime_ns(&st) != entry->fce_mtime_ns
+        || (size_t) st.st_size != entry->fce_size
+        || (unsigned long long) st.st_ino != entry->fce_ino;
+}
+
+
+/* Returns the entry if path is cached and up to date */
+static struct fc_entry *
+fc_find (struct file_cache *cache, const char *path)
+{
+    struct lsquic_hash_elem *el;
+    struct fc_entry *entry;
+
+    el = lsquic_hash_find(cache->fc_hash, path, strlen(path));
+    if (!el)
+        return NULL;
+
+    entry = lsquic_hashelem_getdata(el);
+    if (fc_stale(cache, entry))
+    {
+        LSQ_DEBUG("%s changed on disk", path);
+        ++cache->fc_stats.invalidations;
+        fc_remove(cache, entry);
+        return NULL;
+    }
+
+    return entry;
+}
+
+
+/* Returns a referenced entry if path is cached and up to date */
+static struct fc_entry *
+fc_lookup (struct file_cache *cache, const char *path)
+{
+    struct fc_entry *entry;
+
+    entry = fc_find(cache, path);
+    if (!entry)
+        return NULL;
+
+    ++cache->fc_stats.hits;
+    /* Before fc_lfu_hit(): aging reads the access order off fc_lru */
+    TAILQ_REMOVE(&cache->fc_lru, entry, fce_next_lru);
+    TAILQ_INSERT_TAIL(&cache->fc_lru, entry, fce_next_lru);
+    if (cache->fc_settings.fcs_policy == FCP_LFU)
+        fc_lfu_hit(cache, entry);
+    else
+        ++entry->fce_hits;
+    ++entry->fce_refcnt;
+    return entry;
+}
+
+
+/* Returns 0 if the entry is a duplicate and was not inserted */
+static int
+fc_insert (struct file_cache *cache, struct fc_entry *entry)
+{
+    if (!lsquic_hash_insert(cache->fc_hash, entry->fce_path,
+                strlen(entry->fce_path), entry, &entry->fce_hash_el))
+        return 0;
+    entry->fce_flags |= FCE_HASHED;
+    TAILQ_INSERT_TAIL(&cache->fc_lru, entry, fce_next_lru);
+    if (cache->fc_settings.fcs_policy == FCP_LFU)
+        TAILQ_INSERT_TAIL(&cache->fc_lfu[fc_lfu_bucket(entry->fce_hits)],
+                                                        entry, fce_next_lfu);
+    ++cache->fc_stats.n_entries;
+    cache->fc_stats.n_bytes += entry->fce_size;
+    LSQ_DEBUG("cached %s, %zu bytes", entry->fce_path, entry->fce_size);
+    return 1;
+}
+
+
+struct fc_entry *
+file_cache_peek (struct file_cache *cache, const char *path)
+{
+    return fc_lookup(cache, path);
+}
+
+
+struct fc_entry *
+file_cache_get (struct file_cache *cache, const char *path)
+{
+    struct fc_entry *entry;
+
+    entry = fc_lookup(cache, path);
+    if (entry)
+        return entry;
+
+    ++cache->fc_stats.misses;
+    entry = fc_entry_new(cache, path);
+    if (!entry)
+    {
+        if (errno == EFBIG)
+        {
+            LSQ_DEBUG("%s is larger than the cache budget", path);
+            ++cache->fc_stats.uncacheable;
+        }
+        else
+            LSQ_INFO("cannot load %s: %s", path, strerror(errno));
+        return NULL;
+    }
+    entry->fce_refcnt = 1;
+
+    if (fc_insert(cache, entry))
+        fc_evict(cache);
+    return entry;
+}
+
+
+int
+file_cache_has (struct file_cache *cache, const char *path)
+{
+    return fc_find(cache, path) != NULL;
+}
+
+
+#ifndef WIN32
+/* Touch every page so that the stream's reader does not fault them in */
+static void
+fc_prefault (const struct fc_entry *entry)
+{
+    const volatile unsigned char *const p = entry->fce_buf;
+    const size_t page_size = sysconf(_SC_PAGESIZE);
+    size_t off;
+
+    for (off = 0; off < entry->fce_size; off += page_size)
+        (void) p[off];
+}
+
+
+#endif
+struct fc_entry *
+file_cache_load (const struct file_cache *cache, const char *path)
+{
+    struct fc_entry *entry;
+
+    entry = fc_entry_new(cache, path);
+#ifndef WIN32
+    if (entry && (entry->fce_flags & FCE_MAPPED))
+        fc_prefault(entry);
+#endif
+    return entry;
+}
+
+
+void
+file_cache_add (struct file_cache *cache, struct fc_entry *entry)
+{
+    if (fc_find(cache, entry->fce_path) || !fc_insert(cache, entry))
+    {
+        /* Loaded by a request while the prefetch was in flight */
+        fc_entry_destroy(entry);
+        return;
+    }
+    ++cache->fc_stats.prefetched;
+    fc_evict(cache);
+}
+
+
+void
+file_cache_release (struct file_cache *cache, struct fc_entry *entry)
+{
+    assert(entry->fce_refcnt > 0);
+    if (--entry->fce_refcnt == 0)
+    {
+        if (!(entry->fce_flags & FCE_HASHED))
+            fc_entry_destroy(entry);
+        else if (fc_over_budget(cache))
+            fc_evict(cache);
+    }
+}
+
+
+void
+file_cache_get_stats (const struct file_cache *cache, struct fc_stats *stats)
+{
+    *stats = cache->fc_stats;
+}
+
+
+int
+file_cache_parse_size (const char *str, size_t *size)
+{
+    unsigned long long val;
+    char *end;
+
+    val = strtoull(str, &end, 10);
+    if (end == str)
+        return -1;
+    switch (*end)
+    {
+    case 'G': case 'g':
+        val <<= 10;
+        /* fall through */
+    case 'M': case 'm':
+        val <<= 10;
+        /* fall through */
+    case 'K': case 'k':
+        val <<= 10;
+        ++end;
+        break;
+    }
+    if (*end != '\0')
+        return -1;
+    *size = (size_t) val;
+    return 0;
+}
+
+
+void
+file_cache_destroy (struct file_cache *cache)
+{
+    struct fc_entry *entry;
+
+    while ((entry = TAILQ_FIRST(&cache->fc_lru)))
+    {
+        entry->fce_refcnt = 0;
+        fc_remove(cache, entry);
+    }
+    lsquic_hash_destroy(cache->fc_hash);
+    free(cache);
+}
@@ -0,0 +1,137 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * file_cache.h -- Server-wide cache of file contents, shared by all streams
+ *
+ * Each file is loaded once on first use, either by mmap()ing it or by
+ * reading it into memory.  Later requests for the same path reuse the
+ * cached bytes and the precomputed response headers, so serving a
+ * popular segment costs no system calls after the first hit.
+ *
+ * Entries not used by any stream are evicted -- least recently or least
+ * frequently used first -- when the cache exceeds its byte budget or
+ * entry limit.  LFU hit counts are halved every few hits per entry, so
+ * that yesterday's popular segments make room for today's.  An entry is
+ * revalidated against the file's mtime, size and inode at most once per
+ * revalidation interval.
+ */
+
+#ifndef FILE_CACHE_H
+#define FILE_CACHE_H 1
+
+struct file_cache;
+struct stat;
+
+enum fc_storage
+{
+    /* mmap() the file.  Only for files that are replaced, not rewritten:
+     * if a mapped file is truncated, reading past its new end raises
+     * SIGBUS.  Revalidation does not help, as the entry may be in use.
+     */
+    FCS_MMAP,
+    FCS_MEMORY,     /* read() the file into a malloc'ed buffer */
+};
+
+enum fc_policy
+{
+    FCP_LRU,
+    FCP_LFU,
+};
+
+struct fc_settings
+{
+    enum fc_storage     fcs_storage;
+    enum fc_policy      fcs_policy;
+    unsigned            fcs_max_entries;
+    size_t              fcs_max_bytes;
+    unsigned            fcs_revalidate_ms;  /* 0 means stat() on every hit */
+};
+
+struct fc_stats
+{
+    unsigned long       hits,
+                        misses,
+                        evictions,
+                        invalidations,
+                        uncacheable,        /* Larger than the budget */
+                        prefetched;         /* Added by file_cache_add() */
+    unsigned            n_entries;
+    size_t              n_bytes;
+};
+
+struct fc_entry
+{
+    struct lsquic_hash_elem     fce_hash_el;
+    TAILQ_ENTRY(fc_entry)       fce_next_lru;
+    TAILQ_ENTRY(fc_entry)       fce_next_lfu;
+    char                       *fce_path;
+    const unsigned char        *fce_buf;
+    size_t                      fce_size;
+    unsigned                    fce_refcnt;
+    unsigned long               fce_hits;       /* LFU: aged */
+    /* Used for revalidation: */
+    long long                   fce_mtime_ns;
+    unsigned long long          fce_ino;
+    unsigned long long          fce_checked_ms;
+    /* Response headers, filled in by the user on first use: */
+    const char                 *fce_content_type;
+    char                        fce_content_length[24];
+    char                        fce_etag[64];
+    char                        fce_last_modified[32];
+    enum {
+        FCE_HASHED  = 1 << 0,   /* Can be found by path */
+        FCE_MAPPED  = 1 << 1,   /* fce_buf is mmap()ed, not malloc'ed */
+    }                           fce_flags;
+};
+
+struct file_cache *
+file_cache_new (const struct fc_settings *);
+
+void
+file_cache_destroy (struct file_cache *);
+
+/* Returns a referenced entry or NULL if the file cannot be loaded.  The
+ * entry must be returned using file_cache_release().  errno is set to
+ * EFBIG if the file is larger than the cache budget: serve it from disk.
+ */
+struct fc_entry *
+file_cache_get (struct file_cache *, const char *path);
+
+/* Like file_cache_get(), but returns NULL instead of loading the file */
+struct fc_entry *
+file_cache_peek (struct file_cache *, const char *path);
+
+void
+file_cache_release (struct file_cache *, struct fc_entry *);
+
+/* Returns true if path is cached and up to date.  Does not count as a
+ * hit or a miss.
+ */
+int
+file_cache_has (struct file_cache *, const char *path);
+
+/* Load the file into a new entry without adding it to the cache.  The
+ * cache itself is not touched, so this may be called from any thread.
+ * mmap()ed files are faulted in.  Returns NULL and sets errno on error;
+ * errno is EFBIG if the file is larger than the cache budget.
+ */
+struct fc_entry *
+file_cache_load (const struct file_cache *, const char *path);
+
+/* Add an entry returned by file_cache_load().  The cache takes
+ * ownership: if the file has been cached meanwhile, the entry is freed.
+ */
+void
+file_cache_add (struct file_cache *, struct fc_entry *);
+
+void
+file_cache_get_stats (const struct file_cache *, struct fc_stats *);
+
+/* Modification time of a file, as used for revalidation */
+long long
+file_cache_mtime_ns (const struct stat *);
+
+/* Parse sizes like "512M" or "2G" */
+int
+file_cache_parse_size (const char *, size_t *);
+
+#endif
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+frame_analysis.py -- frame-level analysis of recorded_video_*.webm
+
+Decodes a recording with ffmpeg, in parallel chunks of --chunk seconds
+on a process pool.  Each worker streams grey frames scaled to --size
+through a pipe, one frame at a time, so memory use does not depend on
+the length of the recording.  Per frame it measures:
+
+  diff        Mean absolute luma difference from the previous frame;
+              runs of frames below --freeze-threshold lasting at least
+              --min-freeze seconds are reported as freezes
+  width, height
+              Decoded resolution, from ffmpeg's showinfo filter, to find
+              resolution changes
+  psnr, ssim  Against --reference, the source rendition, at the media
+              time being shown (needs --qoe to map recording time to
+              playback time; SSIM uses 8x8 box windows)
+
+The timeline carries the wall clock, media time and the stall count of
+the QoE samples, so freezes can be checked against the stalls that the
+player reported.  Time 0 of the recording is at wall_clock --offset;
+watch_and_save.py reports it as record_offset.
+
+Requires ffmpeg and ffprobe 5.1 or later.
+
+Usage:
+    ./frame_analysis.py results/run/recorded_video_quic.webm \\
+        --qoe results/run/qoe_metrics_quic.csv --offset -1.2 \\
+        --reference video/manifest.mpd --rendition 2 -j 8
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+FRAME_FIELDS = ("pts", "wall_clock", "media_time", "width", "height", "diff",
+                "frozen", "psnr", "ssim", "stall_count")
+
+SHOWINFO_RE = re.compile(r"\bn:\s*\d+\s.*?\bpts_time:\s*(\S+).*?\bs:(\d+)x(\d+)")
+
+
+# ─── Decoding ───────────────────────────────────────────────────────────
+
+def probe_duration(path):
+    out = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                          "-of", "csv=p=0", path],
+                         capture_output=True, text=True, check=True).stdout.strip()
+    return float(out)
+
+
+def remux(path, tmpdir):
+    """MediaRecorder output has neither duration nor cues; copying it into
+    Matroska adds both, so workers can seek to their chunk"""
+    out = os.path.join(tmpdir, "recording.mkv")
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", path, "-map", "0:v:0",
+                    "-c", "copy", out], check=True)
+    return out
+
+
+def assemble_rendition(manifest, rep_id, tmpdir):
+    """Concatenate a representation's init and media segments into one
+    fragmented MP4 that ffmpeg can decode"""
+    from abr_sim import rendition_files
+
+    base = os.path.dirname(manifest)
+    out = os.path.join(tmpdir, f"rendition-{rep_id}.mp4")
+    with open(out, "wb") as dst:
+        for name in rendition_files(manifest, rep_id):
+            with open(os.path.join(base, name), "rb") as src:
+                shutil.copyfileobj(src, dst)
+    return out
+
+
+def decode(path, start, end, size):
+    """Yield (pts, width, height, frame) for frames with start <= pts < end
+
+    frame is a (height, width) uint8 luma array at `size'; width and
+    height are the decoded resolution before scaling.
+    """
+    w, h = size
+    # showinfo logs at the info level; nothing else is parsed from stderr
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-v", "info", "-nostdin", "-copyts",
+           "-ss", f"{max(start, 0.0):.3f}"]
+    if end != float("inf"):
+        cmd += ["-to", f"{end:.3f}"]
+    cmd += ["-i", path, "-map", "0:v:0", "-vf", f"showinfo,scale={w}:{h},format=gray",
+            "-fps_mode", "passthrough", "-f", "rawvideo", "-"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # showinfo logs one line per frame on stderr, in output order
+    info, cond = [], threading.Condition()
+
+    def read_info():
+        for line in proc.stderr:
+            m = SHOWINFO_RE.search(line.decode(errors="replace"))
+            if m:
+                with cond:
+                    info.append((float(m.group(1)), int(m.group(2)), int(m.group(3))))
+                    cond.notify()
+        with cond:
+            info.append(None)
+            cond.notify()
+
+    reader = threading.Thread(target=read_info, daemon=True)
+    reader.start()
+    frame_bytes = w * h
+    try:
+        while True:
+            buf = proc.stdout.read(frame_bytes)
+            if len(buf) < frame_bytes:
+                break
+            with cond:
+                cond.wait_for(lambda: info)
+                meta = info.pop(0)
+            if meta is None:
+                break
+            pts, fw, fh = meta
+            if pts >= end:
+                break
+            if pts >= start:
+                yield pts, fw, fh, np.frombuffer(buf, dtype=np.uint8).reshape(h, w)
+    finally:
+        proc.kill()
+        proc.wait()
+        reader.join()
+
+
+# ─── Frame metrics ──────────────────────────────────────────────────────
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b) ** 2)
+    return 100.0 if mse == 0 else 10.0 * np.log10(255.0 * 255.0 / mse)
+
+
+def _box(x, n):
+    """Sums over every n x n window, via an integral image"""
+    s = np.zeros((x.shape[0] + 1, x.shape[1] + 1))
+    s[1:, 1:] = x.cumsum(0).cumsum(1)
+    return s[n:, n:] - s[:-n, n:] - s[n:, :-n] + s[:-n, :-n]
+
+
+def ssim(a, b, n=8):
+    """Mean SSIM of luma over all n x n windows"""
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    k = float(n * n)
+    mu_a, mu_b = _box(a, n) / k, _box(b, n) / k
+    var_a = _box(a * a, n) / k - mu_a * mu_a
+    var_b = _box(b * b, n) / k - mu_b * mu_b
+    cov = _box(a * b, n) / k - mu_a * mu_b
+    return float(np.mean((2 * mu_a * mu_b + c1) * (2 * cov + c2)
+                         / ((mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2))))
+
+
+class ReferenceCursor:
+    """Walks the reference forward, keeping only the frames around the
+    requested media time"""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.prev = None
+        self.next = next(self.frames, None)
+
+    def at(self, t):
+        while self.next is not None and self.next[0] <= t:
+            self.prev, self.next = self.next, next(self.frames, None)
+        if self.prev is None:
+            return self.next
+        if self.next is not None and self.next[0] - t < t - self.prev[0]:
+            return self.next
+        return self.prev
+
+
+def analyse_chunk(job):
+    """Per-frame metrics for recording time [start, end)"""
+    (path, start, end, size, margin, reference, offset, wall, play) = job
+    cols = {name: [] for name in ("pts", "width", "height", "diff", "psnr", "ssim")}
+    prev = None
+    ref = None
+    for pts, w, h, frame in decode(path, start - margin, end, size):
+        if pts >= start:
+            cols["pts"].append(pts)
+            cols["width"].append(w)
+            cols["height"].append(h)
+            # The very first frame has nothing to repeat
+            cols["diff"].append(np.nan if prev is None else
+                                float(np.mean(np.abs(frame.astype(np.int16) - prev))))
+            if reference:
+                media = float(np.interp(pts + offset, wall, play)) if len(wall) else pts
+                if ref is None:
+                    ref = ReferenceCursor(decode(reference, max(media - 1.0, 0.0),
+                                                 float("inf"), size))
+                match = ref.at(media)
+                if match is not None:
+                    cols["psnr"].append(psnr(frame, match[3]))
+                    cols["ssim"].append(ssim(frame, match[3]))
+                else:
+                    cols["psnr"].append(np.nan)
+                    cols["ssim"].append(np.nan)
+        prev = frame
+    if reference and ref is not None:
+        ref.frames.close()
+    n = len(cols["pts"])
+    if not reference:
+        cols["psnr"] = cols["ssim"] = [np.nan] * n
+    return {name: np.array(values, dtype=np.float64) for name, values in cols.items()}
+
+
+# ─── Timeline ───────────────────────────────────────────────────────────
+
+def find_freezes(pts, diff, threshold, min_duration):
+    """(start, duration, frames) of each run of frames that repeat the
+    previous one, lasting at least min_duration seconds"""
+    frozen = np.nan_to_num(diff, nan=np.inf) < threshold
+    edges = np.diff(np.concatenate(([0], frozen.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return []
+    # Frames starts..ends-1 repeat frame starts-1, which stays on screen
+    # until frame `ends' (or the end of the recording)
+    t0 = pts[np.maximum(starts - 1, 0)]
+    t1 = pts[np.minimum(ends, len(pts) - 1)]
+    keep = (t1 - t0) >= min_duration
+    return [(float(a), float(b - a), int(e - s))
+            for a, b, s, e in zip(t0[keep], t1[keep], starts[keep], ends[keep])]
+
+
+def resolution_changes(pts, width, height):
+    change = np.flatnonzero((np.diff(width) != 0) | (np.diff(height) != 0)) + 1
+    return [(float(pts[i]), int(width[i - 1]), int(height[i - 1]), int(width[i]), int(height[i]))
+            for i in change]
+
+
+def load_samples(path):
+    """wall_clock, playback_time and stall_count of a qoe_metrics file"""
+    if path.endswith(".qoe"):
+        from qoe_sink import load_run
+        cols = load_run(path)
+    else:
+        from qoe_analysis import load_csv_run
+        cols = load_csv_run(path)
+    return (np.asarray(cols["wall_clock"], dtype=np.float64),
+            np.asarray(cols["playback_time"], dtype=np.float64),
+            np.asarray(cols["stall_count"], dtype=np.float64))
+
+
+def default_offset(recording):
+    """record_offset from the run.json that abr_sweep.py leaves beside the run"""
+    try:
+        with open(os.path.join(os.path.dirname(recording), "run.json")) as f:
+            return float(json.load(f).get("record_offset") or 0.0)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Frame-level analysis of a recorded playback')
+    parser.add_argument('recording', help='recorded_video_*.webm')
+    parser.add_argument('--qoe', default=None,
+                        help='qoe_metrics_*.csv/.qoe of the same run, for media time and stalls')
+    parser.add_argument('--offset', type=float, default=None,
+                        help='wall_clock at recording time 0 (default: record_offset from '
+                             'run.json, else 0)')
+    parser.add_argument('--reference', default=None,
+                        help='Source video, or the DASH manifest with --rendition')
+    parser.add_argument('--rendition', default=None,
+                        help='Representation id to assemble from the manifest given as --reference')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk', type=float, default=30.0,
+                        help='Seconds of recording per work item (default: 30)')
+    parser.add_argument('--size', default='320x180',
+                        help='Analysis resolution (default: 320x180)')
+    parser.add_argument('--freeze-threshold', type=float, default=0.5,
+                        help='Mean luma difference below which a frame repeats (default: 0.5)')
+    parser.add_argument('--min-freeze', type=float, default=0.25,
+                        help='Shortest freeze reported, in seconds (default: 0.25)')
+    parser.add_argument('--outdir', default=None,
+                        help='Output directory (default: next to the recording)')
+    args = parser.parse_args()
+
+    size = tuple(int(x) for x in args.size.split("x"))
+    offset = default_offset(args.recording) if args.offset is None else args.offset
+    outdir = args.outdir or os.path.dirname(os.path.abspath(args.recording))
+    stem = os.path.splitext(os.path.basename(args.recording))[0].replace("recorded_video", "frames")
+    if args.qoe:
+        wall, play, stalls = load_samples(args.qoe)
+    else:
+        wall = play = stalls = np.zeros(0)
+        if args.reference:
+            print("⚠️  No --qoe: assuming the recording has no stalls", file=sys.stderr)
+
+    t0 = time.time()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = remux(args.recording, tmpdir)
+        duration = probe_duration(source)
+        reference = args.reference
+        if reference and args.rendition:
+            reference = assemble_rendition(reference, args.rendition, tmpdir)
+
+        bounds = np.arange(0.0, duration, args.chunk)
+        jobs = [(source, float(s), float(min(s + args.chunk, duration + 1.0)), size,
+                 1.0, reference, offset, wall, play) for s in bounds]
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            parts = list(executor.map(analyse_chunk, jobs))
+
+    frames = {name: np.concatenate([p[name] for p in parts] or [np.zeros(0)])
+              for name in ("pts", "width", "height", "diff", "psnr", "ssim")}
+    pts = frames["pts"]
+    frames["wall_clock"] = pts + offset
+    frames["media_time"] = np.interp(frames["wall_clock"], wall, play) if len(wall) else pts
+    frames["frozen"] = (np.nan_to_num(frames["diff"], nan=np.inf)
+                        < args.freeze_threshold).astype(np.float64)
+    # Stall count of the latest sample at or before each frame
+    idx = np.searchsorted(wall, frames["wall_clock"], side="right") - 1
+    frames["stall_count"] = np.where(idx >= 0, stalls[np.maximum(idx, 0)], 0) \
+                            if len(wall) else np.zeros(len(pts))
+    elapsed = time.time() - t0
+
+    freezes = find_freezes(pts, frames["diff"], args.freeze_threshold, args.min_freeze)
+    changes = resolution_changes(pts, frames["width"], frames["height"])
+
+    os.makedirs(outdir, exist_ok=True)
+    timeline = os.path.join(outdir, f"{stem}.csv")
+    with open(timeline, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FRAME_FIELDS)
+        ints = [name in ("width", "height", "frozen", "stall_count") for name in FRAME_FIELDS]
+        for row in zip(*(frames[name].tolist() for name in FRAME_FIELDS)):
+            writer.writerow(["" if v != v else int(v) if is_int else round(v, 4)
+                             for v, is_int in zip(row, ints)])
+    events = os.path.join(outdir, f"{stem}_events.csv")
+    with open(events, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("event", "pts", "wall_clock", "duration", "frames", "from", "to"))
+        for start, dur, n in freezes:
+            writer.writerow(("freeze", round(start, 3), round(start + offset, 3),
+                             round(dur, 3), n, "", ""))
+        for at, w0, h0, w1, h1 in changes:
+            writer.writerow(("resolution", round(at, 3), round(at + offset, 3), "", "",
+                             f"{w0}x{h0}", f"{w1}x{h1}"))
+
+    print(f"✔ {len(pts)} frames, {duration:.1f}s of video analysed in {elapsed:.1f}s "
+          f"({duration / max(elapsed, 1e-3):.1f}x real time)")
+    print(f"   freezes: {len(freezes)}, {sum(d for _, d, _ in freezes):.2f}s; "
+          f"resolution changes: {len(changes)}")
+    if len(stalls):
+        print(f"   stalls reported by the player: {int(stalls[-1])}")
+    if reference:
+        print(f"   mean PSNR {np.nanmean(frames['psnr']):.2f} dB, "
+              f"mean SSIM {np.nanmean(frames['ssim']):.4f}")
+    print(f"🗒  Timeline written to {timeline}, events to {events}")
+
+
+if __name__ == "__main__":
+    main()
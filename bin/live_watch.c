@@ -0,0 +1,451 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * live_watch.c -- Follow media segments that a packager is still writing
+ */
+
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/queue.h>
+#include <sys/stat.h>
+#include <sys/types.h>
+#include <time.h>
+#include <unistd.h>
+#if __linux__
+#include <sys/inotify.h>
+#endif
+
+#include <event2/event.h>
+
+#include "lsquic.h"
+#include "../src/liblsquic/lsquic_hash.h"
+#include "../src/liblsquic/lsquic_logger.h"
+
+#include "test_config.h"
+#include "test_common.h"
+#include "prog.h"
+#include "file_cache.h"
+#include "live_watch.h"
+
+#if __linux__
+#define LW_INOTIFY_MASK (IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO)
+#endif
+
+
+/* A directory watched with inotify */
+struct lw_dir
+{
+    TAILQ_ENTRY(lw_dir)         lwd_next;
+    char                       *lwd_path;
+    int                         lwd_wd;
+    unsigned                    lwd_refcnt;     /* Files followed in it */
+};
+
+struct live_file
+{
+    TAILQ_ENTRY(live_file)      lf_next;
+    char                       *lf_path;
+    char                       *lf_next_path;
+    struct lw_dir              *lf_dir;         /* NULL: polled */
+    size_t                      lf_size;
+    long long                   lf_mtime_ns;
+    unsigned                    lf_refcnt;
+    int                         lf_final;
+    int                         lf_changed;     /* To report */
+};
+
+struct live_watch
+{
+    TAILQ_HEAD(, live_file)     lw_files;
+    TAILQ_HEAD(, lw_dir)        lw_dirs;
+    struct event_base          *lw_eb;
+    /* Only exist while files are followed: */
+    struct event               *lw_timer;
+    struct event               *lw_event;       /* lw_fd is readable */
+    struct timeval              lw_interval;
+    struct lw_settings          lw_settings;
+    int                         lw_fd;          /* inotify; -1: polling */
+    lw_change_f                 lw_change_cb;
+    void                       *lw_ctx;
+};
+
+
+/* File modification times are wall-clock times */
+static long long
+lw_now_ns (void)
+{
+    struct timespec ts;
+    (void) clock_gettime(CLOCK_REALTIME, &ts);
+    return (long long) ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+
+static int
+lw_is_idle (const struct live_watch *lw, long long mtime_ns, long long now)
+{
+    return now - mtime_ns > (long long) lw->lw_settings.lws_idle_ms * 1000000;
+}
+
+
+/*
+ * Sets lf_changed if the file has grown or is now complete.  The next
+ * segment is looked for first: once it exists, the packager is done with
+ * this one, so the size read after it is the final size.
+ */
+static void
+lw_check (struct live_watch *lw, struct live_file *lf, long long now)
+{
+    struct stat st;
+    size_t old_size;
+    int next_exists;
+
+    next_exists = 0 == stat(lf->lf_next_path, &st);
+    if (0 != stat(lf->lf_path, &st))
+    {
+        LSQ_INFO("%s is gone: stop following it at %zu bytes", lf->lf_path,
+                                                                lf->lf_size);
+        lf->lf_final = 1;
+        lf->lf_changed = 1;
+        return;
+    }
+
+    old_size = lf->lf_size;
+    /* A file that shrinks has been replaced: its old bytes were sent */
+    if ((size_t) st.st_size > lf->lf_size)
+        lf->lf_size = st.st_size;
+    lf->lf_mtime_ns = file_cache_mtime_ns(&st);
+    if (next_exists || lw_is_idle(lw, lf->lf_mtime_ns, now))
+    {
+        LSQ_DEBUG("%s is complete: %zu bytes", lf->lf_path, lf->lf_size);
+        lf->lf_final = 1;
+    }
+    lf->lf_changed = lf->lf_final || lf->lf_size > old_size;
+}
+
+
+/*
+ * Helper: Report the files that changed.  The callback may run the
+ * engine, whose streams may release any of the files, so the list is
+ * walked again after each call.
+ */
+static void
+lw_report (struct live_watch *lw)
+{
+    struct live_file *lf;
+
+  again:
+    TAILQ_FOREACH(lf, &lw->lw_files, lf_next)
+        if (lf->lf_changed)
+        {
+            lf->lf_changed = 0;
+            ++lf->lf_refcnt;
+            lw->lw_change_cb(lw->lw_ctx, lf);
+            live_watch_release(lw, lf);
+            goto again;
+        }
+}
+
+
+static void
+lw_on_timer (evutil_socket_t fd, short what, void *arg)
+{
+    struct live_watch *const lw = arg;
+    struct live_file *lf;
+    long long now;
+
+    now = lw_now_ns();
+    TAILQ_FOREACH(lf, &lw->lw_files, lf_next)
+        /* inotify reports writes: only look for files that went idle */
+        if (!lf->lf_final
+                && (lw->lw_fd < 0 || lw_is_idle(lw, lf->lf_mtime_ns, now)))
+            lw_check(lw, lf, now);
+    lw_report(lw);
+    /* Not persistent: let the event loop exit once the engine is stopped.
+     * The timer is gone if the last file was released.
+     */
+    if (lw->lw_timer && !prog_is_stopped())
+        event_add(lw->lw_timer, &lw->lw_interval);
+}
+
+
+#if __linux__
+static void
+lw_on_inotify (evutil_socket_t fd, short what, void *arg)
+{
+    struct live_watch *const lw = arg;
+    struct live_file *lf;
+    long long now;
+    char buf[0x1000]
+            __attribute__((aligned(__alignof__(struct inotify_event))));
+
+    /* Which file an event is about does not matter: there are few files
+     * followed, and all of them are checked.
+     */
+    while (read(lw->lw_fd, buf, sizeof(buf)) > 0)
+        ;
+
+    now = lw_now_ns();
+    TAILQ_FOREACH(lf, &lw->lw_files, lf_next)
+        if (!lf->lf_final)
+            lw_check(lw, lf, now);
+    lw_report(lw);
+    if (lw->lw_event && !prog_is_stopped())
+        event_add(lw->lw_event, NULL);
+}
+
+
+/* Watch the directory of `path', which new segments are created in and
+ * whose files report their writes.
+ */
+static struct lw_dir *
+lw_dir_get (struct live_watch *lw, const char *path)
+{
+    struct lw_dir *dir;
+    const char *slash;
+    char *dir_path;
+    int wd;
+
+    slash = strrchr(path, '/');
+    dir_path = slash ? strndup(path, slash - path + 1) : strdup(".");
+    if (!dir_path)
+        return NULL;
+
+    TAILQ_FOREACH(dir, &lw->lw_dirs, lwd_next)
+        if (0 == strcmp(dir->lwd_path, dir_path))
+            goto found;
+
+    wd = inotify_add_watch(lw->lw_fd, dir_path, LW_INOTIFY_MASK);
+    if (wd < 0)
+    {
+        LSQ_WARN("cannot watch %s: %s", dir_path, strerror(errno));
+        free(dir_path);
+        return NULL;
+    }
+    /* The same directory by another name */
+    TAILQ_FOREACH(dir, &lw->lw_dirs, lwd_next)
+        if (dir->lwd_wd == wd)
+            goto found;
+
+    dir = calloc(1, sizeof(*dir));
+    if (!dir)
+    {
+        (void) inotify_rm_watch(lw->lw_fd, wd);
+        free(dir_path);
+        return NULL;
+    }
+    dir->lwd_path = dir_path;
+    dir->lwd_wd = wd;
+    dir->lwd_refcnt = 1;
+    TAILQ_INSERT_TAIL(&lw->lw_dirs, dir, lwd_next);
+    return dir;
+
+  found:
+    free(dir_path);
+    ++dir->lwd_refcnt;
+    return dir;
+}
+
+
+static void
+lw_dir_put (struct live_watch *lw, struct lw_dir *dir)
+{
+    if (--dir->lwd_refcnt > 0)
+        return;
+    (void) inotify_rm_watch(lw->lw_fd, dir->lwd_wd);
+    TAILQ_REMOVE(&lw->lw_dirs, dir, lwd_next);
+    free(dir->lwd_path);
+    free(dir);
+}
+
+
+#endif
+/* The events only exist while files are followed, so that they neither
+ * keep the event loop running nor outlive it.
+ */
+static int
+lw_start (struct live_watch *lw)
+{
+    if (!lw->lw_timer)
+    {
+        lw->lw_timer = event_new(lw->lw_eb, -1, 0, lw_on_timer, lw);
+        if (!lw->lw_timer)
+            return -1;
+        (void) event_add(lw->lw_timer, &lw->lw_interval);
+    }
+#if __linux__
+    if (lw->lw_fd >= 0 && !lw->lw_event)
+    {
+        lw->lw_event = event_new(lw->lw_eb, lw->lw_fd, EV_READ,
+                                                        lw_on_inotify, lw);
+        if (!lw->lw_event)
+            return -1;
+        (void) event_add(lw->lw_event, NULL);
+    }
+#endif
+    return 0;
+}
+
+
+static void
+lw_stop (struct live_watch *lw)
+{
+    if (lw->lw_timer)
+    {
+        event_free(lw->lw_timer);
+        lw->lw_timer = NULL;
+    }
+    if (lw->lw_event)
+    {
+        event_free(lw->lw_event);
+        lw->lw_event = NULL;
+    }
+}
+
+
+struct live_watch *
+live_watch_new (struct event_base *eb, const struct lw_settings *settings,
+                lw_change_f change_cb, void *ctx)
+{
+    struct live_watch *lw;
+
+    lw = calloc(1, sizeof(*lw));
+    if (!lw)
+        return NULL;
+
+    TAILQ_INIT(&lw->lw_files);
+    TAILQ_INIT(&lw->lw_dirs);
+    lw->lw_eb = eb;
+    lw->lw_settings = *settings;
+    lw->lw_interval.tv_sec = settings->lws_poll_ms / 1000;
+    lw->lw_interval.tv_usec = settings->lws_poll_ms % 1000 * 1000;
+    lw->lw_change_cb = change_cb;
+    lw->lw_ctx = ctx;
+    lw->lw_fd = -1;
+
+#if __linux__
+    if (!settings->lws_poll)
+    {
+        lw->lw_fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+        if (lw->lw_fd < 0)
+            LSQ_WARN("inotify is not available (%s): poll files instead",
+                                                            strerror(errno));
+    }
+#endif
+
+    if (lw->lw_fd >= 0)
+        LSQ_INFO("live mode: inotify; complete after %u ms idle",
+                                                    settings->lws_idle_ms);
+    else
+        LSQ_INFO("live mode: poll every %u ms; complete after %u ms idle",
+                                settings->lws_poll_ms, settings->lws_idle_ms);
+    return lw;
+}
+
+
+struct live_file *
+live_watch_open (struct live_watch *lw, const char *path,
+                 const char *next_path)
+{
+    struct live_file *lf;
+    struct stat st;
+
+    TAILQ_FOREACH(lf, &lw->lw_files, lf_next)
+        if (0 == strcmp(lf->lf_path, path))
+        {
+            if (lf->lf_final)
+                return NULL;
+            ++lf->lf_refcnt;
+            return lf;
+        }
+
+    if (0 == stat(next_path, &st) || 0 != stat(path, &st)
+            || !S_ISREG(st.st_mode)
+            || lw_is_idle(lw, file_cache_mtime_ns(&st), lw_now_ns()))
+        return NULL;
+
+    lf = calloc(1, sizeof(*lf));
+    if (!lf)
+        return NULL;
+    lf->lf_path = strdup(path);
+    lf->lf_next_path = strdup(next_path);
+    if (!lf->lf_path || !lf->lf_next_path)
+        goto err;
+#if __linux__
+    if (lw->lw_fd >= 0)
+    {
+        lf->lf_dir = lw_dir_get(lw, path);
+        if (!lf->lf_dir)
+            goto err;
+        /* Writes made before the watch was added are not reported */
+        if (0 != stat(path, &st))
+        {
+            lw_dir_put(lw, lf->lf_dir);
+            goto err;
+        }
+    }
+#endif
+    lf->lf_size = st.st_size;
+    lf->lf_mtime_ns = file_cache_mtime_ns(&st);
+    lf->lf_refcnt = 1;
+    TAILQ_INSERT_TAIL(&lw->lw_files, lf, lf_next);
+    if (0 != lw_start(lw))
+    {
+        live_watch_release(lw, lf);
+        return NULL;
+    }
+
+    LSQ_DEBUG("follow %s from %zu bytes", path, lf->lf_size);
+    return lf;
+
+  err:
+    free(lf->lf_next_path);
+    free(lf->lf_path);
+    free(lf);
+    return NULL;
+}
+
+
+void
+live_watch_release (struct live_watch *lw, struct live_file *lf)
+{
+    if (--lf->lf_refcnt > 0)
+        return;
+
+    TAILQ_REMOVE(&lw->lw_files, lf, lf_next);
+#if __linux__
+    if (lf->lf_dir)
+        lw_dir_put(lw, lf->lf_dir);
+#endif
+    free(lf->lf_next_path);
+    free(lf->lf_path);
+    free(lf);
+    if (TAILQ_EMPTY(&lw->lw_files))
+        lw_stop(lw);
+}
+
+
+size_t
+live_file_size (const struct live_file *lf)
+{
+    return lf->lf_size;
+}
+
+
+int
+live_file_is_final (const struct live_file *lf)
+{
+    return lf->lf_final;
+}
+
+
+/* All files must have been released */
+void
+live_watch_destroy (struct live_watch *lw)
+{
+    lw_stop(lw);
+    if (lw->lw_fd >= 0)
+        (void) close(lw->lw_fd);
+    free(lw);
+}
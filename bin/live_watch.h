@@ -0,0 +1,71 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * live_watch.h -- Follow media segments that a packager is still writing
+ *
+ * A low-latency DASH packager writes each CMAF segment one chunk -- a
+ * moof and mdat pair -- at a time, and the player requests the segment as
+ * soon as its first chunk is due.  The watcher tracks how much of such a
+ * file has been written and tells the server when it grows and when it
+ * is complete.
+ *
+ * On Linux, inotify reports writes to the files followed and new files
+ * in their directories; elsewhere, or with lws_poll set (inotify does not
+ * see writes made by other hosts of a network file system), the files
+ * are stat()ed every poll interval.  A file is complete once the packager
+ * has moved on to the next segment, that is, once the file named
+ * `next_path' exists, or once it has not been modified for the idle
+ * timeout: segment names with a time rather than a number in them, and
+ * the last segment of a stream, are only finalized that way.
+ *
+ * Each path is followed once, however many streams are reading it.
+ */
+
+#ifndef LIVE_WATCH_H
+#define LIVE_WATCH_H 1
+
+#include <stddef.h>
+
+struct event_base;
+struct live_file;
+struct live_watch;
+
+struct lw_settings
+{
+    unsigned            lws_idle_ms;    /* Complete if unmodified this long */
+    unsigned            lws_poll_ms;
+    int                 lws_poll;       /* stat() even if inotify works */
+};
+
+/* Called on the event loop thread when `file' has grown or is complete.
+ * The callback may release files, this one included.
+ */
+typedef void (*lw_change_f)(void *ctx, struct live_file *file);
+
+struct live_watch *
+live_watch_new (struct event_base *, const struct lw_settings *,
+                lw_change_f, void *ctx);
+
+/* Start following `path' if it is being written: it was modified within
+ * the idle timeout and `next_path' does not exist.  Returns a reference
+ * to release with live_watch_release(), or NULL if the file is complete
+ * or cannot be followed.
+ */
+struct live_file *
+live_watch_open (struct live_watch *, const char *path,
+                 const char *next_path);
+
+void
+live_watch_release (struct live_watch *, struct live_file *);
+
+/* Bytes written so far; it only grows */
+size_t
+live_file_size (const struct live_file *);
+
+int
+live_file_is_final (const struct live_file *);
+
+/* Call once all files are released */
+void
+live_watch_destroy (struct live_watch *);
+
+#endif
@@ -0,0 +1,417 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * mpd_index.c -- Map file names to the representations of DASH manifests
+ */
+
+#include <ctype.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/queue.h>
+
+#include "mpd_index.h"
+
+
+struct mpd_rep
+{
+    TAILQ_ENTRY(mpd_rep)        mr_next;
+    char                       *mr_manifest;
+    char                       *mr_media;       /* Prefix or, if mr_whole,
+                                                 * the whole path
+                                                 */
+    size_t                      mr_media_len;
+    char                       *mr_init;        /* NULL if none */
+    int                         mr_whole;
+    enum mpd_content            mr_content;
+    unsigned long               mr_bandwidth;
+};
+
+TAILQ_HEAD(mpd_reps, mpd_rep);
+
+struct mpd_index
+{
+    struct mpd_reps             mi_reps;
+};
+
+/* State while one manifest is scanned */
+struct mpd_scan
+{
+    struct mpd_reps             ms_reps;
+    const char                 *ms_manifest;
+    size_t                      ms_dir_len;     /* Including the slash */
+};
+
+
+struct mpd_index *
+mpd_index_new (void)
+{
+    struct mpd_index *index;
+
+    index = malloc(sizeof(*index));
+    if (index)
+        TAILQ_INIT(&index->mi_reps);
+    return index;
+}
+
+
+static void
+mpd_rep_destroy (struct mpd_rep *mr)
+{
+    free(mr->mr_manifest);
+    free(mr->mr_media);
+    free(mr->mr_init);
+    free(mr);
+}
+
+
+/* Find element `name' -- and not one whose name merely starts with it,
+ * such as RepresentationIndex -- at or after `p' and before `end'.
+ */
+static const char *
+find_tag (const char *p, const char *end, const char *name)
+{
+    const size_t len = strlen(name);
+    const char *tag;
+
+    for (; (tag = strstr(p, name)) && tag < end; p = tag + len)
+        if (tag[len] == '>' || tag[len] == '/'
+                                        || isspace((unsigned char) tag[len]))
+            return tag;
+    return NULL;
+}
+
+
+/* Value of attribute `name' in the start tag between `tag' and `tag_end' */
+static const char *
+get_attr (const char *tag, const char *tag_end, const char *name,
+          size_t *val_len)
+{
+    const size_t len = strlen(name);
+    const char *p, *val, *quote;
+
+    for (p = tag; (p = strstr(p, name)) && p < tag_end; p += len)
+        if (isspace((unsigned char) p[-1]) && p[len] == '='
+                                && (p[len + 1] == '"' || p[len + 1] == '\''))
+        {
+            val = p + len + 2;
+            quote = strchr(val, p[len + 1]);
+            if (!quote || quote > tag_end)
+                return NULL;
+            *val_len = quote - val;
+            return val;
+        }
+    return NULL;
+}
+
+
+/* Content type of an AdaptationSet or Representation, if it gives one */
+static enum mpd_content
+get_content (const char *tag, const char *tag_end, enum mpd_content dflt)
+{
+    static const struct {
+        const char         *prefix;
+        enum mpd_content    content;
+    } types[] = {
+        { "video", MPDC_VIDEO, },
+        { "audio", MPDC_AUDIO, },
+        { "text",  MPDC_TEXT, },
+    };
+    const char *val;
+    size_t len;
+    unsigned n;
+
+    val = get_attr(tag, tag_end, "contentType", &len);
+    if (!val)
+        val = get_attr(tag, tag_end, "mimeType", &len);
+    if (val)
+        for (n = 0; n < sizeof(types) / sizeof(types[0]); ++n)
+            if (len >= strlen(types[n].prefix)
+                    && 0 == strncmp(val, types[n].prefix,
+                                                strlen(types[n].prefix)))
+                return types[n].content;
+    return dflt;
+}
+
+
+/* Expand the template `tmpl' for one representation and prepend the
+ * manifest's directory.  With `prefix' set, expansion stops at $Number$
+ * or $Time$.  Returns a malloc'ed path or NULL.
+ */
+static char *
+expand_template (const struct mpd_scan *scan, const char *tmpl,
+                 size_t tmpl_len, const char *id, size_t id_len,
+                 unsigned long bandwidth, int prefix)
+{
+    const char *p, *const end = tmpl + tmpl_len;
+    const char *ident_end, *fmt;
+    size_t name_len, out_sz;
+    unsigned width;
+    char *out, *o;
+
+    if (tmpl_len == 0 || tmpl[0] == '/' || memchr(tmpl, ':', tmpl_len))
+        return NULL;    /* Not relative to the manifest */
+
+    /* Every identifier is at least two characters long */
+    out_sz = scan->ms_dir_len + tmpl_len + tmpl_len / 2 * (id_len + 20) + 1;
+    out = malloc(out_sz);
+    if (!out)
+        return NULL;
+    memcpy(out, scan->ms_manifest, scan->ms_dir_len);
+    o = out + scan->ms_dir_len;
+
+    for (p = tmpl; p < end; )
+    {
+        if (*p != '$')
+        {
+            *o++ = *p++;
+            continue;
+        }
+        ident_end = memchr(p + 1, '$', end - p - 1);
+        if (!ident_end)
+            goto err;
+        if (ident_end == p + 1)
+        {
+            *o++ = '$';
+            p += 2;
+            continue;
+        }
+        fmt = memchr(p + 1, '%', ident_end - p - 1);
+        name_len = (fmt ? fmt : ident_end) - p - 1;
+        width = fmt && fmt[1] == '0' ? (unsigned) atoi(fmt + 2) : 0;
+        if (width > 20)
+            width = 20;
+        if (name_len == 16 && 0 == strncmp(p + 1, "RepresentationID", 16))
+        {
+            memcpy(o, id, id_len);
+            o += id_len;
+        }
+        else if (name_len == 9 && 0 == strncmp(p + 1, "Bandwidth", 9))
+            o += sprintf(o, "%0*lu", (int) width, bandwidth);
+        else if (prefix
+                    && ((name_len == 6 && 0 == strncmp(p + 1, "Number", 6))
+                        || (name_len == 4 && 0 == strncmp(p + 1, "Time", 4))))
+            break;
+        else
+            goto err;
+        p = ident_end + 1;
+    }
+
+    *o = '\0';
+    return out;
+
+  err:
+    free(out);
+    return NULL;
+}
+
+
+/* Index one Representation.  `tmpl' is its SegmentTemplate or that of
+ * its AdaptationSet, or NULL.
+ */
+static int
+scan_rep (struct mpd_scan *scan, const char *rep, const char *rep_tag_end,
+          const char *rep_end, const char *tmpl, enum mpd_content content)
+{
+    const char *id, *val, *tmpl_end, *base, *base_end;
+    struct mpd_rep *mr;
+    size_t id_len, len;
+
+    mr = calloc(1, sizeof(*mr));
+    if (!mr)
+        return -1;
+    mr->mr_content = get_content(rep, rep_tag_end, content);
+    val = get_attr(rep, rep_tag_end, "bandwidth", &len);
+    if (val)
+        mr->mr_bandwidth = strtoul(val, NULL, 10);
+    id = get_attr(rep, rep_tag_end, "id", &id_len);
+    if (!id)
+    {
+        id = "";
+        id_len = 0;
+    }
+
+    if (tmpl && (tmpl_end = strchr(tmpl, '>')))
+    {
+        val = get_attr(tmpl, tmpl_end, "media", &len);
+        if (val)
+            mr->mr_media = expand_template(scan, val, len, id, id_len,
+                                                        mr->mr_bandwidth, 1);
+        val = get_attr(tmpl, tmpl_end, "initialization", &len);
+        if (val)
+            mr->mr_init = expand_template(scan, val, len, id, id_len,
+                                                        mr->mr_bandwidth, 0);
+    }
+    else if ((base = find_tag(rep_tag_end, rep_end, "<BaseURL"))
+                && (base = strchr(base, '>'))
+                && (base_end = strchr(++base, '<')) && base_end < rep_end)
+    {
+        mr->mr_media = expand_template(scan, base, base_end - base, id,
+                                                id_len, mr->mr_bandwidth, 0);
+        mr->mr_whole = 1;
+    }
+
+    if (!mr->mr_media && !mr->mr_init)
+    {
+        mpd_rep_destroy(mr);
+        return 0;
+    }
+    mr->mr_manifest = strdup(scan->ms_manifest);
+    if (!mr->mr_manifest)
+    {
+        mpd_rep_destroy(mr);
+        return -1;
+    }
+    if (mr->mr_media)
+        mr->mr_media_len = strlen(mr->mr_media);
+    TAILQ_INSERT_TAIL(&scan->ms_reps, mr, mr_next);
+    return 1;
+}
+
+
+static int
+scan_manifest (struct mpd_scan *scan, const char *doc, const char *doc_end)
+{
+    const char *set, *set_tag_end, *set_end, *set_tmpl;
+    const char *rep, *rep_tag_end, *rep_end, *tmpl;
+    enum mpd_content content;
+    int n, s;
+
+    n = 0;
+    for (set = find_tag(doc, doc_end, "<AdaptationSet"); set;
+                        set = find_tag(set_end, doc_end, "<AdaptationSet"))
+    {
+        set_tag_end = strchr(set, '>');
+        if (!set_tag_end)
+            break;
+        set_end = find_tag(set_tag_end, doc_end, "</AdaptationSet");
+        if (!set_end)
+            set_end = doc_end;
+        content = get_content(set, set_tag_end, MPDC_OTHER);
+
+        rep = find_tag(set_tag_end, set_end, "<Representation");
+        set_tmpl = find_tag(set_tag_end, rep ? rep : set_end,
+                                                        "<SegmentTemplate");
+        for (; rep; rep = find_tag(rep_end, set_end, "<Representation"))
+        {
+            rep_tag_end = strchr(rep, '>');
+            if (!rep_tag_end)
+                break;
+            if (rep_tag_end[-1] == '/')
+                rep_end = rep_tag_end;
+            else
+            {
+                rep_end = find_tag(rep_tag_end, set_end, "</Representation");
+                if (!rep_end)
+                    rep_end = set_end;
+            }
+            tmpl = find_tag(rep_tag_end, rep_end, "<SegmentTemplate");
+            s = scan_rep(scan, rep, rep_tag_end, rep_end,
+                                            tmpl ? tmpl : set_tmpl, content);
+            if (s < 0)
+                return -1;
+            n += s;
+        }
+    }
+
+    return n;
+}
+
+
+int
+mpd_index_update (struct mpd_index *index, const char *mpd_path,
+                  const char *buf, size_t bufsz)
+{
+    struct mpd_scan scan;
+    struct mpd_rep *mr, *next;
+    const char *slash;
+    char *doc;
+    int n;
+
+    /* The scan relies on strstr() */
+    doc = malloc(bufsz + 1);
+    if (!doc)
+        return -1;
+    memcpy(doc, buf, bufsz);
+    doc[bufsz] = '\0';
+
+    TAILQ_INIT(&scan.ms_reps);
+    scan.ms_manifest = mpd_path;
+    slash = strrchr(mpd_path, '/');
+    scan.ms_dir_len = slash ? (size_t) (slash - mpd_path + 1) : 0;
+    n = scan_manifest(&scan, doc, doc + bufsz);
+    free(doc);
+
+    if (n < 0)
+    {
+        while ((mr = TAILQ_FIRST(&scan.ms_reps)))
+        {
+            TAILQ_REMOVE(&scan.ms_reps, mr, mr_next);
+            mpd_rep_destroy(mr);
+        }
+        return -1;
+    }
+
+    for (mr = TAILQ_FIRST(&index->mi_reps); mr; mr = next)
+    {
+        next = TAILQ_NEXT(mr, mr_next);
+        if (0 == strcmp(mr->mr_manifest, mpd_path))
+        {
+            TAILQ_REMOVE(&index->mi_reps, mr, mr_next);
+            mpd_rep_destroy(mr);
+        }
+    }
+    TAILQ_CONCAT(&index->mi_reps, &scan.ms_reps, mr_next);
+    return n;
+}
+
+
+int
+mpd_index_lookup (const struct mpd_index *index, const char *path,
+                  struct mpd_match *match)
+{
+    const struct mpd_rep *mr, *best;
+
+    best = NULL;
+    TAILQ_FOREACH(mr, &index->mi_reps, mr_next)
+    {
+        if (mr->mr_init && 0 == strcmp(mr->mr_init, path))
+        {
+            best = mr;
+            break;
+        }
+        if (mr->mr_media && (!best || mr->mr_media_len > best->mr_media_len)
+                && (mr->mr_whole ? 0 == strcmp(mr->mr_media, path)
+                        : 0 == strncmp(mr->mr_media, path, mr->mr_media_len)))
+            best = mr;
+    }
+
+    if (!best)
+        return -1;
+    match->mm_content = best->mr_content;
+    match->mm_init = best->mr_init && 0 == strcmp(best->mr_init, path);
+    match->mm_bandwidth = best->mr_bandwidth;
+    match->mm_lowest = 1;
+    TAILQ_FOREACH(mr, &index->mi_reps, mr_next)
+        if (mr->mr_content == best->mr_content
+                && mr->mr_bandwidth < best->mr_bandwidth
+                && 0 == strcmp(mr->mr_manifest, best->mr_manifest))
+        {
+            match->mm_lowest = 0;
+            break;
+        }
+    return 0;
+}
+
+
+void
+mpd_index_destroy (struct mpd_index *index)
+{
+    struct mpd_rep *mr;
+
+    while ((mr = TAILQ_FIRST(&index->mi_reps)))
+    {
+        TAILQ_REMOVE(&index->mi_reps, mr, mr_next);
+        mpd_rep_destroy(mr);
+    }
+    free(index);
+}
@@ -0,0 +1,64 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * mpd_index.h -- Map file names to the representations of DASH manifests
+ *
+ * Segment names such as chunk-stream1-00042.m4s do not say whether they
+ * hold audio or video: only the manifest does.  The index scans each
+ * manifest the server sends for its AdaptationSet, Representation and
+ * SegmentTemplate elements and records, per representation, its content
+ * type, its bandwidth, the path of its initialization segment and the
+ * prefix that the names of its media segments share (the media template
+ * expanded up to $Number$ or $Time$).  Representations without a
+ * template are indexed by their BaseURL, the file that holds them whole.
+ *
+ * This is a scan of the elements that ffmpeg, GPAC and Shaka Packager
+ * write, not an XML parser.  Paths are resolved against the manifest's
+ * directory; BaseURL elements above the Representation are ignored.
+ */
+
+#ifndef MPD_INDEX_H
+#define MPD_INDEX_H 1
+
+struct mpd_index;
+
+enum mpd_content
+{
+    MPDC_OTHER,
+    MPDC_VIDEO,
+    MPDC_AUDIO,
+    MPDC_TEXT,
+};
+
+struct mpd_match
+{
+    enum mpd_content    mm_content;
+    int                 mm_init;        /* Initialization segment */
+    unsigned long       mm_bandwidth;   /* Zero if not given */
+    int                 mm_lowest;      /* No representation of the same
+                                         * content type in the manifest
+                                         * has a lower bandwidth
+                                         */
+};
+
+struct mpd_index *
+mpd_index_new (void);
+
+/* Replace the representations indexed for the manifest at `mpd_path'
+ * with those found in `buf'.  Returns the number of representations
+ * found or -1 on error.
+ */
+int
+mpd_index_update (struct mpd_index *, const char *mpd_path,
+                  const char *buf, size_t bufsz);
+
+/* Returns 0 and fills in `match' if `path' belongs to an indexed
+ * representation, -1 otherwise.  The longest media prefix wins.
+ */
+int
+mpd_index_lookup (const struct mpd_index *, const char *path,
+                  struct mpd_match *match);
+
+void
+mpd_index_destroy (struct mpd_index *);
+
+#endif
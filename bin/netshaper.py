@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+netshaper.py -- trace-driven UDP and TCP relay for reproducible QoE runs
+
+Sits between Chrome and local servers -- video_server for QUIC, any HTTP
+server for TCP -- and replays bandwidth, delay and loss traces on the
+traffic in between:
+
+    Chrome ---> LISTEN:PORT ---[uplink]---> QUIC / TCP upstream
+           <---             <-[downlink]---
+
+All flows of one direction share a Link, so QUIC and TCP see the same
+bottleneck.  A Link is a bounded FIFO drained by a token bucket whose
+fill rate follows the trace millisecond by millisecond, followed by a
+delay line.  UDP datagrams are dropped when the queue is full (drop-tail)
+or at the trace's loss rate.  TCP is relayed as a byte stream: a full
+queue stops reading from the sender instead, and loss does not apply.
+
+Packets are never given timers of their own: a Link drains everything
+that is due whenever a packet arrives or its single timer fires, so the
+per-packet cost stays a few deque operations.
+
+Trace formats (each file describes one direction and is looped):
+
+  mahimahi  one integer per line: a 1500-byte delivery opportunity at
+            that millisecond, as in the usual cellular traces
+  schedule  "duration_ms rate_kbps [delay_ms [loss]]" per line, loss
+            being a fraction; lines starting with '#' are ignored
+
+Example: QUIC and TCP behind the same 3G trace with 40 ms each way
+    ./video_server -s 127.0.0.1:5301 -r ./video -c quic.local,cert.pem,key.pem
+    python3 -m http.server -d ./video 5302 &
+    ./netshaper.py --down-trace traces/3g.mahi --delay 40
+    ./qoe_runner.py --server 127.0.0.1 --protocols tcp quic
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import random
+import socket
+import sys
+import time
+from array import array
+
+MTU = 1500
+
+# TCP is read in chunks of this size; each chunk is one queue entry
+TCP_CHUNK = 16384
+
+UDP_FLOW_IDLE = 60.0        # Seconds before an idle UDP flow is closed
+
+
+class Trace:
+    """Per-millisecond rate (bytes/ms), delay (ms) and loss, looped"""
+
+    def __init__(self, rate, delay, loss):
+        self.period = len(rate)
+        self.rate = array('d', rate)
+        self.delay = array('d', delay)
+        self.loss = array('d', loss)
+        # cum[i] is the capacity from the start of the period to ms i
+        self.cum = array('d', itertools.accumulate(self.rate, initial=0.0))
+        self.total = self.cum[-1]
+        self.peak = max(self.rate)
+
+    @classmethod
+    def constant(cls, rate_kbps, delay_ms=0.0, loss=0.0):
+        """rate_kbps of None means unlimited"""
+        rate = float("inf") if rate_kbps is None else rate_kbps / 8.0
+        return cls([rate], [delay_ms], [loss])
+
+    @property
+    def unlimited(self):
+        return self.total == float("inf")
+
+    def capacity(self, t_ms):
+        """Bytes the link can carry between time 0 and t_ms"""
+        n, r = divmod(t_ms, self.period)
+        i = int(r)
+        return n * self.total + self.cum[i] + (r - i) * self.rate[i]
+
+    def index(self, t_ms):
+        return int(t_ms) % self.period
+
+
+def load_trace(path, delay_ms=0.0, loss=0.0):
+    """Load a mahimahi or schedule trace; missing delay/loss use defaults"""
+    with open(path) as f:
+        lines = [line.replace(",", " ").split() for line in f
+                 if line.strip() and not line.lstrip().startswith("#")]
+    if not lines:
+        raise ValueError(f"{path}: empty trace")
+
+    if all(len(fields) == 1 for fields in lines):
+        # mahimahi: delivery opportunity timestamps, 1-based
+        stamps = [int(fields[0]) for fields in lines]
+        period = max(stamps)
+        rate = [0.0] * period
+        for t in stamps:
+            rate[t - 1] += MTU
+        return Trace(rate, [delay_ms] * period, [loss] * period)
+
+    rate, delay, drop = [], [], []
+    for fields in lines:
+        duration = int(fields[0])
+        rate.extend([float(fields[1]) / 8.0] * duration)
+        delay.extend([float(fields[2]) if len(fields) > 2 else delay_ms] * duration)
+        drop.extend([float(fields[3]) if len(fields) > 3 else loss] * duration)
+    if not rate:
+        raise ValueError(f"{path}: zero-length trace")
+    return Trace(rate, delay, drop)
+
+
+class Link:
+    """One direction of the bottleneck: token bucket, bounded queue, delay
+
+    Queue entries are (nbytes, fn, args); fn(*args) is called when the
+    entry leaves the delay line.
+    """
+
+    def __init__(self, name, trace, queue_bytes, burst_bytes=None, seed=None):
+        self.name = name
+        self.trace = trace
+        self.limit = queue_bytes
+        # The bucket must hold what arrives between two (late) timer
+        # callbacks, or the timer granularity would cap the rate.
+        self.burst = burst_bytes or max(16 * MTU, 4 * trace.peak)
+        self.loop = asyncio.get_running_loop()
+        self.t0 = self.loop.time()
+        self.queue = collections.deque()
+        self.queued = 0
+        self.delay_line = collections.deque()
+        self.last_due = 0.0
+        self.tokens = 0.0
+        self.last_cap = 0.0
+        self.rng = random.Random(seed)
+        self.timer = None
+        self.timer_when = None
+        self.drained = asyncio.Event()
+        self.forwarded = 0
+        self.bytes = 0
+        self.dropped_full = 0
+        self.dropped_loss = 0
+
+    def now(self):
+        return (self.loop.time() - self.t0) * 1000.0
+
+    def offer(self, nbytes, fn, args):
+        """Enqueue a datagram; returns False if it was dropped"""
+        now = self.now()
+        loss = self.trace.loss[self.trace.index(now)]
+        if loss and self.rng.random() < loss:
+            self.dropped_loss += 1
+            return False
+        if self.queued + nbytes > self.limit:
+            self.dropped_full += 1
+            return False
+        self.queue.append((nbytes, fn, args))
+        self.queued += nbytes
+        self._pump(now)
+        return True
+
+    async def put(self, nbytes, fn, args):
+        """Enqueue stream data, waiting while the queue is full"""
+        while self.queued and self.queued + nbytes > self.limit:
+            self.drained.clear()
+            await self.drained.wait()
+        self.queue.append((nbytes, fn, args))
+        self.queued += nbytes
+        self._pump(self.now())
+
+    def _pump(self, now):
+        trace = self.trace
+        if trace.unlimited:
+            self.tokens = float("inf")
+        else:
+            cap = trace.capacity(now)
+            self.tokens = min(self.burst, self.tokens + cap - self.last_cap)
+            self.last_cap = cap
+
+        # The head may leave while any tokens are left; the deficit is
+        # paid back before the next one leaves, so the average rate holds.
+        queue, delay_line = self.queue, self.delay_line
+        queued = self.queued
+        while queue and self.tokens > 0:
+            nbytes, fn, args = queue.popleft()
+            self.queued -= nbytes
+            self.tokens -= nbytes
+            self.forwarded += 1
+            self.bytes += nbytes
+            due = now + trace.delay[trace.index(now)]
+            if due < self.last_due:
+                due = self.last_due     # Delay changes must not reorder
+            self.last_due = due
+            if due <= now and not delay_line:
+                fn(*args)
+            else:
+                delay_line.append((due, fn, args))
+
+        while delay_line and delay_line[0][0] <= now:
+            _, fn, args = delay_line.popleft()
+            fn(*args)
+
+        if self.queued < queued:
+            self.drained.set()
+        self._schedule(now)
+
+    def _schedule(self, now):
+        when = None
+        if self.queue:
+            rate = self.trace.rate[self.trace.index(now)]
+            wait = -self.tokens / rate if rate > 0 else 1.0
+            when = now + min(max(wait, 1.0), 100.0)
+        if self.delay_line:
+            due = self.delay_line[0][0]
+            when = due if when is None else min(when, due)
+        if when is None or (self.timer and self.timer_when <= when):
+            return
+        if self.timer:
+            self.timer.cancel()
+        self.timer_when = when
+        self.timer = self.loop.call_at(self.t0 + when / 1000.0, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self._pump(self.now())
+
+    def stats(self):
+        return (f"{self.name}: {self.forwarded} sent, {self.bytes} bytes, "
+                f"{self.dropped_full} queue drops, {self.dropped_loss} loss drops, "
+                f"{self.queued} bytes queued")
+
+
+def _set_bufsizes(sock, size=1 << 22):
+    for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, opt, size)
+        except OSError:
+            pass
+
+
+class _UdpFlow(asyncio.DatagramProtocol):
+    """Upstream socket of one client address, so replies find their way back"""
+
+    def __init__(self, front, client_addr):
+        self.front = front
+        self.client_addr = client_addr
+        self.transport = None
+        self.pending = []
+        self.last_seen = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        _set_bufsizes(transport.get_extra_info("socket"))
+        for data in self.pending:
+            transport.sendto(data)
+        self.pending = None
+
+    def send(self, data):
+        if self.transport:
+            self.transport.sendto(data)
+        elif self.pending is not None:
+            self.pending.append(data)
+
+    def datagram_received(self, data, addr):
+        self.last_seen = time.monotonic()
+        self.front.down.offer(len(data), self.front.transport.sendto,
+                              (data, self.client_addr))
+
+    def error_received(self, exc):
+        pass        # ICMP errors: QUIC copes with loss on its own
+
+
+class _UdpFront(asyncio.DatagramProtocol):
+    """Listening UDP socket facing the clients"""
+
+    def __init__(self, upstream, up, down):
+        self.upstream = upstream
+        self.up = up
+        self.down = down
+        self.flows = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        _set_bufsizes(transport.get_extra_info("socket"))
+
+    def datagram_received(self, data, addr):
+        flow = self.flows.get(addr)
+        if flow is None:
+            flow = self.flows[addr] = _UdpFlow(self, addr)
+            asyncio.ensure_future(self._connect(flow))
+        flow.last_seen = time.monotonic()
+        self.up.offer(len(data), flow.send, (data,))
+
+    def error_received(self, exc):
+        pass
+
+    async def _connect(self, flow):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_datagram_endpoint(lambda: flow,
+                                                remote_addr=self.upstream)
+        except OSError as e:
+            print(f"⚠️  cannot reach QUIC upstream {self.upstream}: {e}",
+                  file=sys.stderr)
+            self.flows.pop(flow.client_addr, None)
+
+    def expire(self):
+        cutoff = time.monotonic() - UDP_FLOW_IDLE
+        for addr, flow in list(self.flows.items()):
+            if flow.last_seen < cutoff and flow.transport:
+                flow.transport.close()
+                del self.flows[addr]
+
+
+def _write_eof(writer):
+    try:
+        if writer.can_write_eof():
+            writer.write_eof()
+        else:
+            writer.close()
+    except (OSError, RuntimeError):
+        writer.close()
+
+
+async def _pipe(reader, writer, link):
+    try:
+        while True:
+            data = await reader.read(TCP_CHUNK)
+            if not data:
+                break
+            await link.put(len(data), writer.write, (data,))
+            # The link writes later; keep the kernel from being flooded
+            if writer.transport.get_write_buffer_size() > 4 * TCP_CHUNK:
+                await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    # EOF goes through the link too, so it is not delivered early
+    await link.put(0, _write_eof, (writer,))
+
+
+def tcp_handler(upstream, up, down):
+    async def handle(client_reader, client_writer):
+        try:
+            up_reader, up_writer = await asyncio.open_connection(*upstream)
+        except OSError as e:
+            print(f"⚠️  cannot reach TCP upstream {upstream}: {e}", file=sys.stderr)
+            client_writer.close()
+            return
+        for w in (client_writer, up_writer):
+            w.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP,
+                                                  socket.TCP_NODELAY, 1)
+        await asyncio.gather(_pipe(client_reader, up_writer, up),
+                             _pipe(up_reader, client_writer, down))
+        for w in (client_writer, up_writer):
+            w.close()
+    return handle
+
+
+def parse_addr(spec):
+    host, _, port = spec.rpartition(":")
+    return host, int(port)
+
+
+def make_trace(path, rate_kbps, delay_ms, loss):
+    if path:
+        return load_trace(path, delay_ms, loss)
+    return Trace.constant(rate_kbps, delay_ms, loss)
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop()
+    up = Link("uplink", make_trace(args.up_trace, args.up_rate, args.delay, args.loss),
+              args.queue, args.burst, args.seed)
+    down = Link("downlink", make_trace(args.down_trace, args.down_rate, args.delay, args.loss),
+                args.queue, args.burst, None if args.seed is None else args.seed + 1)
+
+    front = None
+    if args.quic_upstream != "none":
+        _, front = await loop.create_datagram_endpoint(
+            lambda: _UdpFront(parse_addr(args.quic_upstream), up, down),
+            local_addr=(args.listen, args.port))
+        print(f"🔀 UDP {args.listen}:{args.port} -> {args.quic_upstream}")
+    server = None
+    if args.tcp_upstream != "none":
+        server = await asyncio.start_server(
+            tcp_handler(parse_addr(args.tcp_upstream), up, down),
+            args.listen, args.port)
+        print(f"🔀 TCP {args.listen}:{args.port} -> {args.tcp_upstream}")
+
+    while True:
+        await asyncio.sleep(args.stats or UDP_FLOW_IDLE)
+        if front:
+            front.expire()
+        if args.stats:
+            print(f"{up.stats()}\n{down.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trace-driven UDP/TCP relay')
+    parser.add_argument('--listen', default='127.0.0.1',
+                        help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5201,
+                        help='UDP and TCP port to listen on (default: 5201)')
+    parser.add_argument('--quic-upstream', default='127.0.0.1:5301',
+                        help="video_server address, or 'none' (default: 127.0.0.1:5301)")
+    parser.add_argument('--tcp-upstream', default='127.0.0.1:5302',
+                        help="HTTP server address, or 'none' (default: 127.0.0.1:5302)")
+    parser.add_argument('--down-trace', help='Downlink trace file')
+    parser.add_argument('--up-trace', help='Uplink trace file')
+    parser.add_argument('--down-rate', type=float, default=None,
+                        help='Constant downlink rate in kbps when there is no trace (default: unlimited)')
+    parser.add_argument('--up-rate', type=float, default=None,
+                        help='Constant uplink rate in kbps when there is no trace (default: unlimited)')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='One-way delay in ms added in each direction, unless the trace has its own (default: 0)')
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='UDP loss probability in each direction, unless the trace has its own (default: 0)')
+    parser.add_argument('--queue', type=int, default=150000,
+                        help='Queue size of each direction in bytes (default: 150000)')
+    parser.add_argument('--burst', type=int, default=None,
+                        help='Token bucket size in bytes (default: 4 ms at the peak rate, at least 16 packets)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Random seed for loss, for reproducible runs')
+    parser.add_argument('--stats', type=float, default=0,
+                        help='Print link counters every N seconds (default: off)')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * prefetch.c -- Read files on worker threads, off the event loop
+ */
+
+#include <errno.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/queue.h>
+#include <sys/types.h>
+#include <unistd.h>
+
+#include <event2/event.h>
+
+#include "lsquic.h"
+#include "../src/liblsquic/lsquic_hash.h"
+#include "../src/liblsquic/lsquic_logger.h"
+
+#include "test_config.h"
+#include "test_common.h"
+#include "prog.h"
+#include "file_cache.h"
+#include "prefetch.h"
+
+
+struct pf_job
+{
+    TAILQ_ENTRY(pf_job)         pfj_next;
+    struct lsquic_hash_elem     pfj_hash_el;
+    char                       *pfj_path;
+    struct fc_entry            *pfj_entry;  /* Loaded, not yet in the cache */
+    int                         pfj_errno;
+    int                         pfj_urgent;
+    enum {
+        PFJ_QUEUED,
+        PFJ_RUNNING,
+        PFJ_DONE,
+    }                           pfj_state;
+};
+
+TAILQ_HEAD(pf_jobs, pf_job);
+
+struct prefetch
+{
+    /* Protected by pf_mutex: */
+    pthread_mutex_t             pf_mutex;
+    pthread_cond_t              pf_cond;
+    struct pf_jobs              pf_queue,
+                                pf_done;
+    unsigned                    pf_n_queued;
+    int                         pf_stop;
+    /* Used by the event loop thread only: */
+    struct lsquic_hash         *pf_pending;     /* All unfinished jobs */
+    struct event               *pf_event;
+    struct pf_stats             pf_stats;
+    pf_done_f                   pf_done_cb;
+    void                       *pf_ctx;
+    /* Read-only once the threads are running: */
+    struct file_cache          *pf_cache;
+    struct pf_settings          pf_settings;
+    pthread_t                  *pf_threads;
+    unsigned                    pf_n_threads;
+    int                         pf_pipe[2];     /* Wakes up the event loop */
+};
+
+
+/* Read the file so that it is in the page cache */
+static int
+pf_warm (const char *path)
+{
+    unsigned char buf[0x10000];
+    ssize_t nread;
+    int fd;
+
+    fd = open(path, O_RDONLY);
+    if (fd < 0)
+        return -1;
+#ifdef POSIX_FADV_SEQUENTIAL
+    (void) posix_fadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL);
+#endif
+    while ((nread = read(fd, buf, sizeof(buf))) > 0)
+        ;
+    (void) close(fd);
+    return nread == 0 ? 0 : -1;
+}
+
+
+/* Runs on a worker thread: must not touch the cache or log */
+static void
+pf_run (struct prefetch *pf, struct pf_job *job)
+{
+    if (pf->pf_cache)
+    {
+        job->pfj_entry = file_cache_load(pf->pf_cache, job->pfj_path);
+        if (job->pfj_entry)
+            return;
+        if (errno != EFBIG)
+        {
+            job->pfj_errno = errno;
+            return;
+        }
+        /* The stream will read it from disk */
+    }
+    if (0 != pf_warm(job->pfj_path))
+        job->pfj_errno = errno;
+}
+
+
+static void *
+pf_worker (void *arg)
+{
+    struct prefetch *const pf = arg;
+    struct pf_job *job;
+    int wakeup;
+
+    pthread_mutex_lock(&pf->pf_mutex);
+    for (;;)
+    {
+        while (!pf->pf_stop && TAILQ_EMPTY(&pf->pf_queue))
+            pthread_cond_wait(&pf->pf_cond, &pf->pf_mutex);
+        if (pf->pf_stop)
+            break;
+        job = TAILQ_FIRST(&pf->pf_queue);
+        TAILQ_REMOVE(&pf->pf_queue, job, pfj_next);
+        --pf->pf_n_queued;
+        job->pfj_state = PFJ_RUNNING;
+        pthread_mutex_unlock(&pf->pf_mutex);
+
+        pf_run(pf, job);
+
+        pthread_mutex_lock(&pf->pf_mutex);
+        /* The event loop takes all finished jobs at once, so one byte in
+         * the pipe is enough.
+         */
+        wakeup = TAILQ_EMPTY(&pf->pf_done);
+        job->pfj_state = PFJ_DONE;
+        TAILQ_INSERT_TAIL(&pf->pf_done, job, pfj_next);
+        if (wakeup)
+            (void) write(pf->pf_pipe[1], "", 1);
+    }
+    pthread_mutex_unlock(&pf->pf_mutex);
+    return NULL;
+}
+
+
+static void
+pf_job_destroy (struct prefetch *pf, struct pf_job *job)
+{
+    lsquic_hash_erase(pf->pf_pending, &job->pfj_hash_el);
+    --pf->pf_stats.n_pending;
+    free(job->pfj_path);
+    free(job);
+}
+
+
+/* The pipe event is only pending while jobs are, and is not persistent:
+ * it does not keep the event loop running once the engine is stopped.
+ */
+static void
+pf_arm (struct prefetch *pf)
+{
+    if (pf->pf_stats.n_pending > 0 && !prog_is_stopped()
+                            && !event_pending(pf->pf_event, EV_READ, NULL))
+        (void) event_add(pf->pf_event, NULL);
+}
+
+
+static void
+pf_on_done (evutil_socket_t fd, short what, void *arg)
+{
+    struct prefetch *const pf = arg;
+    struct pf_jobs done;
+    struct pf_job *job;
+    char buf[64];
+
+    while (read(fd, buf, sizeof(buf)) > 0)
+        ;
+
+    TAILQ_INIT(&done);
+    pthread_mutex_lock(&pf->pf_mutex);
+    TAILQ_CONCAT(&done, &pf->pf_done, pfj_next);
+    pthread_mutex_unlock(&pf->pf_mutex);
+
+    while ((job = TAILQ_FIRST(&done)))
+    {
+        TAILQ_REMOVE(&done, job, pfj_next);
+        if (job->pfj_errno)
+        {
+            LSQ_DEBUG("prefetch of %s failed: %s", job->pfj_path,
+                                                strerror(job->pfj_errno));
+            ++pf->pf_stats.failed;
+        }
+        else
+            ++pf->pf_stats.completed;
+        if (job->pfj_entry)
+            file_cache_add(pf->pf_cache, job->pfj_entry);
+        pf->pf_done_cb(pf->pf_ctx, job->pfj_path, job->pfj_errno);
+        pf_job_destroy(pf, job);
+    }
+    pf_arm(pf);
+}
+
+
+static int
+pf_set_nonblocking (int fd)
+{
+    int flags;
+
+    flags = fcntl(fd, F_GETFL);
+    if (flags == -1)
+        return -1;
+    return fcntl(fd, F_SETFL, flags | O_NONBLOCK);
+}
+
+
+struct prefetch *
+prefetch_new (struct event_base *eb, struct file_cache *cache,
+              const struct pf_settings *settings, pf_done_f done_cb,
+              void *ctx)
+{
+    struct prefetch *pf;
+    int s;
+
+    pf = calloc(1, sizeof(*pf));
+    if (!pf)
+        return NULL;
+
+    pthread_mutex_init(&pf->pf_mutex, NULL);
+    pthread_cond_init(&pf->pf_cond, NULL);
+    TAILQ_INIT(&pf->pf_queue);
+    TAILQ_INIT(&pf->pf_done);
+    pf->pf_pipe[0] = pf->pf_pipe[1] = -1;
+    pf->pf_cache = cache;
+    pf->pf_settings = *settings;
+    pf->pf_done_cb = done_cb;
+    pf->pf_ctx = ctx;
+
+    pf->pf_pending = lsquic_hash_create();
+    if (!pf->pf_pending)
+        goto err;
+    if (0 != pipe(pf->pf_pipe) || 0 != pf_set_nonblocking(pf->pf_pipe[0])
+                               || 0 != pf_set_nonblocking(pf->pf_pipe[1]))
+        goto err;
+    pf->pf_event = event_new(eb, pf->pf_pipe[0], EV_READ, pf_on_done, pf);
+    if (!pf->pf_event)
+        goto err;
+
+    pf->pf_threads = calloc(settings->pfs_threads, sizeof(pf->pf_threads[0]));
+    if (!pf->pf_threads)
+        goto err;
+    for (; pf->pf_n_threads < settings->pfs_threads; ++pf->pf_n_threads)
+    {
+        s = pthread_create(&pf->pf_threads[pf->pf_n_threads], NULL,
+                                                            pf_worker, pf);
+        if (s != 0)
+        {
+            LSQ_ERROR("cannot create prefetch thread: %s", strerror(s));
+            goto err;
+        }
+    }
+
+    LSQ_INFO("prefetch: %u threads, up to %u queued", pf->pf_n_threads,
+                                                settings->pfs_max_queued);
+    return pf;
+
+  err:
+    prefetch_destroy(pf);
+    return NULL;
+}
+
+
+int
+prefetch_submit (struct prefetch *pf, const char *path, int urgent)
+{
+    struct lsquic_hash_elem *el;
+    struct pf_job *job;
+
+    el = lsquic_hash_find(pf->pf_pending, path, strlen(path));
+    if (el)
+    {
+        job = lsquic_hashelem_getdata(el);
+        if (urgent && !job->pfj_urgent)
+        {
+            job->pfj_urgent = 1;
+            ++pf->pf_stats.urgent;
+            pthread_mutex_lock(&pf->pf_mutex);
+            if (job->pfj_state == PFJ_QUEUED)
+            {
+                TAILQ_REMOVE(&pf->pf_queue, job, pfj_next);
+                TAILQ_INSERT_HEAD(&pf->pf_queue, job, pfj_next);
+            }
+            pthread_mutex_unlock(&pf->pf_mutex);
+        }
+        return 0;
+    }
+
+    job = calloc(1, sizeof(*job));
+    if (!job)
+        return -1;
+    job->pfj_path = strdup(path);
+    if (!job->pfj_path)
+    {
+        free(job);
+        return -1;
+    }
+    job->pfj_urgent = urgent;
+    if (!lsquic_hash_insert(pf->pf_pending, job->pfj_path,
+                        strlen(job->pfj_path), job, &job->pfj_hash_el))
+    {
+        free(job->pfj_path);
+        free(job);
+        return -1;
+    }
+
+    pthread_mutex_lock(&pf->pf_mutex);
+    if (!urgent && pf->pf_n_queued >= pf->pf_settings.pfs_max_queued)
+    {
+        pthread_mutex_unlock(&pf->pf_mutex);
+        ++pf->pf_stats.dropped;
+        lsquic_hash_erase(pf->pf_pending, &job->pfj_hash_el);
+        free(job->pfj_path);
+        free(job);
+        return -1;
+    }
+    if (urgent)
+        TAILQ_INSERT_HEAD(&pf->pf_queue, job, pfj_next);
+    else
+        TAILQ_INSERT_TAIL(&pf->pf_queue, job, pfj_next);
+    ++pf->pf_n_queued;
+    pthread_cond_signal(&pf->pf_cond);
+    pthread_mutex_unlock(&pf->pf_mutex);
+
+    ++pf->pf_stats.submitted;
+    pf->pf_stats.urgent += urgent != 0;
+    ++pf->pf_stats.n_pending;
+    pf_arm(pf);
+    LSQ_DEBUG("%s %s", urgent ? "load" : "read ahead", path);
+    return 0;
+}
+
+
+void
+prefetch_get_stats (const struct prefetch *pf, struct pf_stats *stats)
+{
+    *stats = pf->pf_stats;
+}
+
+
+void
+prefetch_destroy (struct prefetch *pf)
+{
+    struct pf_job *job;
+    unsigned n;
+
+    pthread_mutex_lock(&pf->pf_mutex);
+    pf->pf_stop = 1;
+    pthread_cond_broadcast(&pf->pf_cond);
+    pthread_mutex_unlock(&pf->pf_mutex);
+    for (n = 0; n < pf->pf_n_threads; ++n)
+        pthread_join(pf->pf_threads[n], NULL);
+    free(pf->pf_threads);
+
+    /* No threads left: no locking needed */
+    while ((job = TAILQ_FIRST(&pf->pf_done)))
+    {
+        TAILQ_REMOVE(&pf->pf_done, job, pfj_next);
+        if (job->pfj_entry)
+            file_cache_add(pf->pf_cache, job->pfj_entry);
+        pf_job_destroy(pf, job);
+    }
+    while ((job = TAILQ_FIRST(&pf->pf_queue)))
+    {
+        TAILQ_REMOVE(&pf->pf_queue, job, pfj_next);
+        pf_job_destroy(pf, job);
+    }
+
+    if (pf->pf_event)
+    {
+        event_del(pf->pf_event);
+        event_free(pf->pf_event);
+    }
+    if (pf->pf_pipe[0] >= 0)
+        (void) close(pf->pf_pipe[0]);
+    if (pf->pf_pipe[1] >= 0)
+        (void) close(pf->pf_pipe[1]);
+    if (pf->pf_pending)
+        lsquic_hash_destroy(pf->pf_pending);
+    pthread_cond_destroy(&pf->pf_cond);
+    pthread_mutex_destroy(&pf->pf_mutex);
+    free(pf);
+}
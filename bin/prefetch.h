@@ -0,0 +1,67 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * prefetch.h -- Read files on worker threads, off the event loop
+ *
+ * Jobs are queued by path and run by a fixed pool of threads.  With a
+ * file cache, a job loads the file into a cache entry, which is added to
+ * the cache on the event loop thread; without one -- or if the file is
+ * too large for the cache -- the file is read once so that its pages are
+ * in the page cache when the stream reads it.
+ *
+ * Finished jobs are handed back to the event loop through a pipe, so the
+ * completion callback runs on the event loop thread and may use lsquic
+ * and the file cache.  A path is queued at most once at a time.  Urgent
+ * jobs -- a request is waiting for the file -- go to the front of the
+ * queue; read-ahead goes to the back and is dropped when the queue is
+ * full.
+ */
+
+#ifndef PREFETCH_H
+#define PREFETCH_H 1
+
+struct event_base;
+struct file_cache;
+struct prefetch;
+
+struct pf_settings
+{
+    unsigned            pfs_threads;
+    unsigned            pfs_max_queued;     /* Limits read-ahead only */
+};
+
+struct pf_stats
+{
+    unsigned long       submitted,
+                        urgent,             /* Submitted or promoted */
+                        dropped,            /* Queue was full */
+                        completed,
+                        failed;
+    unsigned            n_pending;          /* Queued or running */
+};
+
+/* Called on the event loop thread when the job for `path' is done.
+ * `err' is 0 or the errno value of the failed open or read.
+ */
+typedef void (*pf_done_f)(void *ctx, const char *path, int err);
+
+/* `cache' may be NULL */
+struct prefetch *
+prefetch_new (struct event_base *, struct file_cache *,
+              const struct pf_settings *, pf_done_f, void *ctx);
+
+/* Returns 0 if the job is queued or already pending and -1 if it was
+ * dropped.  Urgent jobs are never dropped.
+ */
+int
+prefetch_submit (struct prefetch *, const char *path, int urgent);
+
+void
+prefetch_get_stats (const struct prefetch *, struct pf_stats *);
+
+/* Waits for running jobs to finish.  Remaining loaded entries are added
+ * to the cache; the callback is not called.
+ */
+void
+prefetch_destroy (struct prefetch *);
+
+#endif
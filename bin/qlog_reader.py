@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+qlog_reader.py -- load qlog files into NumPy time series
+
+Reads the qlog files that video_server -Q writes, one per connection
+(*.sqlog, JSON Text Sequences), and qlog 0.3 JSON files from other
+implementations (*.qlog).  Files are read incrementally: an .sqlog file
+one record per line, a .qlog file by decoding the objects of its
+"events" arrays one at a time from a sliding buffer.  Memory use depends
+on the number of events kept, not on the size of the file.  Events of
+other types are skipped; in an .sqlog file they are skipped before they
+are decoded, so packet-level traces cost little more than reading them.
+
+Per connection:
+
+  metrics   One row per recovery:metrics_updated event: time, srtt_ms,
+            min_rtt_ms, rttvar_ms, latest_rtt_ms, cwnd, bytes_in_flight
+            and pacing_rate (bits/s).  qlog only reports the fields that
+            changed, so the others carry their previous value (NaN until
+            the first one).
+  loss      time and count of lost packets: one row per
+            recovery:packet_lost event, or per lsquic:packets_lost event,
+            which counts the losses since the previous sample
+  cc        time and name of the congestion controller, from
+            lsquic:cc_selected events, with the adaptive controller's
+            inputs once it has picked
+
+Times are epoch seconds if the trace has a reference_time, so they line
+up with the request log (server_stats.py) and the QoE samples; otherwise
+seconds since the start of the trace.
+
+Usage:
+    ./qlog_reader.py qlog/ > transport.csv
+    ./qlog_reader.py qlog/*.sqlog --summary
+    ./qlog_reader.py qlog/ --start 1700000012.5 --end 1700000016 > stall.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sys
+from array import array
+
+import numpy as np
+
+# qlog field -> column, in column order
+METRIC_FIELDS = {
+    "smoothed_rtt":         "srtt_ms",
+    "min_rtt":              "min_rtt_ms",
+    "rtt_variance":         "rttvar_ms",
+    "latest_rtt":           "latest_rtt_ms",
+    "congestion_window":    "cwnd",
+    "bytes_in_flight":      "bytes_in_flight",
+    "pacing_rate":          "pacing_rate",
+}
+
+CSV_FIELDS = (("conn", "time") + tuple(METRIC_FIELDS.values())
+              + ("lost", "cc"))
+SUMMARY_FIELDS = ("conn", "start", "duration", "samples", "srtt_ms_mean",
+                  "srtt_ms_max", "min_rtt_ms", "cwnd_max", "lost", "cc")
+
+# Substrings of the event names kept, to skip other records undecoded
+WANTED = ("metrics_updated", "packet_lost", "packets_lost", "cc_selected")
+
+CHUNK_SIZE = 1 << 20
+
+EVENTS_RE = re.compile(r'"events"\s*:\s*\[')
+SKIP_RE = re.compile(r"[\s,]*")
+REFERENCE_TIME_RE = re.compile(r'"reference_time"\s*:\s*([-0-9.eE+]+)')
+TIME_FORMAT_RE = re.compile(r'"time_format"\s*:\s*"(\w+)"')
+GROUP_ID_RE = re.compile(r'"(?:group_id|ODCID)"\s*:\s*"([^"]*)"')
+
+
+# ─── Parsing ────────────────────────────────────────────────────────────
+
+def _common_fields(record):
+    trace = record.get("trace") or (record.get("traces") or [{}])[0]
+    return trace.get("common_fields") or {}
+
+
+def _iter_sqlog(f, header):
+    """Yield the events of a JSON-SEQ file; fills in header"""
+    first = True
+    for line in f:
+        line = line.lstrip("\x1e")
+        if first:
+            first = False
+            try:
+                header.update(_common_fields(json.loads(line)))
+            except ValueError:
+                return
+            continue
+        if not any(name in line for name in WANTED):
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # A torn last line from a killed server
+            break
+
+
+def _scan_header(text, header):
+    for key, regex, cast in (("reference_time", REFERENCE_TIME_RE, float),
+                             ("time_format", TIME_FORMAT_RE, str),
+                             ("group_id", GROUP_ID_RE, str)):
+        m = regex.search(text)
+        if m and key not in header:
+            header[key] = cast(m.group(1))
+
+
+def _iter_qlog(f, header):
+    """Yield the events of a JSON file, one object at a time
+
+    The fields before the first "events" array are scanned for the
+    reference time rather than decoded, as the document is not complete
+    until the end of the file.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    head = []
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(CHUNK_SIZE)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    while True:
+        m = EVENTS_RE.search(buf, pos)
+        if not m:
+            if eof:
+                return
+            # Keep enough to match "events": [ across the chunk boundary
+            keep = max(pos, len(buf) - 32)
+            head.append(buf[pos:keep])
+            pos = keep
+            fill()
+            continue
+        head.append(buf[pos:m.start()])
+        _scan_header("".join(head), header)
+        head = []
+        pos = m.end()
+
+        while True:
+            pos = SKIP_RE.match(buf, pos).end()
+            if pos == len(buf):
+                if eof:
+                    return
+                fill()
+                continue
+            if buf[pos] == "]":
+                pos += 1
+                break
+            try:
+                event, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    return
+                fill()
+                continue
+            pos = end
+            yield event
+
+
+def _event_name(event):
+    name = event.get("name")
+    if name is None:
+        name = "%s:%s" % (event.get("category", ""), event.get("event", ""))
+    return name
+
+
+def load_qlog(path):
+    """Load one qlog file into a dict of NumPy columns
+
+    Returns {"conn", "metrics", "loss", "cc"}, where "metrics" and "loss"
+    are dicts of columns and "cc" is a list of (time, data) tuples.
+    """
+    header = {}
+    metrics = {name: array("d") for name in ("time",) + tuple(METRIC_FIELDS.values())}
+    state = dict.fromkeys(METRIC_FIELDS, float("nan"))
+    loss_time, loss_count = array("d"), array("d")
+    cc = []
+    last_time = 0.0
+
+    opener = _iter_sqlog if path.endswith(".sqlog") else _iter_qlog
+    with open(path, encoding="utf-8") as f:
+        for event in opener(f, header):
+            name = _event_name(event)
+            t = float(event.get("time", 0.0))
+            if header.get("time_format") == "delta":
+                t += last_time
+            last_time = t
+            data = event.get("data") or {}
+
+            if name == "recovery:metrics_updated":
+                for field in METRIC_FIELDS:
+                    if field in data:
+                        state[field] = data[field]
+                metrics["time"].append(t)
+                for field, column in METRIC_FIELDS.items():
+                    metrics[column].append(state[field])
+            elif name == "recovery:packet_lost":
+                loss_time.append(t)
+                loss_count.append(1)
+            elif name == "lsquic:packets_lost":
+                loss_time.append(t)
+                loss_count.append(data.get("count", 1))
+            elif name == "lsquic:cc_selected":
+                cc.append((t, data))
+
+    # Milliseconds since reference_time -> seconds
+    offset = header.get("reference_time", 0.0)
+
+    def seconds(times):
+        return (np.frombuffer(times, dtype=np.float64) + offset) / 1000.0
+
+    conn = header.get("group_id") or os.path.splitext(os.path.basename(path))[0]
+    out_metrics = {column: np.frombuffer(values, dtype=np.float64)
+                   for column, values in metrics.items()}
+    out_metrics["time"] = seconds(metrics["time"])
+    return {
+        "conn":     conn,
+        "metrics":  out_metrics,
+        "loss":     {"time": seconds(loss_time),
+                     "count": np.frombuffer(loss_count, dtype=np.float64)},
+        "cc":       [((t + offset) / 1000.0, data) for t, data in cc],
+    }
+
+
+def qlog_paths(args):
+    """Expand directories into the qlog files they hold"""
+    paths = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend(sorted(glob.glob(os.path.join(arg, "*.sqlog"))
+                                + glob.glob(os.path.join(arg, "*.qlog"))))
+        else:
+            paths.append(arg)
+    return paths
+
+
+# ─── Time series ────────────────────────────────────────────────────────
+
+def timeline(qlog):
+    """Metrics columns with the cumulative losses and the controller in
+    use at each sample
+    """
+    out = dict(qlog["metrics"])
+    loss = qlog["loss"]
+    # Losses reported at or before each sample
+    idx = np.searchsorted(loss["time"], out["time"], side="right")
+    out["lost"] = np.concatenate(([0.0], np.cumsum(loss["count"])))[idx]
+    names = np.array([""] + [data.get("cc", "") for _, data in qlog["cc"]],
+                     dtype=object)
+    times = np.array([t for t, _ in qlog["cc"]], dtype=np.float64)
+    out["cc"] = names[np.searchsorted(times, out["time"], side="right")]
+    return out
+
+
+def summary(qlog):
+    m = qlog["metrics"]
+    n = len(m["time"])
+
+    def stat(fn, column):
+        col = m[column]
+        return fn(col) if n and not np.isnan(col).all() else np.nan
+
+    return {
+        "conn":         qlog["conn"],
+        "start":        m["time"][0] if n else np.nan,
+        "duration":     m["time"][-1] - m["time"][0] if n else np.nan,
+        "samples":      n,
+        "srtt_ms_mean": stat(np.nanmean, "srtt_ms"),
+        "srtt_ms_max":  stat(np.nanmax, "srtt_ms"),
+        "min_rtt_ms":   stat(np.nanmin, "min_rtt_ms"),
+        "cwnd_max":     stat(np.nanmax, "cwnd"),
+        "lost":         qlog["loss"]["count"].sum(),
+        "cc":           qlog["cc"][-1][1].get("cc", "") if qlog["cc"] else "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load qlog files into transport time series')
+    parser.add_argument('qlogs', nargs='+',
+                        help='qlog files or directories of them (video_server -Q)')
+    parser.add_argument('--summary', action='store_true',
+                        help='One row per connection instead of one per sample')
+    parser.add_argument('--start', type=float,
+                        help='Only samples at or after this time (epoch seconds)')
+    parser.add_argument('--end', type=float,
+                        help='Only samples at or before this time (epoch seconds)')
+    args = parser.parse_args()
+
+    def r(value):
+        if isinstance(value, str):
+            return value
+        if value != value:
+            return ""
+        value = float(value)
+        return int(value) if value.is_integer() else round(value, 3)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(SUMMARY_FIELDS if args.summary else CSV_FIELDS)
+    # One file at a time: only one connection is held in memory
+    for path in qlog_paths(args.qlogs):
+        qlog = load_qlog(path)
+        if args.summary:
+            row = summary(qlog)
+            writer.writerow([r(row[name]) for name in SUMMARY_FIELDS])
+            continue
+        cols = timeline(qlog)
+        keep = np.ones(len(cols["time"]), dtype=bool)
+        if args.start is not None:
+            keep &= cols["time"] >= args.start
+        if args.end is not None:
+            keep &= cols["time"] <= args.end
+        for i in np.flatnonzero(keep):
+            writer.writerow([qlog["conn"]]
+                            + [r(cols[name][i]) for name in CSV_FIELDS[1:]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * qlog_writer.c -- Write the transport state of a connection as qlog
+ */
+
+#include <errno.h>
+#include <inttypes.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include <event2/util.h>
+
+#include "lsquic.h"
+#include "../src/liblsquic/lsquic_int_types.h"
+#include "../src/liblsquic/lsquic_util.h"
+
+#include "qlog_writer.h"
+
+/* A sample is a few hundred bytes at most */
+#define QW_BUF_SIZE (1 << 14)
+
+/* Record separator that starts each JSON-SEQ record (RFC 7464) */
+#define QW_RS "\x1e"
+
+
+struct qlog_writer
+{
+    FILE                       *qw_file;
+    struct timeval              qw_start;       /* reference_time */
+    struct lsquic_conn_info     qw_last;        /* Previous sample */
+    int                         qw_have_last;   /* qw_last is set */
+};
+
+
+static double
+qw_ms (const struct timeval *tv)
+{
+    return tv->tv_sec * 1000.0 + tv->tv_usec / 1000.0;
+}
+
+
+static const char *
+qw_cc_name (unsigned cc_algo)
+{
+    switch (cc_algo)
+    {
+    case 1:  return "cubic";
+    case 2:  return "bbr";
+    default: return "adaptive";
+    }
+}
+
+
+static void
+qw_begin_event (struct qlog_writer *qw, const char *name)
+{
+    struct timeval now;
+
+    (void) evutil_gettimeofday(&now, NULL);
+    fprintf(qw->qw_file, QW_RS "{\"time\":%.3f,\"name\":\"%s\",\"data\":{",
+                            qw_ms(&now) - qw_ms(&qw->qw_start), name);
+}
+
+
+static void
+qw_end_event (struct qlog_writer *qw)
+{
+    fputs("}}\n", qw->qw_file);
+}
+
+
+struct qlog_writer *
+qlog_writer_open (const char *dir, struct lsquic_conn *conn)
+{
+    struct qlog_writer *qw;
+    const lsquic_cid_t *cid;
+    char cid_str[MAX_CID_LEN * 2 + 1];
+    char *path;
+    size_t path_sz;
+    int saved_errno;
+
+    cid = lsquic_conn_id(conn);
+    lsquic_hexstr(cid->idbuf, cid->len, cid_str, sizeof(cid_str));
+    path_sz = strlen(dir) + 1 + strlen(cid_str) + sizeof(".sqlog");
+    path = malloc(path_sz);
+    if (!path)
+        return NULL;
+    snprintf(path, path_sz, "%s/%s.sqlog", dir, cid_str);
+
+    qw = calloc(1, sizeof(*qw));
+    if (qw)
+        qw->qw_file = fopen(path, "w");
+    if (!qw || !qw->qw_file)
+    {
+        saved_errno = errno;
+        free(qw);
+        free(path);
+        errno = saved_errno;
+        return NULL;
+    }
+    free(path);
+    (void) setvbuf(qw->qw_file, NULL, _IOFBF, QW_BUF_SIZE);
+
+    (void) evutil_gettimeofday(&qw->qw_start, NULL);
+    fprintf(qw->qw_file, QW_RS "{\"qlog_version\":\"0.3\","
+        "\"qlog_format\":\"JSON-SEQ\",\"title\":\"video_server\","
+        "\"trace\":{\"vantage_point\":{\"type\":\"server\"},"
+        "\"common_fields\":{\"group_id\":\"%s\",\"time_format\":\"relative\","
+        "\"reference_time\":%.3f}}}\n", cid_str, qw_ms(&qw->qw_start));
+    return qw;
+}
+
+
+static void
+qw_cc_selected (struct qlog_writer *qw, struct lsquic_conn *conn,
+                                                            unsigned cc_algo)
+{
+    struct lsquic_cc_decision decision;
+
+    qw_begin_event(qw, "lsquic:cc_selected");
+    fprintf(qw->qw_file, "\"cc\":\"%s\"", qw_cc_name(cc_algo));
+    if (0 == lsquic_conn_get_cc_decision(conn, &decision))
+        fprintf(qw->qw_file, ",\"samples\":%u,\"smoothed_rtt\":%.3f,"
+            "\"rtt_variance\":%.3f,\"min_rtt\":%.3f,\"rtt_threshold\":%.3f,"
+            "\"bbr_bandwidth\":%"PRIu64",\"cubic_cwnd\":%"PRIu64","
+            "\"bbr_cwnd\":%"PRIu64, decision.lccd_n_samples,
+            decision.lccd_srtt / 1000.0, decision.lccd_rttvar / 1000.0,
+            decision.lccd_min_rtt / 1000.0, decision.lccd_rtt_thresh / 1000.0,
+            decision.lccd_bbr_bw * 8, decision.lccd_cubic_cwnd,
+            decision.lccd_bbr_cwnd);
+    qw_end_event(qw);
+}
+
+
+/* qlog units: RTTs in milliseconds, pacing rate in bits per second */
+static void
+qw_metrics_updated (struct qlog_writer *qw,
+                                        const struct lsquic_conn_info *info)
+{
+    const struct lsquic_conn_info *const last =
+                                    qw->qw_have_last ? &qw->qw_last : NULL;
+    const char *sep = "";
+
+#define CHANGED(field) (!last || last->field != info->field)
+    if (!(CHANGED(lci_min_rtt) || CHANGED(lci_srtt) || CHANGED(lci_rttvar)
+            || CHANGED(lci_cwnd) || CHANGED(lci_bytes_in_flight)
+            || CHANGED(lci_pacing_rate)))
+        return;
+
+    qw_begin_event(qw, "recovery:metrics_updated");
+    if (CHANGED(lci_min_rtt))
+    {
+        fprintf(qw->qw_file, "%s\"min_rtt\":%.3f", sep,
+                                                info->lci_min_rtt / 1000.0);
+        sep = ",";
+    }
+    if (CHANGED(lci_srtt))
+    {
+        fprintf(qw->qw_file, "%s\"smoothed_rtt\":%.3f", sep,
+                                                    info->lci_srtt / 1000.0);
+        sep = ",";
+    }
+    if (CHANGED(lci_rttvar))
+    {
+        fprintf(qw->qw_file, "%s\"rtt_variance\":%.3f", sep,
+                                                info->lci_rttvar / 1000.0);
+        sep = ",";
+    }
+    if (CHANGED(lci_cwnd))
+    {
+        fprintf(qw->qw_file, "%s\"congestion_window\":%"PRIu64, sep,
+                                                            info->lci_cwnd);
+        sep = ",";
+    }
+    if (CHANGED(lci_bytes_in_flight))
+    {
+        fprintf(qw->qw_file, "%s\"bytes_in_flight\":%u", sep,
+                                                info->lci_bytes_in_flight);
+        sep = ",";
+    }
+    if (CHANGED(lci_pacing_rate))
+        fprintf(qw->qw_file, "%s\"pacing_rate\":%"PRIu64, sep,
+                                                info->lci_pacing_rate * 8);
+#undef CHANGED
+    qw_end_event(qw);
+}
+
+
+void
+qlog_writer_sample (struct qlog_writer *qw, struct lsquic_conn *conn)
+{
+    struct lsquic_conn_info info;
+
+    if (0 != lsquic_conn_get_info(conn, &info))
+        return;
+
+    if (!qw->qw_have_last || qw->qw_last.lci_cc_algo != info.lci_cc_algo)
+        qw_cc_selected(qw, conn, info.lci_cc_algo);
+    qw_metrics_updated(qw, &info);
+    if (qw->qw_have_last
+                && info.lci_lost_packets > qw->qw_last.lci_lost_packets)
+    {
+        qw_begin_event(qw, "lsquic:packets_lost");
+        fprintf(qw->qw_file, "\"count\":%"PRIu64,
+                    info.lci_lost_packets - qw->qw_last.lci_lost_packets);
+        qw_end_event(qw);
+    }
+
+    qw->qw_last = info;
+    qw->qw_have_last = 1;
+}
+
+
+void
+qlog_writer_close (struct qlog_writer *qw, struct lsquic_conn *conn)
+{
+    qlog_writer_sample(qw, conn);
+    qw_begin_event(qw, "connectivity:connection_closed");
+    qw_end_event(qw);
+    (void) fclose(qw->qw_file);
+    free(qw);
+}
@@ -0,0 +1,51 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * qlog_writer.h -- Write the transport state of a connection as qlog
+ *
+ * One file per connection, named after its connection ID, in the JSON
+ * Text Sequences serialization of qlog 0.3 (*.sqlog): a header record,
+ * then one record per event, each a single line.  The file is written
+ * through a stdio buffer and never flushed until it is closed, so that a
+ * sample costs a few formatted writes to memory.
+ *
+ * The library does not report individual packets to the application:
+ * the events are derived from lsquic_conn_get_info() samples.  Each
+ * sample writes
+ *
+ *   recovery:metrics_updated   RTT, congestion window, bytes in flight
+ *                              and pacing rate, only the fields that
+ *                              changed since the previous sample
+ *   lsquic:packets_lost        "count": packets declared lost since the
+ *                              previous sample, if any
+ *   lsquic:cc_selected         "cc": the congestion controller in use,
+ *                              when it changes; once the adaptive
+ *                              controller picks, also what it was based
+ *                              on (see lsquic_conn_get_cc_decision())
+ *
+ * and closing the file writes connectivity:connection_closed.  Times are
+ * milliseconds since reference_time, itself milliseconds since the epoch.
+ */
+
+#ifndef QLOG_WRITER_H
+#define QLOG_WRITER_H 1
+
+struct lsquic_conn;
+struct qlog_writer;
+
+/* Create `dir'/<CID>.sqlog and write the header.  Returns NULL and sets
+ * errno on failure.
+ */
+struct qlog_writer *
+qlog_writer_open (const char *dir, struct lsquic_conn *);
+
+/* Write the events for what has changed since the previous sample */
+void
+qlog_writer_sample (struct qlog_writer *, struct lsquic_conn *);
+
+/* Take a last sample, write connectivity:connection_closed, close the
+ * file and free the writer.
+ */
+void
+qlog_writer_close (struct qlog_writer *, struct lsquic_conn *);
+
+#endif
@@ -4,6 +4,8 @@ from selenium.webdriver.common.by import By  # ← Add this line
 from selenium.webdriver.chrome.options import Options
 import time
 
+from fetch_dashjs import DASHJS_PATH
+
 
 chrome_options = Options()
 
@@ -26,26 +28,31 @@ service = Service("/opt/homebrew/bin/chromedriver")
 # Start WebDriver
 driver = webdriver.Chrome(service=service, options=chrome_options)
 
-driver.get("https://quic.local:5201/index.html")
-
-# Wait for video element to load
-time.sleep(20)
+driver.get("https://quic.local:5201/index.html")   # returns after load
 
+# The pinned dash.js is not in the tree, see fetch_dashjs.py
+if not driver.execute_script("return !!window.dashjs"):
+    driver.quit()
+    raise SystemExit(f"{DASHJS_PATH} did not load: run fetch_dashjs.py on the server")
 video = driver.find_element(By.ID, "videoPlayer")
 
-# **Ensure video starts playing**
+# **Ensure video starts playing**: resolves on the first `playing' event
+# rather than after a fixed delay
 play_script = """
-var video = arguments[0];
-if (video) {
-    video.muted = true;  // Mute required for autoplay
-    video.play();
-    return video.paused ? 'Video did not start' : 'Video is playing';
-} else {
-    return 'No video element found';
-}
+var video = arguments[0], done = arguments[arguments.length - 1];
+if (!video)
+    return done('No video element found');
+if (!video.paused && video.readyState >= 3)
+    return done('Video is playing');
+video.addEventListener('playing', () => done('Video is playing'), {once: true});
+setTimeout(() => done('Video did not start'), 60000);
+video.muted = true;  // Mute required for autoplay
+video.play().catch(() => done('Video did not start'));
 """
-result = driver.execute_script(play_script, video)
-print(f"🔹 Play Status: {result}")
+driver.set_script_timeout(90)
+t0 = time.time()
+result = driver.execute_async_script(play_script, video)
+print(f"🔹 Play Status: {result} after {time.time() - t0:.2f}s")
 
 if result == "Video did not start":
     print("⚠️ Video failed to play. Check browser settings.")
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+qoe_analysis.py -- QoE metrics over whole runs, computed in bulk
+
+The capture loops only store what the browser reports.  This module
+loads the samples of many runs into one set of concatenated arrays (see
+qoe_sink.load_runs) and derives every metric with NumPy group
+operations, so no per-sample Python code runs and thousands of runs are
+analysed per second.
+
+Metrics per run:
+
+  startup_delay      Wall clock time until playback_time first advances
+  bitrate_kbps       Bitrate weighted by the playback time spent at it
+  log_utility        Same, of ln(bitrate / lowest bitrate of the run)
+  bitrate_changes    Bitrate changes seen in the samples, and their
+  mean_change_kbps   mean size
+  switches           Rendered quality switches from switches_*.log, per
+  switches_per_min   minute of playback, and their mean and largest
+  mean_switch_levels size in ladder levels
+  max_switch_levels
+  stall_count        Stalls after startup, total time, and the median,
+  total_stall_time   90th percentile and longest stall
+  stall_p50 ... stall_max
+  rebuffer_rate      total_stall_time / playback_time
+  fps_mean           Frames rendered per second of playback, from the
+                     total_frames counter
+  fps_p5             5th percentile of fps over a sliding window
+  frame_drop_pct     Dropped frames as a percentage of total frames
+  qoe                Linear QoE per second of playback (Yin et al.,
+                     SIGCOMM 2015): bitrate in Mbps, minus the bitrate
+                     changes, rebuffering and startup delay, weighted
+                     by --switch-penalty, --stall-penalty and
+                     --startup-penalty
+
+Usage:
+    ./qoe_analysis.py results/ > metrics.csv
+    ./qoe_analysis.py results/*/qoe_metrics_quic.qoe --window 2
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from qoe_sink import RAW_FIELDS, load_runs
+
+METRIC_FIELDS = (
+    "samples", "playback_time", "startup_delay", "bitrate_kbps", "log_utility",
+    "bitrate_changes", "mean_change_kbps", "switches", "switches_per_min",
+    "mean_switch_levels", "max_switch_levels", "stall_count", "total_stall_time",
+    "stall_p50", "stall_p90", "stall_max", "rebuffer_rate", "fps_mean", "fps_p5",
+    "frame_drop_pct", "qoe",
+)
+
+
+# ─── Loading ────────────────────────────────────────────────────────────
+
+def find_runs(paths):
+    """Expand run directories into their qoe_metrics_* files"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "**", "qoe_metrics_*.*"),
+                                          recursive=True)))
+        else:
+            found.append(path)
+    return [p for p in found if p.endswith((".qoe", ".csv"))]
+
+
+def load_csv_run(path):
+    """Load a qoe_metrics_*.csv into the columns load_run() returns"""
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    cols = {name: np.array([float(r[name]) for r in rows])
+            for name in RAW_FIELDS if name not in ("width", "height")}
+    res = [r["resolution"].partition("x") for r in rows]
+    cols["width"] = np.array([float(w or 0) for w, _, _ in res])
+    cols["height"] = np.array([float(h or 0) for _, _, h in res])
+    return cols
+
+
+def switch_log_for(path):
+    """switches_<protocol>.log next to qoe_metrics_<protocol>.*"""
+    head, name = os.path.split(path)
+    proto = os.path.splitext(name)[0][len("qoe_metrics_"):]
+    return os.path.join(head, f"switches_{proto}.log")
+
+
+def _switch_levels(event):
+    """(old, new) Representation index of a switch, or None
+
+    The collector logs dash.js 5 Representations (oldIndex, newIndex);
+    logs of dash.js 4 runs have quality indices (oldQuality, newQuality).
+    """
+    for old, new in (("oldIndex", "newIndex"), ("oldQuality", "newQuality")):
+        o, n = event.get(old), event.get(new)
+        if isinstance(o, (int, float)) and isinstance(n, (int, float)):
+            return o, n
+    return None
+
+
+def load_switches(path):
+    """(old, new) quality levels of each switch; empty if there is no log"""
+    try:
+        with open(path) as f:
+            events = json.load(f)
+    except (OSError, ValueError):
+        events = []
+    levels = [lv for lv in map(_switch_levels, events) if lv is not None]
+    if events and not levels:
+        print(f"⚠️  {path}: none of {len(events)} switches has quality levels; "
+              f"switch sizes are not counted", file=sys.stderr)
+    return np.array(levels, dtype=np.float64).reshape(-1, 2)
+
+
+class RunSet:
+    """Samples of many runs, concatenated
+
+    Samples of run i are columns[name][offsets[i]:offsets[i+1]]; switches
+    of run i are switches[sw_offsets[i]:sw_offsets[i+1]].  Every run has
+    at least one sample.
+    """
+
+    def __init__(self, names, columns, offsets, switches, sw_offsets):
+        self.names = names
+        self.columns = {name: np.asarray(col, dtype=np.float64)
+                        for name, col in columns.items()}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.switches = switches
+        self.sw_offsets = np.asarray(sw_offsets, dtype=np.int64)
+        self.lengths = np.diff(self.offsets)
+        self.run = np.repeat(np.arange(len(names)), self.lengths)
+        self.first = self.offsets[:-1]
+        self.last = self.offsets[1:] - 1
+
+    def __len__(self):
+        return len(self.names)
+
+
+def load(paths):
+    """Load qoe_metrics files (.qoe or .csv) and their switch logs"""
+    paths = list(paths)
+    binary = [p for p in paths if p.endswith(".qoe")]
+    columns, offsets = load_runs(binary)
+    runs = [(p, {name: columns[name][offsets[i]:offsets[i + 1]] for name in columns})
+            for i, p in enumerate(binary)]
+    runs += [(p, load_csv_run(p)) for p in paths if not p.endswith(".qoe")]
+    runs = [(p, cols) for p, cols in runs if len(cols["wall_clock"])]
+
+    names = [p for p, _ in runs]
+    lengths = [len(cols["wall_clock"]) for _, cols in runs]
+    columns = {name: np.concatenate([cols[name] for _, cols in runs] or [np.zeros(0)])
+               for name in RAW_FIELDS}
+    switches = [load_switches(switch_log_for(p)) for p in names]
+    return RunSet(names, columns,
+                  np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+                  np.concatenate(switches or [np.zeros((0, 2))]),
+                  np.concatenate(([0], np.cumsum([len(s) for s in switches],
+                                                 dtype=np.int64))))
+
+
+# ─── Group helpers ──────────────────────────────────────────────────────
+
+def _per_run(groups, values, n):
+    return np.bincount(groups, weights=values, minlength=n)
+
+
+def _div(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b > 0, a / np.where(b > 0, b, 1), 0.0)
+
+
+def _percentile(groups, values, n, q):
+    """Nearest-rank q-th percentile of values within each group; NaN if empty"""
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=n)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = starts + np.floor(q / 100.0 * np.maximum(counts - 1, 0)).astype(np.int64)
+    out = np.full(n, np.nan)
+    has = counts > 0
+    out[has] = values[order][rank[has]]
+    return out
+
+
+def _prev(runs, col):
+    """Value of the previous sample in the same run (own value for the first)"""
+    prev = np.empty_like(col)
+    prev[1:] = col[:-1]
+    prev[runs.first] = col[runs.first]
+    return prev
+
+
+# ─── Metrics ────────────────────────────────────────────────────────────
+
+def windowed_fps(runs, window=2.0):
+    """Frames rendered per second over the last `window' seconds of each
+    sample, from wall clock and totalVideoFrames"""
+    wall = runs.columns["wall_clock"]
+    frames = runs.columns["total_frames"]
+    # Shift each run past the previous one so one searchsorted() serves all
+    stride = (wall.max() - wall.min() + window + 1.0) if len(wall) else 1.0
+    key = wall + runs.run * stride
+    j = np.searchsorted(key, key - window, side="left")
+    # Samples further apart than the window fall back to the previous one
+    j = np.maximum(np.minimum(j, np.arange(len(key)) - 1), runs.first[runs.run])
+    return _div(frames - frames[j], wall - wall[j])
+
+
+def stall_durations(runs):
+    """(run, seconds) of every stall, from the growth of total_stall_time
+    between consecutive increments of stall_count"""
+    count = runs.columns["stall_count"]
+    total = runs.columns["total_stall_time"]
+    # Group consecutive samples with the same run and stall count
+    starts = np.flatnonzero(np.concatenate(([True], (np.diff(count) != 0)
+                                            | (np.diff(runs.run) != 0))))
+    ends = np.concatenate((starts[1:], [len(count)])) - 1
+    g_run, g_count, g_total = runs.run[starts], count[starts], total[ends]
+    new_run = np.concatenate(([True], g_run[1:] != g_run[:-1]))
+    before = np.where(new_run, 0.0, np.concatenate(([0.0], g_total[:-1])))
+    stalled = g_count > np.where(new_run, 0, np.concatenate(([0], g_count[:-1])))
+    return g_run[stalled], (g_total - before)[stalled]
+
+
+def compute(runs, window=2.0, switch_penalty=1.0, stall_penalty=4.3,
+            startup_penalty=4.3):
+    """Return a dict of per-run metric arrays named as METRIC_FIELDS"""
+    n = len(runs)
+    c = runs.columns
+    rid = runs.run
+    play = c["playback_time"]
+    wall = c["wall_clock"]
+    bitrate = c["bitrate_kbps"]
+    m = {"samples": runs.lengths.astype(np.float64)}
+
+    m["playback_time"] = np.maximum.reduceat(play, runs.first) if n else np.zeros(0)
+
+    # Startup: the first sample showing progress, less the progress made
+    started = np.flatnonzero(play > 0)
+    first = np.full(n, -1)
+    first[rid[started][::-1]] = started[::-1]
+    m["startup_delay"] = np.where(first >= 0,
+                                  np.maximum(wall[first] - play[first], 0.0), np.nan)
+
+    # Each playback interval is credited to the bitrate reported before it
+    dt = np.maximum(play - _prev(runs, play), 0.0)
+    prev_rate = _prev(runs, bitrate)
+    rated = prev_rate > 0
+    lowest = np.full(n, np.inf)
+    np.minimum.at(lowest, rid[bitrate > 0], bitrate[bitrate > 0])
+    played = _per_run(rid, dt * rated, n)
+    m["bitrate_kbps"] = _div(_per_run(rid, dt * prev_rate, n), played)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        utility = np.where(rated, np.log(prev_rate / lowest[rid]), 0.0)
+    m["log_utility"] = _div(_per_run(rid, dt * utility, n), played)
+
+    change = np.abs(bitrate - prev_rate) * (rated & (bitrate > 0))
+    m["bitrate_changes"] = _per_run(rid, change > 0, n)
+    m["mean_change_kbps"] = _div(_per_run(rid, change, n), m["bitrate_changes"])
+
+    sw_run = np.repeat(np.arange(n), np.diff(runs.sw_offsets))
+    levels = np.abs(runs.switches[:, 1] - runs.switches[:, 0])
+    m["switches"] = np.bincount(sw_run, minlength=n).astype(np.float64)
+    m["switches_per_min"] = _div(m["switches"] * 60.0, m["playback_time"])
+    m["mean_switch_levels"] = _div(_per_run(sw_run, levels, n), m["switches"])
+    m["max_switch_levels"] = np.zeros(n)
+    np.maximum.at(m["max_switch_levels"], sw_run, levels)
+
+    s_run, s_dur = stall_durations(runs)
+    m["stall_count"] = c["stall_count"][runs.last]
+    m["total_stall_time"] = c["total_stall_time"][runs.last]
+    m["stall_p50"] = _percentile(s_run, s_dur, n, 50)
+    m["stall_p90"] = _percentile(s_run, s_dur, n, 90)
+    m["stall_max"] = _percentile(s_run, s_dur, n, 100)
+    m["rebuffer_rate"] = _div(m["total_stall_time"], m["playback_time"])
+
+    fps = windowed_fps(runs, window)
+    playing = (dt > 0) & (wall - wall[runs.first[rid]] >= window)
+    m["fps_mean"] = _div(c["total_frames"][runs.last], m["playback_time"])
+    m["fps_p5"] = _percentile(rid[playing], fps[playing], n, 5)
+    m["frame_drop_pct"] = _div(c["dropped_frames"][runs.last] * 100.0,
+                               c["total_frames"][runs.last])
+
+    m["qoe"] = _div(_per_run(rid, dt * prev_rate, n) / 1000.0
+                    - switch_penalty * _per_run(rid, change, n) / 1000.0
+                    - stall_penalty * m["total_stall_time"]
+                    - startup_penalty * np.nan_to_num(m["startup_delay"]),
+                    m["playback_time"])
+    return m
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute QoE metrics over whole runs')
+    parser.add_argument('runs', nargs='+',
+                        help='qoe_metrics_*.qoe/.csv files or directories holding them')
+    parser.add_argument('--window', type=float, default=2.0,
+                        help='Sliding window for fps in seconds (default: 2)')
+    parser.add_argument('--switch-penalty', type=float, default=1.0,
+                        help='QoE cost per Mbps of bitrate change (default: 1)')
+    parser.add_argument('--stall-penalty', type=float, default=4.3,
+                        help='QoE cost per second of rebuffering (default: 4.3)')
+    parser.add_argument('--startup-penalty', type=float, default=4.3,
+                        help='QoE cost per second of startup delay (default: 4.3)')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    runs = load(find_runs(args.runs))
+    t1 = time.time()
+    metrics = compute(runs, args.window, args.switch_penalty, args.stall_penalty,
+                      args.startup_penalty)
+    t2 = time.time()
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("run",) + METRIC_FIELDS)
+    for i, name in enumerate(runs.names):
+        writer.writerow([name] + ["" if metrics[f][i] != metrics[f][i]
+                                  else round(float(metrics[f][i]), 4)
+                                  for f in METRIC_FIELDS])
+    print(f"✔ {len(runs)} runs, {len(runs.run)} samples: loaded in "
+          f"{(t1 - t0) * 1000:.0f} ms, analysed in {(t2 - t1) * 1000:.0f} ms",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
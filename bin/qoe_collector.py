@@ -0,0 +1,345 @@
+"""
+qoe_collector.py -- event-driven QoE sampling inside the page
+
+The collector hooks the <video> element and dash.js events and appends
+samples into a fixed-size ring buffer in the page.  The Python side drains
+the buffer with a single execute_script() call per interval instead of
+polling each metric with its own WebDriver round trip.
+
+StartupTimer replaces fixed sleeps before and after starting the player:
+it records when the media element reaches loadedmetadata, canplay, its
+first playing event and its first presented frame, and lets the caller
+block on any of them with one asynchronous script instead of polling.
+
+Samples hold raw counters and timestamps only; rates such as fps and
+the rebuffer rate are left to qoe_analysis.py.  All timestamps are taken
+in the browser (performance.timeOrigin + event.timeStamp), in
+milliseconds since the epoch.  For live streams, each sample also
+carries the player's latency to the live edge in seconds (liveLatency;
+null for on-demand streams).
+
+Quality switches are logged to window.__quality_switches with the index,
+id and bitrate of the old and new Representation, as reported by the
+dash.js 5 QUALITY_CHANGE_RENDERED event.
+"""
+
+COLLECTOR_JS = """
+(() => {
+  const v = arguments[0], capacity = arguments[1], sampleMs = arguments[2];
+  if (window.__qoe) return;
+
+  const now = (ev) => performance.timeOrigin +
+                      (ev && ev.timeStamp ? ev.timeStamp : performance.now());
+  const qoe = window.__qoe = {
+    ring: new Array(capacity), capacity: capacity, head: 0, tail: 0,
+    dropped: 0, lastSampleTs: 0, started: false,
+    stallStart: null, stallCount: 0, stallMs: 0, switchCount: 0, bitrate: 0
+  };
+  window.__quality_switches = window.__quality_switches || [];
+
+  const push = (rec) => {
+    if (qoe.head - qoe.tail >= qoe.capacity) { ++qoe.tail; ++qoe.dropped; }
+    qoe.ring[qoe.head++ % qoe.capacity] = rec;
+  };
+
+  const player = window.__dash_player;
+  const liveLatency = () => {
+    try {
+      if (!player || !player.isDynamic()) return null;
+      const latency = player.getCurrentLiveLatency();
+      return Number.isFinite(latency) ? latency : null;
+    } catch (e) {
+      return null;    /* Not initialized yet */
+    }
+  };
+
+  const sample = (ts, kind) => {
+    const q = v.getVideoPlaybackQuality();
+    const stallMs = qoe.stallMs + (qoe.stallStart !== null ? ts - qoe.stallStart : 0);
+    push({
+      kind:         kind,
+      ts:           ts,
+      currentTime:  v.currentTime,
+      buffered:     v.buffered.length ? v.buffered.end(v.buffered.length-1) : 0,
+      rate:         v.playbackRate,
+      bitrate:      qoe.bitrate,
+      switches:     qoe.switchCount,
+      dropped:      q.droppedVideoFrames,
+      total:        q.totalVideoFrames,
+      width:        v.videoWidth,
+      height:       v.videoHeight,
+      readyState:   v.readyState,
+      stallCount:   qoe.stallCount,
+      stallMs:      stallMs,
+      liveLatency:  liveLatency(),
+      ended:        v.ended
+    });
+    qoe.lastSampleTs = ts;
+  };
+
+  v.addEventListener('timeupdate', (e) => {
+    const ts = now(e);
+    if (ts - qoe.lastSampleTs >= sampleMs) sample(ts, 'timeupdate');
+  });
+  v.addEventListener('waiting', (e) => {
+    /* Only a stall once playback has started: initial buffering is
+     * startup delay, not rebuffering.
+     */
+    if (qoe.started && qoe.stallStart === null && !v.seeking) {
+      qoe.stallStart = now(e);
+      ++qoe.stallCount;
+      sample(qoe.stallStart, 'stall_start');
+    }
+  });
+  v.addEventListener('playing', (e) => {
+    const ts = now(e);
+    qoe.started = true;
+    if (qoe.stallStart !== null) {
+      qoe.stallMs += ts - qoe.stallStart;
+      qoe.stallStart = null;
+      sample(ts, 'stall_end');
+    }
+  });
+  v.addEventListener('ended', (e) => sample(now(e), 'ended'));
+
+  /* timeupdate does not fire while stalled; keep sampling on a timer. */
+  setInterval(() => {
+    const ts = now();
+    if (ts - qoe.lastSampleTs >= sampleMs) sample(ts, 'timer');
+  }, sampleMs);
+
+  if (player && typeof player.on === 'function') {
+    /* dash.js 5 reports Representations rather than quality indices */
+    const kbps = (r) => r.bitrateInKbit || Math.round((r.bandwidth || 0) / 1000);
+    const updateBitrate = () => {
+      try {
+        const r = player.getCurrentRepresentationForType('video');
+        if (r) qoe.bitrate = kbps(r);
+      } catch (e) {
+        /* No stream yet; the first QUALITY_CHANGE_RENDERED sets it */
+      }
+    };
+    player.on(dashjs.MediaPlayer.events.QUALITY_CHANGE_RENDERED, (e) => {
+      if (e.mediaType && e.mediaType !== 'video') return;
+      const o = e.oldRepresentation, n = e.newRepresentation;
+      ++qoe.switchCount;
+      if (n) qoe.bitrate = kbps(n);
+      else updateBitrate();
+      window.__quality_switches.push({
+        timestamp:      now(),
+        oldIndex:       o ? o.index : null,
+        newIndex:       n ? n.index : null,
+        oldId:          o ? o.id : null,
+        newId:          n ? n.id : null,
+        oldBitrateKbps: o ? kbps(o) : null,
+        newBitrateKbps: n ? kbps(n) : null
+      });
+    });
+    updateBitrate();
+  }
+})();
+"""
+
+DRAIN_JS = """
+const qoe = window.__qoe;
+if (!qoe) return null;
+const out = [];
+for (; qoe.tail < qoe.head; ++qoe.tail) {
+  out.push(qoe.ring[qoe.tail % qoe.capacity]);
+  qoe.ring[qoe.tail % qoe.capacity] = undefined;
+}
+const dropped = qoe.dropped;
+qoe.dropped = 0;
+return {records: out, dropped: dropped};
+"""
+
+
+class QoECollector:
+    """Installs the in-page collector and drains it in batches"""
+
+    def __init__(self, driver, video, capacity=4096, sample_ms=250):
+        self.driver = driver
+        self.video = video
+        self.capacity = capacity
+        self.sample_ms = sample_ms
+        self.dropped = 0
+        self.last = None
+
+    def install(self):
+        """Hook video and dash.js events; call after the player is created"""
+        self.driver.execute_script(COLLECTOR_JS, self.video, self.capacity,
+                                   self.sample_ms)
+
+    def drain(self):
+        """Return records collected since the previous drain, oldest first"""
+        batch = self.driver.execute_script(DRAIN_JS)
+        if not batch:
+            return []
+        self.dropped += batch["dropped"]
+        records = batch["records"]
+        if records:
+            self.last = records[-1]
+        return records
+
+
+# Append-only event logs with sequence numbers.  window[name].push(ev)
+# stamps ev.seq; drains return only events after the caller's cursor and
+# drop those the caller has acknowledged, so a poll costs O(new events).
+EVENT_LOG_JS = """
+window.__make_event_log = window.__make_event_log || (() => ({
+  seq: 0, items: [],
+  push(ev) { ev.seq = ++this.seq; this.items.push(ev); return this.seq; }
+}));
+"""
+
+DRAIN_LOGS_JS = """
+const cursors = arguments[0], out = {};
+for (const name in cursors) {
+  const log = window[name];
+  if (!log || !log.items) { out[name] = []; continue; }
+  let acked = 0;
+  while (acked < log.items.length && log.items[acked].seq <= cursors[name])
+    ++acked;
+  if (acked) log.items.splice(0, acked);
+  out[name] = log.items;
+}
+return out;
+"""
+
+
+class EventLogDrain:
+    """Cursor-based drain of several in-page event logs in one round trip
+
+    An event is dropped from the page only on the poll after it was
+    returned, so a failed WebDriver call loses nothing.
+    """
+
+    def __init__(self, driver, names):
+        self.driver = driver
+        self.cursors = {name: 0 for name in names}
+
+    def install(self):
+        """Define window.__make_event_log(); run before creating the logs"""
+        self.driver.execute_script(EVENT_LOG_JS)
+
+    def drain(self):
+        """Return {name: [new events]} since the previous drain"""
+        out = self.driver.execute_script(DRAIN_LOGS_JS, self.cursors)
+        for name, events in out.items():
+            if events:
+                self.cursors[name] = events[-1]["seq"]
+        return out
+
+
+# Startup milestones of the media element, in page milliseconds since the
+# epoch.  Install right before player.initialize() so that no event of
+# the new source is missed; "init" is the install time.
+STARTUP_JS = """
+(() => {
+  const v = arguments[0];
+  const stamp = (ts) => performance.timeOrigin + (ts === undefined ? performance.now() : ts);
+  const t = window.__startup = {init: stamp(), waiters: {}};
+  const mark = (name, ts) => {
+    if (t[name] !== undefined) return;
+    t[name] = ts;
+    for (const done of t.waiters[name] || []) done(ts);
+    delete t.waiters[name];
+  };
+  for (const name of ['loadedmetadata', 'canplay', 'playing'])
+    v.addEventListener(name, (e) => mark(name, stamp(e.timeStamp)), {once: true});
+  if (v.requestVideoFrameCallback)
+    v.requestVideoFrameCallback((now, meta) =>
+      mark('first_frame', stamp(meta.presentationTime || now)));
+  else
+    v.addEventListener('playing', (e) => mark('first_frame', stamp(e.timeStamp)),
+                       {once: true});
+})();
+"""
+
+# Resolves with the milestone's timestamp as soon as it is reached, or
+# with null after the timeout
+WAIT_STARTUP_JS = """
+const name = arguments[0], timeoutMs = arguments[1];
+const done = arguments[arguments.length - 1];
+const t = window.__startup;
+if (!t) return done(null);
+if (t[name] !== undefined) return done(t[name]);
+(t.waiters[name] = t.waiters[name] || []).push(done);
+setTimeout(() => done(null), timeoutMs);
+"""
+
+NAV_TIMING_JS = """
+const n = performance.getEntriesByType('navigation')[0];
+return {
+  time_origin:    performance.timeOrigin,
+  response_start: n ? n.responseStart : null,
+  load_end:       n ? n.loadEventEnd : null,
+  protocol:       n ? n.nextHopProtocol : null,
+  startup:        window.__startup || null
+};
+"""
+
+# Loads a script unless `global' is already defined; resolves when done
+LOAD_SCRIPT_JS = """
+const src = arguments[0], global = arguments[1];
+const done = arguments[arguments.length - 1];
+if (window[global]) return done(true);
+const s = document.createElement('script');
+s.src = src;
+s.onload = () => done(!!window[global]);
+s.onerror = () => done(false);
+document.head.appendChild(s);
+"""
+
+
+def load_script(driver, src, global_name):
+    """Inject a script and block until it has loaded; False on failure"""
+    return driver.execute_async_script(LOAD_SCRIPT_JS, src, global_name)
+
+
+class StartupTimer:
+    """Startup milestones of one playback, driven by media events"""
+
+    STAGES = ("loadedmetadata", "canplay", "playing", "first_frame")
+
+    def __init__(self, driver, video):
+        self.driver = driver
+        self.video = video
+
+    def install(self):
+        """Start listening; call right before the player is initialized"""
+        self.driver.execute_script(STARTUP_JS, self.video)
+
+    def wait(self, stage="playing", timeout=60.0):
+        """Block until stage is reached; returns its timestamp or None"""
+        return self.driver.execute_async_script(WAIT_STARTUP_JS, stage,
+                                                int(timeout * 1000))
+
+    def timings(self):
+        """Navigation and startup times in milliseconds
+
+        page_* are relative to the start of navigation, the player
+        milestones to the call to player.initialize().  None where a
+        milestone was not reached.
+        """
+        nav = self.driver.execute_script(NAV_TIMING_JS)
+        startup = nav["startup"] or {}
+
+        def since(stage, origin):
+            ts = startup.get(stage)
+            return None if ts is None or origin is None else round(ts - origin, 1)
+
+        def r(value):
+            return None if value is None else round(value, 1)
+
+        init = startup.get("init")
+        return {
+            "page_protocol":          nav["protocol"],
+            "page_response_ms":       r(nav["response_start"]),
+            "page_load_ms":           r(nav["load_end"]),
+            "loadedmetadata_ms":      since("loadedmetadata", init),
+            "canplay_ms":             since("canplay", init),
+            "first_playing_ms":       since("playing", init),
+            "time_to_first_frame_ms": since("first_frame", init),
+            "first_frame_since_nav_ms": since("first_frame", nav["time_origin"]),
+        }
@@ -0,0 +1,98 @@
+"""
+qoe_recorder.py -- stream MediaRecorder output to disk during playback
+
+The page keeps only the chunks produced since the last drain.  Every few
+seconds the Python side pulls them as one base64 string and appends them
+to the .webm file, so browser memory and the size of each WebDriver
+response stay bounded by the drain period, not by the video length.
+"""
+import base64
+import time
+
+# Returns when recording started, in page milliseconds since the epoch
+START_JS = """
+return ((v, timesliceMs) => {
+  v.muted = true;
+  v.play();
+  if (window.__rec) return window.__rec.startTs;
+
+  const stream = v.captureStream();
+  const rec = new MediaRecorder(stream, { mimeType: 'video/webm;codecs=vp9' });
+  window.__rec = { recorder: rec, pending: [], stopped: null };
+  rec.ondataavailable = e => { if (e.data.size) window.__rec.pending.push(e.data); };
+  window.__rec.stopped = new Promise(resolve => { rec.onstop = resolve; });
+  rec.start(timesliceMs);
+  return window.__rec.startTs = performance.timeOrigin + performance.now();
+})(arguments[0], arguments[1]);
+"""
+
+# Resolves with the base64 of all pending chunks (or null) and forgets them
+DRAIN_JS = """
+const done = arguments[arguments.length - 1];
+const r = window.__rec;
+if (!r || !r.pending.length) { done(null); return; }
+const blob = new Blob(r.pending, {type: 'video/webm'});
+r.pending = [];
+const fr = new FileReader();
+fr.onloadend = () => done(fr.result ? fr.result.slice(fr.result.indexOf(',') + 1) : null);
+fr.readAsDataURL(blob);
+"""
+
+STOP_JS = """
+const done = arguments[arguments.length - 1];
+const r = window.__rec;
+if (!r || r.recorder.state === 'inactive') { done(false); return; }
+r.recorder.stop();      /* emits the final dataavailable, then stop */
+r.stopped.then(() => done(true));
+setTimeout(() => done(false), 5000);
+"""
+
+
+class StreamingRecorder:
+    """Records the <video> element and appends chunks to path as they arrive"""
+
+    def __init__(self, driver, video, path, drain_every=5.0, timeslice_ms=1000):
+        self.driver = driver
+        self.video = video
+        self.path = path
+        self.drain_every = drain_every
+        self.timeslice_ms = timeslice_ms
+        self.file = None
+        self.nbytes = 0
+        self.last_drain = 0.0
+        self.start_ts = None    # Epoch seconds of time 0 in the recording
+
+    def start(self):
+        self.file = open(self.path, "wb")
+        start_ms = self.driver.execute_script(START_JS, self.video, self.timeslice_ms)
+        self.start_ts = start_ms / 1000.0 if start_ms else None
+        self.last_drain = time.time()
+
+    def drain(self):
+        """Append whatever the page has buffered; returns bytes written"""
+        self.last_drain = time.time()
+        b64 = self.driver.execute_async_script(DRAIN_JS)
+        if not b64:
+            return 0
+        data = base64.b64decode(b64)
+        self.file.write(data)
+        self.file.flush()
+        self.nbytes += len(data)
+        return len(data)
+
+    def maybe_drain(self):
+        """Drain if drain_every seconds have passed since the last drain"""
+        if time.time() - self.last_drain >= self.drain_every:
+            self.drain()
+
+    def stop(self):
+        """Stop recording, write the final chunks and close the file"""
+        if not self.file:
+            return 0
+        try:
+            self.driver.execute_async_script(STOP_JS)
+            self.drain()
+        finally:
+            self.file.close()
+            self.file = None
+        return self.nbytes
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+qoe_runner.py -- run many QoE sessions in parallel headless Chrome instances
+
+Builds a matrix of protocol x ABR rule set x repetition, runs it on a
+thread pool and reuses Chrome sessions between the runs of one protocol
+and rule set, so that browser startup is paid once per worker and arm
+rather than once per run.  Every run gets
+its own output directory; a merged summary.csv is written at the end.
+
+Example:
+    ./qoe_runner.py -j 8 --protocols tcp quic --rules bolaRule \
+                    --rules throughputRule --repeat 25 --outdir results
+"""
+import argparse
+import csv
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from selenium.common.exceptions import WebDriverException
+
+from watch_and_save import (DEFAULT_ABR_RULES, DEFAULT_SERVER, create_driver,
+                            get_target_url, run_session)
+
+
+class DriverPool:
+    """Idle Chrome sessions, kept per arm of the experiment
+
+    A browser carries warm QUIC and TCP connections, TLS session tickets
+    for 0-RTT and Alt-Svc entries from one run to the next, and CDP cannot
+    clear them.  Sessions are therefore only reused within one arm: the
+    protocol, whose flags differ anyway, plus whatever the caller passes
+    as arm.  Idle sessions of other arms are quit when a new one has to be
+    started, which keeps the number of browsers to about the number of
+    workers.
+    """
+
+    def __init__(self, chromedriver=None, server=DEFAULT_SERVER):
+        self.chromedriver = chromedriver
+        self.server = server
+        self.idle = {}
+        self.all = []
+        self.lock = threading.Lock()
+
+    def acquire(self, protocol, arm=None):
+        """Return an idle session of this arm or a new one; see reset()"""
+        key = (protocol, arm)
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop()
+            stale = [driver for k in list(self.idle) if k != key
+                     for driver in self.idle.pop(k)]
+        for driver in stale:
+            self.discard(driver)
+        return self.create(protocol)
+
+    def create(self, protocol):
+        driver = create_driver(protocol, self.chromedriver, self.server)
+        with self.lock:
+            self.all.append(driver)
+        return driver
+
+    def reset(self, protocol, driver):
+        """Clear what the previous run left in the session's profile
+
+        Returns driver, or a new session if driver cannot be reset.
+        """
+        origin = urlsplit(get_target_url(protocol, self.server))
+        try:
+            # Stop the previous player before touching its data
+            driver.get("about:blank")
+            # Do not let cached segments from the previous run skew this one
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                "origin": f"{origin.scheme}://{origin.netloc}",
+                "storageTypes": "all",
+            })
+        except WebDriverException:
+            self.discard(driver)
+            return self.create(protocol)
+        return driver
+
+    def release(self, protocol, driver, arm=None):
+        with self.lock:
+            self.idle.setdefault((protocol, arm), []).append(driver)
+
+    def discard(self, driver):
+        with self.lock:
+            if driver not in self.all:
+                return
+            self.all.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            drivers, self.all = self.all, []
+            self.idle = {}
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+def build_matrix(protocols, rule_sets, repeat):
+    """Return the list of (protocol, rules, run number) to execute"""
+    return [(protocol, rules, n)
+            for protocol, rules, n in itertools.product(protocols, rule_sets,
+                                                        range(repeat))]
+
+
+def run_one(pool, outdir, protocol, rules, n, interval, sample_ms, fmt):
+    tag = f"{protocol}-{'+'.join(rules)}-{n}"
+    run_dir = os.path.join(outdir, tag)
+    driver = pool.acquire(protocol, rules)
+    try:
+        driver = pool.reset(protocol, driver)
+        summary = run_session(driver, protocol, run_dir, abr_rules=rules,
+                              interval=interval, sample_ms=sample_ms, tag=tag,
+                              fmt=fmt, server=pool.server)
+    except Exception as e:
+        # A session that failed mid-run is not trusted for reuse
+        pool.discard(driver)
+        return {"protocol": protocol, "abr_rules": "+".join(rules),
+                "outdir": run_dir, "run": n, "status": f"error: {e}"}
+    pool.release(protocol, driver, rules)
+    summary.update(run=n, status="ok")
+    return summary
+
+
+def write_summary(path, rows):
+    fields = []
+    for row in rows:
+        fields.extend(k for k in row if k not in fields)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a matrix of QoE sessions in parallel')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of concurrent Chrome sessions (default: CPU count)')
+    parser.add_argument('--protocols', nargs='+', choices=['tcp', 'quic'],
+                        default=['tcp', 'quic'], help='Protocols to run (default: tcp quic)')
+    parser.add_argument('--rules', action='append', default=None,
+                        help='Comma-separated dash.js ABR rules enabled in one rule set; '
+                             'repeat to add rule sets (default: bolaRule)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Runs per protocol and rule set (default: 1)')
+    parser.add_argument('--outdir', default='results',
+                        help='Root output directory (default: results)')
+    parser.add_argument('--chromedriver', default=None,
+                        help='Path to chromedriver (default: let Selenium find it)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Seconds between collector drains (default: 1.0)')
+    parser.add_argument('--sample-ms', type=int, default=250,
+                        help='In-page sampling period in milliseconds (default: 250)')
+    parser.add_argument('--format', choices=['csv', 'qoe'], default='csv',
+                        help='Per-run QoE metrics format (default: csv)')
+    parser.add_argument('--server', default=DEFAULT_SERVER,
+                        help=f'Server address; 127.0.0.1 for a local netshaper.py (default: {DEFAULT_SERVER})')
+    args = parser.parse_args()
+
+    rule_sets = [tuple(r for r in spec.split(",") if r) for spec in args.rules] \
+                if args.rules else [DEFAULT_ABR_RULES]
+    matrix = build_matrix(args.protocols, rule_sets, args.repeat)
+    os.makedirs(args.outdir, exist_ok=True)
+    print(f"Running {len(matrix)} sessions, {args.jobs} at a time...")
+
+    pool = DriverPool(args.chromedriver, args.server)
+    rows = []
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(run_one, pool, args.outdir, protocol,
+                                       rules, n, args.interval, args.sample_ms,
+                                       args.format)
+                       for protocol, rules, n in matrix]
+            for future in as_completed(futures):
+                row = future.result()
+                rows.append(row)
+                print(f"✔ {len(rows)}/{len(matrix)} {row['outdir']}: {row['status']}")
+    finally:
+        pool.close()
+        rows.sort(key=lambda r: (r["protocol"], r["abr_rules"], r["run"]))
+        write_summary(os.path.join(args.outdir, "summary.csv"), rows)
+
+    print(f"🗒  {len(rows)} runs in {time.time() - start:.0f}s, "
+          f"summary written to {os.path.join(args.outdir, 'summary.csv')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+qoe_sink.py -- pluggable output for QoE samples
+
+Two sinks share one interface (write, flush, close):
+
+  CsvSink     The familiar qoe_metrics_*.csv text format.
+  FramedSink  A compact append-only binary format (*.qoe).  Samples are
+              stored as fixed-width little-endian records with typed
+              columns; resolution is split into width and height.
+
+FramedSink layout:
+
+    "QOE1" | u32 schema length | schema (JSON) | frame | frame | ...
+
+    frame:  u32 payload length | u32 CRC-32 of payload | payload
+
+Each frame holds a batch of records and is written with a single write()
+followed by a flush, so a run that is killed loses at most the batch in
+flight.  The loader stops at the first short or corrupt frame.
+
+Usage:
+    ./qoe_sink.py run.qoe > run.csv     # convert a binary run to CSV
+"""
+import csv
+import json
+import struct
+import sys
+import zlib
+
+# Column name -> struct format code.  Order is the on-disk order.
+QOE_FIELDS = {
+    "wall_clock":           "d",
+    "playback_time":        "d",
+    "buffered":             "f",
+    "playback_rate":        "f",
+    "bitrate_kbps":         "I",
+    "quality_switch_count": "I",
+    "dropped_frames":       "I",
+    "total_frames":         "I",
+    "fps":                  "f",
+    "width":                "H",
+    "height":               "H",
+    "stall_count":          "I",
+    "total_stall_time":     "d",
+    "rebuffer_rate":        "f",
+}
+
+# Cumulative rates, stored so that a run can be read at a glance.  They are
+# not raw counters: writers compute them with derived_rates(), and
+# qoe_analysis.py derives its own from total_frames, total_stall_time and
+# playback_time, so runs stored with RAW_FIELDS only load as well.
+DERIVED_FIELDS = ("fps", "rebuffer_rate")
+RAW_FIELDS = tuple(f for f in QOE_FIELDS if f not in DERIVED_FIELDS)
+
+# CSV precision; other float columns are rounded to two digits
+CSV_DIGITS = {"rebuffer_rate": 4}
+
+MAGIC = b"QOE1"
+FRAME_HDR = struct.Struct("<II")
+
+
+class CsvSink:
+    """Writes samples as CSV, flushing one batch at a time"""
+
+    def __init__(self, path, fields=tuple(QOE_FIELDS)):
+        self.fields = tuple(fields)
+        self.file = open(path, "w", newline="")
+        self.writer = csv.writer(self.file)
+        # Keep the historical single "resolution" column in text output
+        self.res_idx = (self.fields.index("width")
+                        if "width" in self.fields and "height" in self.fields
+                        else None)
+        header = [f for f in self.fields if f != "height" or self.res_idx is None]
+        if self.res_idx is not None:
+            header[self.res_idx] = "resolution"
+        self.writer.writerow(header)
+        self.floats = [(i, CSV_DIGITS.get(f, 2)) for i, f in enumerate(self.fields)
+                       if QOE_FIELDS[f] in "fd"]
+
+    def write(self, row):
+        row = list(row)
+        for i, digits in self.floats:
+            row[i] = round(row[i], digits)
+        if self.res_idx is not None:
+            h = self.fields.index("height")
+            row[self.res_idx] = f"{row[self.res_idx]}x{row[h]}"
+            del row[h]
+        self.writer.writerow(row)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FramedSink:
+    """Appends samples to a binary .qoe file in CRC-protected frames"""
+
+    def __init__(self, path, fields=tuple(QOE_FIELDS), batch_size=64):
+        self.fields = tuple(fields)
+        self.record = struct.Struct("<" + "".join(QOE_FIELDS[f] for f in self.fields))
+        self.batch_size = batch_size
+        self.pending = []
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            schema = json.dumps({"fields": [[f, QOE_FIELDS[f]] for f in self.fields]})
+            schema = schema.encode()
+            self.file.write(MAGIC + struct.pack("<I", len(schema)) + schema)
+            self.file.flush()
+        elif read_schema(path) != self.fields:
+            self.file.close()
+            raise ValueError(f"{path}: existing file has a different schema")
+
+    def write(self, row):
+        self.pending.append(self.record.pack(*row))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        payload = b"".join(self.pending)
+        self.pending = []
+        self.file.write(FRAME_HDR.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def derived_rates(total_frames, total_stall_time, playback_time):
+    """Return (fps, rebuffer_rate) of a sample, both over playback_time"""
+    if playback_time <= 0:
+        return 0.0, 0.0
+    return total_frames / playback_time, total_stall_time / playback_time
+
+
+def open_sink(path, fields=tuple(QOE_FIELDS)):
+    """Pick the sink from the file extension: .qoe is binary, anything else CSV"""
+    if path.endswith(".qoe"):
+        return FramedSink(path, fields)
+    return CsvSink(path, fields)
+
+
+def _parse_header(buf, path):
+    if buf[:4] != MAGIC:
+        raise ValueError(f"{path}: not a QoE file")
+    (schema_len,) = struct.unpack_from("<I", buf, 4)
+    schema = json.loads(bytes(buf[8:8 + schema_len]))
+    return schema["fields"], 8 + schema_len
+
+
+def read_schema(path):
+    """Return the column names stored in a .qoe file"""
+    with open(path, "rb") as f:
+        fields, _ = _parse_header(f.read(64 * 1024), path)
+    return tuple(name for name, _ in fields)
+
+
+def load_run(path):
+    """Load one .qoe file into a dict of NumPy arrays, one per column"""
+    import numpy as np
+
+    with open(path, "rb") as f:
+        buf = memoryview(f.read())
+    fields, off = _parse_header(buf, path)
+    dtype = np.dtype([(name, "<" + code) for name, code in fields])
+
+    payloads = []
+    while off + FRAME_HDR.size <= len(buf):
+        size, crc = FRAME_HDR.unpack_from(buf, off)
+        payload = buf[off + FRAME_HDR.size:off + FRAME_HDR.size + size]
+        if len(payload) < size or zlib.crc32(payload) != crc \
+                                        or size % dtype.itemsize:
+            break       # Torn write at the end of a killed run
+        payloads.append(payload)
+        off += FRAME_HDR.size + size
+
+    records = np.frombuffer(b"".join(payloads), dtype=dtype)
+    return {name: records[name] for name in dtype.names}
+
+
+def load_runs(paths):
+    """Load many .qoe files into the concatenated columns they all have
+
+    Returns (columns, offsets): samples of run i are in the slice
+    offsets[i]:offsets[i+1] of every column.
+    """
+    import numpy as np
+
+    runs = [load_run(p) for p in paths]
+    if not runs:
+        return {}, np.zeros(1, dtype=np.int64)
+    lengths = [len(next(iter(run.values()))) for run in runs]
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    # Runs written with and without the derived columns load together
+    columns = {name: np.concatenate([run[name] for run in runs])
+               for name in runs[0] if all(name in run for run in runs)}
+    return columns, offsets
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} FILE.qoe", file=sys.stderr)
+        sys.exit(1)
+    columns = load_run(sys.argv[1])
+    sink = CsvSink("/dev/stdout", columns)
+    for row in zip(*(col.tolist() for col in columns.values())):
+        sink.write(row)
+    sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
+import json
 import time
-import csv
-import base64
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 
+from fetch_dashjs import DASHJS_PATH
+from qoe_collector import StartupTimer, load_script
+from qoe_recorder import StreamingRecorder
+from qoe_sink import open_sink
+
 chrome_options = Options()
 chrome_options.add_argument("--ignore-certificate-errors")
 chrome_options.add_argument("--ignore-certificate-errors-spki-list=dSiDY7LGoozlpLzHmutdwpKP/y2cfN9oh98uNYpNViI=")
@@ -25,8 +29,7 @@ driver  = webdriver.Chrome(service=service, options=chrome_options)
 
 driver.set_script_timeout(180)
 
-driver.get("https://quic.local:5201/index.html")
-time.sleep(10)                                       
+driver.get("https://quic.local:5201/index.html")   # returns after load
 video = driver.find_element(By.ID, "videoPlayer")
 
 # # get the list of available ABR algorithms & their IDs
@@ -36,15 +39,10 @@ video = driver.find_element(By.ID, "videoPlayer")
 # """)
 # print(abr_settings)
 
-driver.execute_script("""
-   if (!window.dashjs) {
-     const s = document.createElement('script');
-     s.src = 'https://cdn.dashjs.org/latest/dash.all.min.js';
-     s.crossOrigin = 'anonymous';
-     document.head.appendChild(s);
-   }
- """)
-time.sleep(1)  # give dash.js time to load
+if not load_script(driver, DASHJS_PATH, "dashjs"):
+    raise SystemExit(f"cannot load {DASHJS_PATH}")
+startup = StartupTimer(driver, video)
+startup.install()
 
 # (2) Create the player, turn off all rules except BOLA as an example
 driver.execute_script("""
@@ -82,32 +80,20 @@ current_abr = driver.execute_script(
 print("Current ABR config:", current_abr)
 
 
-driver.execute_script("""
-(() => {
-  const v = arguments[0];
-  if (!v) return;
-  v.muted = true; v.play();
-
-  if (window.__recorder_started) return;           
-  window.__recorder_started = true;
-
-  const stream = v.captureStream();
-  const rec    = new MediaRecorder(stream, {mimeType:'video/webm;codecs=vp9'});
-  window.__chunks = [];
-  rec.ondataavailable = e => window.__chunks.push(e.data);
-  rec.start(1000);                                   
-  window.__recorder = rec;
-})();
-""", video)
-
-
-csv_file   = open("qoe_metrics.csv", "w", newline="")
-csv_writer = csv.writer(csv_file)
-csv_writer.writerow([
+# Record the video element; chunks are appended to the file during playback
+recorder = StreamingRecorder(driver, video, "recorded_video.webm")
+recorder.start()
+
+if startup.wait("playing") is None:
+    print("Not playing after 60s, sampling anyway")
+
+
+# Pass qoe_metrics.qoe to write the compact binary format instead
+sink = open_sink("qoe_metrics.csv", fields=(
     "wall_clock", "playback_time", "buffered", "playback_rate",
-    "dropped_frames", "total_frames", "fps", "resolution",
+    "dropped_frames", "total_frames", "fps", "width", "height",
     "stall_count", "total_stall_time", "rebuffer_rate"
-])
+))
 
 stall_count = 0
 total_stall_time = 0
@@ -126,7 +112,8 @@ try:
             dropped:      q.droppedVideoFrames,
             total:        q.totalVideoFrames,
             fps:          (q.totalVideoFrames / (v.currentTime || 1)),
-            res:          `${v.videoWidth}x${v.videoHeight}`,
+            width:        v.videoWidth,
+            height:       v.videoHeight,
             readyState:   v.readyState,
             ended:        v.ended
           };
@@ -149,71 +136,41 @@ try:
               f"rate={qoe['rate']:.2f}  "
               f"fps={qoe['fps']:.1f}  "
               f"drop={frame_drop_pct:.1f}%  "
-              f"res={qoe['res']}  "
+              f"res={qoe['width']}x{qoe['height']}  "
               f"stalls={stall_count}  "
               f"stall_time={total_stall_time:.1f}s")
 
-        # Write CSV
-        csv_writer.writerow([
-            round(time.time() - wall_clock_start, 2),
-            round(qoe["currentTime"], 2),
-            round(qoe["buffered"], 2),
-            round(qoe["rate"], 2),
+        # Write one sample
+        sink.write((
+            time.time() - wall_clock_start,
+            qoe["currentTime"],
+            qoe["buffered"],
+            qoe["rate"],
             qoe["dropped"], qoe["total"],
-            round(qoe["fps"], 2),
-            qoe["res"],
+            qoe["fps"],
+            qoe["width"], qoe["height"],
             stall_count,
-            round(total_stall_time, 2),
-            round(rebuffer_rate, 4)
-        ])
+            total_stall_time,
+            rebuffer_rate
+        ))
+        sink.flush()
 
         # Exit when video finished (or set your own duration trigger)
         if qoe["ended"]:
             print("\nVideo ended – finishing up…")
             break
 
+        recorder.maybe_drain()
         time.sleep(1)
 
 finally:
-    csv_file.close()
-
-    data_url = driver.execute_async_script("""
-    const done = arguments[0];
-
-    // Graceful fallbacks
-    if (!window.__recorder)              { done(null); return; }
-    if (window.__video_data_url)         { done(window.__video_data_url); return; }
-
-    // Helper: turn the chunks we have into a data-URL and resolve
-    const finish = () => {
-        try {
-            const blob   = new Blob(window.__chunks || [], {type:'video/webm'});
-            if (!blob.size) { done(null); return; }          // nothing captured
-            const fr = new FileReader();
-            fr.onloadend = () => { window.__video_data_url = fr.result; done(fr.result); };
-            fr.readAsDataURL(blob);
-        } catch(e) { done(null); }
-    };
-
-    // If already inactive, just finish
-    if (window.__recorder.state === 'inactive') { finish(); return; }
-
-    // Otherwise stop → flush → finish
-    let ended = false;
-    window.__recorder.ondataavailable = e => { window.__chunks.push(e.data); };
-    window.__recorder.onstop          = () => { ended = true; finish(); };
-
-    window.__recorder.requestData();   // force final chunk
-    window.__recorder.stop();
-
-    // Safety valve: after 20 s give up and return null
-    setTimeout(() => { if (!ended) done(null); }, 20000);
-    """)
-
-    if data_url:
-        header, b64 = data_url.split(',', 1)
-        with open("recorded_video.webm", "wb") as f:
-            f.write(base64.b64decode(b64))
+    sink.close()
+
+    if recorder.stop():
         print("recorded_video.webm saved ✔")
 
+    with open("startup.json", "w") as f:
+        json.dump(startup.timings(), f, indent=2)
+    print("startup.json saved ✔")
+
     driver.quit()
\ No newline at end of file
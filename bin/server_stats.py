@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+server_stats.py -- join video_server request records with QoE samples
+
+video_server -R FILE appends one JSON line per finished request:
+
+    {"ts": ms since epoch, "conn": "...", "stream": N, "path": "...",
+     "status": 200, "bytes": N, "complete": true, "ttfb_ms": ...,
+     "duration_ms": ..., "srtt_us": ..., "rttvar_us": ..., "min_rtt_us": ...,
+     "cwnd": ..., "bytes_in_flight": ..., "pacing_rate": ..., "cc": "bbr"}
+
+With -w, the workers append to the same file and each record also has
+"worker": N; records are sorted by end time on loading, so this needs no
+special handling.  Records also carry the request's "class" (manifest,
+init, audio, text, video or other) and the "urgency" and "incremental"
+parameters of the stream's priority when the response finished.  With
+-x, "cc_assigned" is the controller the connection was given; "cc" is the
+one in use, which for the adaptive controller is Cubic or BBR once it has
+picked.
+
+The same file gets a record with "event": "cc_decision" for each closed
+connection on which the adaptive controller picked: "decided_ts" (ms
+since epoch), "cc", "samples", "srtt_us", "rttvar_us", "min_rtt_us",
+"rtt_thresh_us", "bbr_bw" (bytes/s), "cubic_cwnd" and "bbr_cwnd".  Event
+records are not requests and are skipped here.
+
+Each QoE sample is matched with the requests that finished since the
+previous sample (count, bytes, worst TTFB) and with the connection state
+reported by the most recent one.  Sample times are wall_clock plus the
+run's wall_clock_start (see summary.csv); client and server are assumed
+to share a clock, as they do when both run on one host.
+
+Usage:
+    ./server_stats.py requests.jsonl qoe_metrics_quic.csv --start EPOCH > joined.csv
+"""
+import argparse
+import csv
+import json
+import sys
+
+NUMERIC_FIELDS = ("ts", "stream", "status", "bytes", "ttfb_ms", "duration_ms",
+                  "srtt_us", "rttvar_us", "min_rtt_us", "cwnd",
+                  "bytes_in_flight", "pacing_rate")
+TEXT_FIELDS = ("conn", "path", "cc")
+
+JOINED_FIELDS = ("n_requests", "bytes", "max_ttfb_ms", "srtt_ms", "min_rtt_ms",
+                 "cwnd", "pacing_rate", "cc")
+
+
+def load_requests(path):
+    """Load a request log into a dict of NumPy columns, sorted by end time
+
+    Times are converted to epoch seconds; "end" is when the last byte was
+    written.  A torn last line from a killed server is skipped, and so
+    are event records.
+    """
+    import numpy as np
+
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if "event" not in record:
+                records.append(record)
+    cols = {name: np.array([r[name] if r[name] is not None else np.nan
+                            for r in records], dtype=np.float64)
+            for name in NUMERIC_FIELDS}
+    cols.update((name, np.array([r[name] for r in records], dtype=object))
+                for name in TEXT_FIELDS)
+    cols["complete"] = np.array([r["complete"] for r in records], dtype=bool)
+    cols["ts"] /= 1000.0
+    cols["end"] = cols["ts"] + cols["duration_ms"] / 1000.0
+
+    order = np.argsort(cols["end"], kind="stable")
+    return {name: col[order] for name, col in cols.items()}
+
+
+def join(sample_times, requests):
+    """Return a dict of columns aligned with sample_times (epoch seconds)"""
+    import numpy as np
+
+    n = len(sample_times)
+    # Requests finished in (sample_times[i-1], sample_times[i]] belong to i
+    idx = np.searchsorted(requests["end"], sample_times, side="right")
+    lo = np.concatenate(([0], idx[:-1]))[:n]
+    counts = idx - lo
+
+    csum = np.concatenate(([0], np.cumsum(requests["bytes"])))
+    out = {
+        "n_requests":   counts,
+        "bytes":        (csum[idx] - csum[lo]).astype(np.int64),
+        "max_ttfb_ms":  np.full(n, np.nan),
+    }
+    has = counts > 0
+    if has.any():
+        # Non-empty intervals are contiguous, so reduceat can walk them
+        ttfb = np.nan_to_num(requests["ttfb_ms"][:idx[-1]], nan=-np.inf)
+        worst = np.maximum.reduceat(ttfb, lo[has])
+        out["max_ttfb_ms"][has] = np.where(np.isneginf(worst), np.nan, worst)
+
+    # As-of join: connection state reported by the last finished request
+    valid = idx > 0
+    take = np.maximum(idx - 1, 0)
+    if not len(requests["end"]):
+        valid[:] = False
+        requests = {name: np.zeros(1, dtype=col.dtype)
+                    for name, col in requests.items()}
+
+    def asof(name, scale=1.0):
+        return np.where(valid, requests[name][take] * scale, np.nan)
+
+    out["srtt_ms"] = asof("srtt_us", 1e-3)
+    out["min_rtt_ms"] = asof("min_rtt_us", 1e-3)
+    out["cwnd"] = asof("cwnd")
+    out["pacing_rate"] = asof("pacing_rate")
+    out["cc"] = np.where(valid, requests["cc"][take], "")
+    return out
+
+
+def load_qoe(path):
+    """Load QoE samples, .qoe or .csv, as a dict of columns"""
+    import numpy as np
+    from qoe_sink import load_run
+
+    if path.endswith(".qoe"):
+        return load_run(path)
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return {name: np.array([float(r[name]) for r in rows])
+            for name in ("wall_clock", "playback_time")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Join video_server request records with QoE samples')
+    parser.add_argument('requests', help='Request log written by video_server -R')
+    parser.add_argument('qoe', help='qoe_metrics_*.csv or *.qoe file')
+    parser.add_argument('--start', type=float, required=True,
+                        help='Epoch seconds of wall_clock 0 (wall_clock_start in summary.csv)')
+    args = parser.parse_args()
+
+    qoe = load_qoe(args.qoe)
+    requests = load_requests(args.requests)
+    joined = join(args.start + qoe["wall_clock"], requests)
+
+    def r(value):
+        if isinstance(value, str):
+            return value
+        if value != value:
+            return ""
+        value = float(value)
+        return int(value) if value.is_integer() else round(value, 3)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("wall_clock", "playback_time") + JOINED_FIELDS)
+    for i in range(len(qoe["wall_clock"])):
+        writer.writerow([r(qoe["wall_clock"][i]), r(qoe["playback_time"][i])]
+                        + [r(joined[name][i]) for name in JOINED_FIELDS])
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,15 @@
 import time
 import csv
 import base64
-import json
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 
+from cdp_network import CSV_HEADER as SEGMENT_CSV_HEADER, NetworkTracker, csv_row
+from fetch_dashjs import DASHJS_PATH
+from qoe_collector import EventLogDrain
+
 chrome_options = Options()
 # Removed QUIC-specific arguments
 chrome_options.add_argument("--ignore-certificate-errors")
@@ -29,9 +32,18 @@ driver.set_script_timeout(180)
 
 # Changed to localhost HTTP server (adjust URL as needed)
 driver.get("http://45.76.170.255:5201/index.html")
+
+# The pinned dash.js is not in the tree, see fetch_dashjs.py
+if not driver.execute_script("return !!window.dashjs"):
+    driver.quit()
+    raise SystemExit(f"{DASHJS_PATH} did not load: run fetch_dashjs.py on the server")
 time.sleep(10)                                       
 video = driver.find_element(By.ID, "videoPlayer")
 
+# ABR and segment events are kept in cursor-drained logs in the page
+event_logs = EventLogDrain(driver, ("__abr_events", "__segment_downloads"))
+event_logs.install()
+
 # Enhanced JavaScript to capture DASH player events and ABR decisions
 driver.execute_script("""
 (() => {
@@ -51,8 +63,8 @@ driver.execute_script("""
   window.__recorder = rec;
 
   // ABR event tracking
-  window.__abr_events = [];
-  window.__segment_downloads = [];
+  window.__abr_events = window.__make_event_log();
+  window.__segment_downloads = window.__make_event_log();
   window.__last_quality = null;
 
   // Try to detect DASH player (dash.js) - different versions have different APIs
@@ -93,17 +105,19 @@ driver.execute_script("""
       // Listen for quality change events if the API supports it
       if (typeof player.on === 'function') {
         try {
-          // Listen for quality change events
+          // Listen for quality change events; dash.js 5 reports the old
+          // and new Representation rather than quality indices
           player.on('qualityChangeRendered', (e) => {
+            const o = e.oldRepresentation, n = e.newRepresentation;
             const event = {
               timestamp: Date.now(),
               type: 'quality_change',
               mediaType: e.mediaType,
               streamId: e.streamId,
-              oldQuality: e.oldQuality,
-              newQuality: e.newQuality,
-              bitrate: e.newQuality ? e.newQuality.bitrate : null,
-              resolution: e.newQuality ? `${e.newQuality.width}x${e.newQuality.height}` : null
+              oldQuality: o ? o.index : null,
+              newQuality: n ? n.index : null,
+              bitrate: n ? n.bandwidth : null,
+              resolution: n && n.width ? `${n.width}x${n.height}` : null
             };
             window.__abr_events.push(event);
             console.log('ABR Quality Change:', event);
@@ -128,8 +142,8 @@ driver.execute_script("""
               mediaType: e.mediaType,
               url: e.request.url,
               size: e.response.length,
-              quality: e.request.quality,
-              bitrate: e.request.quality ? e.request.quality.bitrate : null,
+              quality: e.request.representation ? e.request.representation.index : null,
+              bitrate: e.request.representation ? e.request.representation.bandwidth : null,
               downloadTime: e.response.requestEndDate - e.response.requestStartDate
             };
             window.__segment_downloads.push(event);
@@ -142,20 +156,23 @@ driver.execute_script("""
       // Get current quality info
       window.__getCurrentQuality = () => {
         try {
-          if (typeof player.getQualityFor === 'function' && 
-              typeof player.getBitrateInfoListFor === 'function') {
-            const videoQuality = player.getQualityFor('video');
-            const audioQuality = player.getQualityFor('audio');
-            const bitrateInfoListFor = player.getBitrateInfoListFor('video');
-            
+          if (typeof player.getCurrentRepresentationForType === 'function' &&
+              typeof player.getRepresentationsByType === 'function') {
+            const video = player.getCurrentRepresentationForType('video');
+            const audio = player.getCurrentRepresentationForType('audio');
+            const available = player.getRepresentationsByType('video') || [];
+
             return {
               video: {
-                currentQuality: videoQuality,
-                availableQualities: bitrateInfoListFor,
-                currentBitrate: bitrateInfoListFor[videoQuality] ? bitrateInfoListFor[videoQuality].bitrate : null
+                currentQuality: video ? video.index : null,
+                availableQualities: available.map((r) => ({
+                  index: r.index, id: r.id, bitrate: r.bandwidth,
+                  width: r.width, height: r.height
+                })),
+                currentBitrate: video ? video.bandwidth : null
               },
               audio: {
-                currentQuality: audioQuality
+                currentQuality: audio ? audio.index : null
               }
             };
           }
@@ -205,46 +222,24 @@ abr_csv_writer.writerow([
 # Additional CSV for segment downloads
 segment_csv_file = open("segment_downloads.csv", "w", newline="")
 segment_csv_writer = csv.writer(segment_csv_file)
-segment_csv_writer.writerow([
-    "timestamp", "wall_clock", "url", "size", "bitrate", "download_time", "media_type"
-])
+segment_csv_writer.writerow(SEGMENT_CSV_HEADER)
+network = NetworkTracker()
 
 stall_count = 0
 total_stall_time = 0
 wall_clock_start = time.time()
-last_processed_abr_events = 0
-last_processed_segments = 0
 
 try:
     while True:
-        # Get network logs for segment downloads
-        logs = driver.get_log('performance')
-        for log in logs:
-            try:
-                message = json.loads(log['message'])
-                if message['message']['method'] == 'Network.responseReceived':
-                    url = message['message']['params']['response']['url']
-                    if '.m4s' in url or '.mp4' in url:
-                        response_data = message['message']['params']['response']
-                        segment_csv_writer.writerow([
-                            log['timestamp'],
-                            round(time.time() - wall_clock_start, 2),
-                            url,
-                            response_data.get('encodedDataLength', 0),
-                            'unknown',  # bitrate not directly available from network logs
-                            'unknown',  # download time calculation would need request start
-                            'video' if 'video' in url else 'audio' if 'audio' in url else 'unknown'
-                        ])
-            except (json.JSONDecodeError, KeyError):
-                continue
-
-        # Get ABR events from JavaScript
-        abr_events = driver.execute_script("return window.__abr_events || [];")
-        segment_downloads = driver.execute_script("return window.__segment_downloads || [];")
+        # Correlate CDP network events into per-segment timings
+        for segment in network.feed(driver.get_log('performance')):
+            segment_csv_writer.writerow(csv_row(segment, wall_clock_start))
+
+        # Get only the ABR events and segments added since the last poll
+        new_events = event_logs.drain()
         
         # Process new ABR events
-        new_abr_events = abr_events[last_processed_abr_events:]
-        for event in new_abr_events:
+        for event in new_events["__abr_events"]:
             abr_csv_writer.writerow([
                 event.get('timestamp', ''),
                 round(time.time() - wall_clock_start, 2),
@@ -264,12 +259,8 @@ try:
                 print(f"🔄 ABR Quality Change: {event.get('resolution', 'unknown')} @ {event.get('bitrate', 'unknown')} bps")
         
         # Process new segment downloads
-        new_segments = segment_downloads[last_processed_segments:]
-        for segment in new_segments:
+        for segment in new_events["__segment_downloads"]:
             print(f"📥 Segment: {segment.get('url', '')[-20:]} | {segment.get('bitrate', 'unknown')} bps | {segment.get('downloadTime', 'unknown')}ms")
-        
-        last_processed_abr_events = len(abr_events)
-        last_processed_segments = len(segment_downloads)
 
         # Regular QoE metrics
         qoe = driver.execute_script("""
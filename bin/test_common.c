@@ -836,6 +836,18 @@ sport_init_server (struct service_port *sport, struct lsquic_engine *engine,
         return -1;
     }
 
+#ifdef SO_REUSEPORT
+    if ((sport->sp_flags & SPORT_REUSEPORT)
+        && setsockopt(sockfd, SOL_SOCKET, SO_REUSEPORT,
+                      CHAR_CAST &on, sizeof(on)) == -1)
+    {
+        saved_errno = errno;
+        close(sockfd);
+        errno = saved_errno;
+        return -1;
+    }
+#endif
+
     if (0 != bind(sockfd, sa_local, socklen)) {
         saved_errno = errno;
         LSQ_WARN("bind failed: %s", strerror(errno));
@@ -2013,6 +2025,11 @@ set_engine_option (struct lsquic_engine_settings *settings,
             settings->es_delay_onclose = atoi(val);
             return 0;
         }
+        if (0 == strncmp(name, "cc_rtt_thresh", 13))
+        {
+            settings->es_cc_rtt_thresh = atoi(val);
+            return 0;
+        }
         break;
     case 14:
         if (0 == strncmp(name, "max_streams_in", 14))
@@ -2035,6 +2052,11 @@ set_engine_option (struct lsquic_engine_settings *settings,
             settings->es_max_batch_size = atoi(val);
             return 0;
         }
+        if (0 == strncmp(name, "cc_rtt_samples", 14))
+        {
+            settings->es_cc_rtt_samples = atoi(val);
+            return 0;
+        }
         break;
     case 15:
         if (0 == strncmp(name, "allow_migration", 15))
@@ -2354,6 +2376,27 @@ create_lsquic_reader_ctx (const char *filename)
 }
 
 
+/* Limit the reader to `len' bytes starting at offset `off' */
+int
+test_reader_set_range (struct reader_ctx *ctx, size_t off, size_t len)
+{
+    if (off + len > ctx->file_size)
+        return -1;
+#ifndef WIN32
+    if ((off_t) -1 == lseek(ctx->fd, (off_t) off, SEEK_SET))
+#else
+    if (-1 == _lseeki64(ctx->fd, (__int64) off, SEEK_SET))
+#endif
+    {
+        LSQ_WARN("%s: cannot seek: %s", __func__, strerror(errno));
+        return -1;
+    }
+    ctx->file_size = len;
+    ctx->nread = 0;
+    return 0;
+}
+
+
 void
 destroy_lsquic_reader_ctx (struct reader_ctx *ctx)
 {
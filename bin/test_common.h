@@ -47,6 +47,7 @@ enum sport_flags
     SPORT_SET_RCVBUF        = (1 << 2), /* SO_RCVBUF */
     SPORT_SERVER            = (1 << 3),
     SPORT_CONNECT           = (1 << 4),
+    SPORT_REUSEPORT         = (1 << 5), /* SO_REUSEPORT */
 };
 
 struct service_port {
@@ -135,6 +136,9 @@ test_reader_read (void *void_ctx, void *buf, size_t count);
 struct reader_ctx *
 create_lsquic_reader_ctx (const char *filename);
 
+int
+test_reader_set_range (struct reader_ctx *ctx, size_t off, size_t len);
+
 void
 destroy_lsquic_reader_ctx (struct reader_ctx *ctx);
 
@@ -0,0 +1,152 @@
+"""Tests for abr_sim.py"""
+import numpy as np
+import pytest
+
+import abr_sim
+import qoe_sink
+
+MPD = """<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static"
+     mediaPresentationDuration="PT0H0M10.0S">
+  <Period>
+    <AdaptationSet contentType="audio" mimeType="audio/mp4">
+      <Representation id="a" bandwidth="128000">
+        <SegmentTemplate media="a_$Number$.m4s" duration="4" startNumber="1"/>
+      </Representation>
+    </AdaptationSet>
+    <AdaptationSet contentType="video" mimeType="video/mp4" frameRate="30000/1001">
+      <SegmentTemplate media="v_$RepresentationID$_$Number%03d$.m4s"
+                       initialization="v_$RepresentationID$_init.mp4"
+                       timescale="1000" duration="4000" startNumber="1"/>
+      <Representation id="hi" bandwidth="3000000" width="1280" height="720"/>
+      <Representation id="lo" bandwidth="1000000" width="640" height="360"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def make_ladder(n_segments=10):
+    return abr_sim.Ladder([1000.0, 3000.0, 5000.0], [640, 1280, 1920],
+                          [360, 720, 1080], [4.0] * n_segments)
+
+
+def constant_traces(*kbps, seconds=600.0, dt=0.5):
+    steps = int(seconds / dt)
+    return abr_sim.TraceSet(np.array([[r] * steps for r in kbps]), dt)
+
+
+def test_parse_mpd(tmp_path):
+    path = tmp_path / "manifest.mpd"
+    path.write_text(MPD)
+    ladder = abr_sim.parse_mpd(str(path))
+    np.testing.assert_allclose(ladder.bitrates, [1000.0, 3000.0])
+    np.testing.assert_array_equal(ladder.heights, [360, 720])
+    # The last segment is cut short by the presentation duration
+    np.testing.assert_allclose(ladder.seg_durations, [4.0, 4.0, 2.0])
+    assert ladder.fps == pytest.approx(29.97, abs=0.01)
+    assert abr_sim.rendition_files(str(path), "lo") == [
+        "v_lo_init.mp4", "v_lo_001.m4s", "v_lo_002.m4s", "v_lo_003.m4s"]
+
+
+def test_parse_mpd_segment_sizes(tmp_path):
+    path = tmp_path / "manifest.mpd"
+    path.write_text(MPD)
+    for rep, size in (("lo", 1000), ("hi", 3000)):
+        for i in range(1, 4):
+            (tmp_path / f"v_{rep}_{i:03d}.m4s").write_bytes(b"\0" * size * i)
+    ladder = abr_sim.parse_mpd(str(path), str(tmp_path))
+    np.testing.assert_allclose(ladder.sizes, [[8000, 16000, 24000],
+                                              [24000, 48000, 72000]])
+
+
+def test_trace_finish_time():
+    # 1000 kbps for 10 s, then 3000 kbps for 10 s: mean 2000 kbps
+    traces = abr_sim.TraceSet(np.array([[1000.0] * 20 + [3000.0] * 20]), 0.5)
+    np.testing.assert_allclose(traces.finish_time(np.zeros(1), 4e6), [4.0])
+    np.testing.assert_allclose(traces.finish_time(np.array([8.0]), 8e6),
+                               [12.0])
+    # Past the end, at the mean rate
+    np.testing.assert_allclose(traces.finish_time(np.array([20.0]), 2e6),
+                               [21.0])
+    np.testing.assert_allclose(traces.capacity(np.array([15.0])), [25e6])
+
+
+def test_fast_link_climbs_without_stalls():
+    ladder = make_ladder()
+    result = abr_sim.simulate(ladder, constant_traces(20000.0),
+                              abr_sim.ThroughputRule())
+    assert result["quality"][0, 0] == 0
+    assert result["quality"][0, -1] == ladder.n_qualities - 1
+    assert result["stall_count"][0, -1] == 0
+    assert result["total_stall_time"][0, -1] == 0
+    assert result["startup_delay"][0] == pytest.approx(4000 / 20000.0)
+
+
+def test_slow_link_stalls():
+    ladder = make_ladder()
+    # Even the lowest quality downloads at half the playback rate
+    result = abr_sim.simulate(ladder, constant_traces(500.0),
+                              abr_sim.ThroughputRule())
+    np.testing.assert_array_equal(result["quality"][0], 0)
+    assert result["stall_count"][0, -1] > 0
+    assert result["total_stall_time"][0, -1] > 0
+    # Each 4 s segment takes 8 s: one second of stall per second played
+    np.testing.assert_allclose(result["rebuffer_rate"][0, 1:], 1.0)
+
+
+def test_traces_are_independent():
+    ladder = make_ladder()
+    together = abr_sim.simulate(ladder, constant_traces(500.0, 20000.0),
+                                abr_sim.make_rule(["throughputRule"]))
+    for i, kbps in enumerate((500.0, 20000.0)):
+        alone = abr_sim.simulate(ladder, constant_traces(kbps),
+                                 abr_sim.make_rule(["throughputRule"]))
+        for name in ("wall_clock", "playback_time", "quality",
+                     "total_stall_time"):
+            np.testing.assert_allclose(together[name][i], alone[name][0])
+
+
+def test_bola_follows_buffer():
+    ladder = make_ladder()
+    rule = abr_sim.BolaRule()
+    state = abr_sim.AbrState(ladder, 2)
+    state.buffer = np.array([0.0, rule.min_buffer(ladder)])
+    np.testing.assert_array_equal(rule.choose(state),
+                                  [0, ladder.n_qualities - 1])
+
+
+def test_make_rule():
+    assert isinstance(abr_sim.make_rule(["bolaRule"]), abr_sim.BolaRule)
+    rule = abr_sim.make_rule(["bolaRule", "abr_sim:ThroughputRule"])
+    assert isinstance(rule, abr_sim.LowestOf)
+    assert isinstance(rule.rules[1], abr_sim.ThroughputRule)
+    with pytest.raises(ValueError):
+        abr_sim.make_rule(["noSuchRule"])
+
+
+def test_traces_from_segment_logs(tmp_path):
+    header = "timestamp,download_time,size,media_type\n"
+    empty = tmp_path / "empty" / "segment_downloads_quic.csv"
+    empty.parent.mkdir()
+    empty.write_text(header + "0.0,100,1000,audio\n")
+    run = tmp_path / "run" / "segment_downloads_quic.csv"
+    run.parent.mkdir()
+    run.write_text(header + "0.0,1000,125000,video\n2.0,1000,250000,video\n")
+    traces = abr_sim.traces_from_segment_logs([str(empty), str(run)], dt=1.0)
+    assert traces.names == ["run"]
+    np.testing.assert_allclose(traces.rate[0, :3], [1000.0, 1000.0, 2000.0])
+    with pytest.raises(ValueError):
+        abr_sim.traces_from_segment_logs([str(empty)])
+
+
+def test_write_run(tmp_path):
+    ladder = make_ladder(3)
+    result = abr_sim.simulate(ladder, constant_traces(20000.0, 500.0),
+                              abr_sim.ThroughputRule())
+    path = str(tmp_path / "run.qoe")
+    abr_sim.write_run(path, result, 1)
+    run = qoe_sink.load_run(path)
+    assert list(run) == list(qoe_sink.QOE_FIELDS)
+    np.testing.assert_allclose(run["wall_clock"], result["wall_clock"][1])
+    np.testing.assert_array_equal(run["height"], result["height"][1])
@@ -0,0 +1,138 @@
+"""Tests for qlog_reader.py"""
+import json
+import math
+import sys
+
+import numpy as np
+
+import qlog_reader
+
+REF_MS = 1700000000000.0
+
+# What qlog_writer.c writes: header, then one event per line
+SQLOG = [
+    {"qlog_version": "0.3", "qlog_format": "JSON-SEQ", "title": "video_server",
+     "trace": {"vantage_point": {"type": "server"},
+               "common_fields": {"group_id": "0123ABCD",
+                                 "time_format": "relative",
+                                 "reference_time": REF_MS}}},
+    {"time": 0.0, "name": "lsquic:cc_selected", "data": {"cc": "adaptive"}},
+    {"time": 0.0, "name": "recovery:metrics_updated",
+     "data": {"min_rtt": 30.0, "smoothed_rtt": 30.0, "rtt_variance": 15.0,
+              "congestion_window": 14720, "bytes_in_flight": 0,
+              "pacing_rate": 8000}},
+    {"time": 10.0, "name": "recovery:metrics_updated",
+     "data": {"smoothed_rtt": 31.0}},
+    {"time": 10.0, "name": "lsquic:packets_lost", "data": {"count": 2}},
+    {"time": 20.0, "name": "lsquic:cc_selected",
+     "data": {"cc": "bbr", "samples": 1, "smoothed_rtt": 31.0}},
+    {"time": 20.0, "name": "transport:packet_sent", "data": {}},
+    {"time": 30.0, "name": "recovery:metrics_updated",
+     "data": {"congestion_window": 20000}},
+    {"time": 40.0, "name": "connectivity:connection_closed", "data": {}},
+]
+
+
+def write_sqlog(path, records, torn=""):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write("\x1e" + json.dumps(record) + "\n")
+        f.write(torn)
+
+
+def test_sqlog(tmp_path):
+    path = str(tmp_path / "0123ABCD.sqlog")
+    write_sqlog(path, SQLOG)
+    qlog = qlog_reader.load_qlog(path)
+
+    assert qlog["conn"] == "0123ABCD"
+    m = qlog["metrics"]
+    np.testing.assert_allclose(m["time"], [1700000000.0, 1700000000.01,
+                                           1700000000.03])
+    # Fields not in an event keep their previous value
+    np.testing.assert_allclose(m["srtt_ms"], [30.0, 31.0, 31.0])
+    np.testing.assert_allclose(m["cwnd"], [14720, 14720, 20000])
+    np.testing.assert_allclose(m["pacing_rate"], [8000] * 3)
+    assert np.isnan(m["latest_rtt_ms"]).all()
+    np.testing.assert_allclose(qlog["loss"]["time"], [1700000000.01])
+    np.testing.assert_allclose(qlog["loss"]["count"], [2])
+    assert [data["cc"] for _, data in qlog["cc"]] == ["adaptive", "bbr"]
+    assert qlog["cc"][1][1]["samples"] == 1
+
+
+def test_sqlog_torn_last_line(tmp_path):
+    path = str(tmp_path / "torn.sqlog")
+    write_sqlog(path, SQLOG[:3],
+                torn='\x1e{"time": 10.0, "name": "recovery:metrics_upd')
+    qlog = qlog_reader.load_qlog(path)
+    assert len(qlog["metrics"]["time"]) == 1
+
+
+def test_qlog_json_delta(tmp_path):
+    """A qlog 0.3 JSON file from another stack, with delta times"""
+    doc = {
+        "qlog_version": "0.3",
+        "traces": [{
+            "common_fields": {"ODCID": "beef", "time_format": "delta",
+                              "reference_time": REF_MS},
+            "events": [
+                {"time": 5.0, "name": "recovery:metrics_updated",
+                 "data": {"latest_rtt": 20.0, "smoothed_rtt": 20.0}},
+                {"time": 5.0, "name": "transport:packet_received",
+                 "data": {"header": {"packet_number": 1}}},
+                {"time": 5.0, "name": "recovery:packet_lost",
+                 "data": {"header": {"packet_number": 2}}},
+                {"time": 5.0, "name": "recovery:packet_lost",
+                 "data": {"header": {"packet_number": 3}}},
+            ],
+        }],
+    }
+    path = str(tmp_path / "x.qlog")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+
+    # Small chunks: events straddle the buffer boundary
+    saved = qlog_reader.CHUNK_SIZE
+    qlog_reader.CHUNK_SIZE = 7
+    try:
+        qlog = qlog_reader.load_qlog(path)
+    finally:
+        qlog_reader.CHUNK_SIZE = saved
+
+    assert qlog["conn"] == "beef"
+    np.testing.assert_allclose(qlog["metrics"]["time"], [1700000000.005])
+    np.testing.assert_allclose(qlog["metrics"]["latest_rtt_ms"], [20.0])
+    np.testing.assert_allclose(qlog["loss"]["time"],
+                               [1700000000.015, 1700000000.02])
+    np.testing.assert_allclose(qlog["loss"]["count"], [1, 1])
+
+
+def test_timeline_and_summary(tmp_path):
+    path = str(tmp_path / "0123ABCD.sqlog")
+    write_sqlog(path, SQLOG)
+    qlog = qlog_reader.load_qlog(path)
+
+    cols = qlog_reader.timeline(qlog)
+    np.testing.assert_allclose(cols["lost"], [0, 2, 2])
+    assert list(cols["cc"]) == ["adaptive", "adaptive", "bbr"]
+
+    row = qlog_reader.summary(qlog)
+    assert row["samples"] == 3
+    assert math.isclose(row["duration"], 0.03, abs_tol=1e-6)
+    assert math.isclose(row["srtt_ms_mean"], 92.0 / 3)
+    assert row["srtt_ms_max"] == 31.0
+    assert row["cwnd_max"] == 20000
+    assert row["lost"] == 2
+    assert row["cc"] == "bbr"
+
+
+def test_main_csv(tmp_path, monkeypatch, capsys):
+    write_sqlog(str(tmp_path / "0123ABCD.sqlog"), SQLOG)
+    monkeypatch.setattr(sys, "argv", ["qlog_reader.py", str(tmp_path),
+                                      "--start", "1700000000.005"])
+    qlog_reader.main()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split(",") == list(qlog_reader.CSV_FIELDS)
+    assert len(lines) == 3
+    assert lines[1].startswith("0123ABCD,1700000000.01,31,")
+    assert lines[2].endswith(",2,bbr")
@@ -0,0 +1,156 @@
+"""Tests for qoe_analysis.py"""
+import json
+import math
+
+import numpy as np
+import pytest
+
+import qoe_analysis
+from qoe_sink import QOE_FIELDS, RAW_FIELDS, CsvSink, FramedSink
+
+# Run A: starts after 1 s, switches up, stalls for 2 s
+RUN_A = {
+    "wall_clock":           [0, 1, 2, 3, 4, 5, 6],
+    "playback_time":        [0, 0, 1, 2, 2, 2, 3],
+    "bitrate_kbps":         [1000, 1000, 1000, 2000, 2000, 2000, 2000],
+    "total_frames":         [0, 0, 30, 60, 60, 60, 90],
+    "dropped_frames":       [0, 0, 0, 3, 3, 3, 3],
+    "stall_count":          [0, 0, 0, 0, 1, 1, 1],
+    "total_stall_time":     [0, 0, 0, 0, 1, 2, 2],
+}
+
+# Run B: starts at once, one bitrate, no stalls
+RUN_B = {
+    "wall_clock":           [0, 1, 2, 3],
+    "playback_time":        [0, 1, 2, 3],
+    "bitrate_kbps":         [3000] * 4,
+    "total_frames":         [0, 25, 50, 75],
+    "dropped_frames":       [0] * 4,
+    "stall_count":          [0] * 4,
+    "total_stall_time":     [0] * 4,
+}
+
+DEFAULTS = {"buffered": 10.0, "playback_rate": 1.0, "quality_switch_count": 0,
+            "fps": 0.0, "width": 1280, "height": 720, "rebuffer_rate": 0.0}
+
+
+def rows(run, fields):
+    n = len(run["wall_clock"])
+    return [tuple(run[f][i] if f in run else DEFAULTS[f] for f in fields)
+            for i in range(n)]
+
+
+@pytest.fixture
+def results(tmp_path):
+    """Run A as a .qoe file with switches, run B as a legacy CSV file"""
+    a, b = tmp_path / "a", tmp_path / "b"
+    a.mkdir()
+    b.mkdir()
+    with FramedSink(str(a / "qoe_metrics_quic.qoe"), RAW_FIELDS) as sink:
+        for row in rows(RUN_A, RAW_FIELDS):
+            sink.write(row)
+    with CsvSink(str(b / "qoe_metrics_tcp.csv"), QOE_FIELDS) as sink:
+        for row in rows(RUN_B, QOE_FIELDS):
+            sink.write(row)
+    # dash.js 5 and dash.js 4 switch events
+    (a / "switches_quic.log").write_text(json.dumps([
+        {"timestamp": 1, "oldIndex": 0, "newIndex": 2},
+        {"timestamp": 3, "oldQuality": 2, "newQuality": 1},
+    ]))
+    return tmp_path
+
+
+def test_find_runs(results):
+    paths = qoe_analysis.find_runs([str(results)])
+    assert [p[len(str(results)):] for p in paths] == [
+        "/a/qoe_metrics_quic.qoe", "/b/qoe_metrics_tcp.csv"]
+
+
+def test_load(results):
+    runs = qoe_analysis.load(qoe_analysis.find_runs([str(results)]))
+    assert len(runs) == 2
+    assert set(runs.columns) == set(RAW_FIELDS)
+    np.testing.assert_array_equal(runs.offsets, [0, 7, 11])
+    np.testing.assert_array_equal(runs.columns["height"][7:], [720] * 4)
+    np.testing.assert_array_equal(runs.switches, [[0, 2], [2, 1]])
+    np.testing.assert_array_equal(runs.sw_offsets, [0, 2, 2])
+
+
+def test_compute(results):
+    runs = qoe_analysis.load(qoe_analysis.find_runs([str(results)]))
+    m = qoe_analysis.compute(runs)
+    assert set(m) == set(qoe_analysis.METRIC_FIELDS)
+
+    expected_a = {
+        "samples":              7,
+        "playback_time":        3,
+        "startup_delay":        1,
+        # 2 s at 1000 kbps, 1 s at 2000 kbps
+        "bitrate_kbps":         4000 / 3,
+        "log_utility":          math.log(2) / 3,
+        "bitrate_changes":      1,
+        "mean_change_kbps":     1000,
+        "switches":             2,
+        "switches_per_min":     40,
+        "mean_switch_levels":   1.5,
+        "max_switch_levels":    2,
+        "stall_count":          1,
+        "total_stall_time":     2,
+        "stall_p50":            2,
+        "stall_max":            2,
+        "rebuffer_rate":        2 / 3,
+        "fps_mean":             30,
+        "fps_p5":               15,
+        "frame_drop_pct":       100 / 30,
+        "qoe":                  (4 - 1 - 4.3 * 2 - 4.3 * 1) / 3,
+    }
+    for name, value in expected_a.items():
+        assert m[name][0] == pytest.approx(value), name
+
+    expected_b = {
+        "startup_delay":        0,
+        "bitrate_kbps":         3000,
+        "log_utility":          0,
+        "bitrate_changes":      0,
+        "switches":             0,
+        "stall_count":          0,
+        "rebuffer_rate":        0,
+        "fps_mean":             25,
+        "fps_p5":               25,
+        "frame_drop_pct":       0,
+        "qoe":                  3,
+    }
+    for name, value in expected_b.items():
+        assert m[name][1] == pytest.approx(value), name
+    assert np.isnan(m["stall_p50"][1])
+
+
+def test_penalties(results):
+    runs = qoe_analysis.load(qoe_analysis.find_runs([str(results)]))
+    m = qoe_analysis.compute(runs, switch_penalty=0, stall_penalty=0,
+                             startup_penalty=0)
+    assert m["qoe"][0] == pytest.approx(4 / 3)
+
+
+def test_stall_durations():
+    columns = {name: np.zeros(6) for name in RAW_FIELDS}
+    columns["stall_count"] = np.array([0, 1, 1, 2, 1, 1], dtype=float)
+    columns["total_stall_time"] = np.array([0, .5, 1, 3, .25, .25])
+    runs = qoe_analysis.RunSet(["x", "y"], columns, [0, 4, 6],
+                               np.zeros((0, 2)), [0, 0, 0])
+    run, dur = qoe_analysis.stall_durations(runs)
+    np.testing.assert_array_equal(run, [0, 0, 1])
+    np.testing.assert_allclose(dur, [1, 2, .25])
+
+
+def test_switch_without_levels(tmp_path, capsys):
+    path = tmp_path / "switches_quic.log"
+    path.write_text(json.dumps([{"timestamp": 1, "newId": "v3"}]))
+    assert qoe_analysis.load_switches(str(path)).shape == (0, 2)
+    assert "none of 1 switches" in capsys.readouterr().err
+
+
+def test_no_switch_log(tmp_path, capsys):
+    levels = qoe_analysis.load_switches(str(tmp_path / "switches_quic.log"))
+    assert levels.shape == (0, 2)
+    assert capsys.readouterr().err == ""
@@ -0,0 +1,132 @@
+"""Tests for qoe_sink.py"""
+import csv
+import struct
+
+import numpy as np
+import pytest
+
+import qoe_sink
+from qoe_sink import QOE_FIELDS, RAW_FIELDS
+
+
+def sample(i, fields=tuple(QOE_FIELDS)):
+    values = {
+        "wall_clock":           1700000000.0 + i,
+        "playback_time":        i * 0.5,
+        "buffered":             10.0 - i,
+        "playback_rate":        1.0,
+        "bitrate_kbps":         3000 + i,
+        "quality_switch_count": i // 2,
+        "dropped_frames":       i,
+        "total_frames":         30 * i,
+        "fps":                  29.5,
+        "width":                1920,
+        "height":               1080,
+        "stall_count":          i // 3,
+        "total_stall_time":     0.25 * i,
+        "rebuffer_rate":        0.0125,
+    }
+    return tuple(values[f] for f in fields)
+
+
+def write_run(path, n, fields=tuple(QOE_FIELDS), batch_size=4):
+    with qoe_sink.FramedSink(path, fields, batch_size=batch_size) as sink:
+        for i in range(n):
+            sink.write(sample(i, fields))
+
+
+def test_framed_round_trip(tmp_path):
+    path = str(tmp_path / "run.qoe")
+    write_run(path, 10)
+    assert qoe_sink.read_schema(path) == tuple(QOE_FIELDS)
+    run = qoe_sink.load_run(path)
+    assert list(run) == list(QOE_FIELDS)
+    np.testing.assert_allclose(run["wall_clock"],
+                               1700000000.0 + np.arange(10))
+    np.testing.assert_array_equal(run["total_frames"], 30 * np.arange(10))
+    np.testing.assert_array_equal(run["height"], [1080] * 10)
+    assert run["bitrate_kbps"].dtype == np.dtype("<u4")
+
+
+def test_framed_append(tmp_path):
+    path = str(tmp_path / "run.qoe")
+    write_run(path, 3)
+    write_run(path, 2)
+    run = qoe_sink.load_run(path)
+    np.testing.assert_array_equal(run["dropped_frames"], [0, 1, 2, 0, 1])
+
+
+def test_framed_schema_mismatch(tmp_path):
+    path = str(tmp_path / "run.qoe")
+    write_run(path, 1)
+    with pytest.raises(ValueError):
+        qoe_sink.FramedSink(path, RAW_FIELDS)
+
+
+def test_framed_torn_frame(tmp_path):
+    """Whole frames before a torn or corrupt one are kept"""
+    path = str(tmp_path / "run.qoe")
+    write_run(path, 8, batch_size=4)
+    with open(path, "rb") as f:
+        data = f.read()
+    record_size = struct.calcsize("<" + "".join(QOE_FIELDS.values()))
+    frame = qoe_sink.FRAME_HDR.size + 4 * record_size
+
+    with open(path, "wb") as f:
+        f.write(data[:-5])
+    assert len(qoe_sink.load_run(path)["wall_clock"]) == 4
+
+    corrupt = bytearray(data)
+    corrupt[-frame + qoe_sink.FRAME_HDR.size] ^= 0xff
+    with open(path, "wb") as f:
+        f.write(bytes(corrupt))
+    assert len(qoe_sink.load_run(path)["wall_clock"]) == 4
+
+    with open(path, "wb") as f:
+        f.write(data[:-frame])
+    assert len(qoe_sink.load_run(path)["wall_clock"]) == 4
+
+
+def test_not_a_qoe_file(tmp_path):
+    path = tmp_path / "run.qoe"
+    path.write_bytes(b"wall_clock,playback_time\n")
+    with pytest.raises(ValueError):
+        qoe_sink.load_run(str(path))
+
+
+def test_load_runs_common_columns(tmp_path):
+    old, new = str(tmp_path / "old.qoe"), str(tmp_path / "new.qoe")
+    write_run(old, 3)
+    write_run(new, 2, RAW_FIELDS)
+    columns, offsets = qoe_sink.load_runs([old, new])
+    assert set(columns) == set(RAW_FIELDS)
+    np.testing.assert_array_equal(offsets, [0, 3, 5])
+    np.testing.assert_array_equal(columns["dropped_frames"],
+                                  [0, 1, 2, 0, 1])
+
+
+def test_csv(tmp_path):
+    path = str(tmp_path / "run.csv")
+    with qoe_sink.open_sink(path) as sink:
+        assert isinstance(sink, qoe_sink.CsvSink)
+        sink.write(sample(1))
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 1
+    row = rows[0]
+    assert "width" not in row and "height" not in row
+    assert row["resolution"] == "1920x1080"
+    assert row["rebuffer_rate"] == "0.0125"
+    assert row["buffered"] == "9.0"
+    assert row["total_frames"] == "30"
+
+
+def test_open_sink_framed(tmp_path):
+    sink = qoe_sink.open_sink(str(tmp_path / "run.qoe"), RAW_FIELDS)
+    assert isinstance(sink, qoe_sink.FramedSink)
+    sink.close()
+
+
+def test_derived_rates():
+    assert qoe_sink.derived_rates(300, 0.5, 10.0) == (30.0, 0.05)
+    assert qoe_sink.derived_rates(0, 0.0, 0.0) == (0.0, 0.0)
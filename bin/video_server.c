@@ -3,10 +3,20 @@
  * video_server.c -- A standalone QUIC HTTP/3 server for serving video files
  *
  * Usage: ./video_server -s ip:port -r ./video -A 2 -c domain,cert.pem,key.pem
+ *
+ * Serves the files under the document root to DASH players over HTTP/3,
+ * with byte ranges, conditional requests, and Cache-Control and stream
+ * priorities chosen by what each request is for.  Options add a shared
+ * file cache (-b), prefetch threads (-p), worker processes (-w), a JSON
+ * request log (-R), qlog files (-Q), per-connection congestion control
+ * experiments (-x) and live streaming of segments that are still being
+ * written (-F).  Run with -h for the full list.
  */
 
 #include <assert.h>
+#include <ctype.h>
 #include <errno.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
@@ -14,6 +24,7 @@
 #include <sys/types.h>
 #include <sys/stat.h>
 #include <inttypes.h>
+#include <time.h>
 
 #ifndef WIN32
 #include <unistd.h>
@@ -24,17 +35,81 @@
 #endif
 
 #include <event2/event.h>
+#include <event2/util.h>
+#include <openssl/rand.h>
 
 #include "lsquic.h"
 #include "../src/liblsquic/lsquic_hash.h"
+#include "../src/liblsquic/lsquic_hq.h"
+#include "../src/liblsquic/lsquic_int_types.h"
+#include "../src/liblsquic/lsquic_util.h"
 #include "lsxpack_header.h"
 #include "test_config.h"
 #include "test_common.h"
 #include "test_cert.h"
 #include "prog.h"
+#include "file_cache.h"
+#include "mpd_index.h"
+#include "qlog_writer.h"
+#ifndef WIN32
+#include "live_watch.h"
+#include "prefetch.h"
+#include "workers.h"
+#endif
 
 #include "../src/liblsquic/lsquic_logger.h"
 
+/* How file contents reach the stream (-b) */
+enum reader_backend {
+    RB_READ,        /* read(2) from a file opened for each request */
+    /* memcpy from the file cache shared by all streams, which holds the
+     * files either mmap()ed (-b mmap) or read into memory (-b memory)
+     */
+    RB_CACHE,
+};
+
+enum range_type {
+    RANGE_NONE,     /* No Range header or one that is ignored: send 200 */
+    RANGE_SINGLE,
+    RANGE_MULTI,    /* Not supported: send 416 */
+};
+
+/* What a request is for, as far as its priority goes */
+enum request_class {
+    RC_OTHER,       /* Player page, scripts, anything else */
+    RC_MANIFEST,
+    RC_INIT,        /* Initialization segment */
+    RC_AUDIO,
+    RC_TEXT,
+    RC_VIDEO,
+};
+
+#define N_REQUEST_CLASSES (RC_VIDEO + 1)
+
+/* How connections are assigned congestion controllers (-x) */
+enum cc_assign {
+    CCA_OFF,        /* All use the engine's es_cc_algo (-A) */
+    CCA_RANDOM,
+    CCA_SNI,        /* Hash of the SNI */
+    CCA_TAG,        /* First label of the SNI; random if it is not one */
+};
+
+/* es_cc_algo values are 1 through N_CC_ALGOS */
+#define N_CC_ALGOS 3
+
+struct cc_arm_stats {
+    unsigned long            conns;
+    unsigned long            requests;
+    unsigned long long       bytes_sent;
+};
+
+/* "bytes=first-last", "bytes=first-" or "bytes=-suffix" */
+struct byte_range {
+    int         suffix;         /* If set, the last `last' bytes */
+    size_t      first, last;    /* `last' is SIZE_MAX if open-ended */
+};
+
+
 /* Server context - holds global server state */
 struct server_ctx {
     struct lsquic_conn_ctx  *conn_h;
@@ -43,12 +118,64 @@ struct server_ctx {
     struct sport_head        sports;
     struct prog             *prog;
     unsigned                 n_current_conns;
+    enum reader_backend      backend;
+    struct file_cache       *file_cache;    /* Used by RB_CACHE */
+    /* If not set, range requests for files not in the cache are read
+     * from disk rather than loading the whole file into the cache.
+     */
+    int                      range_loads_file;
+    struct event            *stats_timer;
+    struct timeval           stats_interval;
+    FILE                    *req_log;       /* JSON lines, one per request */
+    const char              *immutable_prefix;  /* NULL: none */
+    /* Cache-Control by request class (-K); NULL: none */
+    const char              *cache_control[N_REQUEST_CLASSES];
+    struct prefetch         *prefetch;      /* NULL: read on the loop */
+    unsigned                 readahead;     /* Segments to read ahead */
+    struct lsquic_hash      *ra_windows;    /* struct ra_window by name */
+    /* Streams waiting for a prefetch thread to load their file: */
+    TAILQ_HEAD(, lsquic_stream_ctx)
+                             parked;
+    unsigned                 prefetch_threads;
+    struct workers          *workers;       /* NULL: single process */
+    int                      worker_id;     /* -1: single process */
+    unsigned long            n_requests;    /* Answered, since start */
+    unsigned long long       bytes_sent;
+    int                      prioritize;    /* Set stream priorities */
+    struct mpd_index        *mpd_index;     /* Manifests sent so far */
+    enum cc_assign           cc_assign;
+    unsigned                 cc_arms[N_CC_ALGOS];   /* es_cc_algo values */
+    unsigned                 n_cc_arms;
+    struct cc_arm_stats      cc_stats[N_CC_ALGOS];  /* By es_cc_algo - 1 */
+    const char              *qlog_dir;      /* NULL: no qlog */
+    struct event            *qlog_timer;
+    struct timeval           qlog_interval;
+    /* Connections with a qlog writer, sampled by qlog_timer: */
+    TAILQ_HEAD(, lsquic_conn_ctx)
+                             qlog_conns;
+    struct live_watch       *live_watch;    /* NULL: no live mode */
+    /* Streams following a growing segment: */
+    TAILQ_HEAD(, lsquic_stream_ctx)
+                             live_streams;
+};
+
+/* Read-ahead state of one representation: segments whose names differ
+ * only in the number.
+ */
+struct ra_window {
+    struct lsquic_hash_elem  rw_hash_el;
+    char                    *rw_key;        /* Name without the number */
+    unsigned long            rw_next;       /* First number not queued */
 };
 
 /* Connection context - per-connection state */
 struct lsquic_conn_ctx {
     lsquic_conn_t       *conn;
     struct server_ctx   *server_ctx;
+    unsigned             cc_algo;       /* Assigned with -x; 0 if not */
+    struct qlog_writer  *qlog;          /* NULL: no qlog */
+    TAILQ_ENTRY(lsquic_conn_ctx)
+                         next_qlog;
 };
 
 /* Stream context - per-stream state */
@@ -59,11 +186,106 @@ struct lsquic_stream_ctx {
     size_t               req_sz;
     char                *req_filename;
     char                *req_path;
+    enum range_type      range_type;
+    struct byte_range    range;
+    const char          *range_val;     /* Points into req_buf */
+    size_t               range_len;
+    TAILQ_ENTRY(lsquic_stream_ctx)
+                         next_parked;
+    int                  parked;
+    enum request_class   req_class;
     struct lsquic_reader reader;
+    struct fc_entry     *fc_entry;      /* Used by RB_CACHE */
+    size_t               file_off;      /* Used by RB_CACHE */
+    size_t               file_end;      /* Used by RB_CACHE */
+    size_t               file_size;     /* Whole file, even if ranged */
+    const char          *status;
+    const char          *content_type;
+    const char          *content_length;
+    const char          *cache_control;
+    const char          *etag;          /* NULL: no validators */
+    const char          *last_modified;
+    time_t               mtime;
+    char                 clen_buf[24];  /* Used by RB_READ and ranges */
+    char                 etag_buf[64];  /* Used by RB_READ */
+    char                 last_modified_buf[32];     /* Used by RB_READ */
+    char                 content_range[64];
     int                  headers_sent;
+    /* Used for a segment that is still being written: */
+    struct live_file    *live;
+    TAILQ_ENTRY(lsquic_stream_ctx)
+                         next_live;
+    int                  live_fd;
+    size_t               live_off;      /* Bytes read */
+    int                  live_eof;      /* Read error: end the response */
+    /* Used for the request log: */
+    struct timeval       t_start;       /* Stream created */
+    struct timeval       t_first_byte;  /* First body bytes written */
+    struct timeval       t_done;        /* Last body bytes written */
+    size_t               bytes_sent;
 };
 
 
+static double
+tv_ms (const struct timeval *tv)
+{
+    return tv->tv_sec * 1000.0 + tv->tv_usec / 1000.0;
+}
+
+
+static const char *
+cc_algo_name (unsigned cc_algo)
+{
+    switch (cc_algo)
+    {
+    case 1:  return "cubic";
+    case 2:  return "bbr";
+    default: return "adaptive";
+    }
+}
+
+
+/*
+ * Helper: Pick the congestion controller of a new connection (-x), so that
+ * one batch of concurrent sessions compares Cubic, BBRv1 and the adaptive
+ * one on the same network at the same time.  It is picked at random, by
+ * a hash of the SNI, or by a tag: the first label of the SNI, as in
+ * bbr.video.example.  Responses carry it in an x-cc-algo header, request
+ * log records in "cc_assigned", and the counters logged every -T seconds
+ * are broken down by it.
+ */
+static unsigned
+assign_cc_algo (const struct server_ctx *server_ctx, const char *sni)
+{
+    const unsigned char *p;
+    unsigned cc_algo, hash;
+    size_t len;
+
+    switch (server_ctx->cc_assign)
+    {
+    case CCA_SNI:
+        /* FNV-1a: stable across runs, unlike lsquic_hash */
+        hash = 2166136261u;
+        for (p = (const unsigned char *) (sni ? sni : ""); *p; ++p)
+            hash = (hash ^ tolower(*p)) * 16777619u;
+        return server_ctx->cc_arms[hash % server_ctx->n_cc_arms];
+    case CCA_TAG:
+        if (sni)
+        {
+            len = strcspn(sni, ".");
+            for (cc_algo = 1; cc_algo <= N_CC_ALGOS; ++cc_algo)
+                if (len == strlen(cc_algo_name(cc_algo))
+                        && 0 == strncasecmp(sni, cc_algo_name(cc_algo), len))
+                    return cc_algo;
+        }
+        /* fall through */
+    default:
+        RAND_bytes((unsigned char *) &hash, sizeof(hash));
+        return server_ctx->cc_arms[hash % server_ctx->n_cc_arms];
+    }
+}
+
+
 /*
  * Callback: New connection established
  */
@@ -72,6 +294,7 @@ video_server_on_new_conn (void *stream_if_ctx, lsquic_conn_t *conn)
 {
     struct server_ctx *server_ctx = stream_if_ctx;
     const char *sni;
+    unsigned cc_algo;
 
     sni = lsquic_conn_get_sni(conn);
     LSQ_DEBUG("New connection, SNI: %s", sni ? sni : "<not set>");
@@ -82,13 +305,77 @@ video_server_on_new_conn (void *stream_if_ctx, lsquic_conn_t *conn)
 
     conn_h->conn = conn;
     conn_h->server_ctx = server_ctx;
+    conn_h->cc_algo = 0;
+    conn_h->qlog = NULL;
     server_ctx->conn_h = conn_h;
     ++server_ctx->n_current_conns;
 
+    if (server_ctx->cc_assign != CCA_OFF)
+    {
+        cc_algo = assign_cc_algo(server_ctx, sni);
+        if (0 == lsquic_conn_set_cc_algo(conn, cc_algo))
+        {
+            LSQ_INFO("SNI %s: use %s congestion controller",
+                            sni ? sni : "<not set>", cc_algo_name(cc_algo));
+            conn_h->cc_algo = cc_algo;
+            ++server_ctx->cc_stats[cc_algo - 1].conns;
+        }
+        else
+            LSQ_WARN("cannot set the congestion controller of a connection");
+    }
+
+    if (server_ctx->qlog_dir)
+    {
+        conn_h->qlog = qlog_writer_open(server_ctx->qlog_dir, conn);
+        if (conn_h->qlog)
+        {
+            qlog_writer_sample(conn_h->qlog, conn);
+            TAILQ_INSERT_TAIL(&server_ctx->qlog_conns, conn_h, next_qlog);
+        }
+        else
+            LSQ_WARN("cannot create qlog file in %s: %s",
+                                    server_ctx->qlog_dir, strerror(errno));
+    }
+
     return conn_h;
 }
 
 
+/*
+ * Helper: Append the adaptive congestion controller's choice, and what it
+ * was based on, to the request log.  "decided_ts" is when it was made.
+ * The choice is tuned with -o cc_rtt_thresh=USEC and -o cc_rtt_samples=N.
+ */
+static void
+log_cc_decision (const struct server_ctx *server_ctx, lsquic_conn_t *conn)
+{
+    FILE *const out = server_ctx->req_log;
+    struct lsquic_cc_decision decision;
+    const lsquic_cid_t *cid;
+    struct timeval now;
+    char cid_str[MAX_CID_LEN * 2 + 1];
+
+    if (0 != lsquic_conn_get_cc_decision(conn, &decision))
+        return;
+
+    (void) evutil_gettimeofday(&now, NULL);
+    cid = lsquic_conn_id(conn);
+    lsquic_hexstr(cid->idbuf, cid->len, cid_str, sizeof(cid_str));
+    fprintf(out, "{\"ts\":%.3f,\"conn\":\"%s\",", tv_ms(&now), cid_str);
+    if (server_ctx->worker_id >= 0)
+        fprintf(out, "\"worker\":%d,", server_ctx->worker_id);
+    fprintf(out, "\"event\":\"cc_decision\",\"decided_ts\":%.3f,"
+        "\"cc\":\"%s\",\"samples\":%u,\"srtt_us\":%u,\"rttvar_us\":%u,"
+        "\"min_rtt_us\":%u,\"rtt_thresh_us\":%u,\"bbr_bw\":%"PRIu64","
+        "\"cubic_cwnd\":%"PRIu64",\"bbr_cwnd\":%"PRIu64"}\n",
+        tv_ms(&now) - decision.lccd_age / 1000.0,
+        cc_algo_name(decision.lccd_cc_algo), decision.lccd_n_samples,
+        decision.lccd_srtt, decision.lccd_rttvar, decision.lccd_min_rtt,
+        decision.lccd_rtt_thresh, decision.lccd_bbr_bw,
+        decision.lccd_cubic_cwnd, decision.lccd_bbr_cwnd);
+}
+
+
 /*
  * Callback: Connection closed
  */
@@ -98,6 +385,13 @@ video_server_on_conn_closed (lsquic_conn_t *conn)
     lsquic_conn_ctx_t *conn_h = lsquic_conn_get_ctx(conn);
 
     LSQ_INFO("Connection closed");
+    if (conn_h->server_ctx->req_log)
+        log_cc_decision(conn_h->server_ctx, conn);
+    if (conn_h->qlog)
+    {
+        TAILQ_REMOVE(&conn_h->server_ctx->qlog_conns, conn_h, next_qlog);
+        qlog_writer_close(conn_h->qlog, conn);
+    }
     --conn_h->server_ctx->n_current_conns;
     lsquic_conn_set_ctx(conn, NULL);
     free(conn_h);
@@ -116,6 +410,8 @@ video_server_on_new_stream (void *stream_if_ctx, lsquic_stream_t *stream)
 
     st_h->stream = stream;
     st_h->server_ctx = stream_if_ctx;
+    if (st_h->server_ctx->req_log)
+        (void) evutil_gettimeofday(&st_h->t_start, NULL);
     lsquic_stream_wantread(stream, 1);
 
     return st_h;
@@ -188,19 +484,52 @@ select_content_type (const char *filename)
  * Helper: Send HTTP/3 response headers
  */
 static int
-send_headers (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h,
-              const char *status, const char *content_type)
+send_headers (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
 {
     struct header_buf hbuf;
-    struct lsxpack_header headers_arr[2];
+    struct lsxpack_header headers_arr[9];
+    const lsquic_conn_ctx_t *conn_h;
+    const char *cc;
+    unsigned count;
 
     hbuf.off = 0;
-    header_set_ptr(&headers_arr[0], &hbuf, ":status", 7, status, strlen(status));
-    header_set_ptr(&headers_arr[1], &hbuf, "content-type", 12,
-                   content_type, strlen(content_type));
+    count = 0;
+    header_set_ptr(&headers_arr[count++], &hbuf, ":status", 7,
+                   st_h->status, strlen(st_h->status));
+    if (st_h->content_type)
+        header_set_ptr(&headers_arr[count++], &hbuf, "content-type", 12,
+                       st_h->content_type, strlen(st_h->content_type));
+    if (st_h->content_length)
+    {
+        /* Only responses carrying a file have a length */
+        header_set_ptr(&headers_arr[count++], &hbuf, "content-length", 14,
+                       st_h->content_length, strlen(st_h->content_length));
+        header_set_ptr(&headers_arr[count++], &hbuf, "accept-ranges", 13,
+                       "bytes", 5);
+    }
+    if (st_h->content_range[0])
+        header_set_ptr(&headers_arr[count++], &hbuf, "content-range", 13,
+                       st_h->content_range, strlen(st_h->content_range));
+    if (st_h->cache_control)
+        header_set_ptr(&headers_arr[count++], &hbuf, "cache-control", 13,
+                       st_h->cache_control, strlen(st_h->cache_control));
+    if (st_h->etag)
+    {
+        header_set_ptr(&headers_arr[count++], &hbuf, "etag", 4,
+                       st_h->etag, strlen(st_h->etag));
+        header_set_ptr(&headers_arr[count++], &hbuf, "last-modified", 13,
+                       st_h->last_modified, strlen(st_h->last_modified));
+    }
+    conn_h = lsquic_conn_get_ctx(lsquic_stream_conn(stream));
+    if (conn_h && conn_h->cc_algo)
+    {
+        cc = cc_algo_name(conn_h->cc_algo);
+        header_set_ptr(&headers_arr[count++], &hbuf, "x-cc-algo", 9,
+                       cc, strlen(cc));
+    }
 
     lsquic_http_headers_t headers = {
-        .count = 2,
+        .count = count,
         .headers = headers_arr,
     };
 
@@ -215,6 +544,42 @@ send_headers (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h,
 }
 
 
+/*
+ * Helper: Send an error response without a body and finish the stream
+ */
+static void
+send_error (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h,
+            const char *status)
+{
+    st_h->status = status;
+    st_h->content_type = "text/plain";
+    st_h->content_length = NULL;
+    st_h->cache_control = NULL;
+    st_h->etag = NULL;
+    (void) send_headers(stream, st_h);
+    if (st_h->server_ctx->req_log)
+        (void) evutil_gettimeofday(&st_h->t_done, NULL);
+    lsquic_stream_shutdown(stream, 1);
+}
+
+
+/*
+ * Helper: Send a 304.  It carries the validators and Cache-Control of the
+ * response it stands for, but neither a body nor its description.
+ */
+static void
+send_not_modified (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+{
+    st_h->status = "304";
+    st_h->content_type = NULL;
+    st_h->content_length = NULL;
+    (void) send_headers(stream, st_h);
+    if (st_h->server_ctx->req_log)
+        (void) evutil_gettimeofday(&st_h->t_done, NULL);
+    lsquic_stream_shutdown(stream, 1);
+}
+
+
 /*
  * Helper: Parse HTTP request path from buffer
  * Expects format like: "GET /path HTTP/1.1\r\n..."
@@ -250,173 +615,1509 @@ parse_request_path (const char *req_buf, size_t req_sz)
 
 
 /*
- * Callback: Stream has data to read
+ * Helper: Find header value in the request.  With the HTTP/1.x interface
+ * the request looks like "GET /path HTTP/1.1\r\nname: value\r\n..."
+ * Returns NULL if the header is not present.
  */
-static void
-video_server_on_read (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+static const char *
+find_header (const char *req_buf, size_t req_sz, const char *name,
+             size_t *val_len)
 {
-    unsigned char buf[0x400];
-    ssize_t nread;
-    char *path;
-    char *filename;
-
-    /* Read request data */
-    nread = lsquic_stream_read(stream, buf, sizeof(buf) - 1);
+    const char *line, *eol, *const end = req_buf + req_sz;
+    const size_t name_len = strlen(name);
+    size_t len;
 
-    if (nread > 0)
+    /* Skip the request line */
+    for (line = memchr(req_buf, '\n', req_sz); line && ++line < end;
+                                line = memchr(line, '\n', end - line))
     {
-        /* Accumulate request data */
-        char *new_buf = realloc(st_h->req_buf, st_h->req_sz + nread + 1);
-        if (!new_buf)
+        eol = memchr(line, '\n', end - line);
+        if (!eol)
+            eol = end;
+        if ((size_t) (eol - line) > name_len && line[name_len] == ':'
+                                && 0 == strncasecmp(line, name, name_len))
         {
-            LSQ_ERROR("Memory allocation failed");
-            lsquic_stream_close(stream);
-            return;
+            line += name_len + 1;
+            while (line < eol && (*line == ' ' || *line == '\t'))
+                ++line;
+            len = eol - line;
+            while (len > 0 && isspace((unsigned char) line[len - 1]))
+                --len;
+            *val_len = len;
+            return line;
         }
-        st_h->req_buf = new_buf;
-        memcpy(st_h->req_buf + st_h->req_sz, buf, nread);
-        st_h->req_sz += nread;
-        st_h->req_buf[st_h->req_sz] = '\0';
-        return;
     }
 
-    if (nread < 0)
-    {
-        LSQ_ERROR("Error reading: %s", strerror(errno));
-        lsquic_stream_close(stream);
-        return;
-    }
+    return NULL;
+}
 
-    /* nread == 0: End of request */
-    LSQ_INFO("Got request: `%.*s'", (int)(st_h->req_sz > 100 ? 100 : st_h->req_sz),
-             st_h->req_buf ? st_h->req_buf : "");
 
-    /* Parse request path */
-    path = parse_request_path(st_h->req_buf, st_h->req_sz);
-    if (!path)
+static int
+parse_size (const char *p, char **end, size_t *val)
+{
+    unsigned long long n;
+
+    if (!isdigit((unsigned char) *p))
+        return -1;
+    errno = 0;
+    n = strtoull(p, end, 10);
+    if (errno || n > SIZE_MAX)
+        return -1;
+    *val = (size_t) n;
+    return 0;
+}
+
+
+/*
+ * Helper: Parse Range header value.  Single byte ranges are served
+ * (RFC 9110, Section 14), so that DASH SegmentBase profiles and seeking
+ * fetch only the bytes they need.  Syntactically invalid ranges are
+ * ignored, as RFC 9110 requires.
+ */
+static enum range_type
+parse_range (const char *val, size_t val_len, struct byte_range *range)
+{
+    char buf[64], *p, *end;
+
+    if (memchr(val, ',', val_len))
+        return RANGE_MULTI;
+    if (val_len >= sizeof(buf) || val_len < 6
+                                    || 0 != strncasecmp(val, "bytes=", 6))
+        return RANGE_NONE;
+    memcpy(buf, val, val_len);
+    buf[val_len] = '\0';
+    p = buf + 6;
+
+    if (*p == '-')
     {
-        LSQ_WARN("Failed to parse request path");
-        send_headers(stream, st_h, "400", "text/plain");
-        lsquic_stream_shutdown(stream, 1);
-        return;
+        range->suffix = 1;
+        range->first = 0;
+        if (0 != parse_size(p + 1, &end, &range->last) || *end != '\0')
+            return RANGE_NONE;
+        return RANGE_SINGLE;
     }
 
-    /* Construct full filename */
-    filename = malloc(strlen(st_h->server_ctx->document_root) + strlen(path) + 2);
-    if (!filename)
+    range->suffix = 0;
+    if (0 != parse_size(p, &end, &range->first) || *end != '-')
+        return RANGE_NONE;
+    p = end + 1;
+    if (*p == '\0')
+        range->last = SIZE_MAX;
+    else if (0 != parse_size(p, &end, &range->last) || *end != '\0'
+                                            || range->last < range->first)
+        return RANGE_NONE;
+    return RANGE_SINGLE;
+}
+
+
+/*
+ * Helper: Map range onto a file of `size' bytes.
+ * Returns 0 on success, -1 if the range is not satisfiable.
+ */
+static int
+resolve_range (const struct byte_range *range, size_t size, size_t *off,
+               size_t *len)
+{
+    if (range->suffix)
     {
-        free(path);
-        LSQ_ERROR("Memory allocation failed");
-        lsquic_stream_close(stream);
-        return;
+        if (range->last == 0 || size == 0)
+            return -1;
+        *len = range->last < size ? range->last : size;
+        *off = size - *len;
+        return 0;
     }
 
-    strcpy(filename, st_h->server_ctx->document_root);
-    if (path[0] != '/')
-        strcat(filename, "/");
-    strcat(filename, path);
+    if (range->first >= size)
+        return -1;
+    *off = range->first;
+    *len = (range->last < size ? range->last + 1 : size) - range->first;
+    return 0;
+}
 
-    LSQ_INFO("Serving file: %s", filename);
 
-    st_h->req_filename = filename;
-    st_h->req_path = path;
+/*
+ * Helper: Format `t' as an HTTP date, IMF-fixdate (RFC 9110, Section
+ * 5.6.7).  No locale is set, so day and month names are in English.
+ */
+static void
+format_http_date (time_t t, char *buf, size_t bufsz)
+{
+    struct tm tm;
 
-    /* Set up file reader */
-    st_h->reader.lsqr_read = test_reader_read;
-    st_h->reader.lsqr_size = test_reader_size;
-    st_h->reader.lsqr_ctx = create_lsquic_reader_ctx(filename);
+#ifndef WIN32
+    (void) gmtime_r(&t, &tm);
+#else
+    (void) gmtime_s(&tm, &t);
+#endif
+    (void) strftime(buf, bufsz, "%a, %d %b %Y %H:%M:%S GMT", &tm);
+}
 
-    if (!st_h->reader.lsqr_ctx)
-    {
-        LSQ_WARN("File not found: %s", filename);
-        send_headers(stream, st_h, "404", "text/plain");
-        lsquic_stream_shutdown(stream, 1);
-        return;
-    }
 
-    /* Ready to write response */
-    lsquic_stream_shutdown(stream, 0);  /* Done reading */
-    lsquic_stream_wantwrite(stream, 1);
+/*
+ * Helper: Parse an IMF-fixdate such as "Sun, 06 Nov 1994 08:49:37 GMT".
+ * Browsers send back the Last-Modified value they got, so the obsolete
+ * formats are not accepted.  Returns 0 on success, -1 if the date is
+ * invalid, in which case the header is ignored.
+ */
+static int
+parse_http_date (const char *val, size_t val_len, time_t *t)
+{
+    static const char months[] = "JanFebMarAprMayJunJulAugSepOctNovDec";
+    const char *p;
+    char buf[40], mon[4];
+    int day, year, hour, min, sec, n;
+    long y, m, days;
+
+    if (val_len >= sizeof(buf))
+        return -1;
+    memcpy(buf, val, val_len);
+    buf[val_len] = '\0';
+
+    n = -1;
+    if (6 != sscanf(buf, "%*3s, %2d %3s %4d %2d:%2d:%2d GMT%n", &day, mon,
+                                            &year, &hour, &min, &sec, &n)
+            || n != (int) val_len)
+        return -1;
+    p = strlen(mon) == 3 ? strstr(months, mon) : NULL;
+    if (!p || (p - months) % 3 != 0 || day < 1 || day > 31 || year < 1970
+                                || hour > 23 || min > 59 || sec > 60)
+        return -1;
+
+    /* Days since the epoch, counting years from March */
+    m = (p - months) / 3 + 1;
+    y = year - (m <= 2);
+    days = y * 365 + y / 4 - y / 100 + y / 400
+         + (153 * (m + (m > 2 ? -3 : 9)) + 2) / 5 + day - 1 - 719468;
+    *t = (time_t) days * 86400 + hour * 3600 + min * 60 + sec;
+    return 0;
 }
 
 
 /*
- * Callback: Stream is ready for writing
+ * Helper: Derive the validators of a file from its inode, size and
+ * modification time.  The ETag is strong: any change to the file on disk
+ * changes at least one of them.
  */
 static void
-video_server_on_write (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+make_validators (unsigned long long ino, size_t size, long long mtime_ns,
+                 char *etag, size_t etag_sz, char *lm, size_t lm_sz)
 {
-    ssize_t nw;
+    snprintf(etag, etag_sz, "\"%llx-%zx-%llx\"", ino, size,
+                                            (unsigned long long) mtime_ns);
+    format_http_date((time_t) (mtime_ns / 1000000000), lm, lm_sz);
+}
 
-    /* Send headers first */
-    if (!st_h->headers_sent)
-    {
-        const char *content_type = select_content_type(st_h->req_filename);
-        if (0 != send_headers(stream, st_h, "200", content_type))
-        {
-            lsquic_stream_close(stream);
-            return;
-        }
-    }
 
-    /* Write file content */
-    if (st_h->reader.lsqr_ctx && test_reader_size(st_h->reader.lsqr_ctx) > 0)
-    {
-        nw = lsquic_stream_writef(stream, &st_h->reader);
-        if (nw < 0)
-        {
-            LSQ_ERROR("Write error: %s", strerror(errno));
-            lsquic_stream_close(stream);
-            return;
-        }
+/*
+ * Helper: Check If-None-Match (a list of entity tags or "*") against the
+ * ETag, using the weak comparison that it calls for.
+ */
+static int
+etag_list_matches (const char *val, size_t val_len, const char *etag)
+{
+    const char *const end = val + val_len;
+    const char *p, *q;
+    const size_t etag_len = strlen(etag);
 
-        /* More data to write? */
-        if (test_reader_size(st_h->reader.lsqr_ctx) > 0)
-        {
-            lsquic_stream_wantwrite(stream, 1);
-            return;
-        }
+    for (p = val; p < end; p = q + 1)
+    {
+        while (p < end && (*p == ' ' || *p == '\t' || *p == ','))
+            ++p;
+        if (p == end)
+            break;
+        if (*p == '*')
+            return 1;
+        if (end - p > 2 && p[0] == 'W' && p[1] == '/')
+            p += 2;
+        if (*p != '"' || !(q = memchr(p + 1, '"', end - p - 1)))
+            return 0;
+        if ((size_t) (q + 1 - p) == etag_len && 0 == memcmp(p, etag, etag_len))
+            return 1;
     }
 
-    /* Done writing */
-    lsquic_stream_shutdown(stream, 1);
+    return 0;
 }
 
 
 /*
- * Callback: Stream closed
+ * Helper: Evaluate If-None-Match and, if it is absent, If-Modified-Since
+ * (RFC 9110, Section 13.2.2), so that a reload or a returning viewer does
+ * not fetch the player page, manifest and initialization segments again.
+ * Returns true if a 304 is to be sent.
  */
-static void
-video_server_on_close (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+static int
+not_modified (const lsquic_stream_ctx_t *st_h)
 {
-    LSQ_DEBUG("Stream closed");
-
-    free(st_h->req_buf);
-    free(st_h->req_filename);
-    free(st_h->req_path);
+    const char *val;
+    size_t len;
+    time_t since;
+
+    if (!st_h->etag)
+        return 0;
+    val = find_header(st_h->req_buf, st_h->req_sz, "if-none-match", &len);
+    if (val)
+        return etag_list_matches(val, len, st_h->etag);
+    val = find_header(st_h->req_buf, st_h->req_sz, "if-modified-since",
+                                                                        &len);
+    return val && 0 == parse_http_date(val, len, &since)
+                                                && st_h->mtime <= since;
+}
 
-    if (st_h->reader.lsqr_ctx)
-        destroy_lsquic_reader_ctx(st_h->reader.lsqr_ctx);
 
-    free(st_h);
+/*
+ * Helper: Evaluate If-Range.  The range is only sent if the validator
+ * given matches exactly: an ETag, compared strongly, or the Last-Modified
+ * date.  Otherwise the client's copy is stale and it gets the whole file.
+ */
+static int
+if_range_matches (const lsquic_stream_ctx_t *st_h)
+{
+    const char *val;
+    size_t len;
+
+    val = find_header(st_h->req_buf, st_h->req_sz, "if-range", &len);
+    if (!val)
+        return 1;
+    if (!st_h->etag)
+        return 0;
+    return (len == strlen(st_h->etag) && 0 == memcmp(val, st_h->etag, len))
+        || (len == strlen(st_h->last_modified)
+                            && 0 == memcmp(val, st_h->last_modified, len));
 }
 
 
-/* Stream callback interface */
-static const struct lsquic_stream_if video_server_if = {
-    .on_new_conn    = video_server_on_new_conn,
-    .on_conn_closed = video_server_on_conn_closed,
-    .on_new_stream  = video_server_on_new_stream,
-    .on_read        = video_server_on_read,
-    .on_write       = video_server_on_write,
-    .on_close       = video_server_on_close,
-};
+/*
+ * Reader: Copy file contents out of the shared file cache
+ */
+static size_t
+cache_reader_size (void *lsqr_ctx)
+{
+    lsquic_stream_ctx_t *const st_h = lsqr_ctx;
+    return st_h->file_end - st_h->file_off;
+}
 
 
-static void
-usage (const char *prog_name)
+static size_t
+cache_reader_read (void *lsqr_ctx, void *buf, size_t count)
 {
-    printf(
+    lsquic_stream_ctx_t *const st_h = lsqr_ctx;
+
+    if (count > cache_reader_size(st_h))
+        count = cache_reader_size(st_h);
+    memcpy(buf, st_h->fc_entry->fce_buf + st_h->file_off, count);
+    st_h->file_off += count;
+    return count;
+}
+
+
+/*
+ * Helper: Set up the stream's reader and response headers for the
+ * requested file.  Cached files carry their headers with them, so they
+ * are only computed on the first hit.  Files too large for the cache,
+ * and -- unless range_loads_file is set -- ranges of files not in the
+ * cache, are read from disk.
+ * Returns 0 on success, -1 if the file cannot be opened.
+ */
+static int
+open_reader (lsquic_stream_ctx_t *st_h, const char *filename, int ranged)
+{
+    struct server_ctx *const server_ctx = st_h->server_ctx;
+    struct fc_entry *entry;
+    struct stat st;
+
+    st_h->status = "200";
+    switch (server_ctx->backend)
+    {
+    case RB_CACHE:
+        if (ranged && !server_ctx->range_loads_file)
+            entry = file_cache_peek(server_ctx->file_cache, filename);
+        else
+        {
+            entry = file_cache_get(server_ctx->file_cache, filename);
+            if (!entry && errno != EFBIG)
+                return -1;
+        }
+        if (entry)
+        {
+            if (!entry->fce_content_type)
+            {
+                entry->fce_content_type = select_content_type(filename);
+                snprintf(entry->fce_content_length,
+                    sizeof(entry->fce_content_length), "%zu", entry->fce_size);
+                make_validators(entry->fce_ino, entry->fce_size,
+                    entry->fce_mtime_ns, entry->fce_etag,
+                    sizeof(entry->fce_etag), entry->fce_last_modified,
+                    sizeof(entry->fce_last_modified));
+            }
+            st_h->fc_entry = entry;
+            st_h->file_off = 0;
+            st_h->file_end = entry->fce_size;
+            st_h->file_size = entry->fce_size;
+            st_h->content_type = entry->fce_content_type;
+            st_h->content_length = entry->fce_content_length;
+            st_h->etag = entry->fce_etag;
+            st_h->last_modified = entry->fce_last_modified;
+            st_h->mtime = (time_t) (entry->fce_mtime_ns / 1000000000);
+            st_h->reader.lsqr_read = cache_reader_read;
+            st_h->reader.lsqr_size = cache_reader_size;
+            st_h->reader.lsqr_ctx = st_h;
+            return 0;
+        }
+        /* fall through */
+    default:
+        /* The file may change between the two calls: then the validators
+         * describe a version older than the bytes sent, and the next
+         * conditional request fetches it again.
+         */
+        if (0 != stat(filename, &st))
+            return -1;
+        st_h->reader.lsqr_read = test_reader_read;
+        st_h->reader.lsqr_size = test_reader_size;
+        st_h->reader.lsqr_ctx = create_lsquic_reader_ctx(filename);
+        if (!st_h->reader.lsqr_ctx)
+            return -1;
+        st_h->file_size = test_reader_size(st_h->reader.lsqr_ctx);
+        make_validators(st.st_ino, st.st_size, file_cache_mtime_ns(&st),
+            st_h->etag_buf, sizeof(st_h->etag_buf), st_h->last_modified_buf,
+            sizeof(st_h->last_modified_buf));
+        st_h->etag = st_h->etag_buf;
+        st_h->last_modified = st_h->last_modified_buf;
+        st_h->mtime = st.st_mtime;
+        snprintf(st_h->clen_buf, sizeof(st_h->clen_buf), "%zu",
+                                                            st_h->file_size);
+        st_h->content_type = select_content_type(filename);
+        st_h->content_length = st_h->clen_buf;
+        return 0;
+    }
+}
+
+
+/*
+ * Helper: Restrict the response to `len' bytes at offset `off' and turn
+ * it into a 206.  Neither reader touches the bytes before `off'.
+ */
+static int
+set_range (lsquic_stream_ctx_t *st_h, size_t off, size_t len)
+{
+    if (st_h->fc_entry)
+    {
+        st_h->file_off = off;
+        st_h->file_end = off + len;
+    }
+    else if (0 != test_reader_set_range(st_h->reader.lsqr_ctx, off, len))
+        return -1;
+
+    st_h->status = "206";
+    snprintf(st_h->clen_buf, sizeof(st_h->clen_buf), "%zu", len);
+    st_h->content_length = st_h->clen_buf;
+    snprintf(st_h->content_range, sizeof(st_h->content_range),
+                    "bytes %zu-%zu/%zu", off, off + len - 1, st_h->file_size);
+    return 0;
+}
+
+
+#ifndef WIN32
+/*
+ * Helper: Find the number of a media segment such as
+ * chunk-stream0-00042.m4s: the digits right before the extension.
+ * Initialization segments (init-stream0.m4s) are numbered by
+ * representation, not by time, and are skipped.
+ * Returns 0 and sets the number and its offset and width, or -1.
+ */
+static int
+parse_segment_number (const char *filename, size_t *off, size_t *width,
+                      unsigned long *number)
+{
+    const char *base, *ext, *digits;
+
+    base = strrchr(filename, '/');
+    base = base ? base + 1 : filename;
+    ext = strrchr(base, '.');
+    if (!ext || !(0 == strcmp(ext, ".m4s") || 0 == strcmp(ext, ".m4v")
+                                            || 0 == strcmp(ext, ".m4a"))
+             || strstr(base, "init"))
+        return -1;
+    for (digits = ext; digits > base && isdigit((unsigned char) digits[-1]);
+                                                                    --digits)
+        ;
+    if (digits == ext || ext - digits > 9)
+        return -1;
+
+    *off = digits - filename;
+    *width = ext - digits;
+    *number = strtoul(digits, NULL, 10);
+    return 0;
+}
+
+
+/*
+ * Helper: Queue the -P segments after `filename' for prefetching: they are
+ * loaded into the cache or, with -b read, read into the page cache, so
+ * that a slow origin disk or network file system rarely makes a client
+ * wait.  Each representation keeps a window, so that segments are queued
+ * once as playback moves forward; a seek outside the window restarts it.
+ */
+static void
+read_ahead (struct server_ctx *server_ctx, const char *filename)
+{
+    struct lsquic_hash_elem *el;
+    struct ra_window *win;
+    unsigned long number, n, last;
+    size_t off, width, key_len, path_sz;
+    const char *suffix;
+    char *key, *path;
+
+    if (server_ctx->readahead == 0
+            || 0 != parse_segment_number(filename, &off, &width, &number))
+        return;
+    suffix = filename + off + width;
+
+    key_len = strlen(filename) - width;
+    key = malloc(key_len + 1);
+    if (!key)
+        return;
+    memcpy(key, filename, off);
+    strcpy(key + off, suffix);
+
+    el = lsquic_hash_find(server_ctx->ra_windows, key, key_len);
+    if (el)
+    {
+        free(key);
+        win = lsquic_hashelem_getdata(el);
+    }
+    else
+    {
+        win = calloc(1, sizeof(*win));
+        if (!win)
+        {
+            free(key);
+            return;
+        }
+        win->rw_key = key;
+        if (!lsquic_hash_insert(server_ctx->ra_windows, key, key_len, win,
+                                                            &win->rw_hash_el))
+        {
+            free(key);
+            free(win);
+            return;
+        }
+    }
+
+    path_sz = strlen(filename) + 12;
+    path = malloc(path_sz);
+    if (!path)
+        return;
+    last = number + server_ctx->readahead;
+    n = win->rw_next;
+    if (n <= number || n > last + 1)
+        n = number + 1;
+    for (; n <= last; ++n)
+    {
+        snprintf(path, path_sz, "%.*s%0*lu%s", (int) off, filename,
+                                                    (int) width, n, suffix);
+        if (server_ctx->file_cache
+                            && file_cache_has(server_ctx->file_cache, path))
+            continue;
+        /* Queue is full: try again on the next request */
+        if (0 != prefetch_submit(server_ctx->prefetch, path, 0))
+            break;
+    }
+    win->rw_next = n;
+    free(path);
+}
+
+
+/*
+ * Reader: Copy what the packager has written so far out of a growing
+ * segment.  If the file cannot be read, on_write resets the stream.
+ */
+static size_t
+live_reader_size (void *lsqr_ctx)
+{
+    lsquic_stream_ctx_t *const st_h = lsqr_ctx;
+    if (st_h->live_eof)
+        return 0;
+    return live_file_size(st_h->live) - st_h->live_off;
+}
+
+
+static size_t
+live_reader_read (void *lsqr_ctx, void *buf, size_t count)
+{
+    lsquic_stream_ctx_t *const st_h = lsqr_ctx;
+    ssize_t nread;
+
+    if (count > live_reader_size(st_h))
+        count = live_reader_size(st_h);
+    nread = read(st_h->live_fd, buf, count);
+    if (nread <= 0)
+    {
+        LSQ_WARN("cannot read %s at offset %zu: %s", st_h->req_filename,
+            st_h->live_off, nread < 0 ? strerror(errno) : "file shrank");
+        st_h->live_eof = 1;
+        return 0;
+    }
+    st_h->live_off += nread;
+    return nread;
+}
+
+
+/*
+ * Helper: In live mode (-F), follow the requested media segment if the
+ * packager is still writing it: the segment after it does not exist yet.
+ * The response then has neither a length nor validators; it stays open
+ * and carries each new CMAF chunk as it lands until the segment is
+ * complete (see live_watch.h), so that the player can start decoding a
+ * segment before its last chunk exists.
+ */
+static void
+open_live (lsquic_stream_ctx_t *st_h, const char *filename)
+{
+    struct server_ctx *const server_ctx = st_h->server_ctx;
+    unsigned long number;
+    size_t off, width, path_sz;
+    char *next_path;
+
+    if (0 != parse_segment_number(filename, &off, &width, &number))
+        return;
+    path_sz = strlen(filename) + 12;
+    next_path = malloc(path_sz);
+    if (!next_path)
+        return;
+    snprintf(next_path, path_sz, "%.*s%0*lu%s", (int) off, filename,
+                            (int) width, number + 1, filename + off + width);
+    st_h->live = live_watch_open(server_ctx->live_watch, filename, next_path);
+    free(next_path);
+    if (!st_h->live)
+        return;
+
+    st_h->live_fd = open(filename, O_RDONLY);
+    if (st_h->live_fd < 0)
+    {
+        live_watch_release(server_ctx->live_watch, st_h->live);
+        st_h->live = NULL;
+        return;
+    }
+    LSQ_DEBUG("%s is being written: follow it", filename);
+    st_h->live_off = 0;
+    st_h->status = "200";
+    st_h->content_type = select_content_type(filename);
+    st_h->reader.lsqr_read = live_reader_read;
+    st_h->reader.lsqr_size = live_reader_size;
+    st_h->reader.lsqr_ctx = st_h;
+    TAILQ_INSERT_TAIL(&server_ctx->live_streams, st_h, next_live);
+}
+
+
+static void
+free_read_ahead (struct server_ctx *server_ctx)
+{
+    struct lsquic_hash_elem *el;
+    struct ra_window *win;
+
+    while ((el = lsquic_hash_first(server_ctx->ra_windows)))
+    {
+        win = lsquic_hashelem_getdata(el);
+        lsquic_hash_erase(server_ctx->ra_windows, el);
+        free(win->rw_key);
+        free(win);
+    }
+    lsquic_hash_destroy(server_ctx->ra_windows);
+}
+
+
+#endif
+/* Priority of each class.  Nothing is incremental: the player uses a
+ * segment once it has all of it, so segments of equal urgency are better
+ * sent one after the other than interleaved.  Video segments that are
+ * not of the lowest-bandwidth representation are one less urgent.
+ *
+ * Default Cache-Control of each class.  Segments never change once
+ * written; manifests of live streams do, every segment duration.  The
+ * player page and scripts are revalidated on every use, which with
+ * ETags costs a 304.
+ */
+#define CC_IMMUTABLE "public, max-age=31536000, immutable"
+
+/* A segment still being written is not the segment: nothing may store
+ * the response, or a cache would serve the first chunks for a year.
+ */
+#define CC_LIVE "no-store"
+
+static const struct {
+    const char                  *name;
+    struct lsquic_ext_http_prio  ehp;
+    const char                  *cache_control;
+} request_classes[] = {
+    [RC_OTHER]      = { "other",    { LSQUIC_DEF_HTTP_URGENCY, 0, },
+                                                        "no-cache", },
+    [RC_MANIFEST]   = { "manifest", { 0, 0, }, "public, max-age=2", },
+    [RC_INIT]       = { "init",     { 1, 0, }, CC_IMMUTABLE, },
+    [RC_AUDIO]      = { "audio",    { 2, 0, }, CC_IMMUTABLE, },
+    [RC_TEXT]       = { "text",     { 2, 0, }, CC_IMMUTABLE, },
+    [RC_VIDEO]      = { "video",    { 3, 0, }, CC_IMMUTABLE, },
+};
+
+
+/*
+ * Helper: Classify a request by its file.  Segments of the manifests
+ * sent so far are classified by their representation, others by name.
+ * `lowest' is cleared for segments of all but the lowest-bandwidth
+ * representation of their content type.
+ */
+static enum request_class
+classify_request (const struct server_ctx *server_ctx, const char *filename,
+                  int *lowest)
+{
+    struct mpd_match match;
+    const char *base;
+
+    *lowest = 1;
+    if (ends_with(filename, ".mpd") || ends_with(filename, ".m3u8"))
+        return RC_MANIFEST;
+
+    if (0 == mpd_index_lookup(server_ctx->mpd_index, filename, &match))
+    {
+        *lowest = match.mm_lowest;
+        if (match.mm_init)
+            return RC_INIT;
+        switch (match.mm_content)
+        {
+        case MPDC_AUDIO:    return RC_AUDIO;
+        case MPDC_TEXT:     return RC_TEXT;
+        default:            return RC_VIDEO;
+        }
+    }
+
+    base = strrchr(filename, '/');
+    base = base ? base + 1 : filename;
+    if (!(ends_with(base, ".m4s") || ends_with(base, ".m4v")
+            || ends_with(base, ".m4a") || ends_with(base, ".mp4")
+            || ends_with(base, ".webm")))
+        return RC_OTHER;
+    if (strstr(base, "init"))
+        return RC_INIT;
+    if (ends_with(base, ".m4a") || strstr(base, "audio"))
+        return RC_AUDIO;
+    return RC_VIDEO;
+}
+
+
+/*
+ * Helper: Classify the request and, unless -U off, set the stream's
+ * priority by class.  lsquic has already applied the client's Priority
+ * header: the parameters that it gives are kept.
+ */
+static void
+set_priority (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+{
+    struct lsquic_ext_http_prio ehp, client;
+    enum ppc_flags flags;
+    const char *val;
+    size_t len;
+    int lowest;
+    char scratch[0x100];
+
+    st_h->req_class = classify_request(st_h->server_ctx, st_h->req_filename,
+                                                                    &lowest);
+    if (!st_h->server_ctx->prioritize)
+        return;
+
+    ehp = request_classes[st_h->req_class].ehp;
+    if (st_h->req_class == RC_VIDEO && !lowest)
+        ++ehp.urgency;
+    val = find_header(st_h->req_buf, st_h->req_sz, "priority", &len);
+    if (val)
+    {
+        /* Only the parameters present are set */
+        client = ehp;
+        flags = 0;
+        if (0 == lsquic_http_parse_pfv(val, len, &flags, &client, scratch,
+                                                            sizeof(scratch)))
+            ehp = client;
+    }
+
+    LSQ_DEBUG("%s: %s, urgency %hhu, incremental %hhd", st_h->req_filename,
+        request_classes[st_h->req_class].name, ehp.urgency, ehp.incremental);
+    (void) lsquic_stream_set_http_prio(stream, &ehp);
+}
+
+
+#define MAX_MANIFEST_SIZE (1 << 20)
+
+/*
+ * Helper: Index the representations of a DASH manifest that is being
+ * sent, so that requests for its segments can be classified.
+ */
+static void
+index_manifest (lsquic_stream_ctx_t *st_h)
+{
+    const char *const filename = st_h->req_filename;
+    struct mpd_index *const index = st_h->server_ctx->mpd_index;
+    char *buf;
+    FILE *file;
+    size_t size;
+    int n;
+
+    if (st_h->fc_entry)
+        n = mpd_index_update(index, filename,
+                                    (const char *) st_h->fc_entry->fce_buf,
+                                    st_h->fc_entry->fce_size);
+    else
+    {
+        /* Manifests are small: reading this one twice costs little */
+        if (st_h->file_size > MAX_MANIFEST_SIZE)
+            return;
+        file = fopen(filename, "rb");
+        if (!file)
+            return;
+        buf = malloc(st_h->file_size);
+        size = buf ? fread(buf, 1, st_h->file_size, file) : 0;
+        (void) fclose(file);
+        n = buf ? mpd_index_update(index, filename, buf, size) : -1;
+        free(buf);
+    }
+
+    if (n >= 0)
+        LSQ_DEBUG("%s: indexed %d representations", filename, n);
+    else
+        LSQ_WARN("cannot index %s", filename);
+}
+
+
+/*
+ * Helper: Set up the response to a parsed request and start writing it
+ */
+static void
+serve_file (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+{
+    const char *const filename = st_h->req_filename;
+    size_t off, len;
+
+    /* Set up file reader, unless open_live() has */
+    if (!st_h->live && 0 != open_reader(st_h, filename,
+                                        st_h->range_type != RANGE_NONE))
+    {
+        LSQ_WARN("File not found: %s", filename);
+        send_error(stream, st_h, "404");
+        return;
+    }
+
+    if (st_h->live)
+        st_h->cache_control = CC_LIVE;
+    else if (st_h->server_ctx->immutable_prefix
+            && 0 == strncmp(st_h->req_path, st_h->server_ctx->immutable_prefix,
+                                strlen(st_h->server_ctx->immutable_prefix)))
+        st_h->cache_control = CC_IMMUTABLE;
+    else
+        st_h->cache_control = st_h->server_ctx->cache_control[st_h->req_class];
+
+    if (not_modified(st_h))
+    {
+        LSQ_DEBUG("%s not modified", filename);
+        send_not_modified(stream, st_h);
+        return;
+    }
+
+    if (st_h->range_type != RANGE_NONE && !if_range_matches(st_h))
+    {
+        LSQ_DEBUG("If-Range does not match %s: send all of it", filename);
+        st_h->range_type = RANGE_NONE;
+    }
+
+    if (st_h->range_type == RANGE_MULTI || (st_h->range_type == RANGE_SINGLE
+            && 0 != resolve_range(&st_h->range, st_h->file_size, &off, &len)))
+    {
+        LSQ_INFO("Range `%.*s' not satisfiable for %s", (int) st_h->range_len,
+                                                st_h->range_val, filename);
+        snprintf(st_h->content_range, sizeof(st_h->content_range),
+                                            "bytes */%zu", st_h->file_size);
+        send_error(stream, st_h, "416");
+        return;
+    }
+
+    if (st_h->range_type == RANGE_SINGLE)
+    {
+        LSQ_DEBUG("Serving bytes %zu-%zu of %s", off, off + len - 1, filename);
+        if (0 != set_range(st_h, off, len))
+        {
+            send_error(stream, st_h, "500");
+            return;
+        }
+    }
+
+    if (st_h->range_type == RANGE_NONE && ends_with(filename, ".mpd"))
+        index_manifest(st_h);
+
+#ifndef WIN32
+    /* The segments after a growing one do not exist yet */
+    if (st_h->server_ctx->prefetch && !st_h->live)
+        read_ahead(st_h->server_ctx, filename);
+#endif
+
+    /* Ready to write response */
+    lsquic_stream_shutdown(stream, 0);  /* Done reading */
+    lsquic_stream_wantwrite(stream, 1);
+}
+
+
+/*
+ * Callback: Stream has data to read
+ */
+static void
+video_server_on_read (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+{
+    unsigned char buf[0x400];
+    ssize_t nread;
+    char *path;
+    char *filename;
+
+    /* Read request data */
+    nread = lsquic_stream_read(stream, buf, sizeof(buf) - 1);
+
+    if (nread > 0)
+    {
+        /* Accumulate request data */
+        char *new_buf = realloc(st_h->req_buf, st_h->req_sz + nread + 1);
+        if (!new_buf)
+        {
+            LSQ_ERROR("Memory allocation failed");
+            lsquic_stream_close(stream);
+            return;
+        }
+        st_h->req_buf = new_buf;
+        memcpy(st_h->req_buf + st_h->req_sz, buf, nread);
+        st_h->req_sz += nread;
+        st_h->req_buf[st_h->req_sz] = '\0';
+        return;
+    }
+
+    if (nread < 0)
+    {
+        LSQ_ERROR("Error reading: %s", strerror(errno));
+        lsquic_stream_close(stream);
+        return;
+    }
+
+    /* nread == 0: End of request */
+    LSQ_INFO("Got request: `%.*s'", (int)(st_h->req_sz > 100 ? 100 : st_h->req_sz),
+             st_h->req_buf ? st_h->req_buf : "");
+
+    /* Parse request path */
+    path = parse_request_path(st_h->req_buf, st_h->req_sz);
+    if (!path)
+    {
+        LSQ_WARN("Failed to parse request path");
+        send_error(stream, st_h, "400");
+        return;
+    }
+
+    /* Construct full filename */
+    filename = malloc(strlen(st_h->server_ctx->document_root) + strlen(path) + 2);
+    if (!filename)
+    {
+        free(path);
+        LSQ_ERROR("Memory allocation failed");
+        lsquic_stream_close(stream);
+        return;
+    }
+
+    strcpy(filename, st_h->server_ctx->document_root);
+    if (path[0] != '/')
+        strcat(filename, "/");
+    strcat(filename, path);
+
+    LSQ_INFO("Serving file: %s", filename);
+
+    st_h->req_filename = filename;
+    st_h->req_path = path;
+
+    st_h->range_val = find_header(st_h->req_buf, st_h->req_sz, "range",
+                                                        &st_h->range_len);
+    if (st_h->range_val)
+        st_h->range_type = parse_range(st_h->range_val, st_h->range_len,
+                                                            &st_h->range);
+    else
+        st_h->range_type = RANGE_NONE;
+
+    set_priority(stream, st_h);
+
+#ifndef WIN32
+    if (st_h->server_ctx->live_watch && st_h->range_type == RANGE_NONE)
+        open_live(st_h, filename);
+
+    /* Wait for a worker to load the whole file into the cache.  Ranges
+     * are not: they only read their bytes.  Without a cache the worker
+     * could only warm the page cache, and the stream would read the file
+     * again.
+     */
+    if (st_h->server_ctx->prefetch && st_h->server_ctx->file_cache
+            && !st_h->live && st_h->range_type == RANGE_NONE
+            && !file_cache_has(st_h->server_ctx->file_cache, filename)
+            && 0 == prefetch_submit(st_h->server_ctx->prefetch, filename, 1))
+    {
+        LSQ_DEBUG("wait for %s to be loaded", filename);
+        lsquic_stream_wantread(stream, 0);
+        TAILQ_INSERT_TAIL(&st_h->server_ctx->parked, st_h, next_parked);
+        st_h->parked = 1;
+        return;
+    }
+#endif
+
+    serve_file(stream, st_h);
+}
+
+
+#ifndef WIN32
+/*
+ * Callback: A prefetch thread is done with `path'.  Streams waiting for
+ * it are served now; the file is in the cache or the page cache, or the
+ * request fails as it would have without prefetching.
+ */
+static void
+video_server_on_prefetched (void *ctx, const char *path, int err)
+{
+    struct server_ctx *const server_ctx = ctx;
+    lsquic_stream_ctx_t *st_h, *next;
+    int resumed;
+
+    resumed = 0;
+    for (st_h = TAILQ_FIRST(&server_ctx->parked); st_h; st_h = next)
+    {
+        next = TAILQ_NEXT(st_h, next_parked);
+        if (0 == strcmp(st_h->req_filename, path))
+        {
+            TAILQ_REMOVE(&server_ctx->parked, st_h, next_parked);
+            st_h->parked = 0;
+            serve_file(st_h->stream, st_h);
+            resumed = 1;
+        }
+    }
+
+    if (resumed)
+        prog_process_conns(server_ctx->prog);
+}
+
+
+/*
+ * Callback: A growing segment has more bytes or is complete.  The streams
+ * following it are waiting for either.
+ */
+static void
+video_server_on_live_change (void *ctx, struct live_file *file)
+{
+    struct server_ctx *const server_ctx = ctx;
+    lsquic_stream_ctx_t *st_h;
+    int resumed;
+
+    resumed = 0;
+    TAILQ_FOREACH(st_h, &server_ctx->live_streams, next_live)
+        if (st_h->live == file)
+        {
+            lsquic_stream_wantwrite(st_h->stream, 1);
+            resumed = 1;
+        }
+
+    if (resumed)
+        prog_process_conns(server_ctx->prog);
+}
+
+
+#endif
+/*
+ * Callback: Stream is ready for writing
+ */
+static void
+video_server_on_write (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+{
+    ssize_t nw;
+
+    /* Send headers first */
+    if (!st_h->headers_sent)
+    {
+        if (0 != send_headers(stream, st_h))
+        {
+            lsquic_stream_close(stream);
+            return;
+        }
+    }
+
+    /* Write file content */
+    if (st_h->reader.lsqr_ctx && st_h->reader.lsqr_size(st_h->reader.lsqr_ctx) > 0)
+    {
+        nw = lsquic_stream_writef(stream, &st_h->reader);
+        if (nw < 0)
+        {
+            LSQ_ERROR("Write error: %s", strerror(errno));
+            lsquic_stream_close(stream);
+            return;
+        }
+        if (nw > 0 && st_h->bytes_sent == 0 && st_h->server_ctx->req_log)
+            (void) evutil_gettimeofday(&st_h->t_first_byte, NULL);
+        st_h->bytes_sent += nw;
+
+        /* More data to write? */
+        if (st_h->reader.lsqr_size(st_h->reader.lsqr_ctx) > 0)
+        {
+            lsquic_stream_wantwrite(stream, 1);
+            return;
+        }
+    }
+
+#ifndef WIN32
+    /* The body has no Content-Length: ending it with a FIN before all of
+     * the segment is sent would pass a truncated segment for a whole one.
+     */
+    if (st_h->live && st_h->live_eof)
+    {
+        LSQ_WARN("%s: reset the response after %zu bytes",
+                                    st_h->req_filename, st_h->live_off);
+        if ((1 << lsquic_conn_quic_version(lsquic_stream_conn(stream)))
+                                                    & LSQUIC_IETF_VERSIONS)
+            lsquic_stream_reset(stream, 0x102 /* H3_INTERNAL_ERROR */);
+        else
+            lsquic_stream_reset(stream, 1 /* QUIC_ERROR_PROCESSING_STREAM */);
+        return;
+    }
+
+    /* Wait for the packager to write more */
+    if (st_h->live && !live_file_is_final(st_h->live))
+    {
+        lsquic_stream_wantwrite(stream, 0);
+        return;
+    }
+#endif
+
+    /* Done writing */
+    if (st_h->server_ctx->req_log)
+        (void) evutil_gettimeofday(&st_h->t_done, NULL);
+    lsquic_stream_shutdown(stream, 1);
+}
+
+
+/* Write string as a JSON string literal */
+static void
+json_put_str (FILE *out, const char *str)
+{
+    const unsigned char *p;
+
+    putc('"', out);
+    for (p = (const unsigned char *) str; *p; ++p)
+        if (*p == '"' || *p == '\\')
+            fprintf(out, "\\%c", *p);
+        else if (*p < 0x20)
+            fprintf(out, "\\u%04x", *p);
+        else
+            putc(*p, out);
+    putc('"', out);
+}
+
+
+/*
+ * Helper: Append the request record to the request log (-R).  The
+ * connection state is sampled now, when the response is finished or
+ * abandoned.  Requests that never got a response are not logged.
+ * Timestamps are milliseconds since the epoch, so that the records can be
+ * joined with client-side QoE samples (see server_stats.py).
+ */
+static void
+log_request (lsquic_stream_ctx_t *st_h)
+{
+    FILE *const out = st_h->server_ctx->req_log;
+    struct lsquic_conn_info info;
+    struct lsquic_ext_http_prio ehp;
+    const lsquic_conn_ctx_t *conn_h;
+    lsquic_conn_t *conn;
+    const lsquic_cid_t *cid;
+    struct timeval now;
+    int complete;
+    char cid_str[MAX_CID_LEN * 2 + 1];
+
+    if (!st_h->status)
+        return;
+
+    complete = st_h->t_done.tv_sec != 0;
+    if (!complete)
+        (void) evutil_gettimeofday(&now, NULL);
+    conn = lsquic_stream_conn(st_h->stream);
+    cid = lsquic_conn_id(conn);
+    lsquic_hexstr(cid->idbuf, cid->len, cid_str, sizeof(cid_str));
+    if (0 != lsquic_conn_get_info(conn, &info))
+        memset(&info, 0, sizeof(info));
+
+    fprintf(out, "{\"ts\":%.3f,\"conn\":\"%s\",\"stream\":%"PRIu64
+        ",", tv_ms(&st_h->t_start), cid_str,
+        (uint64_t) lsquic_stream_id(st_h->stream));
+    if (st_h->server_ctx->worker_id >= 0)
+        fprintf(out, "\"worker\":%d,", st_h->server_ctx->worker_id);
+    fputs("\"path\":", out);
+    json_put_str(out, st_h->req_path ? st_h->req_path : "");
+    fprintf(out, ",\"class\":\"%s\"", request_classes[st_h->req_class].name);
+    if (0 == lsquic_stream_get_http_prio(st_h->stream, &ehp))
+        fprintf(out, ",\"urgency\":%u,\"incremental\":%s",
+            (unsigned) ehp.urgency, ehp.incremental ? "true" : "false");
+    fprintf(out, ",\"status\":%s,\"bytes\":%zu,\"complete\":%s,",
+        st_h->status, st_h->bytes_sent, complete ? "true" : "false");
+    if (st_h->live)
+        fputs("\"live\":true,", out);
+    if (st_h->t_first_byte.tv_sec)
+        fprintf(out, "\"ttfb_ms\":%.3f,",
+            tv_ms(&st_h->t_first_byte) - tv_ms(&st_h->t_start));
+    else
+        fputs("\"ttfb_ms\":null,", out);
+    fprintf(out, "\"duration_ms\":%.3f,\"srtt_us\":%u,\"rttvar_us\":%u,"
+        "\"min_rtt_us\":%u,\"cwnd\":%"PRIu64",\"bytes_in_flight\":%u,"
+        "\"pacing_rate\":%"PRIu64",\"cc\":\"%s\"",
+        tv_ms(complete ? &st_h->t_done : &now) - tv_ms(&st_h->t_start),
+        info.lci_srtt, info.lci_rttvar, info.lci_min_rtt, info.lci_cwnd,
+        info.lci_bytes_in_flight, info.lci_pacing_rate,
+        cc_algo_name(info.lci_cc_algo));
+    conn_h = lsquic_conn_get_ctx(conn);
+    if (conn_h && conn_h->cc_algo)
+        fprintf(out, ",\"cc_assigned\":\"%s\"",
+                                            cc_algo_name(conn_h->cc_algo));
+    fputs("}\n", out);
+}
+
+
+/*
+ * Callback: Stream closed
+ */
+static void
+video_server_on_close (lsquic_stream_t *stream, lsquic_stream_ctx_t *st_h)
+{
+    const lsquic_conn_ctx_t *conn_h;
+
+    LSQ_DEBUG("Stream closed");
+
+    if (st_h->server_ctx->req_log)
+        log_request(st_h);
+    if (st_h->status)
+    {
+        ++st_h->server_ctx->n_requests;
+        st_h->server_ctx->bytes_sent += st_h->bytes_sent;
+        conn_h = lsquic_conn_get_ctx(lsquic_stream_conn(stream));
+        if (conn_h && conn_h->cc_algo)
+        {
+            ++st_h->server_ctx->cc_stats[conn_h->cc_algo - 1].requests;
+            st_h->server_ctx->cc_stats[conn_h->cc_algo - 1].bytes_sent
+                                                        += st_h->bytes_sent;
+        }
+    }
+
+    if (st_h->parked)
+        TAILQ_REMOVE(&st_h->server_ctx->parked, st_h, next_parked);
+
+    free(st_h->req_buf);
+    free(st_h->req_filename);
+    free(st_h->req_path);
+
+    if (st_h->fc_entry)
+        file_cache_release(st_h->server_ctx->file_cache, st_h->fc_entry);
+#ifndef WIN32
+    else if (st_h->live)
+    {
+        TAILQ_REMOVE(&st_h->server_ctx->live_streams, st_h, next_live);
+        (void) close(st_h->live_fd);
+        live_watch_release(st_h->server_ctx->live_watch, st_h->live);
+    }
+#endif
+    else if (st_h->reader.lsqr_ctx)
+        destroy_lsquic_reader_ctx(st_h->reader.lsqr_ctx);
+
+    free(st_h);
+}
+
+
+static void
+log_fc_stats (const char *who, const struct fc_stats *stats)
+{
+    LSQ_NOTICE("%s: %lu hits, %lu misses (%.1f%% hit rate), "
+        "%lu evictions, %lu invalidations, %lu uncacheable, "
+        "%lu prefetched; %u entries, %zu bytes", who,
+        stats->hits, stats->misses,
+        stats->hits + stats->misses
+            ? 100.0 * stats->hits / (stats->hits + stats->misses) : 0.0,
+        stats->evictions, stats->invalidations, stats->uncacheable,
+        stats->prefetched, stats->n_entries, stats->n_bytes);
+}
+
+
+static void
+log_cc_stats (const char *who, const struct cc_arm_stats *stats)
+{
+    unsigned n;
+
+    for (n = 0; n < N_CC_ALGOS; ++n)
+        if (stats[n].conns)
+            LSQ_NOTICE("%s %s: %lu connections, %lu requests, "
+                "%llu bytes sent", who, cc_algo_name(n + 1), stats[n].conns,
+                stats[n].requests, stats[n].bytes_sent);
+}
+
+
+#ifndef WIN32
+static void
+log_pf_stats (const char *who, const struct pf_stats *stats)
+{
+    LSQ_NOTICE("%s: %lu submitted, %lu waited for, %lu dropped, "
+        "%lu completed, %lu failed; %u pending", who,
+        stats->submitted, stats->urgent, stats->dropped,
+        stats->completed, stats->failed, stats->n_pending);
+}
+
+
+/*
+ * Helper: Publish this worker's counters for the parent to aggregate
+ */
+static void
+update_worker_stats (const struct server_ctx *server_ctx)
+{
+    struct worker_stats *const ws = workers_my_stats(server_ctx->workers);
+    unsigned n;
+
+    ws->ws_n_conns = server_ctx->n_current_conns;
+    ws->ws_n_requests = server_ctx->n_requests;
+    ws->ws_bytes_sent = server_ctx->bytes_sent;
+    if (server_ctx->file_cache)
+        file_cache_get_stats(server_ctx->file_cache, &ws->ws_fc);
+    if (server_ctx->prefetch)
+        prefetch_get_stats(server_ctx->prefetch, &ws->ws_pf);
+    for (n = 0; n < N_CC_ALGOS; ++n)
+    {
+        ws->ws_cc[n].conns      = server_ctx->cc_stats[n].conns;
+        ws->ws_cc[n].requests   = server_ctx->cc_stats[n].requests;
+        ws->ws_cc[n].bytes_sent = server_ctx->cc_stats[n].bytes_sent;
+    }
+}
+
+
+/*
+ * Callback: Log the workers' counters in the parent process
+ */
+static void
+log_worker_stats (void *ctx, const struct worker_stats *ws,
+                  unsigned n_workers)
+{
+    const struct server_ctx *const server_ctx = ctx;
+    struct worker_stats total;
+    struct cc_arm_stats cc_total[N_CC_ALGOS];
+    unsigned n, i;
+
+    memset(&total, 0, sizeof(total));
+    memset(cc_total, 0, sizeof(cc_total));
+    for (n = 0; n < n_workers; ++n)
+    {
+        LSQ_NOTICE("worker %u (pid %d): %u connections, %lu requests, "
+            "%llu bytes sent", n, ws[n].ws_pid, ws[n].ws_n_conns,
+            ws[n].ws_n_requests, ws[n].ws_bytes_sent);
+        total.ws_n_conns        += ws[n].ws_n_conns;
+        total.ws_n_requests     += ws[n].ws_n_requests;
+        total.ws_bytes_sent     += ws[n].ws_bytes_sent;
+        total.ws_fc.hits        += ws[n].ws_fc.hits;
+        total.ws_fc.misses      += ws[n].ws_fc.misses;
+        total.ws_fc.evictions   += ws[n].ws_fc.evictions;
+        total.ws_fc.invalidations += ws[n].ws_fc.invalidations;
+        total.ws_fc.uncacheable += ws[n].ws_fc.uncacheable;
+        total.ws_fc.prefetched  += ws[n].ws_fc.prefetched;
+        total.ws_fc.n_entries   += ws[n].ws_fc.n_entries;
+        total.ws_fc.n_bytes     += ws[n].ws_fc.n_bytes;
+        total.ws_pf.submitted   += ws[n].ws_pf.submitted;
+        total.ws_pf.urgent      += ws[n].ws_pf.urgent;
+        total.ws_pf.dropped     += ws[n].ws_pf.dropped;
+        total.ws_pf.completed   += ws[n].ws_pf.completed;
+        total.ws_pf.failed      += ws[n].ws_pf.failed;
+        total.ws_pf.n_pending   += ws[n].ws_pf.n_pending;
+        for (i = 0; i < N_CC_ALGOS; ++i)
+        {
+            cc_total[i].conns       += ws[n].ws_cc[i].conns;
+            cc_total[i].requests    += ws[n].ws_cc[i].requests;
+            cc_total[i].bytes_sent  += ws[n].ws_cc[i].bytes_sent;
+        }
+    }
+
+    LSQ_NOTICE("all %u workers: %u connections, %lu requests, "
+        "%llu bytes sent", n_workers, total.ws_n_conns,
+        total.ws_n_requests, total.ws_bytes_sent);
+    if (server_ctx->backend == RB_CACHE)
+        log_fc_stats("file cache, all workers", &total.ws_fc);
+    if (server_ctx->prefetch_threads > 0)
+        log_pf_stats("prefetch, all workers", &total.ws_pf);
+    if (server_ctx->cc_assign != CCA_OFF)
+        log_cc_stats("all workers, congestion controller", cc_total);
+}
+
+
+#endif
+static void
+log_stats (const struct server_ctx *server_ctx)
+{
+    struct fc_stats stats;
+#ifndef WIN32
+    struct pf_stats pf_stats;
+#endif
+
+    if (server_ctx->req_log)
+        (void) fflush(server_ctx->req_log);
+
+#ifndef WIN32
+    if (server_ctx->workers)
+    {
+        /* The parent logs them */
+        update_worker_stats(server_ctx);
+        return;
+    }
+#endif
+
+    if (server_ctx->file_cache)
+    {
+        file_cache_get_stats(server_ctx->file_cache, &stats);
+        log_fc_stats("file cache", &stats);
+    }
+
+#ifndef WIN32
+    if (server_ctx->prefetch)
+    {
+        prefetch_get_stats(server_ctx->prefetch, &pf_stats);
+        log_pf_stats("prefetch", &pf_stats);
+    }
+#endif
+
+    if (server_ctx->cc_assign != CCA_OFF)
+        log_cc_stats("congestion controller", server_ctx->cc_stats);
+}
+
+
+static void
+stats_timer_handler (evutil_socket_t fd, short what, void *arg)
+{
+    struct server_ctx *const server_ctx = arg;
+
+    log_stats(server_ctx);
+    /* Not persistent: let the event loop exit once the engine is stopped */
+    if (!prog_is_stopped())
+        event_add(server_ctx->stats_timer, &server_ctx->stats_interval);
+}
+
+
+/*
+ * Timer: Sample the RTT, congestion window, bytes in flight, pacing rate
+ * and losses of every connection with a qlog file (-Q), every -q
+ * milliseconds (see qlog_writer.h).  qlog_reader.py turns these files
+ * into time series.
+ */
+static void
+qlog_timer_handler (evutil_socket_t fd, short what, void *arg)
+{
+    struct server_ctx *const server_ctx = arg;
+    struct lsquic_conn_ctx *conn_h;
+
+    TAILQ_FOREACH(conn_h, &server_ctx->qlog_conns, next_qlog)
+        qlog_writer_sample(conn_h->qlog, conn_h->conn);
+    if (!prog_is_stopped())
+        event_add(server_ctx->qlog_timer, &server_ctx->qlog_interval);
+}
+
+
+/* Stream callback interface */
+static const struct lsquic_stream_if video_server_if = {
+    .on_new_conn    = video_server_on_new_conn,
+    .on_conn_closed = video_server_on_conn_closed,
+    .on_new_stream  = video_server_on_new_stream,
+    .on_read        = video_server_on_read,
+    .on_write       = video_server_on_write,
+    .on_close       = video_server_on_close,
+};
+
+
+#define DEFAULT_MAX_ENTRIES 1024
+#define DEFAULT_CACHE_SIZE "256M"
+#define DEFAULT_REVALIDATE_MS 1000
+/* The harness keeps a pinned dash.js under this prefix (-I), in a
+ * directory named after its version, so the player is loaded from this
+ * origin once rather than from a CDN on every run.
+ */
+#define DEFAULT_IMMUTABLE_PREFIX "/dashjs/"
+#define DEFAULT_READAHEAD 3
+#define DEFAULT_PREFETCH_QUEUE 256
+#define DEFAULT_QLOG_INTERVAL_MS 10
+#define DEFAULT_LIVE_POLL_MS 50
+
+
+/*
+ * Helper: Parse -K CLASS=VALUE, such as "manifest=no-cache"
+ */
+static int
+parse_cache_control (struct server_ctx *server_ctx, const char *spec)
+{
+    const char *eq;
+    unsigned rc;
+
+    eq = strchr(spec, '=');
+    if (!eq)
+        return -1;
+    for (rc = 0; rc < N_REQUEST_CLASSES; ++rc)
+        if ((size_t) (eq - spec) == strlen(request_classes[rc].name)
+                && 0 == strncmp(spec, request_classes[rc].name, eq - spec))
+        {
+            server_ctx->cache_control[rc] = eq[1] ? eq + 1 : NULL;
+            return 0;
+        }
+    return -1;
+}
+
+
+/*
+ * Helper: Parse -x KEY[:ALGOS], such as "random" or "sni:cubic,bbr"
+ */
+static int
+parse_cc_assign (struct server_ctx *server_ctx, const char *spec)
+{
+    static const char *const keys[] = {
+        [CCA_RANDOM]    = "random",
+        [CCA_SNI]       = "sni",
+        [CCA_TAG]       = "tag",
+    };
+    const char *algos, *p;
+    unsigned key, cc_algo;
+    size_t len;
+
+    algos = strchr(spec, ':');
+    len = algos ? (size_t) (algos - spec) : strlen(spec);
+    for (key = CCA_RANDOM; key <= CCA_TAG; ++key)
+        if (len == strlen(keys[key]) && 0 == strncmp(spec, keys[key], len))
+            break;
+    if (key > CCA_TAG)
+        return -1;
+    server_ctx->cc_assign = key;
+
+    server_ctx->n_cc_arms = 0;
+    if (!algos)
+    {
+        for (cc_algo = 1; cc_algo <= N_CC_ALGOS; ++cc_algo)
+            server_ctx->cc_arms[server_ctx->n_cc_arms++] = cc_algo;
+        return 0;
+    }
+    for (p = algos + 1; ; p += len + 1)
+    {
+        len = strcspn(p, ",");
+        for (cc_algo = 1; cc_algo <= N_CC_ALGOS; ++cc_algo)
+            if (len == strlen(cc_algo_name(cc_algo))
+                                && 0 == strncmp(p, cc_algo_name(cc_algo), len))
+                break;
+        if (cc_algo > N_CC_ALGOS || server_ctx->n_cc_arms >= N_CC_ALGOS)
+            return -1;
+        server_ctx->cc_arms[server_ctx->n_cc_arms++] = cc_algo;
+        if (p[len] == '\0')
+            return 0;
+    }
+}
+
+
+static void
+usage (const char *prog_name)
+{
+    printf(
 "Usage: %s [options]\n"
 "\n"
 "Options:\n"
@@ -424,16 +2125,67 @@ usage (const char *prog_name)
 "   -s IP:PORT  Server address and port (e.g., 0.0.0.0:443)\n"
 "   -A ALGO     Congestion control algorithm:\n"
 "                 1 = Cubic\n"
-"                 2 = BBRv1\n"
-"                 3 = Adaptive (default)\n"
+"                 2 = BBRv1 (default)\n"
+"                 3 = Adaptive\n"
 "   -c CERT     Certificate spec: domain,cert.pem,key.pem\n"
+"   -b BACKEND  How files are read:\n"
+"                 read   = read(2) per request (default)\n"
+"                 mmap   = file cache holding mmap()ed files; memory\n"
+"                          with -F\n"
+"                 memory = file cache holding file contents in memory\n"
+"   -C SIZE     File cache budget in bytes; K, M, G suffixes (default: %s)\n"
+"   -n N        Maximum number of files in the file cache (default: %u)\n"
+"   -E POLICY   File cache eviction policy: lru (default) or lfu\n"
+"   -V MS       Check cached files for changes at most every MS\n"
+"                 milliseconds; 0 checks on every hit (default: %u)\n"
+"   -p THREADS  Read files on THREADS worker threads instead of the\n"
+"                 event loop (default: 0, off)\n"
+"   -P N        With -p, read N segments ahead of each media segment\n"
+"                 request (default: %u)\n"
+"   -w N        Run N worker processes sharing the port (default: 1)\n"
+"   -U on|off   Set response priorities by request class; with off,\n"
+"                 only the client's Priority header counts (default: on)\n"
+"   -x KEY[:ALGOS]\n"
+"               Assign each connection one of ALGOS (default:\n"
+"                 cubic,bbr,adaptive), by KEY:\n"
+"                 random = at random\n"
+"                 sni    = by a hash of the SNI\n"
+"                 tag    = named by the first label of the SNI\n"
+"                          (bbr.example.com), else at random\n"
+"                 -A is then ignored\n"
+"   -T SEC      Log file cache and prefetch counters and flush the\n"
+"                 request log every SEC seconds\n"
+"   -R FILE     Append a JSON record for every request, and for every\n"
+"                 adaptive congestion controller choice, to FILE\n"
+"   -I PREFIX   Serve paths starting with PREFIX as immutable; empty\n"
+"                 disables (default: %s)\n"
+"   -K CLASS=VALUE\n"
+"               Cache-Control of responses of CLASS (other, manifest,\n"
+"                 init, audio, text, video); empty VALUE sends none.\n"
+"                 Defaults: other no-cache, manifest public, max-age=2,\n"
+"                 segments public, max-age=31536000, immutable\n"
+"   -Q DIR      Write a qlog file for every connection to DIR\n"
+"   -q MS       With -Q, sample the connections every MS milliseconds\n"
+"                 (default: %u)\n"
+"   -F MS       Live mode: stream media segments that are still being\n"
+"                 written as they grow.  A segment is complete once the\n"
+"                 next one exists or it has not changed for MS\n"
+"                 milliseconds.  Growing segments are sent with\n"
+"                 Cache-Control: no-store.  -V is then 0, and -b mmap\n"
+"                 is -b memory\n"
+"   -f MS       With -F, stat() growing segments every MS milliseconds\n"
+"                 instead of using inotify, which does not see writes\n"
+"                 made on other hosts of a network file system\n"
+"                 (default: inotify where available, else %u)\n"
 "   -L LEVEL    Log level (debug, info, notice, warn, error)\n"
 "   -h          Print this help message\n"
 "\n"
 "Example:\n"
 "   %s -s 0.0.0.0:443 -r ./video -A 2 -c example.com,cert.pem,key.pem\n"
 "\n",
-        prog_name, prog_name);
+        prog_name, DEFAULT_CACHE_SIZE, DEFAULT_MAX_ENTRIES,
+        DEFAULT_REVALIDATE_MS, DEFAULT_READAHEAD, DEFAULT_IMMUTABLE_PREFIX,
+        DEFAULT_QLOG_INTERVAL_MS, DEFAULT_LIVE_POLL_MS, prog_name);
 }
 
 
@@ -441,24 +2193,56 @@ int
 main (int argc, char **argv)
 {
     int opt, s;
+    unsigned n_workers, rc;
     struct stat st;
     struct server_ctx server_ctx;
     struct prog prog;
     const char *const *alpn;
+    struct fc_settings fc_settings = {
+        .fcs_storage        = FCS_MEMORY,
+        .fcs_policy         = FCP_LRU,
+        .fcs_max_entries    = DEFAULT_MAX_ENTRIES,
+        .fcs_revalidate_ms  = DEFAULT_REVALIDATE_MS,
+    };
+#ifndef WIN32
+    struct pf_settings pf_settings = {
+        .pfs_threads        = 0,
+        .pfs_max_queued     = DEFAULT_PREFETCH_QUEUE,
+    };
+    struct lw_settings lw_settings = {
+        .lws_idle_ms        = 0,    /* Set by -F: live mode */
+        .lws_poll_ms        = DEFAULT_LIVE_POLL_MS,
+        .lws_poll           = 0,
+    };
+    struct service_port *sport;
+    unsigned worker_id;
+#endif
 
     memset(&server_ctx, 0, sizeof(server_ctx));
     TAILQ_INIT(&server_ctx.sports);
     server_ctx.prog = &prog;
+    server_ctx.immutable_prefix = DEFAULT_IMMUTABLE_PREFIX;
+    server_ctx.readahead = DEFAULT_READAHEAD;
+    TAILQ_INIT(&server_ctx.parked);
+    TAILQ_INIT(&server_ctx.qlog_conns);
+    TAILQ_INIT(&server_ctx.live_streams);
+    for (rc = 0; rc < N_REQUEST_CLASSES; ++rc)
+        server_ctx.cache_control[rc] = request_classes[rc].cache_control;
+    server_ctx.qlog_interval.tv_usec = DEFAULT_QLOG_INTERVAL_MS * 1000;
+    server_ctx.worker_id = -1;
+    server_ctx.prioritize = 1;
+    n_workers = 1;
 
     /* Initialize program with server + HTTP flags */
     prog_init(&prog, LSENG_SERVER | LSENG_HTTP, &server_ctx.sports,
               &video_server_if, &server_ctx);
 
-    /* Hardcode BBR congestion control (2 = BBRv1) */
+    /* BBRv1 unless -A says otherwise */
     prog.prog_settings.es_cc_algo = 2;
 
     /* Parse command line options */
-    while (-1 != (opt = getopt(argc, argv, PROG_OPTS "r:h")))
+    (void) file_cache_parse_size(DEFAULT_CACHE_SIZE, &fc_settings.fcs_max_bytes);
+    while (-1 != (opt = getopt(argc, argv, PROG_OPTS "r:b:n:C:E:V:T:R:I:K:p:P:w:U:x:Q:q:F:f:h")))
     {
         switch (opt) {
         case 'r':
@@ -478,6 +2262,181 @@ main (int argc, char **argv)
             server_ctx.document_root = optarg;
             break;
 
+        case 'b':
+            if (0 == strcmp(optarg, "read"))
+                server_ctx.backend = RB_READ;
+            else if (0 == strcmp(optarg, "mmap"))
+            {
+#ifndef WIN32
+                server_ctx.backend = RB_CACHE;
+                fc_settings.fcs_storage = FCS_MMAP;
+                /* Pages outside the range are never faulted in */
+                server_ctx.range_loads_file = 1;
+#else
+                fprintf(stderr, "mmap backend is not supported on Windows\n");
+                exit(1);
+#endif
+            }
+            else if (0 == strcmp(optarg, "memory"))
+            {
+                server_ctx.backend = RB_CACHE;
+                fc_settings.fcs_storage = FCS_MEMORY;
+                server_ctx.range_loads_file = 0;
+            }
+            else
+            {
+                fprintf(stderr, "unknown backend `%s'\n", optarg);
+                exit(1);
+            }
+            break;
+
+        case 'n':
+            fc_settings.fcs_max_entries = atoi(optarg);
+            break;
+
+        case 'C':
+            if (0 != file_cache_parse_size(optarg, &fc_settings.fcs_max_bytes))
+            {
+                fprintf(stderr, "invalid cache size `%s'\n", optarg);
+                exit(1);
+            }
+            break;
+
+        case 'E':
+            if (0 == strcmp(optarg, "lru"))
+                fc_settings.fcs_policy = FCP_LRU;
+            else if (0 == strcmp(optarg, "lfu"))
+                fc_settings.fcs_policy = FCP_LFU;
+            else
+            {
+                fprintf(stderr, "unknown eviction policy `%s'\n", optarg);
+                exit(1);
+            }
+            break;
+
+        case 'V':
+            fc_settings.fcs_revalidate_ms = atoi(optarg);
+            break;
+
+        case 'T':
+            server_ctx.stats_interval.tv_sec = atoi(optarg);
+            break;
+
+        case 'R':
+            server_ctx.req_log = fopen(optarg, "a");
+            if (!server_ctx.req_log)
+            {
+                fprintf(stderr, "cannot open %s for appending: %s\n",
+                                                    optarg, strerror(errno));
+                exit(1);
+            }
+            /* Records are small: do not write one at a time */
+            (void) setvbuf(server_ctx.req_log, NULL, _IOFBF, 1 << 16);
+            break;
+
+        case 'I':
+            server_ctx.immutable_prefix = optarg[0] ? optarg : NULL;
+            break;
+
+        case 'K':
+            if (0 != parse_cache_control(&server_ctx, optarg))
+            {
+                fprintf(stderr, "invalid Cache-Control setting `%s'\n",
+                                                                    optarg);
+                exit(1);
+            }
+            break;
+
+        case 'Q':
+            if (-1 == stat(optarg, &st))
+            {
+                perror("stat");
+                exit(2);
+            }
+            server_ctx.qlog_dir = optarg;
+            break;
+
+        case 'q':
+            s = atoi(optarg);
+            if (s <= 0)
+            {
+                fprintf(stderr, "-q takes a positive number of "
+                                                        "milliseconds\n");
+                exit(1);
+            }
+            server_ctx.qlog_interval.tv_sec = s / 1000;
+            server_ctx.qlog_interval.tv_usec = s % 1000 * 1000;
+            break;
+
+        case 'F':
+        case 'f':
+#ifndef WIN32
+            s = atoi(optarg);
+            if (s <= 0)
+            {
+                fprintf(stderr, "-%c takes a positive number of "
+                                                "milliseconds\n", opt);
+                exit(1);
+            }
+            if (opt == 'F')
+                lw_settings.lws_idle_ms = s;
+            else
+            {
+                lw_settings.lws_poll_ms = s;
+                lw_settings.lws_poll = 1;
+            }
+#else
+            fprintf(stderr, "live mode is not supported on Windows\n");
+            exit(1);
+#endif
+            break;
+
+        case 'p':
+#ifndef WIN32
+            pf_settings.pfs_threads = atoi(optarg);
+#else
+            fprintf(stderr, "prefetch threads are not supported on Windows\n");
+            exit(1);
+#endif
+            break;
+
+        case 'P':
+            server_ctx.readahead = atoi(optarg);
+            break;
+
+        case 'w':
+            n_workers = atoi(optarg);
+#ifdef WIN32
+            if (n_workers > 1)
+            {
+                fprintf(stderr, "worker processes are not supported on "
+                                                                "Windows\n");
+                exit(1);
+            }
+#endif
+            break;
+
+        case 'U':
+            if (0 == strcmp(optarg, "on"))
+                server_ctx.prioritize = 1;
+            else if (0 == strcmp(optarg, "off"))
+                server_ctx.prioritize = 0;
+            else
+            {
+                fprintf(stderr, "-U takes `on' or `off'\n");
+                exit(1);
+            }
+            break;
+
+        case 'x':
+            if (0 != parse_cc_assign(&server_ctx, optarg))
+            {
+                fprintf(stderr, "invalid controller assignment `%s'\n",
+                                                                    optarg);
+                exit(1);
+            }
+            break;
+
         case 'h':
             usage(argv[0]);
             prog_print_common_options(&prog, stdout);
@@ -498,6 +2457,47 @@ main (int argc, char **argv)
         exit(1);
     }
 
+    /* Connections start with the adaptive controller, which runs Cubic
+     * and BBRv1 side by side, and are then switched to their own.
+     */
+    if (server_ctx.cc_assign != CCA_OFF)
+        prog.prog_settings.es_cc_algo = 3;
+
+#ifndef WIN32
+    if (lw_settings.lws_idle_ms > 0)
+    {
+        /* Cached entries of growing segments are partial */
+        fc_settings.fcs_revalidate_ms = 0;
+        /* The packager rewrites and truncates files in place: reading a
+         * mapped page past the new end of the file raises SIGBUS.
+         */
+        if (server_ctx.backend == RB_CACHE
+                                && fc_settings.fcs_storage == FCS_MMAP)
+        {
+            LSQ_WARN("live mode: use memory backend instead of mmap");
+            fc_settings.fcs_storage = FCS_MEMORY;
+            server_ctx.range_loads_file = 0;
+        }
+    }
+#endif
+
+    if (server_ctx.backend == RB_CACHE)
+    {
+        server_ctx.file_cache = file_cache_new(&fc_settings);
+        if (!server_ctx.file_cache)
+        {
+            LSQ_ERROR("Cannot create file cache");
+            exit(EXIT_FAILURE);
+        }
+    }
+
+    server_ctx.mpd_index = mpd_index_new();
+    if (!server_ctx.mpd_index)
+    {
+        LSQ_ERROR("Cannot create manifest index");
+        exit(EXIT_FAILURE);
+    }
+
     /* Set up ALPN protocols for HTTP/3 */
     alpn = lsquic_get_h3_alpns(prog.prog_settings.es_versions);
     while (*alpn)
@@ -511,6 +2511,50 @@ main (int argc, char **argv)
         }
     }
 
+#ifndef WIN32
+    /* Each worker process has its own engine.  Packets are steered to
+     * workers by connection ID (see workers.h), so a connection stays on
+     * its worker when the client's address changes.  The parent logs the
+     * workers' counters every -T seconds and on exit.
+     */
+    if (n_workers > 1)
+    {
+        server_ctx.workers = workers_new(n_workers);
+        if (!server_ctx.workers)
+        {
+            LSQ_ERROR("Cannot run %u workers: %s", n_workers, strerror(errno));
+            exit(EXIT_FAILURE);
+        }
+        /* Including the default port prog_prep() adds if there is no -s */
+        prog.prog_dummy_sport.sp_flags |= SPORT_REUSEPORT;
+        TAILQ_FOREACH(sport, &server_ctx.sports, next_sport)
+            sport->sp_flags |= SPORT_REUSEPORT;
+        prog.prog_api.ea_generate_scid = workers_generate_scid;
+        prog.prog_api.ea_gen_scid_ctx = server_ctx.workers;
+        server_ctx.prefetch_threads = pf_settings.pfs_threads;
+
+        switch (workers_fork(server_ctx.workers, &worker_id))
+        {
+        case 0:
+            s = workers_supervise(server_ctx.workers,
+                    &server_ctx.stats_interval, log_worker_stats, &server_ctx);
+            return s == 0 ? EXIT_SUCCESS : EXIT_FAILURE;
+        case 1:
+            break;
+        default:
+            exit(EXIT_FAILURE);
+        }
+
+        server_ctx.worker_id = worker_id;
+        /* Other workers append to the same file: write whole records */
+        if (server_ctx.req_log)
+            (void) setvbuf(server_ctx.req_log, NULL, _IOLBF, 1 << 16);
+        /* The parent logs the counters, but they have to be fresh */
+        if (server_ctx.stats_interval.tv_sec == 0)
+            server_ctx.stats_interval.tv_sec = 1;
+    }
+#endif
+
     /* Prepare the engine */
     if (0 != prog_prep(&prog))
     {
@@ -518,13 +2562,101 @@ main (int argc, char **argv)
         exit(EXIT_FAILURE);
     }
 
+#ifndef WIN32
+    if (server_ctx.workers)
+    {
+        if (server_ctx.worker_id == 0)
+            TAILQ_FOREACH(sport, &server_ctx.sports, next_sport)
+                if (0 != workers_steer(server_ctx.workers, sport->fd))
+                    LSQ_WARN("Packets are not steered by connection ID: "
+                        "connections may move between workers");
+        workers_ready(server_ctx.workers);
+    }
+#endif
+
+#ifndef WIN32
+    if (pf_settings.pfs_threads > 0)
+    {
+        server_ctx.ra_windows = lsquic_hash_create();
+        server_ctx.prefetch = prefetch_new(prog_eb(&prog),
+                server_ctx.file_cache, &pf_settings,
+                video_server_on_prefetched, &server_ctx);
+        if (!server_ctx.ra_windows || !server_ctx.prefetch)
+        {
+            LSQ_ERROR("Cannot start prefetch threads");
+            exit(EXIT_FAILURE);
+        }
+    }
+
+    if (lw_settings.lws_idle_ms > 0)
+    {
+        server_ctx.live_watch = live_watch_new(prog_eb(&prog), &lw_settings,
+                                video_server_on_live_change, &server_ctx);
+        if (!server_ctx.live_watch)
+        {
+            LSQ_ERROR("Cannot start live mode");
+            exit(EXIT_FAILURE);
+        }
+    }
+#endif
+
     LSQ_NOTICE("Video server starting, document root: %s", server_ctx.document_root);
 
+    if ((server_ctx.file_cache || server_ctx.req_log || server_ctx.prefetch
+                    || server_ctx.workers || server_ctx.cc_assign != CCA_OFF)
+                                    && server_ctx.stats_interval.tv_sec > 0)
+    {
+        server_ctx.stats_timer = event_new(prog_eb(&prog), -1, 0,
+                                        stats_timer_handler, &server_ctx);
+        if (server_ctx.stats_timer)
+            event_add(server_ctx.stats_timer, &server_ctx.stats_interval);
+    }
+
+    if (server_ctx.qlog_dir)
+    {
+        server_ctx.qlog_timer = event_new(prog_eb(&prog), -1, 0,
+                                        qlog_timer_handler, &server_ctx);
+        if (server_ctx.qlog_timer)
+            event_add(server_ctx.qlog_timer, &server_ctx.qlog_interval);
+    }
+
     /* Run event loop */
     s = prog_run(&prog);
 
     /* Cleanup */
+    log_stats(&server_ctx);
+    if (server_ctx.stats_timer)
+    {
+        event_del(server_ctx.stats_timer);
+        event_free(server_ctx.stats_timer);
+    }
+    if (server_ctx.qlog_timer)
+    {
+        event_del(server_ctx.qlog_timer);
+        event_free(server_ctx.qlog_timer);
+    }
+#ifndef WIN32
+    /* Before the event base, which its event belongs to, and before the
+     * cache: loaded entries still in flight are added to it
+     */
+    if (server_ctx.prefetch)
+    {
+        prefetch_destroy(server_ctx.prefetch);
+        server_ctx.prefetch = NULL;
+        free_read_ahead(&server_ctx);
+    }
+#endif
     prog_cleanup(&prog);
+#ifndef WIN32
+    /* After the engine: its streams release the files they follow */
+    if (server_ctx.live_watch)
+        live_watch_destroy(server_ctx.live_watch);
+#endif
+    if (server_ctx.file_cache)
+        file_cache_destroy(server_ctx.file_cache);
+    mpd_index_destroy(server_ctx.mpd_index);
+    if (server_ctx.req_log)
+        (void) fclose(server_ctx.req_log);
 
     return s == 0 ? EXIT_SUCCESS : EXIT_FAILURE;
 }
@@ -1,7 +1,7 @@
 import time
 import csv
-import base64
 import json
+import os
 import sys
 import argparse
 from selenium import webdriver
@@ -9,7 +9,16 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 
-def setup_chrome_options(protocol):
+from fetch_dashjs import DASHJS_PATH
+from cdp_network import CSV_HEADER as SEGMENT_CSV_HEADER, NetworkTracker, csv_row
+from qoe_collector import QoECollector, StartupTimer, load_script
+from qoe_recorder import StreamingRecorder
+from qoe_sink import derived_rates, open_sink
+
+# Remote test server; use 127.0.0.1 to go through a local netshaper.py
+DEFAULT_SERVER = "45.76.170.255"
+
+def setup_chrome_options(protocol, server=DEFAULT_SERVER):
     """Setup Chrome options based on transport protocol"""
     chrome_options = Options()
     
@@ -19,13 +28,16 @@ def setup_chrome_options(protocol):
         chrome_options.add_argument("--ignore-certificate-errors-spki-list=dSiDY7LGoozlpLzHmutdwpKP/y2cfN9oh98uNYpNViI=")
         chrome_options.add_argument("--ignore-ssl-errors")
         chrome_options.add_argument("--enable-quic")
-        chrome_options.add_argument("--host-resolver-rules=MAP quic.local 45.76.170.255")
+        chrome_options.add_argument(f"--host-resolver-rules=MAP quic.local {server}")
         chrome_options.add_argument("--origin-to-force-quic-on=quic.local:5201")
         chrome_options.add_argument("--disable-web-security")
         chrome_options.add_argument("--allow-running-insecure-content")
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--headless")
         
+        # CDP network events for per-segment timing
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        
     elif protocol.lower() == 'tcp':
         # TCP-specific options from tcp_selenium.py
         chrome_options.add_argument("--ignore-certificate-errors")
@@ -45,247 +57,320 @@ def setup_chrome_options(protocol):
     
     return chrome_options
 
-def get_target_url(protocol):
+def get_target_url(protocol, server=DEFAULT_SERVER):
     """Get the target URL based on transport protocol"""
     if protocol.lower() == 'quic':
         return "https://quic.local:5201/index.html"
     elif protocol.lower() == 'tcp':
-        return "http://45.76.170.255:5201/index.html"
+        return f"http://{server}:5201/index.html"
     else:
         raise ValueError(f"Unsupported protocol: {protocol}")
 
-def main():
-    # Parse command line arguments
-    parser = argparse.ArgumentParser(description='Watch and save video with specified transport protocol')
-    parser.add_argument('protocol', choices=['tcp', 'quic'], 
-                       help='Transport protocol to use (tcp or quic)')
-    args = parser.parse_args()
-    
-    print(f"Starting video monitoring with {args.protocol.upper()} protocol...")
-    
-    # Setup Chrome options based on protocol
-    chrome_options = setup_chrome_options(args.protocol)
-    
-    # Setup Chrome driver
-    service = Service("/opt/homebrew/bin/chromedriver")
+def get_manifest_url(protocol, server=DEFAULT_SERVER):
+    """Get the DASH manifest URL, served from the same origin as the page"""
+    return get_target_url(protocol, server).rsplit('/', 1)[0] + "/manifest.mpd"
+
+# ABR rules enabled by default: BOLA only
+DEFAULT_ABR_RULES = ("bolaRule",)
+
+ALL_ABR_RULES = (
+    "throughputRule", "bolaRule", "insufficientBufferRule",
+    "abandonRequestsRule", "droppedFramesRule", "l2ARule", "loLPRule",
+    "switchHistoryRule",
+)
+
+def abr_rules_settings(active_rules):
+    """Build the dash.js streaming.abr.rules block from a list of active rules"""
+    unknown = set(active_rules) - set(ALL_ABR_RULES)
+    if unknown:
+        raise ValueError(f"Unknown ABR rules: {', '.join(sorted(unknown))}")
+    return {rule: {"active": rule in active_rules} for rule in ALL_ABR_RULES}
+
+def delay_settings(live_delay=None):
+    """Build the dash.js streaming.delay block; None keeps the player default"""
+    return {} if live_delay is None else {"liveDelay": live_delay}
+
+def buffer_settings(stable_buffer=None, top_buffer=None):
+    """Build the dash.js streaming.buffer block; None keeps the player default"""
+    settings = {}
+    if stable_buffer is not None:
+        settings["stableBufferTime"] = stable_buffer
+    if top_buffer is not None:
+        settings["bufferTimeAtTopQuality"] = top_buffer
+    return settings
+
+def create_driver(protocol, chromedriver=None, server=DEFAULT_SERVER):
+    """Start a Chrome session set up for the given protocol"""
+    chrome_options = setup_chrome_options(protocol, server)
+    # Without an explicit path, Selenium locates chromedriver itself
+    service = Service(chromedriver) if chromedriver else Service()
     driver = webdriver.Chrome(service=service, options=chrome_options)
     driver.set_script_timeout(180)  # up to 3 minutes for async JS
-    
-    # Get target URL based on protocol
-    target_url = get_target_url(args.protocol)
-    
-    # Navigate & load page
-    driver.get(target_url)
-    time.sleep(10)  # allow DOM, dash.js, and media to load
+    return driver
+
+
+def run_session(driver, protocol, outdir=".", abr_rules=DEFAULT_ABR_RULES,
+                interval=1.0, sample_ms=250, tag=None, fmt="csv",
+                record_drain=5.0, server=DEFAULT_SERVER, stable_buffer=None,
+                top_buffer=None, startup_timeout=60.0, live_delay=None,
+                duration=None):
+    """Play the video once in an existing driver and write its logs to outdir
+
+    fmt selects the metrics sink: "csv" or the binary "qoe" format.  The
+    recording is appended to disk every record_drain seconds.
+    stable_buffer and top_buffer set dash.js buffer targets in seconds.
+    Sampling starts once the video is playing, or after startup_timeout
+    seconds; startup milestones are written to startup_<protocol>.json.
+    For a live stream, live_delay sets the target latency to the live edge
+    in seconds, the measured latency is written to
+    live_latency_<protocol>.csv, and duration, in seconds of sampling,
+    ends the session, as a live stream does not.
+    Returns a dict summarising the run.  The driver is left open so that
+    it can be reused for the next session.
+    """
+    tag = tag or protocol
+    os.makedirs(outdir, exist_ok=True)
+    session_start = time.time()
+
+    # Discard network events left over from a previous session
+    driver.get_log('performance')
+
+    # Navigate & load page; get() returns after the load event
+    driver.get(get_target_url(protocol, server))
     video = driver.find_element(By.ID, "videoPlayer")
-    
-    # TODO: Add the rest of the video monitoring logic here
-    # This would include the DASH player setup, quality monitoring, 
-    # CSV logging, and video recording functionality
-    
-    print(f"Successfully loaded page with {args.protocol.upper()} protocol")
-    
-    # ─── 1) Install quality-switch listener for oscillation logging ───────
-    driver.execute_script("""
-    (() => {
-    if (!window.__quality_switches) {
-        window.__quality_switches = [];
-        const player = dashjs.MediaPlayer().create();
-        player.on(
-        dashjs.MediaPlayer.events.QUALITY_CHANGE_RENDERED,
-        e => window.__quality_switches.push({
-            timestamp:   e.time,
-            oldQuality:  e.oldQuality,
-            newQuality:  e.newQuality
-        })
-        );
-    }
-    })();
-    """)
 
-    # ─── 2) Inject dash.js and configure ABR algorithm (BOLA example) ─────
-    driver.execute_script("""
-    (() => {
-    if (!window.dashjs) {
-        const s = document.createElement('script');
-        s.src = 'https://cdn.dashjs.org/latest/dash.all.min.js';
-        s.crossOrigin = 'anonymous';
-        document.head.appendChild(s);
-    }
-    })();
-    """)
-    time.sleep(1)  # wait for dash.js to load
+    print(f"[{tag}] Successfully loaded page with {protocol.upper()} protocol")
+
+    # ─── 1) Inject dash.js and configure ABR algorithm (BOLA example) ─────
+    # The pinned copy comes from the same origin, see fetch_dashjs.py
+    if not load_script(driver, DASHJS_PATH, "dashjs"):
+        raise RuntimeError(f"cannot load {DASHJS_PATH}")
+
+    # Startup is timed from player.initialize()
+    startup = StartupTimer(driver, video)
+    startup.install()
 
     # Configure and initialize the DASH player
     driver.execute_script("""
     (() => {
     const v = document.getElementById('videoPlayer');
-    const mpd = 'https://quic.local:5201/manifest.mpd';
+    const mpd = arguments[0];
     const player = dashjs.MediaPlayer().create();
 
     player.updateSettings({
         streaming: {
         abr: {
-            rules: {
-            throughputRule:         { active: false },
-            bolaRule:               { active: true  },
-            insufficientBufferRule: { active: false },
-            abandonRequestsRule:    { active: false },
-            droppedFramesRule:      { active: false },
-            l2ARule:                { active: false },
-            loLPRule:               { active: false },
-            switchHistoryRule:      { active: false }
-            }
-        }
+            rules: arguments[1]
+        },
+        buffer: arguments[2],
+        delay: arguments[3]
         }
     });
 
     player.initialize(v, mpd, true);
     window.__dash_player = player;
     })();
-    """)
+    """, get_manifest_url(protocol, server), abr_rules_settings(abr_rules),
+         buffer_settings(stable_buffer, top_buffer), delay_settings(live_delay))
 
     # Verify current ABR settings
     current_abr = driver.execute_script("return window.__dash_player.getSettings().streaming.abr;")
-    print("Current ABR config:", json.dumps(current_abr, indent=2))
+    with open(os.path.join(outdir, f"abr_config_{protocol}.json"), "w") as f:
+        json.dump(current_abr, f, indent=2)
+
+    # ─── 2) Record the video element, streaming chunks to disk ───────────
+    recorder = StreamingRecorder(driver, video,
+                                 os.path.join(outdir, f"recorded_video_{protocol}.webm"),
+                                 drain_every=record_drain)
+    recorder.start()
+
+    # ─── 3) Install the in-page QoE collector ─────────────────────────────
+    collector = QoECollector(driver, video, sample_ms=sample_ms)
+    collector.install()
+
+    if startup.wait("playing", startup_timeout) is None:
+        print(f"[{tag}] ⚠️  Not playing after {startup_timeout:.0f}s, sampling anyway")
+
+    # ───── Setup the QoE metrics sink ─────────────────────────────────────
+    sink = open_sink(os.path.join(outdir, f"qoe_metrics_{protocol}.{fmt}"))
+
+    # Per-segment TTFB, transfer time and goodput from CDP network events
+    segment_csv_file = open(os.path.join(outdir, f"segment_downloads_{protocol}.csv"), "w", newline="")
+    segment_csv_writer = csv.writer(segment_csv_file)
+    segment_csv_writer.writerow(SEGMENT_CSV_HEADER)
+    network = NetworkTracker()
+
+    # Latency to the live edge, opened on the first live sample
+    latency_csv_file = None
+    latency_sum, latency_max, n_latency = 0.0, None, 0
 
-    # ─── 3) Inject MediaRecorder for local recording ─────────────────────
-    driver.execute_script("""
-    ((v) => {
-    v.muted = true;
-    v.play();
-    if (window.__recorder_started) return;
-    window.__recorder_started = true;
-
-    const stream = v.captureStream();
-    const rec = new MediaRecorder(stream, { mimeType: 'video/webm;codecs=vp9' });
-    window.__chunks = [];
-    rec.ondataavailable = e => window.__chunks.push(e.data);
-    rec.start(1000);  // flush every 1s
-    window.__recorder = rec;
-    })(arguments[0]);
-    """, video)
-
-    # ───── Setup CSV for QoE metrics ──────────────────────────────────────
-    csv_file = open(f"qoe_metrics_{args.protocol}.csv", "w", newline="")
-    csv_writer = csv.writer(csv_file)
-    csv_writer.writerow([
-    "wall_clock", "playback_time", "buffered", "playback_rate",
-    "bitrate_kbps", "quality_switch_count",
-    "dropped_frames", "total_frames", "fps", "resolution",
-    "stall_count", "total_stall_time", "rebuffer_rate"
-    ])
-
-    stall_count = 0
-    total_stall_time = 0.0
     wall_clock_start = time.time()
+    n_samples = 0
 
-    # ───────── Main loop: QoE, bitrate, oscillation logging ──────────────
+    # ───────── Main loop: drain the collector once per interval ───────────
     try:
+        ended = False
         while True:
-            # 1) Basic QoE metrics
-            q = driver.execute_script("""
-            const v = arguments[0];
-            const q = v.getVideoPlaybackQuality();
-            return {
-                currentTime: v.currentTime,
-                buffered:    v.buffered.length ? v.buffered.end(v.buffered.length-1) : 0,
-                rate:        v.playbackRate,
-                dropped:     q.droppedVideoFrames,
-                total:       q.totalVideoFrames,
-                fps:         q.totalVideoFrames / (v.currentTime || 1),
-                res:         `${v.videoWidth}x${v.videoHeight}`,
-                readyState:  v.readyState,
-                ended:       v.ended
-            };
-            """, video)
-
-            # 2) Stall detection
-            if q["readyState"] < 3:
-                stall_count += 1
-                t0 = time.time()
-                while driver.execute_script("return arguments[0].readyState;", video) < 3:
-                    time.sleep(0.1)
-                total_stall_time += time.time() - t0
-
-            # 3) Playback bitrate
-            bitrate_kbps = driver.execute_script(
-            "return (window.__dash_player.getCurrentTrackFor('video') || {}).bitrate || 0;"
-            )
-
-            # 4) Quality switch count
-            switch_count = driver.execute_script(
-            "return (window.__quality_switches || []).length;"
-            )
-
-            # 5) Derived metrics
-            rebuffer_rate = total_stall_time / q["currentTime"] if q["currentTime"] else 0
-            drop_pct = (q["dropped"] / q["total"] * 100) if q["total"] else 0
-
-            # 6) Print summary
-            print(f"t={q['currentTime']:.1f}s buf={q['buffered']:.1f}s "
-                f"bitrate={bitrate_kbps}kbps switches={switch_count} "
-                f"fps={q['fps']:.1f} drop={drop_pct:.1f}% "
-                f"stalls={stall_count} totalStall={total_stall_time:.1f}s "
-                f"rebuffer rate={rebuffer_rate*100:.1f}%")
-
-            # 7) Write CSV
-            csv_writer.writerow([
-            round(time.time() - wall_clock_start,2),
-            round(q['currentTime'],2), round(q['buffered'],2), round(q['rate'],2),
-            bitrate_kbps, switch_count,
-            q['dropped'], q['total'], round(q['fps'],2), q['res'],
-            stall_count, round(total_stall_time,2), round(rebuffer_rate,4)
-            ])
-
-            if q['ended']:
-                print("\n🎬 Video ended – finishing up…")
+            # 1) One round trip returns every sample since the last drain
+            samples = collector.drain()
+            n_samples += len(samples)
+
+            # Samples are stored as the browser reports them: stall
+            # counts and times come from its own waiting/playing
+            # timestamps.  fps and rebuffer_rate are cumulative rates
+            # derived from these counters; run metrics are left to
+            # qoe_analysis.py.
+            for q in samples:
+                fps, rebuffer_rate = derived_rates(q['total'], q["stallMs"] / 1000.0,
+                                                   q['currentTime'])
+                sink.write((
+                q["ts"] / 1000.0 - wall_clock_start,
+                q['currentTime'], q['buffered'], q['rate'],
+                q["bitrate"], q["switches"],
+                q['dropped'], q['total'], fps, q['width'], q['height'],
+                q["stallCount"], q["stallMs"] / 1000.0, rebuffer_rate
+                ))
+                ended = ended or q["ended"]
+                latency = q.get("liveLatency")
+                if latency is not None:
+                    if latency_csv_file is None:
+                        latency_csv_file = open(os.path.join(outdir, f"live_latency_{protocol}.csv"), "w", newline="")
+                        latency_csv_writer = csv.writer(latency_csv_file)
+                        latency_csv_writer.writerow(("wall_clock", "live_latency"))
+                    latency_csv_writer.writerow((round(q["ts"] / 1000.0 - wall_clock_start, 3),
+                                                 round(latency, 3)))
+                    latency_sum += latency
+                    latency_max = latency if latency_max is None else max(latency_max, latency)
+                    n_latency += 1
+            sink.flush()
+            if latency_csv_file:
+                latency_csv_file.flush()
+
+            for segment in network.feed(driver.get_log('performance')):
+                segment_csv_writer.writerow(csv_row(segment, wall_clock_start))
+            segment_csv_file.flush()
+
+            # 2) Print summary of the latest sample
+            q = collector.last
+            if q:
+                print(f"[{tag}] t={q['currentTime']:.1f}s buf={q['buffered']:.1f}s "
+                    f"bitrate={q['bitrate']}kbps switches={q['switches']} "
+                    f"dropped={q['dropped']}/{q['total']} samples={len(samples)} "
+                    f"stalls={q['stallCount']} totalStall={q['stallMs']/1000:.1f}s"
+                    + (f" latency={q['liveLatency']:.2f}s" if q.get("liveLatency") is not None else ""))
+
+            if ended:
+                print(f"\n[{tag}] 🎬 Video ended – finishing up…")
+                break
+            if duration is not None and time.time() - wall_clock_start >= duration:
+                print(f"\n[{tag}] ⏹  {duration:g}s sampled – finishing up…")
                 break
 
-            time.sleep(1)
+            recorder.maybe_drain()
+            time.sleep(interval)
+
+        if collector.dropped:
+            print(f"[{tag}] ⚠️  {collector.dropped} samples overwritten in the ring buffer; "
+                  f"lower --interval")
 
     finally:
-        csv_file.close()
-
-        # Stop recorder and save webm
-        data_url = driver.execute_async_script("""
-        const done = arguments[0];
-        if (!window.__recorder) { done(null); return; }
-        if (window.__video_data_url) { done(window.__video_data_url); return; }
-        const finish = () => {
-            try {
-            const blob = new Blob(window.__chunks||[], {type:'video/webm'});
-            if (!blob.size) { done(null); return; }
-            const fr = new FileReader();
-            fr.onloadend = () => { window.__video_data_url = fr.result; done(fr.result); };
-            fr.readAsDataURL(blob);
-            } catch(e) { done(null); }
-        };
-        if (window.__recorder.state === 'inactive') { finish(); return; }
-        let ended = false;
-        window.__recorder.ondataavailable = e => window.__chunks.push(e.data);
-        window.__recorder.onstop = () => { ended = true; finish(); };
-        window.__recorder.requestData(); window.__recorder.stop();
-        setTimeout(() => { if (!ended) done(null); }, 20000);
-        """
-        )
+        sink.close()
+        segment_csv_file.close()
+        if latency_csv_file:
+            latency_csv_file.close()
 
-        if data_url:
-            _, b64 = data_url.split(',',1)
-            with open(f"recorded_video_{args.protocol}.webm","wb") as f:
-                f.write(base64.b64decode(b64))
-            print("📼  recorded_video.webm saved ✔")
+        # Stop recorder and flush the last chunks to the webm
+        if recorder.stop():
+            print(f"[{tag}] 📼  recorded_video.webm saved ✔ ({recorder.nbytes} bytes)")
         else:
-            print("⚠️  No recording produced.")
+            print(f"[{tag}] ⚠️  No recording produced.")
 
         # Save quality-switch log
         switches = driver.execute_script("return window.__quality_switches || [];"
         )
-        with open(f"switches_{args.protocol}.log","w") as f:
+        with open(os.path.join(outdir, f"switches_{protocol}.log"),"w") as f:
             json.dump(switches, f, indent=2)
-        print(f"🗒  {len(switches)} switches logged to switches.log")
-    # Cleanup
-    driver.quit()
+        print(f"[{tag}] 🗒  {len(switches)} switches logged to switches.log")
+
+        startup_times = startup.timings()
+        with open(os.path.join(outdir, f"startup_{protocol}.json"), "w") as f:
+            json.dump(startup_times, f, indent=2)
+        print(f"[{tag}] ⏱  first frame {startup_times['time_to_first_frame_ms']} ms "
+              f"after player start")
+
+    q = collector.last or {}
+    playback_time = q.get("currentTime", 0)
+    total_stall_time = q.get("stallMs", 0) / 1000.0
+    return {
+        "protocol":         protocol,
+        "abr_rules":        "+".join(abr_rules),
+        "stable_buffer":    stable_buffer,
+        "top_buffer":       top_buffer,
+        "outdir":           outdir,
+        # Epoch seconds of wall_clock 0 in the QoE samples
+        "wall_clock_start": round(wall_clock_start, 3),
+        "wall_time":        round(time.time() - session_start, 2),
+        # wall_clock of time 0 in the recording (see frame_analysis.py)
+        "record_offset":    round(recorder.start_ts - wall_clock_start, 3)
+                            if recorder.start_ts else None,
+        "samples":          n_samples,
+        "playback_time":    round(playback_time, 2),
+        "bitrate_kbps":     q.get("bitrate", 0),
+        "switches":         len(switches),
+        "dropped_frames":   q.get("dropped", 0),
+        "total_frames":     q.get("total", 0),
+        "stall_count":      q.get("stallCount", 0),
+        "total_stall_time": round(total_stall_time, 2),
+        "rebuffer_rate":    round(total_stall_time / playback_time, 4) if playback_time else 0,
+        # Seconds behind the live edge; None for on-demand streams
+        "live_latency_mean": round(latency_sum / n_latency, 3) if n_latency else None,
+        "live_latency_max": round(latency_max, 3) if n_latency else None,
+        **startup_times,
+    }
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Watch and save video with specified transport protocol')
+    parser.add_argument('protocol', choices=['tcp', 'quic'], 
+                       help='Transport protocol to use (tcp or quic)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                       help='Seconds between collector drains (default: 1.0)')
+    parser.add_argument('--sample-ms', type=int, default=250,
+                       help='In-page sampling period in milliseconds (default: 250)')
+    parser.add_argument('--chromedriver', default=None,
+                       help='Path to chromedriver (default: let Selenium find it)')
+    parser.add_argument('--rules', default=",".join(DEFAULT_ABR_RULES),
+                       help='Comma-separated dash.js ABR rules to enable (default: bolaRule)')
+    parser.add_argument('--outdir', default=".",
+                       help='Directory for CSV, logs and recording (default: .)')
+    parser.add_argument('--format', choices=['csv', 'qoe'], default='csv',
+                       help='QoE metrics format: text CSV or binary .qoe (default: csv)')
+    parser.add_argument('--server', default=DEFAULT_SERVER,
+                       help=f'Server address; 127.0.0.1 for a local netshaper.py (default: {DEFAULT_SERVER})')
+    parser.add_argument('--stable-buffer', type=float, default=None,
+                       help='dash.js stableBufferTime in seconds (default: player default)')
+    parser.add_argument('--top-buffer', type=float, default=None,
+                       help='dash.js bufferTimeAtTopQuality in seconds (default: player default)')
+    parser.add_argument('--live-delay', type=float, default=None,
+                       help='Target latency to the live edge in seconds (default: player default)')
+    parser.add_argument('--duration', type=float, default=None,
+                       help='Stop after this many seconds of sampling; live streams do not end '
+                            '(default: until the video ends)')
+    args = parser.parse_args()
+    
+    print(f"Starting video monitoring with {args.protocol.upper()} protocol...")
+    
+    driver = create_driver(args.protocol, args.chromedriver, args.server)
+    try:
+        run_session(driver, args.protocol, args.outdir,
+                    abr_rules=tuple(r for r in args.rules.split(",") if r),
+                    interval=args.interval, sample_ms=args.sample_ms,
+                    fmt=args.format, server=args.server,
+                    stable_buffer=args.stable_buffer, top_buffer=args.top_buffer,
+                    live_delay=args.live_delay, duration=args.duration)
+    finally:
+        # Cleanup
+        driver.quit()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,377 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * workers.c -- Run a server in several processes sharing its UDP ports
+ */
+
+#include <errno.h>
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/queue.h>
+#include <sys/socket.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#if __linux__
+#include <linux/filter.h>
+#include <sys/prctl.h>
+#endif
+
+#include <event2/event.h>
+#include <openssl/rand.h>
+
+#include "lsquic.h"
+#include "../src/liblsquic/lsquic_hash.h"
+#include "../src/liblsquic/lsquic_logger.h"
+
+#include "file_cache.h"
+#include "prefetch.h"
+#include "workers.h"
+
+
+struct workers
+{
+    unsigned                w_n_workers;
+    int                     w_worker_id;    /* -1 in the parent */
+    int                     w_ready_fd;     /* Worker: tell parent it is up */
+    pid_t                  *w_pids;         /* Zero once reaped */
+    unsigned                w_n_running;
+    int                     w_stopping;
+    int                     w_failed;
+    struct worker_stats    *w_stats;        /* Shared, one per worker */
+    /* Used by workers_supervise(): */
+    struct event_base      *w_eb;
+    struct event           *w_timer;
+    struct timeval          w_interval;
+    workers_stats_f         w_stats_cb;
+    void                   *w_stats_ctx;
+};
+
+
+struct workers *
+workers_new (unsigned n_workers)
+{
+    struct workers *w;
+
+    /* The steering program maps a CID byte onto a worker */
+    if (n_workers < 1 || n_workers > 256)
+    {
+        errno = EINVAL;
+        return NULL;
+    }
+
+    w = calloc(1, sizeof(*w));
+    if (!w)
+        return NULL;
+    w->w_n_workers = n_workers;
+    w->w_worker_id = -1;
+    w->w_ready_fd = -1;
+    w->w_pids = calloc(n_workers, sizeof(w->w_pids[0]));
+    w->w_stats = mmap(NULL, n_workers * sizeof(w->w_stats[0]),
+                PROT_READ|PROT_WRITE, MAP_SHARED|MAP_ANONYMOUS, -1, 0);
+    if (!w->w_pids || w->w_stats == MAP_FAILED)
+    {
+        free(w->w_pids);
+        free(w);
+        return NULL;
+    }
+    memset(w->w_stats, 0, n_workers * sizeof(w->w_stats[0]));
+    return w;
+}
+
+
+static void
+workers_signal (struct workers *w, int signo)
+{
+    unsigned n;
+
+    for (n = 0; n < w->w_n_workers; ++n)
+        if (w->w_pids[n] > 0)
+            (void) kill(w->w_pids[n], signo);
+}
+
+
+/* Returns true if a child was reaped */
+static int
+workers_reap (struct workers *w, int block)
+{
+    pid_t pid;
+    unsigned n;
+    int status;
+
+    pid = waitpid(-1, &status, block ? 0 : WNOHANG);
+    if (pid <= 0)
+        return 0;
+    for (n = 0; n < w->w_n_workers; ++n)
+        if (w->w_pids[n] == pid)
+            break;
+    if (n == w->w_n_workers)
+        return 1;
+
+    w->w_pids[n] = 0;
+    --w->w_n_running;
+    if (!w->w_stopping || !WIFEXITED(status) || WEXITSTATUS(status) != 0)
+    {
+        if (WIFSIGNALED(status))
+            LSQ_ERROR("worker %u (pid %d) killed by signal %d", n, (int) pid,
+                                                            WTERMSIG(status));
+        else
+            LSQ_ERROR("worker %u (pid %d) exited with status %d", n,
+                                                (int) pid, WEXITSTATUS(status));
+        w->w_failed = 1;
+    }
+    else
+        LSQ_INFO("worker %u (pid %d) exited", n, (int) pid);
+    return 1;
+}
+
+
+int
+workers_fork (struct workers *w, unsigned *worker_id)
+{
+    int fds[2];
+    pid_t pid;
+    ssize_t nread;
+    unsigned n;
+    char c;
+
+    for (n = 0; n < w->w_n_workers; ++n)
+    {
+        if (0 != pipe(fds))
+        {
+            LSQ_ERROR("cannot create pipe: %s", strerror(errno));
+            goto err;
+        }
+        pid = fork();
+        if (pid < 0)
+        {
+            LSQ_ERROR("cannot fork worker %u: %s", n, strerror(errno));
+            (void) close(fds[0]);
+            (void) close(fds[1]);
+            goto err;
+        }
+        if (pid == 0)
+        {
+            (void) close(fds[0]);
+            free(w->w_pids);
+            w->w_pids = NULL;
+            w->w_worker_id = n;
+            w->w_ready_fd = fds[1];
+            w->w_stats[n].ws_pid = getpid();
+            /* Ctrl-C reaches the whole process group: let the parent
+             * stop the workers in order.
+             */
+            (void) signal(SIGINT, SIG_IGN);
+#if __linux__
+            (void) prctl(PR_SET_PDEATHSIG, SIGUSR1);
+#endif
+            *worker_id = n;
+            return 1;
+        }
+
+        /* Start the next worker only once this one has bound its sockets,
+         * so that the order of sockets in the reuseport groups matches
+         * the worker numbers.
+         */
+        w->w_pids[n] = pid;
+        ++w->w_n_running;
+        (void) close(fds[1]);
+        do
+            nread = read(fds[0], &c, 1);
+        while (nread < 0 && errno == EINTR);
+        (void) close(fds[0]);
+        if (nread != 1)
+        {
+            LSQ_ERROR("worker %u (pid %d) failed to start", n, (int) pid);
+            goto err;
+        }
+        LSQ_INFO("worker %u started, pid %d", n, (int) pid);
+    }
+
+    return 0;
+
+  err:
+    w->w_stopping = 1;
+    workers_signal(w, SIGUSR1);
+    while (w->w_n_running > 0 && workers_reap(w, 1))
+        ;
+    return -1;
+}
+
+
+void
+workers_ready (struct workers *w)
+{
+    if (w->w_ready_fd >= 0)
+    {
+        (void) write(w->w_ready_fd, "", 1);
+        (void) close(w->w_ready_fd);
+        w->w_ready_fd = -1;
+    }
+}
+
+
+struct worker_stats *
+workers_my_stats (struct workers *w)
+{
+    return &w->w_stats[w->w_worker_id];
+}
+
+
+int
+workers_steer (struct workers *w, int fd)
+{
+#if __linux__ && defined(SO_ATTACH_REUSEPORT_CBPF)
+    /* The program sees the UDP payload.  Its return value is the index of
+     * the socket in the group; out-of-range values fall back to hashing.
+     */
+    struct sock_filter code[] = {
+        /* Long header if the top bit of the first byte is set */
+        BPF_STMT(BPF_LD|BPF_B|BPF_ABS, 0),
+        BPF_JUMP(BPF_JMP|BPF_JSET|BPF_K, 0x80, 0, 2),
+        /* Long header: DCID follows version and DCID length */
+        BPF_STMT(BPF_LD|BPF_B|BPF_ABS, 6),
+        BPF_JUMP(BPF_JMP|BPF_JA, 1, 0, 0),
+        /* Short header: DCID follows the first byte */
+        BPF_STMT(BPF_LD|BPF_B|BPF_ABS, 1),
+        BPF_STMT(BPF_ALU|BPF_MOD|BPF_K, w->w_n_workers),
+        BPF_STMT(BPF_RET|BPF_A, 0),
+    };
+    struct sock_fprog prog = {
+        .len    = sizeof(code) / sizeof(code[0]),
+        .filter = code,
+    };
+
+    if (0 != setsockopt(fd, SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, &prog,
+                                                                sizeof(prog)))
+    {
+        LSQ_WARN("cannot attach reuseport program: %s", strerror(errno));
+        return -1;
+    }
+    return 0;
+#else
+    errno = ENOSYS;
+    return -1;
+#endif
+}
+
+
+void
+workers_generate_scid (void *ctx, struct lsquic_conn *conn, uint8_t *cid,
+                       unsigned len)
+{
+    struct workers *const w = ctx;
+    unsigned byte;
+
+    if (len == 0)
+        return;
+    RAND_bytes(cid, len);
+    /* Keep the byte random, but make it select this worker */
+    byte = cid[0] - cid[0] % w->w_n_workers + w->w_worker_id;
+    if (byte > 0xFF)
+        byte -= w->w_n_workers;
+    cid[0] = byte;
+}
+
+
+static void
+workers_stop (struct workers *w)
+{
+    if (!w->w_stopping)
+    {
+        w->w_stopping = 1;
+        workers_signal(w, SIGUSR1);
+    }
+}
+
+
+static void
+workers_on_signal (evutil_socket_t signo, short what, void *arg)
+{
+    struct workers *const w = arg;
+
+    LSQ_NOTICE("got signal %d, stopping workers", (int) signo);
+    workers_stop(w);
+}
+
+
+static void
+workers_on_child (evutil_socket_t signo, short what, void *arg)
+{
+    struct workers *const w = arg;
+
+    while (workers_reap(w, 0))
+        if (w->w_failed && !w->w_stopping)
+        {
+            /* The reuseport groups have changed: steering is off */
+            LSQ_ERROR("a worker exited, stopping the others");
+            workers_stop(w);
+        }
+    if (w->w_n_running == 0)
+        event_base_loopbreak(w->w_eb);
+}
+
+
+static void
+workers_on_timer (evutil_socket_t fd, short what, void *arg)
+{
+    struct workers *const w = arg;
+
+    w->w_stats_cb(w->w_stats_ctx, w->w_stats, w->w_n_workers);
+    if (!w->w_stopping)
+        event_add(w->w_timer, &w->w_interval);
+}
+
+
+int
+workers_supervise (struct workers *w, const struct timeval *interval,
+                   workers_stats_f stats_cb, void *ctx)
+{
+    static const int signals[] = { SIGINT, SIGTERM, SIGUSR1, SIGCHLD, };
+    struct event *events[sizeof(signals) / sizeof(signals[0])];
+    unsigned n;
+
+    w->w_eb = event_base_new();
+    if (!w->w_eb)
+    {
+        workers_stop(w);
+        return -1;
+    }
+    for (n = 0; n < sizeof(signals) / sizeof(signals[0]); ++n)
+    {
+        events[n] = evsignal_new(w->w_eb, signals[n],
+                            signals[n] == SIGCHLD ? workers_on_child
+                                                  : workers_on_signal, w);
+        if (events[n])
+            evsignal_add(events[n], NULL);
+    }
+    w->w_stats_cb = stats_cb;
+    w->w_stats_ctx = ctx;
+    if (interval && (interval->tv_sec || interval->tv_usec))
+    {
+        w->w_interval = *interval;
+        w->w_timer = event_new(w->w_eb, -1, 0, workers_on_timer, w);
+        if (w->w_timer)
+            event_add(w->w_timer, &w->w_interval);
+    }
+
+    /* A worker may have exited before SIGCHLD was caught */
+    workers_on_child(SIGCHLD, 0, w);
+    if (w->w_n_running > 0)
+        event_base_dispatch(w->w_eb);
+
+    stats_cb(ctx, w->w_stats, w->w_n_workers);
+
+    if (w->w_timer)
+        event_free(w->w_timer);
+    for (n = 0; n < sizeof(signals) / sizeof(signals[0]); ++n)
+        if (events[n])
+            event_free(events[n]);
+    event_base_free(w->w_eb);
+    w->w_eb = NULL;
+    return w->w_failed ? -1 : 0;
+}
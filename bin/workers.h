@@ -0,0 +1,85 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * workers.h -- Run a server in several processes sharing its UDP ports
+ *
+ * Each worker process has its own engine and event loop and binds its
+ * own sockets with SO_REUSEPORT.  Workers are started one at a time, so
+ * worker i holds socket i of every reuseport group.  On Linux, a classic
+ * BPF program attached to the group then steers each packet by the
+ * first byte of its destination connection ID: the worker is that byte
+ * modulo the number of workers.  Workers generate their source CIDs to
+ * match, so all packets of a connection reach the same worker even if
+ * the client's address changes (NAT rebinding, migration).  Without BPF
+ * steering the kernel hashes the 4-tuple instead; with zero-length
+ * server CIDs (scid_len=0) connections are not kept on one worker.
+ *
+ * The parent process only supervises: it forwards SIGINT, SIGTERM and
+ * SIGUSR1 to the workers as SIGUSR1 (stop the engine), stops them all
+ * if one of them exits, and aggregates the counters that the workers
+ * publish in shared memory.
+ */
+
+#ifndef WORKERS_H
+#define WORKERS_H 1
+
+struct lsquic_conn;
+struct timeval;
+struct workers;
+
+struct worker_stats
+{
+    int                 ws_pid;
+    unsigned            ws_n_conns;         /* Current connections */
+    unsigned long       ws_n_requests;
+    unsigned long long  ws_bytes_sent;
+    struct fc_stats     ws_fc;              /* Zero without a file cache */
+    struct pf_stats     ws_pf;              /* Zero without prefetch */
+    /* By congestion controller assigned, es_cc_algo - 1: */
+    struct {
+        unsigned long       conns;
+        unsigned long       requests;
+        unsigned long long  bytes_sent;
+    }                   ws_cc[3];
+};
+
+typedef void (*workers_stats_f)(void *ctx, const struct worker_stats *,
+                                                        unsigned n_workers);
+
+struct workers *
+workers_new (unsigned n_workers);
+
+/* Returns 1 in a worker, setting `worker_id', 0 in the parent once all
+ * workers are up, and -1 in the parent if a worker could not be started:
+ * the workers already started are stopped.
+ */
+int
+workers_fork (struct workers *, unsigned *worker_id);
+
+/* Called by a worker once its sockets are bound: the next one starts */
+void
+workers_ready (struct workers *);
+
+/* This worker's slot in shared memory */
+struct worker_stats *
+workers_my_stats (struct workers *);
+
+/* Attach the CID steering program to the reuseport group of `fd'.
+ * Returns 0 on success and -1 if it is not supported.
+ */
+int
+workers_steer (struct workers *, int fd);
+
+/* ea_generate_scid() callback; the context is the struct workers */
+void
+workers_generate_scid (void *ctx, struct lsquic_conn *, uint8_t *,
+                       unsigned len);
+
+/* Run in the parent until all workers have exited.  `stats_cb' is called
+ * every `interval', if set, and once at the end.  Returns 0 if all
+ * workers exited normally after being told to stop.
+ */
+int
+workers_supervise (struct workers *, const struct timeval *interval,
+                   workers_stats_f stats_cb, void *ctx);
+
+#endif
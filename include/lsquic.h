@@ -404,6 +404,9 @@ typedef struct ssl_ctx_st * (*lsquic_lookup_cert_f)(
 /* Default value of the CC RTT threshold is 1.5 ms */
 #define LSQUIC_DF_CC_RTT_THRESH 1500
 
+/* By default, adaptive congestion control picks on the first RTT sample */
+#define LSQUIC_DF_CC_RTT_SAMPLES 1
+
 /** Turn off datagram extension by default */
 #define LSQUIC_DF_DATAGRAMS 0
 
@@ -719,6 +722,16 @@ struct lsquic_engine_settings {
      */
     unsigned        es_cc_rtt_thresh;
 
+    /**
+     * Number of RTT samples adaptive congestion control waits for before
+     * it compares the smoothed RTT with es_cc_rtt_thresh.  The first
+     * samples are taken during the handshake; waiting for more makes the
+     * choice less sensitive to a single delayed ACK.  Must be at least 1.
+     *
+     * The default value is @ref LSQUIC_DF_CC_RTT_SAMPLES.
+     */
+    unsigned        es_cc_rtt_samples;
+
     /**
      * No progress timeout.
      *
@@ -1706,6 +1719,22 @@ int lsquic_stream_shutdown(lsquic_stream_t *s, int how);
 
 int lsquic_stream_close(lsquic_stream_t *s);
 
+/**
+ * Abort the stream: instead of the rest of the data and a FIN, send the
+ * peer RESET_STREAM (RST_STREAM in gQUIC) carrying `error_code', and
+ * close the stream.  Use it when a response cannot be completed, so that
+ * the peer does not take a truncated body for a whole one.  In HTTP/3,
+ * `error_code' is an HTTP/3 error code, such as 0x102 (H3_INTERNAL_ERROR).
+ *
+ * If the FIN or a reset has already been sent, the stream is just closed.
+ * As with lsquic_stream_close(), on_close will be called.
+ *
+ * Returns 0 on success, or -1 with errno set to EBADF if the stream is
+ * already closed.
+ */
+int
+lsquic_stream_reset (lsquic_stream_t *s, uint64_t error_code);
+
 /**
  * Return true if peer has not ACKed all data written to the stream.  This
  * includes both packetized and buffered data.
@@ -2124,6 +2153,81 @@ enum LSQUIC_CONN_STATUS
 enum LSQUIC_CONN_STATUS
 lsquic_conn_status (lsquic_conn_t *, char *errbuf, size_t bufsz);
 
+/**
+ * Connection transport information returned by lsquic_conn_get_info().
+ */
+struct lsquic_conn_info
+{
+    uint64_t    lci_cwnd;           /* Congestion window, in bytes */
+    uint64_t    lci_pacing_rate;    /* Bytes per second */
+    unsigned    lci_bytes_in_flight;
+    uint64_t    lci_lost_packets;   /* Declared lost so far */
+    /* RTT values are in microseconds: */
+    unsigned    lci_srtt;
+    unsigned    lci_rttvar;
+    unsigned    lci_min_rtt;
+    /**
+     * Congestion controller currently in use, using the values of
+     * es_cc_algo: 1 is Cubic, 2 is BBRv1.  3 means the adaptive controller
+     * has not picked one yet.
+     */
+    unsigned    lci_cc_algo;
+};
+
+/**
+ * Fill `info' with the current transport state of the connection.
+ *
+ * Returns 0 on success and -1 if the connection does not have this
+ * information yet (for example, it is still a mini connection).
+ */
+int
+lsquic_conn_get_info (lsquic_conn_t *, struct lsquic_conn_info *info);
+
+/**
+ * Select the congestion controller of this connection, using the values
+ * of es_cc_algo: 1 is Cubic, 2 is BBRv1, and 3 leaves the choice to the
+ * adaptive controller.
+ *
+ * The adaptive controller runs Cubic and BBRv1 side by side until it
+ * picks one, so this only works on a connection that uses the adaptive
+ * controller (es_cc_algo is 3) and before it has picked.  On the server,
+ * call it from the on_new_conn callback.
+ *
+ * Returns 0 on success and -1 if the controller can no longer be changed.
+ */
+int
+lsquic_conn_set_cc_algo (lsquic_conn_t *, unsigned cc_algo);
+
+/**
+ * The choice made by the adaptive congestion controller and what it was
+ * based on.  Returned by lsquic_conn_get_cc_decision().
+ */
+struct lsquic_cc_decision
+{
+    unsigned    lccd_cc_algo;       /* 1 is Cubic, 2 is BBRv1 */
+    uint64_t    lccd_age;           /* Microseconds since the choice */
+    unsigned    lccd_n_samples;     /* RTT samples taken */
+    /* RTT values and the threshold are in microseconds: */
+    unsigned    lccd_srtt;
+    unsigned    lccd_rttvar;
+    unsigned    lccd_min_rtt;
+    unsigned    lccd_rtt_thresh;
+    uint64_t    lccd_bbr_bw;        /* BBRv1 bandwidth estimate, bytes/sec */
+    /* Congestion windows of both controllers, in bytes: */
+    uint64_t    lccd_cubic_cwnd;
+    uint64_t    lccd_bbr_cwnd;
+};
+
+/**
+ * Get the choice made by the adaptive congestion controller.
+ *
+ * Returns 0 on success and -1 if the connection does not use adaptive
+ * congestion control, has not made a choice yet, or had its controller
+ * set by lsquic_conn_set_cc_algo().
+ */
+int
+lsquic_conn_get_cc_decision (lsquic_conn_t *, struct lsquic_cc_decision *);
+
 extern const char *const
 lsquic_ver2str[N_LSQVER];
 
@@ -270,6 +270,37 @@ lsquic_conn_status (struct lsquic_conn *lconn, char *errbuf, size_t bufsz)
 }
 
 
+int
+lsquic_conn_get_info (struct lsquic_conn *lconn, struct lsquic_conn_info *info)
+{
+    if (lconn->cn_if->ci_get_info)
+        return lconn->cn_if->ci_get_info(lconn, info);
+    else
+        return -1;
+}
+
+
+int
+lsquic_conn_set_cc_algo (struct lsquic_conn *lconn, unsigned cc_algo)
+{
+    if (lconn->cn_if->ci_set_cc_algo)
+        return lconn->cn_if->ci_set_cc_algo(lconn, cc_algo);
+    else
+        return -1;
+}
+
+
+int
+lsquic_conn_get_cc_decision (struct lsquic_conn *lconn,
+                                        struct lsquic_cc_decision *decision)
+{
+    if (lconn->cn_if->ci_get_cc_decision)
+        return lconn->cn_if->ci_get_cc_decision(lconn, decision);
+    else
+        return -1;
+}
+
+
 const lsquic_cid_t *
 lsquic_conn_log_cid (const struct lsquic_conn *lconn)
 {
@@ -165,6 +165,18 @@ struct conn_iface
     enum LSQUIC_CONN_STATUS
     (*ci_status) (struct lsquic_conn *, char *errbuf, size_t bufsz);
 
+    /* Optional method: only full connections have congestion state */
+    int
+    (*ci_get_info) (struct lsquic_conn *, struct lsquic_conn_info *);
+
+    /* Optional method */
+    int
+    (*ci_set_cc_algo) (struct lsquic_conn *, unsigned cc_algo);
+
+    /* Optional method */
+    int
+    (*ci_get_cc_decision) (struct lsquic_conn *, struct lsquic_cc_decision *);
+
     unsigned
     (*ci_n_avail_streams) (const struct lsquic_conn *);
 
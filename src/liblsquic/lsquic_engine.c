@@ -386,6 +386,7 @@ lsquic_engine_init_settings (struct lsquic_engine_settings *settings,
     settings->es_dplpmtud        = LSQUIC_DF_DPLPMTUD;
     settings->es_cc_algo         = LSQUIC_DF_CC_ALGO;
     settings->es_cc_rtt_thresh   = LSQUIC_DF_CC_RTT_THRESH;
+    settings->es_cc_rtt_samples  = LSQUIC_DF_CC_RTT_SAMPLES;
     settings->es_optimistic_nat  = LSQUIC_DF_OPTIMISTIC_NAT;
     settings->es_ext_http_prio   = LSQUIC_DF_EXT_HTTP_PRIO;
     settings->es_ptpc_periodicity= LSQUIC_DF_PTPC_PERIODICITY;
@@ -465,6 +466,14 @@ lsquic_engine_check_settings (const struct lsquic_engine_settings *settings,
         return -1;
     }
 
+    if (settings->es_cc_rtt_samples < 1)
+    {
+        if (err_buf)
+            snprintf(err_buf, err_buf_sz, "The number of RTT samples for "
+                "adaptive congestion control must be at least 1");
+        return -1;
+    }
+
     if (!(settings->es_ql_bits >= 0 && settings->es_ql_bits <= 2))
     {
         if (err_buf)
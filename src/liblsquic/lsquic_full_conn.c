@@ -4205,6 +4205,36 @@ full_conn_ci_tls_alert (struct lsquic_conn *lconn, uint8_t alert)
 }
 
 
+static int
+full_conn_ci_get_info (struct lsquic_conn *lconn,
+                                            struct lsquic_conn_info *info)
+{
+    struct full_conn *const conn = (struct full_conn *) lconn;
+
+    lsquic_send_ctl_get_info(&conn->fc_send_ctl, info);
+    return 0;
+}
+
+
+static int
+full_conn_ci_set_cc_algo (struct lsquic_conn *lconn, unsigned cc_algo)
+{
+    struct full_conn *const conn = (struct full_conn *) lconn;
+
+    return lsquic_send_ctl_set_cc_algo(&conn->fc_send_ctl, cc_algo);
+}
+
+
+static int
+full_conn_ci_get_cc_decision (struct lsquic_conn *lconn,
+                                        struct lsquic_cc_decision *decision)
+{
+    struct full_conn *const conn = (struct full_conn *) lconn;
+
+    return lsquic_send_ctl_get_cc_decision(&conn->fc_send_ctl, decision);
+}
+
+
 static enum LSQUIC_CONN_STATUS
 full_conn_ci_status (struct lsquic_conn *lconn, char *errbuf, size_t bufsz)
 {
@@ -4570,6 +4600,9 @@ static const struct conn_iface full_conn_iface = {
      */
     .ci_report_live          =  NULL,
     .ci_status               =  full_conn_ci_status,
+    .ci_get_info             =  full_conn_ci_get_info,
+    .ci_set_cc_algo          =  full_conn_ci_set_cc_algo,
+    .ci_get_cc_decision      =  full_conn_ci_get_cc_decision,
     .ci_tick                 =  full_conn_ci_tick,
     .ci_write_ack            =  full_conn_ci_write_ack,
     .ci_push_stream          =  full_conn_ci_push_stream,
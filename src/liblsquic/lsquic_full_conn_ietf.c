@@ -8706,6 +8706,36 @@ ietf_full_conn_ci_tick (struct lsquic_conn *lconn, lsquic_time_t now)
 }
 
 
+static int
+ietf_full_conn_ci_get_info (struct lsquic_conn *lconn,
+                                            struct lsquic_conn_info *info)
+{
+    struct ietf_full_conn *const conn = (struct ietf_full_conn *) lconn;
+
+    lsquic_send_ctl_get_info(&conn->ifc_send_ctl, info);
+    return 0;
+}
+
+
+static int
+ietf_full_conn_ci_set_cc_algo (struct lsquic_conn *lconn, unsigned cc_algo)
+{
+    struct ietf_full_conn *const conn = (struct ietf_full_conn *) lconn;
+
+    return lsquic_send_ctl_set_cc_algo(&conn->ifc_send_ctl, cc_algo);
+}
+
+
+static int
+ietf_full_conn_ci_get_cc_decision (struct lsquic_conn *lconn,
+                                        struct lsquic_cc_decision *decision)
+{
+    struct ietf_full_conn *const conn = (struct ietf_full_conn *) lconn;
+
+    return lsquic_send_ctl_get_cc_decision(&conn->ifc_send_ctl, decision);
+}
+
+
 static enum LSQUIC_CONN_STATUS
 ietf_full_conn_ci_status (struct lsquic_conn *lconn, char *errbuf, size_t bufsz)
 {
@@ -9078,6 +9108,9 @@ ietf_full_conn_ci_log_stats (struct lsquic_conn *lconn)
     .ci_drop_crypto_streams  =  ietf_full_conn_ci_drop_crypto_streams, \
     .ci_early_data_failed    =  ietf_full_conn_ci_early_data_failed, \
     .ci_get_engine           =  ietf_full_conn_ci_get_engine, \
+    .ci_get_info             =  ietf_full_conn_ci_get_info, \
+    .ci_set_cc_algo          =  ietf_full_conn_ci_set_cc_algo, \
+    .ci_get_cc_decision      =  ietf_full_conn_ci_get_cc_decision, \
     .ci_get_min_datagram_size=  ietf_full_conn_ci_get_min_datagram_size, \
     .ci_get_path             =  ietf_full_conn_ci_get_path, \
     .ci_going_away           =  ietf_full_conn_ci_going_away, \
@@ -770,11 +770,30 @@ lsquic_send_ctl_sent_packet (lsquic_send_ctl_t *ctl,
 
 
 static void
-send_ctl_select_cc (struct lsquic_send_ctl *ctl)
+send_ctl_select_cc (struct lsquic_send_ctl *ctl, lsquic_time_t now)
 {
+    const struct lsquic_rtt_stats *const rtt_stats
+                                            = &ctl->sc_conn_pub->rtt_stats;
     lsquic_time_t srtt;
 
-    srtt = lsquic_rtt_stats_get_srtt(&ctl->sc_conn_pub->rtt_stats);
+    srtt = lsquic_rtt_stats_get_srtt(rtt_stats);
+
+    /* Record the inputs before the controller that is not picked stops
+     * getting updates.
+     */
+    ctl->sc_cc_decision.time = now;
+    ctl->sc_cc_decision.srtt = srtt;
+    ctl->sc_cc_decision.rttvar = lsquic_rtt_stats_get_rttvar(rtt_stats);
+    ctl->sc_cc_decision.min_rtt = lsquic_rtt_stats_get_min_rtt(rtt_stats);
+    ctl->sc_cc_decision.bbr_bw = minmax_get(
+                        &ctl->sc_adaptive_cc.acc_bbr.bbr_max_bandwidth) / 8;
+    ctl->sc_cc_decision.cubic_cwnd = lsquic_cong_cubic_if.cci_get_cwnd(
+                                        &ctl->sc_adaptive_cc.acc_cubic);
+    ctl->sc_cc_decision.bbr_cwnd = lsquic_cong_bbr_if.cci_get_cwnd(
+                                        &ctl->sc_adaptive_cc.acc_bbr);
+    ctl->sc_cc_decision.n_samples = ctl->sc_n_rtt_samples;
+    ctl->sc_cc_decision.rtt_thresh
+                            = ctl->sc_enpub->enp_settings.es_cc_rtt_thresh;
 
     if (srtt <= ctl->sc_enpub->enp_settings.es_cc_rtt_thresh)
     {
@@ -784,6 +803,7 @@ send_ctl_select_cc (struct lsquic_send_ctl *ctl)
         ctl->sc_ci = &lsquic_cong_cubic_if;
         ctl->sc_cong_ctl = &ctl->sc_adaptive_cc.acc_cubic;
         ctl->sc_flags |= SC_CLEANUP_BBR;
+        ctl->sc_cc_decision.cc_algo = 1;
     }
     else
     {
@@ -792,7 +812,18 @@ send_ctl_select_cc (struct lsquic_send_ctl *ctl)
             ctl->sc_enpub->enp_settings.es_cc_rtt_thresh);
         ctl->sc_ci = &lsquic_cong_bbr_if;
         ctl->sc_cong_ctl = &ctl->sc_adaptive_cc.acc_bbr;
+        ctl->sc_cc_decision.cc_algo = 2;
     }
+
+    EV_LOG_CONN_EVENT(LSQUIC_LOG_CONN_ID, "adaptive CC: selected %s after "
+        "%u RTT samples; srtt: %"PRIu64"; rttvar: %"PRIu64"; min_rtt: "
+        "%"PRIu64"; threshold: %u; BBR bandwidth: %"PRIu64" bytes/sec; "
+        "cwnd: Cubic %"PRIu64", BBR %"PRIu64,
+        ctl->sc_cc_decision.cc_algo == 1 ? "Cubic" : "BBRv1",
+        ctl->sc_cc_decision.n_samples, srtt, ctl->sc_cc_decision.rttvar,
+        ctl->sc_cc_decision.min_rtt, ctl->sc_cc_decision.rtt_thresh,
+        ctl->sc_cc_decision.bbr_bw, ctl->sc_cc_decision.cubic_cwnd,
+        ctl->sc_cc_decision.bbr_cwnd);
 }
 
 
@@ -816,8 +847,10 @@ take_rtt_sample (lsquic_send_ctl_t *ctl,
         LSQ_DEBUG("packno %"PRIu64"; rtt: %"PRIu64"; delta: %"PRIu64"; "
             "new srtt: %"PRIu64, packno, measured_rtt, lack_delta,
             lsquic_rtt_stats_get_srtt(&ctl->sc_conn_pub->rtt_stats));
-        if (ctl->sc_ci == &lsquic_cong_adaptive_if)
-            send_ctl_select_cc(ctl);
+        if (ctl->sc_ci == &lsquic_cong_adaptive_if
+                && ++ctl->sc_n_rtt_samples
+                            >= ctl->sc_enpub->enp_settings.es_cc_rtt_samples)
+            send_ctl_select_cc(ctl, now);
     }
 }
 
@@ -1021,6 +1054,7 @@ send_ctl_handle_regular_lost_packet (struct lsquic_send_ctl *ctl,
     packet_sz = packet_out_sent_sz(packet_out);
 
     ++ctl->sc_loss_count;
+    ++ctl->sc_n_lost_packets;
 #if LSQUIC_CONN_STATS
     ++ctl->sc_conn_pub->conn_stats->out.lost_packets;
 #endif
@@ -3961,6 +3995,86 @@ lsquic_send_ctl_can_send_probe (const struct lsquic_send_ctl *ctl,
 }
 
 
+void
+lsquic_send_ctl_get_info (const struct lsquic_send_ctl *ctl,
+                                                struct lsquic_conn_info *info)
+{
+    const struct lsquic_rtt_stats *const rtt_stats =
+                                            &ctl->sc_conn_pub->rtt_stats;
+
+    memset(info, 0, sizeof(*info));
+    info->lci_cwnd = ctl->sc_ci->cci_get_cwnd(CGP(ctl));
+    info->lci_pacing_rate = ctl->sc_ci->cci_pacing_rate(CGP(ctl),
+                                    send_ctl_in_recovery(ctl));
+    info->lci_bytes_in_flight = ctl->sc_bytes_unacked_all;
+    info->lci_lost_packets = ctl->sc_n_lost_packets;
+    info->lci_srtt = lsquic_rtt_stats_get_srtt(rtt_stats);
+    info->lci_rttvar = lsquic_rtt_stats_get_rttvar(rtt_stats);
+    info->lci_min_rtt = lsquic_rtt_stats_get_min_rtt(rtt_stats);
+    if (ctl->sc_ci == &lsquic_cong_cubic_if)
+        info->lci_cc_algo = 1;
+    else if (ctl->sc_ci == &lsquic_cong_bbr_if)
+        info->lci_cc_algo = 2;
+    else
+        info->lci_cc_algo = 3;
+}
+
+
+int
+lsquic_send_ctl_set_cc_algo (struct lsquic_send_ctl *ctl, unsigned cc_algo)
+{
+    /* Both controllers have seen every packet only until the adaptive
+     * controller picks one of them.
+     */
+    if (ctl->sc_ci != &lsquic_cong_adaptive_if)
+    {
+        LSQ_INFO("cannot change congestion controller: already selected");
+        return -1;
+    }
+
+    switch (cc_algo)
+    {
+    case 1:
+        LSQ_INFO("select Cubic congestion controller");
+        ctl->sc_ci = &lsquic_cong_cubic_if;
+        ctl->sc_cong_ctl = &ctl->sc_adaptive_cc.acc_cubic;
+        ctl->sc_flags |= SC_CLEANUP_BBR;
+        return 0;
+    case 2:
+        LSQ_INFO("select BBRv1 congestion controller");
+        ctl->sc_ci = &lsquic_cong_bbr_if;
+        ctl->sc_cong_ctl = &ctl->sc_adaptive_cc.acc_bbr;
+        return 0;
+    case 3:
+        return 0;
+    default:
+        LSQ_INFO("invalid congestion controller %u", cc_algo);
+        return -1;
+    }
+}
+
+
+int
+lsquic_send_ctl_get_cc_decision (const struct lsquic_send_ctl *ctl,
+                                    struct lsquic_cc_decision *decision)
+{
+    if (!ctl->sc_cc_decision.cc_algo)
+        return -1;
+
+    decision->lccd_cc_algo = ctl->sc_cc_decision.cc_algo;
+    decision->lccd_age = lsquic_time_now() - ctl->sc_cc_decision.time;
+    decision->lccd_n_samples = ctl->sc_cc_decision.n_samples;
+    decision->lccd_srtt = ctl->sc_cc_decision.srtt;
+    decision->lccd_rttvar = ctl->sc_cc_decision.rttvar;
+    decision->lccd_min_rtt = ctl->sc_cc_decision.min_rtt;
+    decision->lccd_rtt_thresh = ctl->sc_cc_decision.rtt_thresh;
+    decision->lccd_bbr_bw = ctl->sc_cc_decision.bbr_bw;
+    decision->lccd_cubic_cwnd = ctl->sc_cc_decision.cubic_cwnd;
+    decision->lccd_bbr_cwnd = ctl->sc_cc_decision.bbr_cwnd;
+    return 0;
+}
+
+
 void
 lsquic_send_ctl_disable_ecn (struct lsquic_send_ctl *ctl)
 {
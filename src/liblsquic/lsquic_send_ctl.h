@@ -21,6 +21,8 @@ struct network_path;
 struct ver_neg;
 enum pns;
 struct to_coal;
+struct lsquic_conn_info;
+struct lsquic_cc_decision;
 
 enum buf_packet_type { BPT_HIGHEST_PRIO, BPT_OTHER_PRIO, };
 
@@ -128,6 +130,18 @@ typedef struct lsquic_send_ctl {
     unsigned                        sc_next_limit;
     unsigned                        sc_n_scheduled;
     enum packno_bits                sc_max_packno_bits;
+    unsigned                        sc_n_rtt_samples;
+    /* What the adaptive congestion controller picked and why: */
+    struct
+    {
+        lsquic_time_t           time;
+        lsquic_time_t           srtt, rttvar, min_rtt;
+        uint64_t                bbr_bw;         /* Bytes per second */
+        uint64_t                cubic_cwnd, bbr_cwnd;
+        unsigned                n_samples;
+        unsigned                rtt_thresh;
+        unsigned                cc_algo;        /* Zero until it picks */
+    }                               sc_cc_decision;
 #if LSQUIC_SEND_STATS
     struct {
         unsigned            n_total_sent,
@@ -142,6 +156,7 @@ typedef struct lsquic_send_ctl {
     lsquic_packno_t                 sc_cur_rt_end;
     lsquic_packno_t                 sc_gap;
     unsigned                        sc_loss_count;  /* Used to set loss bit */
+    uint64_t                        sc_n_lost_packets;
     unsigned                        sc_square_count;/* Used to set square bit */
     unsigned                        sc_reord_thresh;
     signed char                     sc_cidlen;      /* For debug purposes */
@@ -452,6 +467,17 @@ lsquic_send_ctl_can_send_probe (const struct lsquic_send_ctl *,
 void
 lsquic_send_ctl_disable_ecn (struct lsquic_send_ctl *);
 
+void
+lsquic_send_ctl_get_info (const struct lsquic_send_ctl *,
+                                                struct lsquic_conn_info *);
+
+int
+lsquic_send_ctl_set_cc_algo (struct lsquic_send_ctl *, unsigned cc_algo);
+
+int
+lsquic_send_ctl_get_cc_decision (const struct lsquic_send_ctl *,
+                                            struct lsquic_cc_decision *);
+
 struct send_ctl_state
 {
     struct pacer        pacer;
@@ -4400,6 +4400,28 @@ lsquic_stream_close (lsquic_stream_t *stream)
 }
 
 
+int
+lsquic_stream_reset (lsquic_stream_t *stream, uint64_t error_code)
+{
+    LSQ_DEBUG("lsquic_stream_reset() called, error code %"PRIu64, error_code);
+    if (lsquic_stream_is_closed(stream))
+    {
+        LSQ_INFO("Attempt to reset a closed stream");
+        errno = EBADF;
+        return -1;
+    }
+    /* Too late to reset: lsquic_stream_maybe_reset() would only shut down
+     * the read side, leaving the stream open.  Close it instead.
+     */
+    if ((stream->stream_flags
+            & (STREAM_RST_SENT|STREAM_FIN_SENT|STREAM_U_WRITE_DONE))
+        || (stream->sm_qflags & SMQF_SEND_RST))
+        return lsquic_stream_close(stream);
+    stream_reset(stream, error_code, 1);
+    return 0;
+}
+
+
 #ifndef NDEBUG
 #if __GNUC__
 __attribute__((weak))
@@ -0,0 +1,539 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * test_conn_info.c -- Test the transport state the send controller reports
+ * through lsquic_conn_get_info() and the choice of congestion controller:
+ * lsquic_conn_set_cc_algo() and lsquic_conn_get_cc_decision().
+ */
+
+#include <assert.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/queue.h>
+#include <sys/types.h>
+#ifndef WIN32
+#include <unistd.h>
+#else
+#include <getopt.h>
+#endif
+
+#include "lsquic.h"
+
+#include "lsquic_packet_common.h"
+#include "lsquic_alarmset.h"
+#include "lsquic_packet_in.h"
+#include "lsquic_conn_flow.h"
+#include "lsquic_rtt.h"
+#include "lsquic_sfcw.h"
+#include "lsquic_varint.h"
+#include "lsquic_hq.h"
+#include "lsquic_hash.h"
+#include "lsquic_stream.h"
+#include "lsquic_types.h"
+#include "lsquic_malo.h"
+#include "lsquic_mm.h"
+#include "lsquic_conn_public.h"
+#include "lsquic_logger.h"
+#include "lsquic_parse.h"
+#include "lsquic_conn.h"
+#include "lsquic_engine_public.h"
+#include "lsquic_cong_ctl.h"
+#include "lsquic_cubic.h"
+#include "lsquic_pacer.h"
+#include "lsquic_senhist.h"
+#include "lsquic_bw_sampler.h"
+#include "lsquic_minmax.h"
+#include "lsquic_bbr.h"
+#include "lsquic_adaptive_cc.h"
+#include "lsquic_send_ctl.h"
+#include "lsquic_ver_neg.h"
+#include "lsquic_packet_out.h"
+#include "lsquic_enc_sess.h"
+
+/* Time of the first packet; RTTs are in microseconds, as in the library */
+#define T0 1000000
+
+
+struct test_objs {
+    struct lsquic_conn        lconn;
+    struct lsquic_engine_public eng_pub;
+    struct lsquic_conn_public conn_pub;
+    struct lsquic_send_ctl    send_ctl;
+    struct lsquic_alarmset    alset;
+    struct ver_neg            ver_neg;
+};
+
+
+static struct network_path network_path;
+
+static struct network_path *
+get_network_path (struct lsquic_conn *lconn, const struct sockaddr *sa)
+{
+    return &network_path;
+}
+
+
+static int
+unit_test_doesnt_write_ack (struct lsquic_conn *lconn)
+{
+    return 0;
+}
+
+
+/* Same as the full connections do */
+static int
+get_info (struct lsquic_conn *lconn, struct lsquic_conn_info *info)
+{
+    struct test_objs *const tobjs = (void *) lconn;
+
+    lsquic_send_ctl_get_info(&tobjs->send_ctl, info);
+    return 0;
+}
+
+
+static int
+set_cc_algo (struct lsquic_conn *lconn, unsigned cc_algo)
+{
+    struct test_objs *const tobjs = (void *) lconn;
+
+    return lsquic_send_ctl_set_cc_algo(&tobjs->send_ctl, cc_algo);
+}
+
+
+static int
+get_cc_decision (struct lsquic_conn *lconn,
+                                    struct lsquic_cc_decision *decision)
+{
+    struct test_objs *const tobjs = (void *) lconn;
+
+    return lsquic_send_ctl_get_cc_decision(&tobjs->send_ctl, decision);
+}
+
+
+static const struct conn_iface our_conn_if =
+{
+    .ci_can_write_ack   = unit_test_doesnt_write_ack,
+    .ci_get_path        = get_network_path,
+    .ci_get_info        = get_info,
+    .ci_set_cc_algo     = set_cc_algo,
+    .ci_get_cc_decision = get_cc_decision,
+};
+
+#if LSQUIC_CONN_STATS
+static struct conn_stats s_conn_stats;
+#endif
+
+static void
+init_test_objs (struct test_objs *tobjs, unsigned cc_algo)
+{
+    memset(tobjs, 0, sizeof(*tobjs));
+    LSCONN_INITIALIZE(&tobjs->lconn);
+    tobjs->lconn.cn_pf = select_pf_by_ver(LSQVER_043);
+    tobjs->lconn.cn_version = LSQVER_043;
+    tobjs->lconn.cn_esf_c = &lsquic_enc_session_common_gquic_1;
+    tobjs->lconn.cn_if = &our_conn_if;
+    network_path.np_pack_size = 1370;
+    lsquic_engine_init_settings(&tobjs->eng_pub.enp_settings, LSENG_SERVER);
+    tobjs->eng_pub.enp_settings.es_cc_algo = cc_algo;
+    tobjs->eng_pub.enp_settings.es_pace_packets = 0;
+    lsquic_mm_init(&tobjs->eng_pub.enp_mm);
+    TAILQ_INIT(&tobjs->conn_pub.sending_streams);
+    TAILQ_INIT(&tobjs->conn_pub.read_streams);
+    TAILQ_INIT(&tobjs->conn_pub.write_streams);
+    TAILQ_INIT(&tobjs->conn_pub.service_streams);
+    lsquic_alarmset_init(&tobjs->alset, 0);
+    tobjs->conn_pub.mm = &tobjs->eng_pub.enp_mm;
+    tobjs->conn_pub.lconn = &tobjs->lconn;
+    tobjs->conn_pub.enpub = &tobjs->eng_pub;
+    tobjs->conn_pub.send_ctl = &tobjs->send_ctl;
+    tobjs->conn_pub.packet_out_malo =
+                        lsquic_malo_create(sizeof(struct lsquic_packet_out));
+    tobjs->conn_pub.path = &network_path;
+#if LSQUIC_CONN_STATS
+    tobjs->conn_pub.conn_stats = &s_conn_stats;
+#endif
+    lsquic_send_ctl_init(&tobjs->send_ctl, &tobjs->alset, &tobjs->eng_pub,
+        &tobjs->ver_neg, &tobjs->conn_pub, 0);
+}
+
+
+static void
+deinit_test_objs (struct test_objs *tobjs)
+{
+    lsquic_send_ctl_cleanup(&tobjs->send_ctl);
+    lsquic_malo_destroy(tobjs->conn_pub.packet_out_malo);
+    lsquic_mm_cleanup(&tobjs->eng_pub.enp_mm);
+}
+
+
+/* Pretend to send a packet with a PING frame at time `now'.  Returns its
+ * packet number.
+ */
+static lsquic_packno_t
+send_packet (struct test_objs *tobjs, lsquic_time_t now)
+{
+    struct lsquic_packet_out *packet_out;
+    int s;
+
+    packet_out = lsquic_send_ctl_new_packet_out(&tobjs->send_ctl, 0, PNS_APP,
+                                                            &network_path);
+    assert(packet_out);
+    packet_out->po_frame_types |= QUIC_FTBIT_PING;
+    packet_out->po_data_sz = 1;
+    lsquic_send_ctl_scheduled_one(&tobjs->send_ctl, packet_out);
+    packet_out = lsquic_send_ctl_next_packet_to_send(&tobjs->send_ctl, 0);
+    assert(packet_out);
+    packet_out->po_sent = now;
+    s = lsquic_send_ctl_sent_packet(&tobjs->send_ctl, packet_out);
+    assert(0 == s);
+    return packet_out->po_packno;
+}
+
+
+/* ACK packets `low' through `high', received at time `now' */
+static void
+ack_packets (struct test_objs *tobjs, lsquic_packno_t low,
+                                lsquic_packno_t high, lsquic_time_t now)
+{
+    struct ack_info acki;
+    int s;
+
+    memset(&acki, 0, sizeof(acki));
+    acki.pns = PNS_APP;
+    acki.n_ranges = 1;
+    acki.ranges[0].low = low;
+    acki.ranges[0].high = high;
+    s = lsquic_send_ctl_got_ack(&tobjs->send_ctl, &acki, now, now);
+    assert(0 == s);
+}
+
+
+/* A connection that does not have this information -- a mini connection
+ * -- says so.
+ */
+static void
+test_no_info (void)
+{
+    static const struct conn_iface mini_conn_if =
+    {
+        .ci_get_path      = get_network_path,
+    };
+    struct lsquic_conn lconn;
+    struct lsquic_conn_info info;
+    struct lsquic_cc_decision decision;
+    int s;
+
+    memset(&lconn, 0, sizeof(lconn));
+    LSCONN_INITIALIZE(&lconn);
+    lconn.cn_if = &mini_conn_if;
+    s = lsquic_conn_get_info(&lconn, &info);
+    assert(-1 == s);
+    s = lsquic_conn_set_cc_algo(&lconn, 1);
+    assert(-1 == s);
+    s = lsquic_conn_get_cc_decision(&lconn, &decision);
+    assert(-1 == s);
+}
+
+
+/* The controller in use is reported with the values of es_cc_algo */
+static void
+test_cc_algo (void)
+{
+    struct test_objs tobjs;
+    struct lsquic_conn_info info;
+    unsigned cc_algo;
+    int s;
+
+    for (cc_algo = 1; cc_algo <= 3; ++cc_algo)
+    {
+        init_test_objs(&tobjs, cc_algo);
+        s = lsquic_conn_get_info(&tobjs.lconn, &info);
+        assert(0 == s);
+        assert(cc_algo == info.lci_cc_algo);
+        deinit_test_objs(&tobjs);
+    }
+}
+
+
+/* Congestion window and pacing rate come from the controller, bytes in
+ * flight and RTT from the send controller.
+ */
+static void
+test_transport_state (void)
+{
+    struct test_objs tobjs;
+    struct lsquic_conn_info info;
+    lsquic_packno_t first, last;
+    unsigned i;
+    int s;
+
+    init_test_objs(&tobjs, 1);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(info.lci_cwnd == lsquic_cong_cubic_if.cci_get_cwnd(
+                                    &tobjs.send_ctl.sc_adaptive_cc.acc_cubic));
+    assert(info.lci_cwnd > 0);
+    assert(0 == info.lci_bytes_in_flight);
+    assert(0 == info.lci_srtt);
+
+    first = last = send_packet(&tobjs, T0);
+    for (i = 1; i < 4; ++i)
+        last = send_packet(&tobjs, T0);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(info.lci_bytes_in_flight
+                            == tobjs.send_ctl.sc_bytes_unacked_all);
+    assert(info.lci_bytes_in_flight > 0);
+
+    /* One RTT sample: 30 ms */
+    ack_packets(&tobjs, first, last, T0 + 30000);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(0 == info.lci_bytes_in_flight);
+    assert(30000 == info.lci_srtt);
+    assert(15000 == info.lci_rttvar);
+    assert(30000 == info.lci_min_rtt);
+    assert(info.lci_pacing_rate == lsquic_cong_cubic_if.cci_pacing_rate(
+                            &tobjs.send_ctl.sc_adaptive_cc.acc_cubic, 0));
+    assert(1 == info.lci_cc_algo);
+
+    deinit_test_objs(&tobjs);
+}
+
+
+/* Packets past the reordering threshold when a later packet is ACKed are
+ * counted as lost.
+ */
+static void
+test_lost_packets (void)
+{
+    struct test_objs tobjs;
+    struct lsquic_conn_info info;
+    lsquic_packno_t packnos[6];
+    unsigned i;
+    int s;
+
+    init_test_objs(&tobjs, 1);
+    for (i = 0; i < sizeof(packnos) / sizeof(packnos[0]); ++i)
+        packnos[i] = send_packet(&tobjs, T0);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(0 == info.lci_lost_packets);
+
+    /* Only the first packet is more than three packets behind.  The last
+     * packet stays unacknowledged, so that early retransmit does not kick
+     * in.
+     */
+    ack_packets(&tobjs, packnos[4], packnos[4], T0 + 30000);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(1 == info.lci_lost_packets);
+
+    /* The count does not go back when the rest are ACKed */
+    ack_packets(&tobjs, packnos[1], packnos[5], T0 + 40000);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(1 == info.lci_lost_packets);
+    assert(0 == info.lci_bytes_in_flight);
+
+    deinit_test_objs(&tobjs);
+}
+
+
+/* The application may pick the controller while the adaptive controller
+ * is still running both of them, and only then.
+ */
+static void
+test_set_cc_algo (void)
+{
+    struct test_objs tobjs;
+    struct lsquic_conn_info info;
+    unsigned cc_algo;
+    int s;
+
+    for (cc_algo = 1; cc_algo <= 2; ++cc_algo)
+    {
+        init_test_objs(&tobjs, 3);
+        s = lsquic_conn_set_cc_algo(&tobjs.lconn, cc_algo);
+        assert(0 == s);
+        s = lsquic_conn_get_info(&tobjs.lconn, &info);
+        assert(0 == s);
+        assert(cc_algo == info.lci_cc_algo);
+        /* Too late to change it now */
+        s = lsquic_conn_set_cc_algo(&tobjs.lconn, 3 - cc_algo);
+        assert(-1 == s);
+        s = lsquic_conn_set_cc_algo(&tobjs.lconn, 3);
+        assert(-1 == s);
+        s = lsquic_conn_get_info(&tobjs.lconn, &info);
+        assert(0 == s);
+        assert(cc_algo == info.lci_cc_algo);
+        deinit_test_objs(&tobjs);
+    }
+
+    /* Keep adapting */
+    init_test_objs(&tobjs, 3);
+    s = lsquic_conn_set_cc_algo(&tobjs.lconn, 3);
+    assert(0 == s);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(3 == info.lci_cc_algo);
+
+    /* Invalid values change nothing */
+    s = lsquic_conn_set_cc_algo(&tobjs.lconn, 0);
+    assert(-1 == s);
+    s = lsquic_conn_set_cc_algo(&tobjs.lconn, 4);
+    assert(-1 == s);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(3 == info.lci_cc_algo);
+    deinit_test_objs(&tobjs);
+
+    /* Not using the adaptive controller */
+    for (cc_algo = 1; cc_algo <= 2; ++cc_algo)
+    {
+        init_test_objs(&tobjs, cc_algo);
+        s = lsquic_conn_set_cc_algo(&tobjs.lconn, 3 - cc_algo);
+        assert(-1 == s);
+        s = lsquic_conn_get_info(&tobjs.lconn, &info);
+        assert(0 == s);
+        assert(cc_algo == info.lci_cc_algo);
+        deinit_test_objs(&tobjs);
+    }
+}
+
+
+/* The adaptive controller picks Cubic if smoothed RTT is at most the
+ * threshold and BBR otherwise, after es_cc_rtt_samples RTT samples.
+ */
+static void
+test_cc_decision (unsigned n_samples, lsquic_time_t rtt, unsigned cc_algo)
+{
+    struct test_objs tobjs;
+    struct lsquic_conn_info info;
+    struct lsquic_cc_decision decision;
+    lsquic_packno_t packno;
+    unsigned i;
+    int s;
+
+    init_test_objs(&tobjs, 3);
+    tobjs.eng_pub.enp_settings.es_cc_rtt_samples = n_samples;
+
+    for (i = 0; i < n_samples; ++i)
+    {
+        s = lsquic_conn_get_cc_decision(&tobjs.lconn, &decision);
+        assert(-1 == s);
+        s = lsquic_conn_get_info(&tobjs.lconn, &info);
+        assert(0 == s);
+        assert(3 == info.lci_cc_algo);
+        packno = send_packet(&tobjs, T0 + i * rtt);
+        ack_packets(&tobjs, packno, packno, T0 + (i + 1) * rtt);
+    }
+
+    s = lsquic_conn_get_cc_decision(&tobjs.lconn, &decision);
+    assert(0 == s);
+    assert(cc_algo == decision.lccd_cc_algo);
+    assert(n_samples == decision.lccd_n_samples);
+    assert(rtt == decision.lccd_srtt);
+    assert(rtt == decision.lccd_min_rtt);
+    assert(LSQUIC_DF_CC_RTT_THRESH == decision.lccd_rtt_thresh);
+    assert(decision.lccd_cubic_cwnd > 0);
+    assert(decision.lccd_bbr_cwnd > 0);
+    s = lsquic_conn_get_info(&tobjs.lconn, &info);
+    assert(0 == s);
+    assert(cc_algo == info.lci_cc_algo);
+
+    /* The choice is final */
+    s = lsquic_conn_set_cc_algo(&tobjs.lconn, 3 - cc_algo);
+    assert(-1 == s);
+
+    deinit_test_objs(&tobjs);
+}
+
+
+/* No decision is recorded if the controller was not picked by the
+ * adaptive controller.
+ */
+static void
+test_no_cc_decision (void)
+{
+    struct test_objs tobjs;
+    struct lsquic_cc_decision decision;
+    lsquic_packno_t packno;
+    unsigned cc_algo;
+    int s;
+
+    for (cc_algo = 1; cc_algo <= 2; ++cc_algo)
+    {
+        init_test_objs(&tobjs, cc_algo);
+        packno = send_packet(&tobjs, T0);
+        ack_packets(&tobjs, packno, packno, T0 + 30000);
+        s = lsquic_conn_get_cc_decision(&tobjs.lconn, &decision);
+        assert(-1 == s);
+        deinit_test_objs(&tobjs);
+    }
+
+    init_test_objs(&tobjs, 3);
+    s = lsquic_conn_set_cc_algo(&tobjs.lconn, 2);
+    assert(0 == s);
+    packno = send_packet(&tobjs, T0);
+    ack_packets(&tobjs, packno, packno, T0 + 30000);
+    s = lsquic_conn_get_cc_decision(&tobjs.lconn, &decision);
+    assert(-1 == s);
+    deinit_test_objs(&tobjs);
+}
+
+
+/* At least one RTT sample is needed to make the decision */
+static void
+test_check_rtt_samples (void)
+{
+    struct lsquic_engine_settings settings;
+    char errbuf[100];
+    int s;
+
+    lsquic_engine_init_settings(&settings, LSENG_SERVER);
+    s = lsquic_engine_check_settings(&settings, LSENG_SERVER,
+                                                    errbuf, sizeof(errbuf));
+    assert(0 == s);
+    settings.es_cc_rtt_samples = 0;
+    s = lsquic_engine_check_settings(&settings, LSENG_SERVER,
+                                                    errbuf, sizeof(errbuf));
+    assert(-1 == s);
+}
+
+
+int
+main (int argc, char **argv)
+{
+    int opt;
+
+    lsquic_global_init(LSQUIC_GLOBAL_SERVER);
+
+    while (-1 != (opt = getopt(argc, argv, "l:")))
+    {
+        switch (opt)
+        {
+        case 'l':
+            lsquic_log_to_fstream(stderr, 0);
+            lsquic_logger_lopt(optarg);
+            break;
+        default:
+            exit(1);
+        }
+    }
+
+    test_no_info();
+    test_cc_algo();
+    test_transport_state();
+    test_lost_packets();
+    test_set_cc_algo();
+    test_cc_decision(1, 30000, 2);
+    test_cc_decision(1, 1000, 1);
+    test_cc_decision(3, 30000, 2);
+    test_cc_decision(3, LSQUIC_DF_CC_RTT_THRESH, 1);
+    test_no_cc_decision();
+    test_check_rtt_samples();
+
+    lsquic_global_cleanup();
+    return 0;
+}
@@ -0,0 +1,207 @@
+/* Copyright (c) 2017 - 2022 LiteSpeed Technologies Inc.  See LICENSE. */
+/*
+ * test_qlog_writer.c -- Test the qlog files bin/qlog_writer.c writes
+ */
+
+#include <assert.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/queue.h>
+#include <unistd.h>
+
+#include "lsquic.h"
+#include "lsquic_int_types.h"
+#include "lsquic_hash.h"
+#include "lsquic_conn.h"
+
+#include "../bin/qlog_writer.h"
+
+
+/* What the fake connection reports */
+static struct lsquic_conn_info s_info;
+static struct lsquic_cc_decision s_decision;
+static int s_have_decision;
+
+
+static int
+get_info (struct lsquic_conn *lconn, struct lsquic_conn_info *info)
+{
+    *info = s_info;
+    return 0;
+}
+
+
+static int
+get_cc_decision (struct lsquic_conn *lconn,
+                                        struct lsquic_cc_decision *decision)
+{
+    if (!s_have_decision)
+        return -1;
+    *decision = s_decision;
+    return 0;
+}
+
+
+static const struct conn_iface our_conn_if =
+{
+    .ci_get_info        = get_info,
+    .ci_get_cc_decision = get_cc_decision,
+};
+
+
+/* Read the whole file into a string */
+static char *
+read_file (const char *path)
+{
+    FILE *file;
+    char *buf;
+    long size;
+    size_t nr;
+    int s;
+
+    file = fopen(path, "r");
+    assert(file);
+    s = fseek(file, 0, SEEK_END);
+    assert(0 == s);
+    size = ftell(file);
+    assert(size > 0);
+    rewind(file);
+    buf = malloc(size + 1);
+    assert(buf);
+    nr = fread(buf, 1, size, file);
+    assert(nr == (size_t) size);
+    buf[size] = '\0';
+    fclose(file);
+    return buf;
+}
+
+
+/* Return the next record, each starts with RS and ends with a newline */
+static char *
+next_record (char **p)
+{
+    char *record, *nl;
+
+    if (**p == '\0')
+        return NULL;
+    assert(**p == '\x1e');
+    record = *p + 1;
+    nl = strchr(record, '\n');
+    assert(nl);
+    *nl = '\0';
+    *p = nl + 1;
+    return record;
+}
+
+
+static int
+has_event (const char *record, const char *name)
+{
+    char buf[100];
+
+    snprintf(buf, sizeof(buf), "\"name\":\"%s\"", name);
+    return strstr(record, buf) != NULL;
+}
+
+
+int
+main (void)
+{
+    struct lsquic_conn lconn;
+    struct qlog_writer *qw;
+    char dir[] = "/tmp/test_qlog_writer.XXXXXX";
+    char path[sizeof(dir) + 100];
+    char *buf, *p, *record;
+    int s;
+
+    p = mkdtemp(dir);
+    assert(p);
+
+    memset(&lconn, 0, sizeof(lconn));
+    lconn.cn_if = &our_conn_if;
+    lconn.cn_logid.len = 4;
+    memcpy(lconn.cn_logid.idbuf, "\x01\x23\xAB\xCD", 4);
+
+    s_info.lci_cc_algo = 3;
+    s_info.lci_cwnd = 14720;
+    s_info.lci_pacing_rate = 1000;
+    s_info.lci_srtt = 30000;
+    s_info.lci_rttvar = 15000;
+    s_info.lci_min_rtt = 30000;
+
+    qw = qlog_writer_open(dir, &lconn);
+    assert(qw);
+
+    /* First sample: the controller and every metric */
+    qlog_writer_sample(qw, &lconn);
+    /* Nothing changed: no events */
+    qlog_writer_sample(qw, &lconn);
+
+    /* Only the changed metrics, and the losses since the last sample */
+    s_info.lci_srtt = 31000;
+    s_info.lci_lost_packets = 2;
+    qlog_writer_sample(qw, &lconn);
+
+    /* The adaptive controller picks BBR */
+    s_info.lci_cc_algo = 2;
+    s_have_decision = 1;
+    s_decision.lccd_cc_algo = 2;
+    s_decision.lccd_n_samples = 1;
+    s_decision.lccd_srtt = 31000;
+    s_decision.lccd_rtt_thresh = 1500;
+    qlog_writer_sample(qw, &lconn);
+
+    qlog_writer_close(qw, &lconn);
+
+    snprintf(path, sizeof(path), "%s/0123ABCD.sqlog", dir);
+    buf = read_file(path);
+    p = buf;
+
+    record = next_record(&p);
+    assert(record);
+    assert(strstr(record, "\"qlog_version\":\"0.3\""));
+    assert(strstr(record, "\"group_id\":\"0123ABCD\""));
+
+    record = next_record(&p);
+    assert(record && has_event(record, "lsquic:cc_selected"));
+    assert(strstr(record, "\"cc\":\"adaptive\""));
+    assert(!strstr(record, "\"samples\""));
+
+    record = next_record(&p);
+    assert(record && has_event(record, "recovery:metrics_updated"));
+    assert(strstr(record, "\"min_rtt\":30.000"));
+    assert(strstr(record, "\"smoothed_rtt\":30.000"));
+    assert(strstr(record, "\"rtt_variance\":15.000"));
+    assert(strstr(record, "\"congestion_window\":14720"));
+    assert(strstr(record, "\"bytes_in_flight\":0"));
+    assert(strstr(record, "\"pacing_rate\":8000"));
+
+    /* The second sample wrote nothing */
+    record = next_record(&p);
+    assert(record && has_event(record, "recovery:metrics_updated"));
+    assert(strstr(record, "\"data\":{\"smoothed_rtt\":31.000}"));
+
+    record = next_record(&p);
+    assert(record && has_event(record, "lsquic:packets_lost"));
+    assert(strstr(record, "\"data\":{\"count\":2}"));
+
+    record = next_record(&p);
+    assert(record && has_event(record, "lsquic:cc_selected"));
+    assert(strstr(record, "\"cc\":\"bbr\""));
+    assert(strstr(record, "\"samples\":1"));
+    assert(strstr(record, "\"smoothed_rtt\":31.000"));
+    assert(strstr(record, "\"rtt_threshold\":1.500"));
+
+    record = next_record(&p);
+    assert(record && has_event(record, "connectivity:connection_closed"));
+
+    assert(!next_record(&p));
+
+    free(buf);
+    s = unlink(path);
+    assert(0 == s);
+    s = rmdir(dir);
+    assert(0 == s);
+    return 0;
+}
@@ -1574,6 +1574,94 @@ test_data_flush_on_close (struct test_objs *tobjs)
 }
 
 
+/* Reset a stream with data in flight: RST is sent with the error code
+ * instead of a FIN, and the stream is closed.
+ */
+static void
+test_reset_instead_of_fin (struct test_objs *tobjs)
+{
+    lsquic_stream_t *stream;
+    char buf[0x100];
+    size_t n;
+    int s;
+
+    stream = new_stream(tobjs, 345);
+    n = lsquic_stream_write(stream, buf, 100);
+    assert(n == 100);
+    lsquic_stream_flush(stream);
+
+    s = lsquic_stream_reset(stream, 0x102);
+    assert(0 == s);
+    assert(stream->sm_qflags & SMQF_SEND_RST);
+    assert(!(stream->stream_flags & STREAM_FIN_SENT));
+    assert(0x102 == stream->error_code);
+    assert(lsquic_stream_is_closed(stream));
+
+    /* A closed stream cannot be reset again */
+    s = lsquic_stream_reset(stream, 0x102);
+    assert(-1 == s);
+    assert(EBADF == errno);
+
+    lsquic_stream_destroy(stream);
+}
+
+
+/* The FIN is on its way: it is too late to reset, the stream is closed */
+static void
+test_reset_after_fin (struct test_objs *tobjs)
+{
+    lsquic_stream_t *stream;
+    char buf[0x100];
+    size_t n;
+    int s;
+
+    stream = new_stream(tobjs, 345);
+    /* Peer is done too, so that closing the read side does not reset */
+    s = lsquic_stream_frame_in(stream, new_frame_in(tobjs, 0, 0, 1));
+    assert(0 == s);
+    n = lsquic_stream_write(stream, buf, 100);
+    assert(n == 100);
+    s = lsquic_stream_shutdown(stream, 1);
+    assert(0 == s);
+    assert(!lsquic_stream_is_closed(stream));
+
+    s = lsquic_stream_reset(stream, 0x102);
+    assert(0 == s);
+    assert(!(stream->sm_qflags & SMQF_SEND_RST));
+    assert(0 == stream->error_code);
+    assert(lsquic_stream_is_closed(stream));
+    assert(stream->sm_qflags & SMQF_CALL_ONCLOSE);
+
+    lsquic_stream_destroy(stream);
+}
+
+
+/* A reset has already been sent: the stream is closed, the error code kept */
+static void
+test_reset_after_reset (struct test_objs *tobjs)
+{
+    lsquic_stream_t *stream;
+    char buf[0x100];
+    size_t n;
+    int s;
+
+    stream = new_stream(tobjs, 345);
+    n = lsquic_stream_write(stream, buf, 100);
+    assert(n == 100);
+    lsquic_stream_maybe_reset(stream, 0x10C, 0);
+    assert(stream->sm_qflags & SMQF_SEND_RST);
+    assert(!lsquic_stream_is_closed(stream));
+
+    s = lsquic_stream_reset(stream, 0x102);
+    assert(0 == s);
+    assert(0x10C == stream->error_code);
+    assert(lsquic_stream_is_closed(stream));
+    assert(stream->sm_qflags & SMQF_CALL_ONCLOSE);
+
+    lsquic_stream_destroy(stream);
+}
+
+
 /* In this function, we test stream termination conditions.  In particular,
  * we are interested in when the stream becomes finished (this is when
  * connection closes it and starts ignoring frames that come after this):
@@ -1639,6 +1727,9 @@ test_flushing (void)
         test_reset_stream_with_flushed_data,
         test_unlimited_stream_flush_data,
         test_data_flush_on_close,
+        test_reset_instead_of_fin,
+        test_reset_after_fin,
+        test_reset_after_reset,
     };
 
     for (i = 0; i < sizeof(test_funcs) / sizeof(test_funcs[0]); ++i)